@@ -14,6 +14,7 @@ from app.api.v1.routes import (
     delivery_plans,
     exception_reports,
     exception_types,
+    jobs,
     order_plans,
     payment,
     product_categories,
@@ -38,6 +39,7 @@ api_router.include_router(balances.router, tags=["磅单结余管理"])
 api_router.include_router(payment.router, tags=["收款明细管理"])
 api_router.include_router(product_categories.router, tags=["品类管理"])
 api_router.include_router(exception_types.router, tags=["异常审核"])
+api_router.include_router(jobs.router, tags=["定时任务"])
 api_router.include_router(exception_reports.router, tags=["异常审核"])
 api_router.include_router(allocation.router, tags=["分配规划"])
 api_router.include_router(t1_compat.router)
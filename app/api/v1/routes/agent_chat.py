@@ -1,11 +1,16 @@
 """
-AI 鉴伪：用户提交待鉴别文本，经 Coze 流式调用（stream_run）聚合为纯文本结论；
+AI 鉴伪：用户提交待鉴别文本，经 Coze 流式调用（stream_run）聚合为纯文本结论，
+或经 `/agent/chat/stream` 以 text/event-stream 逐段转发给浏览器；
 OpenAPI/Swagger 中见本模块「请求体示例」「响应示例」与字段说明。
 """
+import json
+from typing import Optional
+
 from fastapi import APIRouter, Body, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, ConfigDict, Field
 
-from app.services.coze_agent_service import run_coze_agent_chat
+from app.services.coze_agent_service import CozeAgentError, run_coze_agent_chat, stream_coze_agent
 
 router = APIRouter(prefix="/agent", tags=["AI鉴伪"])
 
@@ -141,10 +146,61 @@ async def agent_chat(
 
     Swagger UI 中可在「请求体」下拉选择不同示例；响应区可查看 200/502 的示例结构。
     """
-    result = run_coze_agent_chat(body.text)
+    result = await run_coze_agent_chat(body.text)
     if result.get("success"):
         return AgentChatResponse(text=result["text"])
     raise HTTPException(
         status_code=502,
         detail=result.get("error", "智能体调用失败"),
     )
+
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post(
+    "/chat/stream",
+    summary="提交待鉴别文本并流式获取说明（SSE）",
+    description=(
+        "与 `/agent/chat` 相同的请求体；响应为 `text/event-stream`，智能体每产出一段文字即转发一条事件：\n\n"
+        "- `data: {\"text\": \"片段\"}`：按顺序拼接即为完整说明；\n"
+        "- `event: error` + `data: {\"detail\": \"错误说明\"}`：流中途失败，随后连接结束；\n"
+        "- `event: done` + `data: {}`：正常结束。\n\n"
+        "配置缺失、上游 HTTP 错误等在首个片段之前发生的失败仍返回 HTTP 502 JSON。"
+        "浏览器断开连接时服务端随即关闭对 Coze 的上游请求。"
+    ),
+    response_class=StreamingResponse,
+    responses={
+        200: {"description": "SSE 事件流", "content": {"text/event-stream": {}}},
+        502: {"description": "智能体不可用：配置缺失、上游错误或执行失败。"},
+    },
+)
+async def agent_chat_stream(body: AgentChatRequest) -> StreamingResponse:
+    """先取到首个片段再开始响应，使开流前的失败仍能以 502 返回；之后逐段转发。"""
+    fragments = stream_coze_agent(body.text)
+    try:
+        first = await fragments.__anext__()
+    except StopAsyncIteration:
+        raise HTTPException(status_code=502, detail="智能体未返回可解析的文本，请检查流式事件结构或会话配置")
+    except CozeAgentError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    async def events():
+        try:
+            yield _sse({"text": first})
+            async for fragment in fragments:
+                yield _sse({"text": fragment})
+            yield _sse({}, event="done")
+        except CozeAgentError as e:
+            yield _sse({"detail": str(e)}, event="error")
+        finally:
+            # 客户端断开时 Starlette 取消本生成器，这里关闭上游流
+            await fragments.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
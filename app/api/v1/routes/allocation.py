@@ -22,6 +22,7 @@ from app.services.allocation_service import (
     get_filter_options,
     query_ai_purchase_quantity,
 )
+from app.services.contract_progress import DELIVERIES, SHIPPING, refresh_contract_progress
 from app.services.contract_service import get_conn
 
 
@@ -410,6 +411,8 @@ def _insert_test_deliveries(contracts: list, max_per_contract: int) -> int:
                     ))
                     inserted += 1
 
+            refresh_contract_progress(cur, [c["contract_no"] for c in contracts], parts=(DELIVERIES,))
+
     return inserted
 
 
@@ -440,6 +443,8 @@ def _insert_test_weighbills(contracts: list, max_per_contract: int) -> int:
                     ))
                     inserted += 1
 
+            refresh_contract_progress(cur, [c["contract_no"] for c in contracts], parts=(SHIPPING,))
+
     return inserted
 
 
@@ -469,6 +474,8 @@ def _cleanup_test_data(prefix: str = "TEST") -> dict:
             cur.execute("DELETE FROM pd_contracts WHERE contract_no LIKE %s", (f'{prefix}%',))
             deleted["contracts"] = cur.rowcount
 
+            cur.execute("DELETE FROM pd_contract_progress WHERE contract_no LIKE %s", (f'{prefix}%',))
+
     return deleted
 
 
@@ -643,11 +650,14 @@ async def get_contracts_status():
         contracts_status = []
         with _get_db_conn() as conn:
             with conn.cursor() as cur:
+                # 已发车数读合同进度台账（报单写入时同步维护），不再逐个合同 COUNT 报单
                 cur.execute("""
-                    SELECT contract_no, smelter_company, total_quantity, truck_count
-                    FROM pd_contracts
-                    WHERE status = '生效中'
-                    ORDER BY contract_no
+                    SELECT c.contract_no, c.smelter_company, c.total_quantity, c.truck_count,
+                           COALESCE(p.delivery_count, 0)
+                    FROM pd_contracts c
+                    LEFT JOIN pd_contract_progress p ON p.contract_no = c.contract_no
+                    WHERE c.status = '生效中'
+                    ORDER BY c.contract_no
                 """)
                 rows = cur.fetchall()
 
@@ -656,14 +666,7 @@ async def get_contracts_status():
                     smelter_company = row[1]
                     total_quantity = row[2]
                     truck_count = row[3] or 0
-
-                    cur.execute("""
-                        SELECT COUNT(*) as count
-                        FROM pd_deliveries
-                        WHERE contract_no = %s
-                    """, (contract_no,))
-                    delivery_row = cur.fetchone()
-                    delivered_trucks = delivery_row[0] if delivery_row else 0
+                    delivered_trucks = int(row[4] or 0)
 
                     contracts_status.append(ContractStatusResponse(
                         contract_no=contract_no,
@@ -11,11 +11,15 @@ from pathlib import Path
 from typing import List, Optional, Dict
 from fastapi.responses import FileResponse
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Body, Form
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field, ValidationError
 
 from app.core.paths import UPLOADS_DIR
+from app.services.balance_allocation import OLDEST_FIRST
+from app.services.balance_backfill import backfill_balance_details
 from app.services.balance_service import BalanceService, get_balance_service, UPLOAD_DIR
 from app.services.contract_service import get_conn
+from app.utils.upload_spool import present_files, spool_uploads
 
 router = APIRouter(prefix="/balances", tags=["磅单结余管理"])
 
@@ -238,6 +242,29 @@ async def generate_balance(
         raise HTTPException(status_code=400, detail=result.get("error"))
 
 
+@router.post("/backfill", summary="批量回填结余明细", response_model=dict)
+def backfill_balances(
+        after_weighbill_id: int = Query(0, ge=0, description="从该磅单ID之后继续（上次返回的 last_weighbill_id）"),
+        contract_no: Optional[str] = Query(None, description="指定合同编号"),
+        chunk_size: int = Query(500, ge=1, le=2000, description="每批磅单数"),
+        max_chunks: Optional[int] = Query(None, ge=1, description="本次最多处理的批数，空 = 处理到结束"),
+):
+    """
+    价格修正后按磅单ID分批生成缺失的结余明细，每批单独提交；
+    done=false 时用返回的 last_weighbill_id 作为 after_weighbill_id 继续。
+    """
+    try:
+        result = backfill_balance_details(
+            after_weighbill_id=after_weighbill_id,
+            contract_no=contract_no,
+            chunk_size=chunk_size,
+            max_chunks=max_chunks,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量回填结余明细失败: {e}")
+    return {"success": True, "data": result.as_dict()}
+
+
 @router.get("/", summary="查询结余明细列表", response_model=dict)
 async def list_balances(
         exact_contract_no: Optional[str] = Query(None, description="精确合同编号"),
@@ -271,6 +298,10 @@ async def list_balances_grouped(
         date_to: Optional[str] = Query(None, description="排款日期结束"),
         page: int = Query(1, ge=1),
         page_size: int = Query(20, ge=1, le=100),
+        cursor: Optional[str] = Query(None, description="游标分页：上一页返回的 next_cursor"),
+        cursor_mode: bool = Query(False, description="启用游标分页（首页传 true，之后传 cursor）"),
+        count_mode: str = Query("exact", pattern="^(exact|cached|estimate|none)$",
+                                description="总数：exact 精确 / cached 缓存 / estimate 估算 / none 不统计"),
         service: BalanceService = Depends(get_balance_service)
 ):
     """
@@ -301,6 +332,9 @@ async def list_balances_grouped(
         date_to=date_to,
         page=page,
         page_size=page_size,
+        cursor=cursor,
+        cursor_mode=cursor_mode,
+        count_mode=count_mode,
     )
     if result["success"]:
         return result
@@ -488,6 +522,44 @@ async def ocr_payment_receipt(
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
 
 
+@router.post("/payment-receipts/reconcile", summary="批量回单对账（识别并建议核销）", response_model=dict)
+async def reconcile_payment_receipts(
+        files: List[UploadFile] = File(..., description="支付回单图片（支持多张，每张一笔转账）"),
+        date_range: int = Form(30, ge=1, le=365, description="只匹配近 N 天生成的结余"),
+        amount_tolerance: float = Form(0.01, ge=0, le=100, description="金额容差（元）"),
+        service: BalanceService = Depends(get_balance_service)
+):
+    """
+    批量识别支付回单，并在涉及收款人的待支付结余中全局求解匹配：
+    每张回单返回建议核销的结余明细（items，可直接作为核销接口的明细）、置信度与状态
+    （confident=可直接确认，review=需人工核对（同分候选或多笔组合），unmatched=未找到）。
+    本接口不保存回单、不核销。
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="请至少上传一张回单图片")
+    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp"]
+    for file in files:
+        if file.content_type not in allowed_types:
+            raise HTTPException(status_code=400, detail=f"文件 {file.filename} 格式不支持，仅支持jpg/png/bmp")
+
+    try:
+        async with spool_uploads(files) as spooled:
+            result = await run_in_threadpool(
+                service.reconcile_payment_receipts,
+                present_files(spooled),
+                date_range,
+                amount_tolerance,
+            )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量对账失败: {str(e)}")
+
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result.get("error"))
+    return result
+
+
 @router.post("/payment-receipts", summary="保存支付回单", response_model=dict)
 async def create_payment_receipt(
         request: Optional[str] = Form(None, description="回单数据JSON字符串（与request_json二选一）"),
@@ -860,20 +932,27 @@ async def batch_verify_by_payee(
         payee_name: str,
         receipt_id: int = Form(..., description="支付回单ID"),
         driver_phone: Optional[str] = Form(None, description="司机电话"),
+        max_amount: Optional[float] = Form(None, gt=0, description="本次最多核销金额，空 = 回单金额"),
+        policy: str = Form(
+            OLDEST_FIRST,
+            description="分配策略：oldest_first=按创建时间从早到晚（默认，与原行为一致），exact_first=优先整笔恰好凑齐，"
+                        "min_partials=尽量整笔结清、部分支付金额最小",
+        ),
         service: BalanceService = Depends(get_balance_service)
 ):
     """
     按收款人批量核销支付
 
-    将一个支付回单的金额，自动分配到该收款人的多笔结余明细上
-    分配顺序：按创建时间从早到晚
+    将一个支付回单的金额，按分配策略自动分配到该收款人的多笔结余明细上
 
     适用场景：司机一次打款覆盖多车货的结余
     """
     result = service.batch_verify_by_payee(
         payee_name=payee_name,
         receipt_id=receipt_id,
-        driver_phone=driver_phone
+        driver_phone=driver_phone,
+        max_amount=max_amount,
+        policy=policy,
     )
 
     if result["success"]:
@@ -2,22 +2,22 @@
 合同管理路由 - 完整版
 支持OCR识别、手动录入、查看、编辑、导出
 """
-import csv
+import itertools
 import os
 import re
 import shutil
 import json
-from io import StringIO
 from decimal import Decimal
 from typing import List, Optional
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Body, Form
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field
 from datetime import date
 
 from app.core.paths import UPLOADS_DIR
 from app.services.contract_service import ContractService, get_contract_service
+from app.utils.streaming_export import iter_export_bytes, streaming_export_response
 
 router = APIRouter(prefix="/contracts", tags=["合同管理"])
 
@@ -574,36 +574,32 @@ async def delete_contract(
 
 
 @router.post("/export", summary="导出合同")
-async def export_contracts(
+def export_contracts(
     contract_ids: List[int] = Body(None, description="要导出的合同ID列表，空则导出全部"),
+    file_format: str = Query("csv", pattern="^(xlsx|csv)$", description="导出格式：csv / xlsx"),
     service: ContractService = Depends(get_contract_service)
 ):
-    """导出合同"""
-    data = service.export_contracts(contract_ids)
-    columns: List[str] = []
-    for row in data:
-        for key in row.keys():
-            if key not in columns:
-                columns.append(key)
-
-    buffer = StringIO()
-    writer = csv.writer(buffer)
-    if columns:
-        writer.writerow(columns)
-        for row in data:
-            writer.writerow([row.get(col) for col in columns])
-
-    filename = "contracts_export.csv"
-    if contract_ids and len(contract_ids) == 1 and data:
-        contract_no = str(data[0].get("contract_no") or "").strip()
+    """导出合同（按合同键集分页读取，边查边写出；同步路由，首页查询在线程池中执行）"""
+    rows = service.iter_export_contracts(contract_ids)
+    # 首页在发出响应头之前读取：此时失败还能返回带说明的错误；之后的失败只能中断响应流
+    try:
+        first = next(rows, None)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"导出合同失败: {str(e)}")
+    columns: List[str] = list(first.keys()) if first else []
+
+    filename = f"contracts_export.{file_format}"
+    if contract_ids and len(contract_ids) == 1 and first:
+        contract_no = str(first.get("contract_no") or "").strip()
         if contract_no:
             safe_name = re.sub(r"[^A-Za-z0-9_-]", "_", contract_no)
-            filename = f"{safe_name}.csv"
-
-    csv_bytes = buffer.getvalue().encode("utf-8-sig")
-    headers = {"Content-Disposition": f"attachment; filename=\"{filename}\""}
-    return StreamingResponse(
-        iter([csv_bytes]),
-        media_type="text/csv; charset=utf-8",
-        headers=headers,
-    )
\ No newline at end of file
+            filename = f"{safe_name}.{file_format}"
+
+    records = itertools.chain([first], rows) if first else iter(())
+    body = iter_export_bytes(
+        file_format,
+        columns,
+        ([row.get(col) for col in columns] for row in records),
+        sheet_title="合同",
+    )
+    return streaming_export_response(body, filename, file_format)
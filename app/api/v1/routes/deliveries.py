@@ -7,15 +7,18 @@ import re
 from typing import List, Dict,Optional, Any
 import logging
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field
 from datetime import datetime
-import mimetypes
 from fastapi import Request, Response
 from fastapi import Body
-from urllib.parse import quote
 from fastapi import Query
+from app.core.config import settings
 from app.services.delivery_service import DeliveryService, get_delivery_service
+from app.services.image_store import get_image_store
+from app.utils.image_response import image_response
+from app.utils.upload_spool import present_files, spool_uploads
 from core.auth import get_current_user
 from core.database import get_conn
 
@@ -169,6 +172,53 @@ class TextExtractResponse(BaseModel):
     suggested_data: Optional[Dict[str, Any]] = Field(None, description="建议的报单数据")
 # ============ 路由 ============
 
+def _load_lenient_json(body_bytes: bytes) -> Dict[str, Any]:
+    """解析请求体 JSON；字符串里夹带原始换行 / 制表符时先转义再解析"""
+    body_str = body_bytes.decode('utf-8', errors='ignore')
+    try:
+        # 方法1：尝试标准解析（处理已转义的 \n）
+        return json.loads(body_str)
+    except json.JSONDecodeError as e:
+        # 方法2：如果失败，尝试清理原始控制字符后再解析
+        # 将原始换行符、回车符替换为 \n 转义序列
+        cleaned_json = body_str.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+        try:
+            return json.loads(cleaned_json)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail=f"JSON解析错误: {str(e)}")
+
+
+def _clean_report_text(text: str) -> str:
+    """清理报单文本：转义换行、控制字符、多余空白"""
+    # 注意：此时 text 中的 \n 已经是字符串，不是控制字符
+    clean_text = text.replace('\\n', ' ').replace('\\r', ' ').replace('\\t', ' ')
+    # 移除其他不可打印控制字符（以防万一）
+    clean_text = ''.join(char for char in clean_text if ord(char) >= 32 or char in '\n\r\t')
+    # 合并多余空格
+    return re.sub(r'\s+', ' ', clean_text).strip()
+
+
+def _text_extract_response(result: Dict[str, Any]) -> TextExtractResponse:
+    return TextExtractResponse(
+        success=result.get('success', True),
+        message=result.get('reason', '解析完成'),
+        extracted=result.get('extracted', {}),
+        validation=result.get('validation', {
+            'is_valid': False,
+            'missing_fields': [],
+            'data': {}
+        }),
+        contract_match=result.get('contract_match', {
+            'matched': False,
+            'match_type': 'none'
+        }),
+        contract_no=(result.get('contract_match') or {}).get('contract_no') or result.get('extracted', {}).get('contract_no'),
+        contract_id=(result.get('contract_match') or {}).get('contract_id') or result.get('extracted', {}).get('contract_id'),
+        ready_to_create=result.get('ready_to_create', False),
+        suggested_data=result.get('suggested_data')
+    )
+
+
 @router.post("/parse", summary="解析报单文本", response_model=TextExtractResponse)
 async def parse_delivery_text(
     request: Request,  # 使用原始 Request 绕过 Pydantic 验证
@@ -176,22 +226,7 @@ async def parse_delivery_text(
 ):
     """解析上传的非结构化报单文本（支持包含换行符的 JSON）"""
     try:
-        # 读取原始字节
-        body_bytes = await request.body()
-        body_str = body_bytes.decode('utf-8', errors='ignore')
-        
-        # 自定义 JSON 解析：先清理控制字符，再解析
-        try:
-            # 方法1：尝试标准解析（处理已转义的 \n）
-            data = json.loads(body_str)
-        except json.JSONDecodeError as e:
-            # 方法2：如果失败，尝试清理原始控制字符后再解析
-            # 将原始换行符、回车符替换为 \n 转义序列
-            cleaned_json = body_str.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
-            try:
-                data = json.loads(cleaned_json)
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=400, detail=f"JSON解析错误: {str(e)}")
+        data = _load_lenient_json(await request.body())
         
         text = data.get('text', '')
         report_date = data.get('report_date')
@@ -199,40 +234,57 @@ async def parse_delivery_text(
         if not text:
             raise HTTPException(status_code=400, detail="text 字段不能为空")
         
-        # 清理文本内容（将转义的换行符等替换为空格）
-        # 注意：此时 text 中的 \n 已经是字符串，不是控制字符
-        clean_text = text.replace('\\n', ' ').replace('\\r', ' ').replace('\\t', ' ')
-        # 移除其他不可打印控制字符（以防万一）
-        clean_text = ''.join(char for char in clean_text if ord(char) >= 32 or char in '\n\r\t')
-        # 合并多余空格
-        clean_text = re.sub(r'\s+', ' ', clean_text).strip()
+        result = service.extract_with_contract(_clean_report_text(text), report_date=report_date)
         
-        result = service.extract_with_contract(clean_text, report_date=report_date)
-        
-        return TextExtractResponse(
-            success=result.get('success', True),
-            message=result.get('reason', '解析完成'),
-            extracted=result.get('extracted', {}),
-            validation=result.get('validation', {
-                'is_valid': False,
-                'missing_fields': [],
-                'data': {}
-            }),
-            contract_match=result.get('contract_match', {
-                'matched': False,
-                'match_type': 'none'
-            }),
-            contract_no=(result.get('contract_match') or {}).get('contract_no') or result.get('extracted', {}).get('contract_no'),
-            contract_id=(result.get('contract_match') or {}).get('contract_id') or result.get('extracted', {}).get('contract_id'),
-            ready_to_create=result.get('ready_to_create', False),
-            suggested_data=result.get('suggested_data')
-        )
+        return _text_extract_response(result)
     except HTTPException:
         raise
     except Exception as e:
         logger.exception(f"解析报单文本失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.post("/parse/batch", summary="批量解析报单文本", response_model=dict)
+async def parse_delivery_texts(
+    request: Request,  # 使用原始 Request 绕过 Pydantic 验证
+    service: DeliveryService = Depends(get_delivery_service)
+):
+    """
+    一次解析多条报单文本（调度成批粘贴的微信消息），请求体 {"texts": [...], "report_date": ...}。
+    合同匹配与 24 小时重复校验各合并为一次查询；data 按输入顺序逐条返回，
+    每条与 /parse 的响应相同，另附 index 与 duplicate_check（含 batch_duplicates：本批中更早出现的同一司机序号）。
+    """
+    try:
+        data = _load_lenient_json(await request.body())
+        texts = data.get('texts')
+        report_date = data.get('report_date')
+
+        if not isinstance(texts, list) or not texts:
+            raise HTTPException(status_code=400, detail="texts 必须为非空数组")
+        if len(texts) > settings.delivery_text_batch_max_messages:
+            raise HTTPException(
+                status_code=400,
+                detail=f"单次最多解析 {settings.delivery_text_batch_max_messages} 条报单文本",
+            )
+        cleaned = [_clean_report_text(str(t or '')) for t in texts]
+        empty = [i for i, t in enumerate(cleaned) if not t]
+        if empty:
+            raise HTTPException(status_code=400, detail=f"第 {', '.join(str(i + 1) for i in empty)} 条文本为空")
+
+        result = await run_in_threadpool(service.extract_with_contract_batch, cleaned, report_date=report_date)
+        items = []
+        for item in result['data']:
+            response = _text_extract_response(item).model_dump()
+            response['index'] = item['index']
+            response['duplicate_check'] = item['duplicate_check']
+            items.append(response)
+        return {"success": True, "total": result['total'], "data": items}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"批量解析报单文本失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/", summary="新增报货订单", response_model=dict)
 async def create_delivery(
     report_date: str = Form(...),
@@ -278,24 +330,17 @@ async def create_delivery(
             "position": position,
         }
 
-        # 读取联单图片
-        delivery_img_bytes = None
-        if delivery_order_image:
-            delivery_img_bytes = await delivery_order_image.read()
-
-        # 读取多张凭证图片
-        voucher_bytes_list = []
-        if voucher_images:
-            for f in voucher_images:
-                voucher_bytes_list.append(await f.read())
-
-        result = service.create_delivery(
-            data,
-            delivery_order_image=delivery_img_bytes,
-            voucher_images=voucher_bytes_list,
-            current_user=current_user,
-            confirm_flag=confirm_flag
-        )
+        # 联单与凭证图片落盘后以文件句柄交给服务层
+        async with spool_uploads([delivery_order_image, *(voucher_images or [])]) as spooled:
+            order_upload = spooled[0] if delivery_order_image else None
+            voucher_uploads = spooled[1:] if delivery_order_image else spooled
+            result = service.create_delivery(
+                data,
+                delivery_order_image=order_upload.file if order_upload else None,
+                voucher_images=present_files(voucher_uploads),
+                current_user=current_user,
+                confirm_flag=confirm_flag
+            )
 
         if result.get("need_confirm"):
             raise HTTPException(
@@ -347,8 +392,8 @@ async def append_voucher_images(
 ):
     """追加凭证图片（不会删除原有图片）"""
     try:
-        img_bytes_list = [await f.read() for f in images]
-        result = service.add_voucher_images(delivery_id, img_bytes_list)
+        async with spool_uploads(images) as spooled:
+            result = service.add_voucher_images(delivery_id, present_files(spooled))
         if result["success"]:
             return result
         else:
@@ -398,12 +443,14 @@ async def list_voucher_images(
     },
 )
 async def view_voucher_image(
+    request: Request,
     delivery_id: int,
     index: int = Query(0, ge=0, description="图片索引，从0开始（默认第一张）"),
+    variant: str = Query("original", pattern="^(original|thumb)$", description="original=原图，thumb=缩略图"),
     service: DeliveryService = Depends(get_delivery_service)
 ):
     """
-    按索引预览指定订单的凭证图片（支持多张图片）
+    按索引预览指定订单的凭证图片（支持多张图片；支持 ETag/Range，variant=thumb 取缩略图）
     """
     try:
         # 获取订单详情（包含 voucher_images 列表）
@@ -424,30 +471,13 @@ async def view_voucher_image(
             )
 
         image_path = voucher_paths[index]
-        if not image_path or not os.path.exists(image_path):
+        store = get_image_store()
+        resolved = store.resolve(image_path, variant)
+        if resolved is None:
             raise HTTPException(status_code=404, detail="图片文件不存在")
 
-        # 自动识别 MIME 类型
-        mime_type, _ = mimetypes.guess_type(image_path)
-        if not mime_type:
-            mime_type = "image/jpeg"  # 默认
-
-        # 对文件名进行 RFC 5987 编码（支持中文）
-        filename = os.path.basename(image_path)
-        try:
-            # 尝试 ASCII 编码
-            filename.encode('ascii')
-            disposition = f'inline; filename="{filename}"'
-        except UnicodeEncodeError:
-            # 非 ASCII 文件名，使用 UTF-8 编码
-            encoded_filename = quote(filename, safe='')
-            disposition = f"inline; filename*=UTF-8''{encoded_filename}"
-
-        return FileResponse(
-            path=image_path,
-            media_type=mime_type,
-            headers={"Content-Disposition": disposition}
-        )
+        filename = os.path.basename(resolved.key or str(resolved.path))
+        return image_response(request, store, resolved, filename=filename, disposition_type="inline")
 
     except HTTPException:
         raise
@@ -463,14 +493,14 @@ async def replace_voucher_images(
 ):
     """整体替换凭证图片（会删除原有所有凭证图片）"""
     try:
-        voucher_bytes_list = [await f.read() for f in voucher_images]
-        result = service.update_delivery(
-            delivery_id,
-            data={},
-            delivery_order_image=None,
-            voucher_images=voucher_bytes_list,
-            uploaded_by=current_user.get('name') if current_user else None
-        )
+        async with spool_uploads(voucher_images) as spooled:
+            result = service.update_delivery(
+                delivery_id,
+                data={},
+                delivery_order_image=None,
+                voucher_images=present_files(spooled),
+                uploaded_by=current_user.get('name') if current_user else None
+            )
         if result["success"]:
             return result
         else:
@@ -533,6 +563,10 @@ async def list_deliveries(
         date_to: Optional[str] = Query(None, description="结束日期"),
         page: int = Query(1, ge=1),
         page_size: int = Query(20, ge=1, le=100),
+        cursor: Optional[str] = Query(None, description="游标分页：上一页返回的 next_cursor"),
+        cursor_mode: bool = Query(False, description="启用游标分页（首页传 true，之后传 cursor）"),
+        count_mode: str = Query("exact", pattern="^(exact|cached|estimate|none)$",
+                                description="总数：exact 精确 / cached 缓存 / estimate 估算 / none 不统计"),
         service: DeliveryService = Depends(get_delivery_service)
 ):
     """查询报货订单列表"""
@@ -554,7 +588,10 @@ async def list_deliveries(
         date_from=date_from,
         date_to=date_to,
         page=page,
-        page_size=page_size
+        page_size=page_size,
+        cursor=cursor,
+        cursor_mode=cursor_mode,
+        count_mode=count_mode
     )
 
 
@@ -637,14 +674,13 @@ async def upload_delivery_order(
                 detail="该订单已上传联单，如需修改请使用 modify-order 接口"
             )
 
-        image_bytes = await image.read()
-
         data = {}
         if has_delivery_order:
             data['has_delivery_order'] = has_delivery_order
             data['uploaded_by'] = uploaded_by
 
-        result = service.update_delivery(delivery_id, data, image_bytes, uploaded_by=uploaded_by)
+        async with spool_uploads([image]) as spooled:
+            result = service.update_delivery(delivery_id, data, spooled[0].file, uploaded_by=uploaded_by)
 
         if result["success"]:
             return {"success": True, "message": "联单上传成功", "data": result["data"]}
@@ -696,14 +732,13 @@ async def modify_delivery_order(
                 detail="该订单未上传联单，请使用 upload-order 接口"
             )
 
-        image_bytes = await image.read()
-
         data = {}
         if has_delivery_order:
             data['has_delivery_order'] = has_delivery_order
             data['uploaded_by'] = uploaded_by
 
-        result = service.update_delivery(delivery_id, data, image_bytes, uploaded_by=uploaded_by)
+        async with spool_uploads([image]) as spooled:
+            result = service.update_delivery(delivery_id, data, spooled[0].file, uploaded_by=uploaded_by)
 
         if result["success"]:
             return {"success": True, "message": "联单修改成功", "data": result["data"]}
@@ -731,10 +766,12 @@ async def delete_delivery_image(
 
 @router.get("/{delivery_id}/view-order", summary="查看联单图片")
 async def view_delivery_order(
+    request: Request,
     delivery_id: int,
+    variant: str = Query("original", pattern="^(original|thumb)$", description="original=原图，thumb=缩略图"),
     service: DeliveryService = Depends(get_delivery_service)
 ):
-    """查看联单图片（仅支持图片格式，PDF 请使用 /view-pdf 接口）"""
+    """查看联单图片（仅支持图片格式，PDF 请使用 /view-pdf 接口；支持 ETag/Range，variant=thumb 取缩略图）"""
     try:
         delivery = service.get_delivery(delivery_id)
         if not delivery:
@@ -744,35 +781,21 @@ async def view_delivery_order(
         if not image_path:
             raise HTTPException(status_code=404, detail="该订单没有上传联单文件")
 
-        if not os.path.exists(image_path):
-            raise HTTPException(status_code=404, detail="联单文件不存在")
-
-        # 获取文件扩展名（小写）
-        ext = os.path.splitext(image_path)[1].lower()
-
-        # 定义图片扩展名集合
-        image_exts = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.gif'}
-
-        if ext == '.pdf':
+        if os.path.splitext(image_path)[1].lower() == '.pdf':
             # 如果是 PDF，返回错误并提示使用 PDF 接口
             raise HTTPException(
                 status_code=400,
                 detail="该联单为 PDF 格式，请使用 /view-pdf 接口预览"
             )
-        elif ext in image_exts:
-            # 图片格式，正常返回
-            return FileResponse(
-                path=image_path,
-                media_type=f"image/{ext[1:]}",  # 如 image/jpeg
-                filename=f"delivery_order_{delivery_id}{ext}"
-            )
-        else:
-            # 其他未知格式，作为通用二进制文件返回
-            return FileResponse(
-                path=image_path,
-                media_type="application/octet-stream",
-                filename=f"delivery_order_{delivery_id}{ext}"
-            )
+
+        store = get_image_store()
+        resolved = store.resolve(image_path, variant)
+        if resolved is None:
+            raise HTTPException(status_code=404, detail="联单文件不存在")
+
+        # 返回文件的扩展名（缩略图为 .webp）；未知格式按通用二进制文件返回
+        ext = os.path.splitext(resolved.key or str(resolved.path))[1].lower()
+        return image_response(request, store, resolved, filename=f"delivery_order_{delivery_id}{ext}")
 
     except HTTPException:
         raise
@@ -782,11 +805,13 @@ async def view_delivery_order(
 
 @router.get("/{delivery_id}/image", summary="查看联单图片（兼容旧接口）")
 async def get_delivery_image(
+    request: Request,
     delivery_id: int,
+    variant: str = Query("original", pattern="^(original|thumb)$", description="original=原图，thumb=缩略图"),
     service: DeliveryService = Depends(get_delivery_service)
 ):
     """查看联单图片（兼容旧接口）"""
-    return await view_delivery_order(delivery_id, service)
+    return await view_delivery_order(request, delivery_id, variant, service)
 
 
 @router.post("/batch-upload-orders", summary="批量上传联单图片", response_model=BatchDeliveryOrderResponse)
@@ -925,219 +950,252 @@ async def batch_upload_delivery_orders(
                 detail=f"图片数量({len(files)})与报单ID数量({len(delivery_id_list)})不一致"
             )
 
-        # ==================== 批量模式（推荐）====================
-        if use_batch_mode and len(files) > 1:
-            # 预读取所有图片并验证
-            items = []
-            pre_check_results = []
-
-            for idx, (file, delivery_id) in enumerate(zip(files, delivery_id_list)):
-                # 验证文件类型
-                allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp", "image/webp"]
-                if file.content_type not in allowed_types:
-                    pre_check_results.append({
-                        "index": idx,
-                        "delivery_id": delivery_id,
-                        "success": False,
-                        "message": f"不支持的文件格式: {file.content_type}，仅支持 jpg/png/bmp/webp",
-                        "pre_check_failed": True
-                    })
-                    continue
-
-                try:
-                    # 读取图片字节（限制 10MB）
-                    MAX_FILE_SIZE = 10 * 1024 * 1024
-                    image_bytes = await file.read()
-
-                    if len(image_bytes) > MAX_FILE_SIZE:
+        # 逐个落盘（超过 10MB 的只标记，由对应条目返回失败），处理结束后统一清理临时文件
+        MAX_FILE_SIZE = 10 * 1024 * 1024
+        async with spool_uploads(files, max_file_bytes=MAX_FILE_SIZE, strict=False) as spooled:
+            # ==================== 批量模式（推荐）====================
+            if use_batch_mode and len(files) > 1:
+                # 预读取所有图片并验证
+                items = []
+                pre_check_results = []
+
+                for idx, (file, upload, delivery_id) in enumerate(zip(files, spooled, delivery_id_list)):
+                    # 验证文件类型
+                    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp", "image/webp"]
+                    if file.content_type not in allowed_types:
                         pre_check_results.append({
                             "index": idx,
                             "delivery_id": delivery_id,
                             "success": False,
-                            "message": f"文件大小超过 10MB 限制",
+                            "message": f"不支持的文件格式: {file.content_type}，仅支持 jpg/png/bmp/webp",
                             "pre_check_failed": True
                         })
                         continue
 
-                    # 预检查报单状态（避免在事务中查询）
-                    delivery = service.get_delivery(delivery_id)
-                    if not delivery:
-                        pre_check_results.append({
-                            "index": idx,
-                            "delivery_id": delivery_id,
-                            "success": False,
-                            "message": "报单不存在",
-                            "pre_check_failed": True
+                    try:
+                        # 图片已落盘（限制 10MB）
+                        if upload.too_large:
+                            pre_check_results.append({
+                                "index": idx,
+                                "delivery_id": delivery_id,
+                                "success": False,
+                                "message": f"文件大小超过 10MB 限制",
+                                "pre_check_failed": True
+                            })
+                            continue
+                        if upload.file is None:
+                            pre_check_results.append({
+                                "index": idx,
+                                "delivery_id": delivery_id,
+                                "success": False,
+                                "message": "文件内容为空",
+                                "pre_check_failed": True
+                            })
+                            continue
+
+                        # 预检查报单状态（避免在事务中查询）
+                        delivery = service.get_delivery(delivery_id)
+                        if not delivery:
+                            pre_check_results.append({
+                                "index": idx,
+                                "delivery_id": delivery_id,
+                                "success": False,
+                                "message": "报单不存在",
+                                "pre_check_failed": True
+                            })
+                            continue
+
+                        if delivery.get('upload_status') == '已上传':
+                            pre_check_results.append({
+                                "index": idx,
+                                "delivery_id": delivery_id,
+                                "success": False,
+                                "message": "已上传联单，请使用 modify-order 接口修改",
+                                "image_path": delivery.get('delivery_order_image'),
+                                "upload_status": "已上传",
+                                "service_fee": float(delivery.get('service_fee', 0)),
+                                "pre_check_failed": True
+                            })
+                            continue
+
+                        # 通过预检查，加入批量处理列表
+                        items.append({
+                            'index': idx,
+                            'delivery_id': delivery_id,
+                            'image_bytes': upload.file,
+                            'has_delivery_order': has_order_list[idx] if has_order_list else '有'
                         })
-                        continue
 
-                    if delivery.get('upload_status') == '已上传':
+                    except Exception as e:
                         pre_check_results.append({
                             "index": idx,
                             "delivery_id": delivery_id,
                             "success": False,
-                            "message": "已上传联单，请使用 modify-order 接口修改",
-                            "image_path": delivery.get('delivery_order_image'),
-                            "upload_status": "已上传",
-                            "service_fee": float(delivery.get('service_fee', 0)),
+                            "message": f"文件读取失败: {str(e)}",
                             "pre_check_failed": True
                         })
-                        continue
 
-                    # 通过预检查，加入批量处理列表
-                    items.append({
-                        'index': idx,
-                        'delivery_id': delivery_id,
-                        'image_bytes': image_bytes,
-                        'has_delivery_order': has_order_list[idx] if has_order_list else '有'
-                    })
-
-                except Exception as e:
-                    pre_check_results.append({
-                        "index": idx,
-                        "delivery_id": delivery_id,
-                        "success": False,
-                        "message": f"文件读取失败: {str(e)}",
-                        "pre_check_failed": True
-                    })
-
-            # 调用批量更新服务（复用数据库连接）
-            batch_results = []
-            if items:
-                batch_results = service.batch_update_delivery_images(items, uploaded_by)
-
-            # 合并预检查失败结果和批量处理结果
-            all_results = pre_check_results + batch_results
-
-            # 按索引排序
-            all_results.sort(key=lambda x: x.get('index', 0))
-
-            # 统计结果
-            success_count = sum(1 for r in all_results if r.get('success'))
-            failed_count = len(all_results) - success_count
-
-            # 转换为响应模型
-            results = []
-            for r in all_results:
-                results.append(BatchUploadResult(
-                    index=r['index'],
-                    delivery_id=r.get('delivery_id', delivery_id_list[r['index']]),
-                    success=r.get('success', False),
-                    message=r.get('message') or r.get('error', '处理失败'),
-                    image_path=r.get('image_path'),
-                    upload_status=r.get('upload_status'),
-                    service_fee=r.get('service_fee'),
-                    source_type=r.get('source_type')
-                ))
-
-            return BatchDeliveryOrderResponse(
-                success=True,
-                message=f"批量上传完成（批量模式）：成功 {success_count}/{len(files)} 条",
-                total_count=len(files),
-                success_count=success_count,
-                failed_count=failed_count,
-                results=results
-            )
+                # 调用批量更新服务（复用数据库连接）
+                batch_results = []
+                if items:
+                    batch_results = service.batch_update_delivery_images(items, uploaded_by)
 
-        # ==================== 单条模式（兼容旧逻辑）====================
-        else:
-            results = []
-            success_count = 0
-            failed_count = 0
+                # 合并预检查失败结果和批量处理结果
+                all_results = pre_check_results + batch_results
 
-            for idx, (file, delivery_id) in enumerate(zip(files, delivery_id_list)):
-                try:
-                    # 验证文件类型
-                    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp", "image/webp"]
-                    if file.content_type not in allowed_types:
-                        results.append(BatchUploadResult(
-                            index=idx,
-                            delivery_id=delivery_id,
-                            success=False,
-                            message=f"不支持的文件格式: {file.content_type}",
-                            image_path=None,
-                            upload_status=None,
-                            service_fee=None,
-                            source_type=None
-                        ))
-                        failed_count += 1
-                        continue
+                # 按索引排序
+                all_results.sort(key=lambda x: x.get('index', 0))
 
-                    # 读取图片（限制 10MB）
-                    MAX_FILE_SIZE = 10 * 1024 * 1024
-                    image_bytes = await file.read()
+                # 统计结果
+                success_count = sum(1 for r in all_results if r.get('success'))
+                failed_count = len(all_results) - success_count
 
-                    if len(image_bytes) > MAX_FILE_SIZE:
-                        results.append(BatchUploadResult(
-                            index=idx,
-                            delivery_id=delivery_id,
-                            success=False,
-                            message="文件大小超过 10MB 限制",
-                            image_path=None,
-                            upload_status=None,
-                            service_fee=None,
-                            source_type=None
-                        ))
-                        failed_count += 1
-                        continue
-
-                    # 检查报单
-                    delivery = service.get_delivery(delivery_id)
-                    if not delivery:
-                        results.append(BatchUploadResult(
-                            index=idx,
-                            delivery_id=delivery_id,
-                            success=False,
-                            message="报单不存在",
-                            image_path=None,
-                            upload_status=None,
-                            service_fee=None,
-                            source_type=None
-                        ))
-                        failed_count += 1
-                        continue
-
-                    if delivery.get('upload_status') == '已上传':
-                        results.append(BatchUploadResult(
-                            index=idx,
-                            delivery_id=delivery_id,
-                            success=False,
-                            message="已上传联单，请使用 modify-order 接口修改",
-                            image_path=delivery.get('delivery_order_image'),
-                            upload_status='已上传',
-                            service_fee=float(delivery.get('service_fee', 0)),
-                            source_type=delivery.get('source_type')
-                        ))
-                        failed_count += 1
-                        continue
-
-                    # 准备数据
-                    data = {
-                        'has_delivery_order': has_order_list[idx] if has_order_list else '有',
-                        'uploaded_by': uploaded_by
-                    }
+                # 转换为响应模型
+                results = []
+                for r in all_results:
+                    results.append(BatchUploadResult(
+                        index=r['index'],
+                        delivery_id=r.get('delivery_id', delivery_id_list[r['index']]),
+                        success=r.get('success', False),
+                        message=r.get('message') or r.get('error', '处理失败'),
+                        image_path=r.get('image_path'),
+                        upload_status=r.get('upload_status'),
+                        service_fee=r.get('service_fee'),
+                        source_type=r.get('source_type')
+                    ))
 
-                    # 调用服务层更新
-                    result = service.update_delivery(delivery_id, data, image_bytes, uploaded_by=uploaded_by)
+                return BatchDeliveryOrderResponse(
+                    success=True,
+                    message=f"批量上传完成（批量模式）：成功 {success_count}/{len(files)} 条",
+                    total_count=len(files),
+                    success_count=success_count,
+                    failed_count=failed_count,
+                    results=results
+                )
 
-                    if result.get("success"):
-                        results.append(BatchUploadResult(
-                            index=idx,
-                            delivery_id=delivery_id,
-                            success=True,
-                            message="联单上传成功",
-                            image_path=result["data"].get("delivery_order_image"),
-                            upload_status=result["data"].get("upload_status"),
-                            service_fee=result["data"].get("service_fee"),
-                            source_type=result["data"].get("source_type")
-                        ))
-                        success_count += 1
-                    else:
+            # ==================== 单条模式（兼容旧逻辑）====================
+            else:
+                results = []
+                success_count = 0
+                failed_count = 0
+
+                for idx, (file, upload, delivery_id) in enumerate(zip(files, spooled, delivery_id_list)):
+                    try:
+                        # 验证文件类型
+                        allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp", "image/webp"]
+                        if file.content_type not in allowed_types:
+                            results.append(BatchUploadResult(
+                                index=idx,
+                                delivery_id=delivery_id,
+                                success=False,
+                                message=f"不支持的文件格式: {file.content_type}",
+                                image_path=None,
+                                upload_status=None,
+                                service_fee=None,
+                                source_type=None
+                            ))
+                            failed_count += 1
+                            continue
+
+                        # 图片已落盘（限制 10MB）
+                        if upload.too_large:
+                            results.append(BatchUploadResult(
+                                index=idx,
+                                delivery_id=delivery_id,
+                                success=False,
+                                message="文件大小超过 10MB 限制",
+                                image_path=None,
+                                upload_status=None,
+                                service_fee=None,
+                                source_type=None
+                            ))
+                            failed_count += 1
+                            continue
+                        if upload.file is None:
+                            results.append(BatchUploadResult(
+                                index=idx,
+                                delivery_id=delivery_id,
+                                success=False,
+                                message="文件内容为空",
+                                image_path=None,
+                                upload_status=None,
+                                service_fee=None,
+                                source_type=None
+                            ))
+                            failed_count += 1
+                            continue
+
+                        # 检查报单
+                        delivery = service.get_delivery(delivery_id)
+                        if not delivery:
+                            results.append(BatchUploadResult(
+                                index=idx,
+                                delivery_id=delivery_id,
+                                success=False,
+                                message="报单不存在",
+                                image_path=None,
+                                upload_status=None,
+                                service_fee=None,
+                                source_type=None
+                            ))
+                            failed_count += 1
+                            continue
+
+                        if delivery.get('upload_status') == '已上传':
+                            results.append(BatchUploadResult(
+                                index=idx,
+                                delivery_id=delivery_id,
+                                success=False,
+                                message="已上传联单，请使用 modify-order 接口修改",
+                                image_path=delivery.get('delivery_order_image'),
+                                upload_status='已上传',
+                                service_fee=float(delivery.get('service_fee', 0)),
+                                source_type=delivery.get('source_type')
+                            ))
+                            failed_count += 1
+                            continue
+
+                        # 准备数据
+                        data = {
+                            'has_delivery_order': has_order_list[idx] if has_order_list else '有',
+                            'uploaded_by': uploaded_by
+                        }
+
+                        # 调用服务层更新
+                        result = service.update_delivery(delivery_id, data, upload.file, uploaded_by=uploaded_by)
+
+                        if result.get("success"):
+                            results.append(BatchUploadResult(
+                                index=idx,
+                                delivery_id=delivery_id,
+                                success=True,
+                                message="联单上传成功",
+                                image_path=result["data"].get("delivery_order_image"),
+                                upload_status=result["data"].get("upload_status"),
+                                service_fee=result["data"].get("service_fee"),
+                                source_type=result["data"].get("source_type")
+                            ))
+                            success_count += 1
+                        else:
+                            results.append(BatchUploadResult(
+                                index=idx,
+                                delivery_id=delivery_id,
+                                success=False,
+                                message=result.get("error", "上传失败"),
+                                image_path=None,
+                                upload_status=None,
+                                service_fee=None,
+                                source_type=None
+                            ))
+                            failed_count += 1
+
+                    except Exception as e:
+                        logger.error(f"单条模式处理第{idx}项失败: {e}")
                         results.append(BatchUploadResult(
                             index=idx,
                             delivery_id=delivery_id,
                             success=False,
-                            message=result.get("error", "上传失败"),
+                            message=f"处理异常: {str(e)}",
                             image_path=None,
                             upload_status=None,
                             service_fee=None,
@@ -1145,28 +1203,14 @@ async def batch_upload_delivery_orders(
                         ))
                         failed_count += 1
 
-                except Exception as e:
-                    logger.error(f"单条模式处理第{idx}项失败: {e}")
-                    results.append(BatchUploadResult(
-                        index=idx,
-                        delivery_id=delivery_id,
-                        success=False,
-                        message=f"处理异常: {str(e)}",
-                        image_path=None,
-                        upload_status=None,
-                        service_fee=None,
-                        source_type=None
-                    ))
-                    failed_count += 1
-
-            return BatchDeliveryOrderResponse(
-                success=True,
-                message=f"批量上传完成（单条模式）：成功 {success_count}/{len(files)} 条",
-                total_count=len(files),
-                success_count=success_count,
-                failed_count=failed_count,
-                results=results
-            )
+                return BatchDeliveryOrderResponse(
+                    success=True,
+                    message=f"批量上传完成（单条模式）：成功 {success_count}/{len(files)} 条",
+                    total_count=len(files),
+                    success_count=success_count,
+                    failed_count=failed_count,
+                    results=results
+                )
 
     except HTTPException:
         raise
@@ -1185,8 +1229,10 @@ async def upload_delivery_pdf(
     """上传联单 PDF 文件（仅支持 PDF 格式）"""
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="只支持 PDF 文件")
-    contents = await file.read()
-    result = service.upload_delivery_pdf(delivery_id, contents, uploaded_by=current_user.get("name"))
+    async with spool_uploads([file]) as spooled:
+        if spooled[0].file is None:
+            raise HTTPException(status_code=400, detail="PDF 文件为空")
+        result = service.upload_delivery_pdf(delivery_id, spooled[0].file, uploaded_by=current_user.get("name"))
     if not result["success"]:
         raise HTTPException(status_code=400, detail=result["error"])
     return result
@@ -1201,8 +1247,10 @@ async def modify_delivery_pdf(
     """替换联单 PDF 文件（覆盖原有）"""
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="只支持 PDF 文件")
-    contents = await file.read()
-    result = service.update_delivery_pdf(delivery_id, contents, uploaded_by=current_user.get("name"))
+    async with spool_uploads([file]) as spooled:
+        if spooled[0].file is None:
+            raise HTTPException(status_code=400, detail="PDF 文件为空")
+        result = service.update_delivery_pdf(delivery_id, spooled[0].file, uploaded_by=current_user.get("name"))
     if not result["success"]:
         raise HTTPException(status_code=400, detail=result["error"])
     return result
@@ -0,0 +1,75 @@
+"""
+定时任务：查看已注册任务与最近一次执行、执行历史，管理员手动触发（后台执行，结果见执行历史）。
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.core.scheduled_jobs import JobRunner, get_job_runner
+from core.auth import get_current_user
+
+router = APIRouter(prefix="/jobs", tags=["定时任务"])
+
+
+def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
+    if (current_user.get("role") or "").strip() != "管理员":
+        raise HTTPException(status_code=403, detail="仅管理员可操作定时任务")
+    return current_user
+
+
+def _ensure_registered(runner: JobRunner, job_id: str) -> None:
+    if job_id not in runner.jobs:
+        raise HTTPException(status_code=404, detail=f"定时任务不存在: {job_id}")
+
+
+@router.get("/", summary="定时任务列表（含最近一次执行）", response_model=dict)
+def list_jobs(
+    _: dict = Depends(require_admin),
+    runner: JobRunner = Depends(get_job_runner),
+):
+    try:
+        last_runs = runner.last_runs()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"查询定时任务执行记录失败: {e}")
+    data = [
+        {
+            "job_id": job.job_id,
+            "description": job.description,
+            "kwargs": job.kwargs,
+            "lease_seconds": job.lease_seconds,
+            "last_run": last_runs.get(job.job_id),
+        }
+        for job in runner.jobs.values()
+    ]
+    return {"success": True, "data": data}
+
+
+@router.get("/{job_id}/runs", summary="定时任务执行历史", response_model=dict)
+def list_job_runs(
+    job_id: str,
+    limit: int = Query(20, ge=1, le=200),
+    _: dict = Depends(require_admin),
+    runner: JobRunner = Depends(get_job_runner),
+):
+    _ensure_registered(runner, job_id)
+    try:
+        runs = runner.list_runs(job_id, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"查询定时任务执行记录失败: {e}")
+    return {"success": True, "data": runs}
+
+
+@router.post("/{job_id}/trigger", summary="手动触发定时任务", response_model=dict, status_code=202)
+def trigger_job(
+    job_id: str,
+    current_user: dict = Depends(require_admin),
+    runner: JobRunner = Depends(get_job_runner),
+):
+    """
+    立即在本 worker 后台执行一次；与正在执行的同一任务（任意 worker）互斥，冲突时记为 skipped。
+    """
+    _ensure_registered(runner, job_id)
+    triggered_by = current_user.get("name") or current_user.get("account") or str(current_user.get("id") or "")
+    try:
+        run_id = runner.trigger_manual(job_id, triggered_by or None)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"触发定时任务失败: {e}")
+    return {"success": True, "message": "已触发，执行结果见执行历史", "data": {"run_id": run_id}}
@@ -17,6 +17,7 @@ from enum import IntEnum
 
 from app.core.paths import UPLOADS_DIR
 from app.services.payment_services import PaymentExcelProcessor
+from app.utils.upload_spool import spool_uploads
 from core.database import get_conn
 from core.logging import get_logger
 from core.auth import get_current_user
@@ -440,6 +441,10 @@ def list_payment_details(
     keyword: Optional[str] = Query(None, description="关键词搜索"),
     # 回款列表筛选参数
     collection_status: Optional[int] = Query(None, ge=0, le=2, description="回款状态筛选：0-待回款, 1-已回首笔待回尾款, 2-已回尾款"),
+    cursor: Optional[str] = Query(None, description="游标分页：上一页返回的 next_cursor"),
+    cursor_mode: bool = Query(False, description="启用游标分页（首页传 true，之后传 cursor）"),
+    count_mode: str = Query("exact", pattern="^(exact|cached|estimate|none)$",
+                            description="总数：exact 精确 / cached 缓存 / estimate 估算 / none 不统计"),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -468,10 +473,15 @@ def list_payment_details(
             start_date=start_date,
             end_date=end_date,
             keyword=keyword,
-            collection_status=collection_status
+            collection_status=collection_status,
+            cursor=cursor,
+            cursor_mode=cursor_mode,
+            count_mode=count_mode
         )
         return result
 
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception:
         logger.exception("查询回款信息列表异常")
         raise HTTPException(status_code=500, detail="查询失败")
@@ -1006,38 +1016,39 @@ async def upload_payment_excel(
             detail=f"不支持的文件格式: {file_ext}，请上传Excel文件(.xlsx/.xls)"
         )
     
-    # ========== 2. 读取并验证文件大小 ==========
-    contents = await file.read()
-    file_size = len(contents)
-    
-    if file_size > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=400,
-            detail=f"文件大小不能超过10MB，当前: {file_size / 1024 / 1024:.2f}MB"
-        )
-    
-    if file_size == 0:
-        raise HTTPException(status_code=400, detail="文件不能为空")
-    
-    # ========== 3. 生成唯一文件名 ==========
-    # 格式: 原文件名(清理)_时间戳_随机4位.xlsx
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    random_suffix = uuid.uuid4().hex[:4]
-    
-    # 清理原文件名（移除非法字符）
-    safe_name = "".join(c for c in file.filename if c.isalnum() or c in (' ', '-', '_', '.')).rstrip()
-    safe_name = Path(safe_name).stem  # 去掉扩展名
-    
-    saved_filename = f"{safe_name}_{timestamp}_{random_suffix}{file_ext}"
-    file_path = PAYMENT_UPLOAD_DIR / saved_filename
-    
-    # ========== 4. 保存文件 ==========
-    try:
-        with open(file_path, "wb") as f:
-            f.write(contents)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
-    
+    # ========== 2. 落盘并验证文件大小（边读边计数，不整体读入内存）==========
+    async with spool_uploads([file], max_file_bytes=MAX_FILE_SIZE, strict=False) as spooled:
+        upload = spooled[0]
+        file_size = upload.size
+
+        if upload.too_large:
+            raise HTTPException(
+                status_code=400,
+                detail=f"文件大小不能超过10MB，当前: {(file.size or file_size) / 1024 / 1024:.2f}MB"
+            )
+
+        if file_size == 0:
+            raise HTTPException(status_code=400, detail="文件不能为空")
+
+        # ========== 3. 生成唯一文件名 ==========
+        # 格式: 原文件名(清理)_时间戳_随机4位.xlsx
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        random_suffix = uuid.uuid4().hex[:4]
+
+        # 清理原文件名（移除非法字符）
+        safe_name = "".join(c for c in file.filename if c.isalnum() or c in (' ', '-', '_', '.')).rstrip()
+        safe_name = Path(safe_name).stem  # 去掉扩展名
+
+        saved_filename = f"{safe_name}_{timestamp}_{random_suffix}{file_ext}"
+        file_path = PAYMENT_UPLOAD_DIR / saved_filename
+
+        # ========== 4. 保存文件 ==========
+        try:
+            with open(file_path, "wb") as f:
+                shutil.copyfileobj(upload.file, f)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
+
     # ========== 5. 记录上传日志（可选）==========
     try:
         with get_conn() as conn:
@@ -2,12 +2,9 @@
 TL比价模块路由
 接口前缀：/tl
 """
-import io
 from typing import Any, Dict, List, Optional, Tuple
-from urllib.parse import quote
 
 from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
-from fastapi.responses import StreamingResponse
 
 from app.models.tl import (
     ComparisonRequest,
@@ -24,6 +21,7 @@ from app.models.tl import (
     TaxRateUpsertRequest,
 )
 from app.services.tl_service import PurchaseSuggestionLLMError, TLService, get_tl_service
+from app.utils.streaming_export import streaming_export_response
 
 router = APIRouter(prefix="/tl", tags=["TL比价模块"])
 
@@ -255,6 +253,10 @@ def get_quote_details_list(
         "full",
         description='返回字段：`full`=库表全量列；`table`=与「报价数据列表」页表格列一致',
     ),
+    cursor: Optional[str] = Query(None, description="游标分页：上一页返回的 next_cursor"),
+    cursor_mode: bool = Query(False, description="启用游标分页（首页传 true，之后传 cursor）"),
+    count_mode: str = Query("exact", pattern="^(exact|cached|estimate|none)$",
+                            description="总数：exact 精确 / cached 缓存 / estimate 估算 / none 不统计"),
     service: TLService = Depends(get_tl_service),
 ):
     eff_from, eff_to, eff_cat = _merge_quote_list_filters(
@@ -271,6 +273,9 @@ def get_quote_details_list(
             page=page,
             page_size=page_size,
             response_format=response_format,
+            cursor=cursor,
+            cursor_mode=cursor_mode,
+            count_mode=count_mode,
         )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -292,28 +297,23 @@ def export_quote_details_excel(
         False,
         description="与列表接口一致：下拉选品种建议 true",
     ),
+    file_format: str = Query("xlsx", pattern="^(xlsx|csv)$", description="导出格式：xlsx / csv"),
     service: TLService = Depends(get_tl_service),
 ):
     eff_from, eff_to, eff_cat = _merge_quote_list_filters(
         date_from, date_to, start_date, end_date, category_name, variety
     )
     try:
-        data = service.export_quote_details_excel(
+        body = service.export_quote_details_excel(
             factory_id=factory_id,
             quote_date=quote_date,
             date_from=eff_from,
             date_to=eff_to,
             category_name=eff_cat,
             category_exact=category_exact,
+            file_format=file_format,
         )
-        filename = "报价数据导出.xlsx"
-        return StreamingResponse(
-            io.BytesIO(data),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
-            },
-        )
+        return streaming_export_response(body, f"报价数据导出.{file_format}", file_format)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
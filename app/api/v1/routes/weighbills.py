@@ -6,13 +6,16 @@ import os
 import shutil
 from typing import Dict, List, Optional
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Form
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Form, Request
 from pydantic import BaseModel, Field
 
 from app.core.paths import TEMP_UPLOADS_DIR
 from app.core.logging import get_logger
+from app.services.contract_progress import SHIPPING, refresh_contract_progress
+from app.services.image_store import get_image_store
 from app.services.weighbill_service import WeighbillService, get_weighbill_service
+from app.utils.image_response import image_response
+from app.utils.upload_spool import present_files, spool_uploads
 from app.services.contract_service import get_conn
 from core.auth import get_current_user
 
@@ -313,16 +316,15 @@ async def upload_weighbill(
             "payee": payee,
         }
 
-        image_bytes = await weighbill_image.read()
-
-        result = service.upload_weighbill(
-            delivery_id=delivery_id,
-            product_name=product_name,
-            data=data,
-            image_file=image_bytes,
-            current_user=current_user,
-            is_manual=is_manual
-        )
+        async with spool_uploads([weighbill_image]) as spooled:
+            result = service.upload_weighbill(
+                delivery_id=delivery_id,
+                product_name=product_name,
+                data=data,
+                image_file=spooled[0].file,
+                current_user=current_user,
+                is_manual=is_manual
+            )
 
         if result["success"]:
             # ========== 新增：自动创建/更新收款明细 ==========
@@ -455,20 +457,17 @@ async def modify_weighbill(
         if 'unit_price' not in data and final_contract and final_product:
             data['unit_price'] = service.get_contract_price_by_product(final_contract, final_product)
 
-        image_bytes = None
-        if weighbill_image:
-            image_bytes = await weighbill_image.read()
-
         target_delivery_id = matched_delivery_id or existing.get('delivery_id')
 
-        result = service.upload_weighbill(
-            delivery_id=target_delivery_id,
-            product_name=final_product,
-            data=data,
-            image_file=image_bytes,
-            current_user=current_user,
-            is_manual=True
-        )
+        async with spool_uploads([weighbill_image]) as spooled:
+            result = service.upload_weighbill(
+                delivery_id=target_delivery_id,
+                product_name=final_product,
+                data=data,
+                image_file=spooled[0].file if spooled else None,
+                current_user=current_user,
+                is_manual=True
+            )
 
         if result["success"]:
             # ========== 新增：更新收款明细 ==========
@@ -560,6 +559,10 @@ async def list_weighbills(
         exact_collection_status: Optional[int] = Query(None, description="回款状态：0=待回款, 1=已回首笔, 2=已回款"),
         page: int = Query(1, ge=1),
         page_size: int = Query(20, ge=1, le=100),
+        cursor: Optional[str] = Query(None, description="游标分页：上一页返回的 next_cursor"),
+        cursor_mode: bool = Query(False, description="启用游标分页（首页传 true，之后传 cursor）"),
+        count_mode: str = Query("exact", pattern="^(exact|cached|estimate|none)$",
+                                description="总数：exact 精确 / cached 缓存 / estimate 估算 / none 不统计"),
         service: WeighbillService = Depends(get_weighbill_service)
 ):
     """
@@ -594,6 +597,9 @@ async def list_weighbills(
             exact_collection_status=exact_collection_status,
             page=page,
             page_size=page_size,
+            cursor=cursor,
+            cursor_mode=cursor_mode,
+            count_mode=count_mode,
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -651,8 +657,11 @@ async def delete_weighbill(
                 logger.warning(f"删除磅单图片失败: {e}")
 
         with get_conn() as conn:
+            conn.begin()
             with conn.cursor() as cur:
                 cur.execute("DELETE FROM pd_weighbills WHERE id = %s", (weighbill_id,))
+                refresh_contract_progress(cur, [bill.get("contract_no")], parts=(SHIPPING,))
+            conn.commit()
 
         return {"success": True, "message": "磅单删除成功"}
 
@@ -664,10 +673,12 @@ async def delete_weighbill(
 
 @router.get("/{weighbill_id}/image", summary="查看磅单图片")
 async def get_weighbill_image(
+        request: Request,
         weighbill_id: int,
+        variant: str = Query("original", pattern="^(original|thumb)$", description="original=原图，thumb=缩略图"),
         service: WeighbillService = Depends(get_weighbill_service)
 ):
-    """查看磅单图片"""
+    """查看磅单图片（支持 ETag/Range，variant=thumb 取缩略图）"""
     try:
         bill = service.get_weighbill(weighbill_id)
         if not bill:
@@ -677,13 +688,15 @@ async def get_weighbill_image(
         if not image_path:
             raise HTTPException(status_code=404, detail="该磅单没有上传图片")
 
-        if not os.path.exists(image_path):
+        store = get_image_store()
+        resolved = store.resolve(image_path, variant)
+        if resolved is None:
             raise HTTPException(status_code=404, detail="图片文件不存在")
 
-        return FileResponse(
-            path=image_path,
-            media_type="image/jpeg",
-            filename=f"weighbill_{weighbill_id}_{bill.get('product_name', '')}.jpg"
+        ext = os.path.splitext(resolved.key or str(resolved.path))[1].lower() or ".jpg"
+        return image_response(
+            request, store, resolved,
+            filename=f"weighbill_{weighbill_id}_{bill.get('product_name', '')}{ext}",
         )
 
     except HTTPException:
@@ -788,8 +801,6 @@ async def batch_upload_weighbills(
         if not weighbill_images:
             raise HTTPException(status_code=400, detail="请至少上传一张磅单图片")
 
-        # 读取所有图片字节
-        image_bytes_list = []
         for image_file in weighbill_images:
             allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp"]
             if image_file.content_type not in allowed_types:
@@ -797,17 +808,15 @@ async def batch_upload_weighbills(
                     status_code=400, 
                     detail=f"不支持的文件格式: {image_file.filename}，仅支持jpg/png/bmp"
                 )
-            
-            content = await image_file.read()
-            image_bytes_list.append(content)
-
-        # 调用批量上传服务
-        result = service.batch_upload_weighbills(
-            warehouse_name=warehouse_name,
-            payee_id=payee_id,
-            image_files=image_bytes_list,
-            current_user=current_user
-        )
+
+        # 图片落盘后以文件句柄交给批量上传服务（预处理时按窗口读取）
+        async with spool_uploads(weighbill_images) as spooled:
+            result = service.batch_upload_weighbills(
+                warehouse_name=warehouse_name,
+                payee_id=payee_id,
+                image_files=present_files(spooled),
+                current_user=current_user
+            )
 
         if not result.get("success"):
             raise HTTPException(status_code=400, detail=result.get("error"))
@@ -100,9 +100,27 @@ def load_settings() -> "Settings":
             "INTELLIGENT_PREDICTION_SCHEDULE_CRON_MINUTE", 30
         ),
         enable_manual_db_init=_env_bool("ENABLE_MANUAL_DB_INIT", False),
+        weighbill_batch_max_workers=_env_int(
+            "WEIGHBILL_BATCH_MAX_WORKERS", min(4, os.cpu_count() or 1)
+        ),
+        delivery_text_batch_max_workers=_env_int("DELIVERY_TEXT_BATCH_MAX_WORKERS", 8),
+        delivery_text_batch_max_messages=_env_int("DELIVERY_TEXT_BATCH_MAX_MESSAGES", 100),
+        driver_duplicate_window_backend=(os.getenv("DRIVER_DUPLICATE_WINDOW") or "db").strip().lower(),
+        manager_allocation_cache_ttl_seconds=_env_int("MANAGER_ALLOCATION_CACHE_TTL_SECONDS", 60),
         intelligent_prediction_history_purge_secret=(
             os.getenv("INTELLIGENT_PREDICTION_HISTORY_PURGE_SECRET") or ""
         ).strip(),
+        image_store_dir=(os.getenv("IMAGE_STORE_DIR") or "").strip(),
+        image_thumbnail_max_side=_env_int("IMAGE_THUMBNAIL_MAX_SIDE", 480),
+        upload_max_file_bytes=_env_int("UPLOAD_MAX_FILE_MB", 20) * 1024 * 1024,
+        upload_max_request_bytes=_env_int("UPLOAD_MAX_REQUEST_MB", 200) * 1024 * 1024,
+        upload_inflight_max_bytes=_env_int("UPLOAD_INFLIGHT_MAX_MB", 512) * 1024 * 1024,
+        upload_spool_memory_bytes=_env_int("UPLOAD_SPOOL_MEMORY_KB", 1024) * 1024,
+        upload_budget_wait_seconds=_env_float("UPLOAD_BUDGET_WAIT_SECONDS", 30.0),
+        startup_test_prediction_enabled=_env_bool("STARTUP_TEST_PREDICTION", True),
+        startup_ocr_warmup_enabled=_env_bool("STARTUP_OCR_WARMUP", True),
+        contract_expiry_chunk_size=_env_int("CONTRACT_EXPIRY_CHUNK_SIZE", 500),
+        contract_expiry_lookback_days=_env_int("CONTRACT_EXPIRY_LOOKBACK_DAYS", 7),
     )
 
 
@@ -139,6 +157,30 @@ class Settings(BaseModel):
     prediction_prometheus_enabled: bool = False
     # 为 true 时开放 GET /init-db（默认关闭，避免公网误暴露建表能力）
     enable_manual_db_init: bool = False
+    #: 批量上传磅单时预处理进程数 / 并行 OCR 引擎数上限（1 = 逐张处理）
+    weighbill_batch_max_workers: int = 4
+    #: 批量解析报单文本：并行调用大模型提取的并发数上限，单次请求最多条数
+    delivery_text_batch_max_workers: int = 8
+    delivery_text_batch_max_messages: int = 100
+    #: 24 小时重复报单校验的号码窗口：redis（多 worker 共享）/ memory（单进程）/ db（不建窗口，走索引查询）
+    driver_duplicate_window_backend: str = "db"
+    #: 大区经理每日分配需求结果缓存秒数（本进程写入即失效，TTL 兜底其他 worker 的写入；0 = 不缓存）
+    manager_allocation_cache_ttl_seconds: int = 60
+    #: 内容寻址图片库根目录（空 = uploads/store）；缩略图长边像素
+    image_store_dir: str = ""
+    image_thumbnail_max_side: int = 480
+    #: 上传文件：单文件 / 单请求上限，本进程在途上传总字节（超出时后续请求排队），内存暂存阈值（超出落盘）
+    upload_max_file_bytes: int = 20 * 1024 * 1024
+    upload_max_request_bytes: int = 200 * 1024 * 1024
+    upload_inflight_max_bytes: int = 512 * 1024 * 1024
+    upload_spool_memory_bytes: int = 1024 * 1024
+    upload_budget_wait_seconds: float = 30.0
+    #: 启动后台预热：测试预测（仅 leader worker 执行）、磅单 OCR 引擎预加载
+    startup_test_prediction_enabled: bool = True
+    startup_ocr_warmup_enabled: bool = True
+    #: 合同失效扫描：每批更新行数；增量扫描在水位线之前回看的天数（覆盖补录/改日期的合同）
+    contract_expiry_chunk_size: int = 500
+    contract_expiry_lookback_days: int = 7
 
     intelligent_prediction_schedule_enabled: bool = False
     intelligent_prediction_schedule_horizon_days: int = 30
@@ -0,0 +1,305 @@
+"""
+定时任务执行层：多 worker / 多主机下每次 cron 触发只执行一次，并记录执行历史、支持手动触发。
+
+每个 uvicorn worker 都会启动自己的 BackgroundScheduler，到点时 N 个进程同时调用同一个任务。现在调度器
+只调用 `JobRunner.run_scheduled(job_id)`，由它在 MySQL 中协调：
+
+- 认领：以「任务ID + 触发分钟」为唯一键向 `pd_job_runs` 插入一行（`INSERT IGNORE`），只有插入成功的进程
+  继续执行，其余直接返回。触发分钟取当前 UTC 时间四舍五入到分钟，主机间 30 秒内的时钟偏差不影响去重；
+- 租约：执行前在 `pd_job_leases` 抢占该任务的租约（过期才可被他人接管），执行中由心跳线程续期，结束释放；
+  租约持有者为「主机:进程号:执行记录ID」，同一进程内的两次执行（两次手动触发、手动与定时）也互斥，
+  同一任务的执行不会重叠，拿不到租约的记为 skipped；
+- 历史：`pd_job_runs` 记录触发方式、执行者、状态、耗时、返回值摘要与异常。
+
+数据库不可用时不执行（这些任务本身都依赖数据库），只记日志。
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from core.database import get_conn
+
+logger = logging.getLogger(__name__)
+
+RUNS_TABLE = "pd_job_runs"
+LEASES_TABLE = "pd_job_leases"
+
+TRIGGER_CRON = "cron"
+TRIGGER_MANUAL = "manual"
+
+RUNNING = "running"
+SUCCESS = "success"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+DEFAULT_LEASE_SECONDS = 300
+
+
+def _value(row: Any, key: str, index: int = 0) -> Any:
+    return row[key] if isinstance(row, dict) else row[index]
+
+
+def current_holder() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def cron_fire_key(now: Optional[datetime] = None) -> str:
+    """定时触发的去重键：UTC 时间四舍五入到分钟。"""
+    now = now or datetime.now(timezone.utc)
+    rounded = (now + timedelta(seconds=30)).replace(second=0, microsecond=0)
+    return "cron:" + rounded.strftime("%Y-%m-%dT%H:%M")
+
+
+def _summarize(result: Any) -> Optional[str]:
+    if result is None:
+        return None
+    text = repr(result)
+    return text if len(text) <= 512 else text[:509] + "..."
+
+
+@dataclass
+class ScheduledJob:
+    job_id: str
+    func: Callable[..., Any]
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    lease_seconds: int = DEFAULT_LEASE_SECONDS
+    description: str = ""
+
+
+class JobRunner:
+    def __init__(self, connect: Callable[[], Any] = get_conn, holder: Optional[str] = None):
+        self._connect = connect
+        self.holder = holder or current_holder()
+        self.jobs: Dict[str, ScheduledJob] = {}
+
+    def register(
+        self,
+        job_id: str,
+        func: Callable[..., Any],
+        kwargs: Optional[Dict[str, Any]] = None,
+        lease_seconds: int = DEFAULT_LEASE_SECONDS,
+        description: str = "",
+    ) -> ScheduledJob:
+        job = ScheduledJob(job_id, func, dict(kwargs or {}), lease_seconds, description)
+        self.jobs[job_id] = job
+        return job
+
+    # ---------- 认领与租约 ----------
+
+    def claim(
+        self,
+        job_id: str,
+        trigger: str,
+        fire_key: str,
+        triggered_by: Optional[str] = None,
+    ) -> Optional[int]:
+        """插入执行记录；同一触发已被其它进程认领时返回 None。"""
+        with self._connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    INSERT IGNORE INTO {RUNS_TABLE} (job_id, fire_key, `trigger`, triggered_by, holder, status)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    """,
+                    (job_id, fire_key, trigger, triggered_by, self.holder, RUNNING),
+                )
+                run_id = cur.lastrowid if cur.rowcount == 1 else None
+            conn.commit()
+        return run_id
+
+    def lease_holder(self, run_id: int) -> str:
+        """某次执行的租约持有者：进程内每次执行各不相同。"""
+        return f"{self.holder}:{run_id}"
+
+    def acquire_lease(self, job_id: str, lease_seconds: int, holder: Optional[str] = None) -> bool:
+        """抢占租约：无人持有或已过期时接管（按列顺序求值，holder 先更新再判断续期）。"""
+        holder = holder or self.holder
+        with self._connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    INSERT INTO {LEASES_TABLE} (job_id, holder, lease_until)
+                    VALUES (%s, %s, NOW() + INTERVAL %s SECOND)
+                    ON DUPLICATE KEY UPDATE
+                        holder = IF(lease_until < NOW(), VALUES(holder), holder),
+                        lease_until = IF(holder = VALUES(holder), VALUES(lease_until), lease_until)
+                    """,
+                    (job_id, holder, lease_seconds),
+                )
+                cur.execute(f"SELECT holder FROM {LEASES_TABLE} WHERE job_id = %s", (job_id,))
+                row = cur.fetchone()
+            conn.commit()
+        return bool(row) and _value(row, "holder") == holder
+
+    def renew_lease(self, job_id: str, lease_seconds: int, holder: Optional[str] = None) -> bool:
+        with self._connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    UPDATE {LEASES_TABLE} SET lease_until = NOW() + INTERVAL %s SECOND
+                    WHERE job_id = %s AND holder = %s
+                    """,
+                    (lease_seconds, job_id, holder or self.holder),
+                )
+                renewed = cur.rowcount == 1
+            conn.commit()
+        return renewed
+
+    def release_lease(self, job_id: str, holder: Optional[str] = None) -> None:
+        with self._connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    UPDATE {LEASES_TABLE} SET lease_until = NOW() - INTERVAL 1 SECOND
+                    WHERE job_id = %s AND holder = %s
+                    """,
+                    (job_id, holder or self.holder),
+                )
+            conn.commit()
+
+    def _finish(
+        self,
+        run_id: int,
+        status: str,
+        duration_ms: Optional[int],
+        result: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        with self._connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    UPDATE {RUNS_TABLE}
+                    SET status = %s, finished_at = NOW(), duration_ms = %s, result = %s, error = %s
+                    WHERE id = %s
+                    """,
+                    (status, duration_ms, result, error, run_id),
+                )
+            conn.commit()
+
+    # ---------- 执行 ----------
+
+    def execute(self, run_id: int, job: ScheduledJob) -> str:
+        """在已认领的执行记录下运行任务（持租约 + 心跳续期），返回最终状态。"""
+        holder = self.lease_holder(run_id)
+        if not self.acquire_lease(job.job_id, job.lease_seconds, holder):
+            logger.info("job skipped, lease held elsewhere job_id=%s run_id=%s", job.job_id, run_id)
+            self._finish(run_id, SKIPPED, 0, error="lease held by another worker")
+            return SKIPPED
+
+        stop = threading.Event()
+
+        def heartbeat() -> None:
+            interval = max(job.lease_seconds / 3, 1)
+            while not stop.wait(interval):
+                try:
+                    if not self.renew_lease(job.job_id, job.lease_seconds, holder):
+                        logger.warning("job lease lost job_id=%s run_id=%s", job.job_id, run_id)
+                except Exception as e:
+                    logger.warning("job lease renew failed job_id=%s: %s", job.job_id, e)
+
+        beat = threading.Thread(target=heartbeat, name=f"job-lease-{job.job_id}", daemon=True)
+        beat.start()
+        started = time.perf_counter()
+        status, result, error = SUCCESS, None, None
+        try:
+            result = _summarize(job.func(**job.kwargs))
+        except Exception as e:
+            status, error = FAILED, f"{type(e).__name__}: {e}"
+            logger.exception("job failed job_id=%s run_id=%s", job.job_id, run_id)
+        finally:
+            stop.set()
+            beat.join()
+            duration_ms = int((time.perf_counter() - started) * 1000)
+            try:
+                self._finish(run_id, status, duration_ms, result, error)
+            finally:
+                try:
+                    self.release_lease(job.job_id, holder)
+                except Exception as e:
+                    logger.warning("job lease release failed job_id=%s: %s", job.job_id, e)
+        logger.info("job finished job_id=%s run_id=%s status=%s duration_ms=%s", job.job_id, run_id, status, duration_ms)
+        return status
+
+    def run(
+        self,
+        job_id: str,
+        trigger: str = TRIGGER_CRON,
+        fire_key: Optional[str] = None,
+        triggered_by: Optional[str] = None,
+    ) -> Optional[str]:
+        """认领并执行；本进程未认领到（其它进程已执行该次触发）或数据库不可用时返回 None。"""
+        job = self.jobs[job_id]
+        fire_key = fire_key or cron_fire_key()
+        try:
+            run_id = self.claim(job_id, trigger, fire_key, triggered_by)
+        except Exception as e:
+            logger.warning("job claim failed (database unavailable) job_id=%s: %s", job_id, e)
+            return None
+        if run_id is None:
+            logger.info("job already claimed job_id=%s fire_key=%s", job_id, fire_key)
+            return None
+        return self.execute(run_id, job)
+
+    def run_scheduled(self, job_id: str) -> Optional[str]:
+        """APScheduler 的入口：`scheduler.add_job(func=runner.run_scheduled, args=[job_id], ...)`。"""
+        return self.run(job_id, TRIGGER_CRON, cron_fire_key())
+
+    def trigger_manual(self, job_id: str, triggered_by: Optional[str] = None) -> int:
+        """手动触发：同步写入执行记录，后台线程执行，立即返回记录 ID。"""
+        job = self.jobs[job_id]
+        run_id = self.claim(job_id, TRIGGER_MANUAL, f"manual:{uuid.uuid4().hex}", triggered_by)
+        threading.Thread(
+            target=self.execute, args=(run_id, job), name=f"job-manual-{job_id}", daemon=True
+        ).start()
+        return run_id
+
+    # ---------- 查询 ----------
+
+    def list_runs(self, job_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        sql = (
+            f"SELECT id, job_id, fire_key, `trigger`, triggered_by, holder, status, started_at, finished_at, "
+            f"duration_ms, result, error FROM {RUNS_TABLE}"
+        )
+        params: tuple = ()
+        if job_id:
+            sql += " WHERE job_id = %s"
+            params = (job_id,)
+        sql += " ORDER BY id DESC LIMIT %s"
+        with self._connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params + (limit,))
+                return list(cur.fetchall() or [])
+
+    def last_runs(self) -> Dict[str, Dict[str, Any]]:
+        with self._connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT r.id, r.job_id, r.`trigger`, r.holder, r.status, r.started_at, r.finished_at,
+                           r.duration_ms, r.error
+                    FROM {RUNS_TABLE} r
+                    JOIN (SELECT job_id, MAX(id) AS id FROM {RUNS_TABLE} GROUP BY job_id) last ON last.id = r.id
+                    """
+                )
+                return {_value(row, "job_id", 1): row for row in (cur.fetchall() or [])}
+
+
+_runner: Optional[JobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner() -> JobRunner:
+    """进程级执行器（main.lifespan 注册任务，jobs 路由查询/手动触发）。"""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = JobRunner()
+    return _runner
@@ -0,0 +1,564 @@
+"""
+版本化库结构迁移与进程级 schema 能力表。
+
+原来各服务在热路径上自行探测/补齐表结构（`_ensure_plan_audit_columns()`、`_ensure_order_plan_*`、
+`DeliveryService._delivery_has_products_column` 等），标记挂在实例或模块上，`get_*_service()` 每次新建实例
+都会重新查 `INFORMATION_SCHEMA`。现改为：
+
+- 补列/补索引写成带版本号的迁移（`@migration(版本, 名称)` 注册），应用启动时在 `create_tables()` 之后由
+  `run_migrations()` 执行一次，已执行的版本记入 `pd_schema_migrations`，之后不再重复；
+- 迁移完成后一次性读取本库所有表的列与索引，生成不可变的 `SchemaCapabilities`，服务层通过
+  `get_schema_capabilities()` 读取，不再发查询。
+
+迁移彼此独立（都是对旧库的补齐，且先检查再变更，可重复执行）：单个失败只记日志、不写版本号，下次启动重试，
+不影响其余迁移。脚本等未经 lifespan 的入口首次读取能力表时会自动执行一次 `run_migrations()`。
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Callable, Dict, FrozenSet, List, Mapping, Optional, Set
+
+from core.database import advisory_lock, get_conn
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_TABLE = "pd_schema_migrations"
+MIGRATIONS_LOCK = "pd_schema_migrations"
+
+MIGRATIONS_TABLE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+    version INT NOT NULL PRIMARY KEY COMMENT '迁移版本号',
+    name VARCHAR(128) NOT NULL COMMENT '迁移名称',
+    duration_ms INT DEFAULT NULL COMMENT '执行耗时（毫秒）',
+    applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '执行时间'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='库结构迁移记录'
+"""
+
+
+def _value(row: Any, key: str, index: int = 0) -> Any:
+    """兼容 DictCursor 与普通游标的取值。"""
+    return row[key] if isinstance(row, dict) else row[index]
+
+
+@dataclass(frozen=True)
+class SchemaCapabilities:
+    """启动时的表结构快照（只读）。loaded=False 表示未能读取（数据库不可用），此时按「不存在」处理。"""
+
+    columns: Mapping[str, FrozenSet[str]] = field(default_factory=lambda: MappingProxyType({}))
+    indexes: Mapping[str, FrozenSet[str]] = field(default_factory=lambda: MappingProxyType({}))
+    versions: FrozenSet[int] = frozenset()
+    loaded: bool = False
+
+    def has_column(self, table: str, column: str) -> bool:
+        return column in self.columns.get(table, ())
+
+    def has_index(self, table: str, index: str) -> bool:
+        return index in self.indexes.get(table, ())
+
+    def columns_of(self, table: str) -> Optional[FrozenSet[str]]:
+        """表的列集合；快照中没有该表时返回 None（调用方可回退到实时查询）。"""
+        return self.columns.get(table)
+
+
+EMPTY_CAPABILITIES = SchemaCapabilities()
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Any], None]
+
+
+_REGISTRY: List[Migration] = []
+
+
+def migration(version: int, name: str) -> Callable[[Callable[[Any], None]], Callable[[Any], None]]:
+    """注册迁移；函数接收游标，自行检查现状后再变更（可重复执行）。版本号全局唯一，按升序执行。"""
+
+    def decorator(func: Callable[[Any], None]) -> Callable[[Any], None]:
+        if any(m.version == version for m in _REGISTRY):
+            raise ValueError(f"迁移版本号重复: {version}")
+        _REGISTRY.append(Migration(version, name, func))
+        _REGISTRY.sort(key=lambda m: m.version)
+        return func
+
+    return decorator
+
+
+def registered_migrations() -> List[Migration]:
+    return list(_REGISTRY)
+
+
+# ============ 迁移辅助 ============
+
+def _existing_columns(cur, table: str) -> Dict[str, str]:
+    """列名 → 规范化后的列类型（小写、去空格）。"""
+    cur.execute(
+        """
+        SELECT COLUMN_NAME AS column_name, COLUMN_TYPE AS column_type
+        FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """,
+        (table,),
+    )
+    return {
+        _value(row, "column_name", 0): (_value(row, "column_type", 1) or "").lower().replace(" ", "")
+        for row in (cur.fetchall() or [])
+    }
+
+
+def _index_exists(cur, table: str, index: str) -> bool:
+    cur.execute(
+        """
+        SELECT 1 FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        LIMIT 1
+        """,
+        (table, index),
+    )
+    return cur.fetchone() is not None
+
+
+def _add_index(cur, table: str, index: str, columns: str) -> None:
+    if _index_exists(cur, table, index):
+        return
+    try:
+        cur.execute(f"CREATE INDEX {index} ON {table}({columns})")
+    except Exception as e:
+        logger.warning("create %s on %s skipped: %s", index, table, e)
+
+
+# ============ 迁移（只追加，不修改已发布的版本） ============
+
+@migration(1, "pd_delivery_plans_operator_columns")
+def _m001_delivery_plan_operator_columns(cur) -> None:
+    """报货计划操作人字段与计划吨数精度（原 delivery_plan_service._ensure_plan_audit_columns）。"""
+    existing = _existing_columns(cur, "pd_delivery_plans")
+    parts: List[str] = []
+    if "created_by" not in existing:
+        parts.append("ADD COLUMN created_by BIGINT DEFAULT NULL COMMENT '创建人用户ID'")
+    if "created_by_name" not in existing:
+        parts.append("ADD COLUMN created_by_name VARCHAR(64) DEFAULT NULL COMMENT '创建人姓名'")
+    if "updated_by" not in existing:
+        parts.append("ADD COLUMN updated_by BIGINT DEFAULT NULL COMMENT '最后修改人用户ID'")
+    if "updated_by_name" not in existing:
+        parts.append("ADD COLUMN updated_by_name VARCHAR(64) DEFAULT NULL COMMENT '最后修改人姓名'")
+    if "planned_tonnage" not in existing:
+        parts.append(
+            "ADD COLUMN planned_tonnage DECIMAL(12, 3) NOT NULL DEFAULT 0.000 COMMENT '计划吨数' AFTER planned_trucks"
+        )
+    elif existing["planned_tonnage"] != "decimal(12,3)":
+        parts.append(
+            "MODIFY COLUMN planned_tonnage DECIMAL(12, 3) NOT NULL DEFAULT 0.000 COMMENT '计划吨数'"
+        )
+    if parts:
+        cur.execute("ALTER TABLE pd_delivery_plans " + ", ".join(parts))
+
+
+@migration(2, "pd_delivery_plans_repair_quota_full_invalid")
+def _m002_repair_quota_full_invalid(cur) -> None:
+    """历史：满额时曾自动将 plan_status 置为「已失效」，与业务期望不符；改回「生效中」（原每个进程执行一次）。"""
+    cur.execute(
+        """
+        UPDATE pd_delivery_plans
+        SET plan_status = '生效中'
+        WHERE plan_status = '已失效'
+          AND planned_trucks > 0
+          AND confirmed_trucks >= planned_trucks
+        """
+    )
+    if cur.rowcount:
+        logger.info("pd_delivery_plans: corrected %s rows from mistaken 已失效 (quota full)", cur.rowcount)
+
+
+@migration(3, "pd_order_plans_audit_remark")
+def _m003_order_plan_audit_remark(cur) -> None:
+    if "audit_remark" not in _existing_columns(cur, "pd_order_plans"):
+        cur.execute(
+            "ALTER TABLE pd_order_plans ADD COLUMN audit_remark TEXT DEFAULT NULL COMMENT '审核备注/原因'"
+        )
+
+
+@migration(4, "pd_order_plans_sign_in_and_settlement_price")
+def _m004_order_plan_sign_in_settlement(cur) -> None:
+    existing = _existing_columns(cur, "pd_order_plans")
+    if "sign_in_deadline" not in existing:
+        cur.execute(
+            """
+            ALTER TABLE pd_order_plans
+            ADD COLUMN sign_in_deadline VARCHAR(64) DEFAULT NULL COMMENT '签到截止时间，示例：4.9号下午五点前签到'
+            """
+        )
+    if "settlement_price" not in existing:
+        cur.execute(
+            """
+            ALTER TABLE pd_order_plans
+            ADD COLUMN settlement_price DECIMAL(12, 2) DEFAULT NULL COMMENT '结算价格（仅用于统计核对，不参与计算），示例：9630'
+            """
+        )
+
+
+@migration(5, "pd_deliveries_order_plan_columns")
+def _m005_delivery_order_plan_columns(cur) -> None:
+    existing = _existing_columns(cur, "pd_deliveries")
+    if "order_plan_id" not in existing:
+        cur.execute(
+            """
+            ALTER TABLE pd_deliveries
+            ADD COLUMN order_plan_id BIGINT DEFAULT NULL
+                COMMENT '关联订货计划ID（与报单人、合同报货计划对应）'
+            """
+        )
+    if "is_last_truck_for_order_plan" not in existing:
+        cur.execute(
+            """
+            ALTER TABLE pd_deliveries
+            ADD COLUMN is_last_truck_for_order_plan TINYINT DEFAULT 0
+                COMMENT '是否订货计划最后一车'
+            """
+        )
+    _add_index(cur, "pd_deliveries", "idx_order_plan_id", "order_plan_id")
+
+
+@migration(6, "pd_weighbills_order_plan_last_truck")
+def _m006_weighbill_order_plan_last_truck(cur) -> None:
+    if "is_last_truck_for_order_plan" not in _existing_columns(cur, "pd_weighbills"):
+        cur.execute(
+            """
+            ALTER TABLE pd_weighbills
+            ADD COLUMN is_last_truck_for_order_plan TINYINT DEFAULT 0
+                COMMENT '是否为订货计划最后一车'
+            """
+        )
+
+
+@migration(7, "pd_weighbills_audit_columns")
+def _m007_weighbill_audit_columns(cur) -> None:
+    existing = _existing_columns(cur, "pd_weighbills")
+    parts: List[str] = []
+    if "audit_status" not in existing:
+        parts.append(
+            "ADD COLUMN audit_status VARCHAR(32) DEFAULT '待审核' "
+            "COMMENT '磅单审核状态：待审核/审核通过/审核未通过'"
+        )
+    if "audit_remark" not in existing:
+        parts.append("ADD COLUMN audit_remark TEXT DEFAULT NULL COMMENT '审核备注'")
+    if parts:
+        cur.execute("ALTER TABLE pd_weighbills " + ", ".join(parts))
+    _add_index(cur, "pd_weighbills", "idx_audit_status", "audit_status")
+
+
+@migration(8, "pd_contracts_delivery_plan_id")
+def _m008_contract_delivery_plan_id(cur) -> None:
+    if "delivery_plan_id" not in _existing_columns(cur, "pd_contracts"):
+        cur.execute(
+            """
+            ALTER TABLE pd_contracts
+            ADD COLUMN delivery_plan_id BIGINT DEFAULT NULL
+            COMMENT '报货计划ID（关联pd_delivery_plans.id）'
+            """
+        )
+    _add_index(cur, "pd_contracts", "idx_contract_delivery_plan_id", "delivery_plan_id")
+    cur.execute(
+        """
+        SELECT CONSTRAINT_NAME FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'pd_contracts'
+          AND CONSTRAINT_TYPE = 'FOREIGN KEY'
+          AND CONSTRAINT_NAME = 'fk_pd_contracts_delivery_plan'
+        """
+    )
+    if not cur.fetchone():
+        try:
+            cur.execute(
+                """
+                ALTER TABLE pd_contracts
+                ADD CONSTRAINT fk_pd_contracts_delivery_plan
+                FOREIGN KEY (delivery_plan_id) REFERENCES pd_delivery_plans(id)
+                ON DELETE RESTRICT
+                """
+            )
+        except Exception as e:
+            logger.warning("add fk_pd_contracts_delivery_plan skipped/failed: %s", e)
+
+
+@migration(9, "pd_job_runs_and_leases")
+def _m009_job_runs_and_leases(cur) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pd_job_leases (
+            job_id VARCHAR(64) NOT NULL PRIMARY KEY COMMENT '定时任务ID',
+            holder VARCHAR(128) NOT NULL COMMENT '持有者（主机:进程号）',
+            lease_until DATETIME NOT NULL COMMENT '租约到期时间',
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='定时任务执行租约'
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pd_job_runs (
+            id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            job_id VARCHAR(64) NOT NULL COMMENT '定时任务ID',
+            fire_key VARCHAR(64) NOT NULL COMMENT '触发标识：cron 为计划触发分钟，手动为随机串',
+            `trigger` VARCHAR(16) NOT NULL COMMENT 'cron/manual',
+            triggered_by VARCHAR(128) DEFAULT NULL COMMENT '手动触发人',
+            holder VARCHAR(128) DEFAULT NULL COMMENT '执行者（主机:进程号）',
+            status VARCHAR(16) NOT NULL COMMENT 'running/success/failed/skipped',
+            started_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME DEFAULT NULL,
+            duration_ms INT DEFAULT NULL,
+            result VARCHAR(512) DEFAULT NULL COMMENT '返回值摘要',
+            error TEXT DEFAULT NULL,
+            UNIQUE KEY uk_job_fire (job_id, fire_key),
+            KEY idx_job_started (job_id, started_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='定时任务执行记录'
+        """
+    )
+
+
+@migration(10, "pd_contracts_expiry_indexes_and_watermarks")
+def _m010_contract_expiry_indexes(cur) -> None:
+    _add_index(cur, "pd_contracts", "idx_status_end_date", "status, end_date")
+    _add_index(cur, "pd_contracts", "idx_status_contract_date", "status, contract_date")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pd_sweep_watermarks (
+            name VARCHAR(64) NOT NULL PRIMARY KEY COMMENT '扫描任务名',
+            watermark DATE NOT NULL COMMENT '已处理到的截止日期（含）',
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='增量扫描水位线'
+        """
+    )
+
+
+@migration(11, "pd_contract_capacity")
+def _m011_contract_capacity(cur) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pd_contract_capacity (
+            contract_no VARCHAR(64) NOT NULL PRIMARY KEY COMMENT '合同编号',
+            used_trucks INT NOT NULL DEFAULT 0 COMMENT '审核通过报单车数合计',
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='合同车数台账'
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO pd_contract_capacity (contract_no, used_trucks)
+        SELECT contract_no, COALESCE(SUM(planned_trucks), 0)
+        FROM pd_deliveries
+        WHERE status = '审核通过' AND contract_no IS NOT NULL AND contract_no <> ''
+        GROUP BY contract_no
+        ON DUPLICATE KEY UPDATE used_trucks = VALUES(used_trucks)
+        """
+    )
+
+
+
+@migration(12, "pd_contract_progress")
+def _m012_contract_progress(cur) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pd_contract_progress (
+            contract_no VARCHAR(64) NOT NULL PRIMARY KEY COMMENT '合同编号',
+            smelter_name VARCHAR(100) DEFAULT NULL COMMENT '冶炼厂名称（取自收款明细）',
+            shipped_trucks INT NOT NULL DEFAULT 0 COMMENT '已发车数（已上传/已确认磅单数）',
+            shipped_weight DECIMAL(16, 3) NOT NULL DEFAULT 0 COMMENT '已发运吨数',
+            last_ship_date DATE DEFAULT NULL COMMENT '最后发运日期',
+            delivery_count INT NOT NULL DEFAULT 0 COMMENT '报单数',
+            receivable_amount DECIMAL(16, 2) NOT NULL DEFAULT 0 COMMENT '应回款合计',
+            received_amount DECIMAL(16, 2) NOT NULL DEFAULT 0 COMMENT '已回款合计',
+            unreceived_amount DECIMAL(16, 2) NOT NULL DEFAULT 0 COMMENT '未回款合计',
+            payment_detail_count INT NOT NULL DEFAULT 0 COMMENT '收款明细数',
+            unpaid_count INT NOT NULL DEFAULT 0 COMMENT '未回款明细数',
+            partial_count INT NOT NULL DEFAULT 0 COMMENT '部分回款明细数',
+            paid_count INT NOT NULL DEFAULT 0 COMMENT '已结清明细数',
+            overpaid_count INT NOT NULL DEFAULT 0 COMMENT '超额回款明细数',
+            last_payment_date DATE DEFAULT NULL COMMENT '最后回款日期',
+            balance_payable_amount DECIMAL(16, 2) NOT NULL DEFAULT 0 COMMENT '结余应付合计',
+            balance_paid_amount DECIMAL(16, 2) NOT NULL DEFAULT 0 COMMENT '结余已付合计',
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_receivable_amount (receivable_amount)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='合同发运/回款进度台账'
+        """
+    )
+    # 回填与每日核对共用同一段重算逻辑
+    from app.services.contract_progress import rebuild_progress_rows
+
+    rebuild_progress_rows(cur)
+
+
+@migration(13, "pd_balance_party_summary")
+def _m013_balance_party_summary(cur) -> None:
+    existing = _existing_columns(cur, "pd_balance_details")
+    parts: List[str] = []
+    if "payee_key" not in existing:
+        parts.append("ADD COLUMN payee_key VARCHAR(128) DEFAULT NULL COMMENT '收款人分组键（收款人/司机姓名规范化）'")
+    if "reporter_key" not in existing:
+        parts.append("ADD COLUMN reporter_key VARCHAR(128) DEFAULT NULL COMMENT '报单人分组键（报单人/发货人规范化）'")
+    if parts:
+        cur.execute("ALTER TABLE pd_balance_details " + ", ".join(parts))
+    _add_index(cur, "pd_balance_details", "idx_payee_key", "payee_key, driver_phone")
+    _add_index(cur, "pd_balance_details", "idx_reporter_key", "reporter_key")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pd_balance_party_summary (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            party_type VARCHAR(16) NOT NULL COMMENT 'payee=收款人, reporter=报单人',
+            party_key VARCHAR(128) NOT NULL COMMENT '分组键',
+            driver_phone VARCHAR(32) DEFAULT NULL COMMENT '司机电话（按收款人汇总时参与分组）',
+            payment_schedule_date DATE DEFAULT NULL COMMENT '最近排款日期',
+            bill_count INT NOT NULL DEFAULT 0 COMMENT '结余笔数',
+            total_payable DECIMAL(16, 2) NOT NULL DEFAULT 0 COMMENT '应付合计',
+            total_paid DECIMAL(16, 2) NOT NULL DEFAULT 0 COMMENT '已付合计',
+            total_balance DECIMAL(16, 2) NOT NULL DEFAULT 0 COMMENT '结余合计',
+            related_contracts TEXT COMMENT '涉及合同',
+            related_vehicles TEXT COMMENT '涉及车牌',
+            first_bill_date DATETIME DEFAULT NULL,
+            last_bill_date DATETIME DEFAULT NULL,
+            pending_count INT NOT NULL DEFAULT 0 COMMENT '待支付笔数',
+            partial_count INT NOT NULL DEFAULT 0 COMMENT '部分支付笔数',
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_party_key (party_type, party_key),
+            INDEX idx_party_balance (party_type, total_balance, last_bill_date)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='结余按收款人/报单人汇总'
+        """
+    )
+    from app.services.balance_party_summary import rebuild_summary_rows
+
+    rebuild_summary_rows(cur)
+
+
+@migration(14, "pd_deliveries_driver_id_card_index")
+def _m014_driver_id_card_index(cur) -> None:
+    # 24 小时重复报单校验按身份证号查询的分支（与 idx_driver_phone_created_at 对称）
+    _add_index(cur, "pd_deliveries", "idx_driver_id_card_created_at", "driver_id_card, created_at")
+
+# ============ 执行与能力表 ============
+
+def load_schema_capabilities(cur, versions: Optional[Set[int]] = None) -> SchemaCapabilities:
+    """两次查询读出本库所有表的列与索引。"""
+    columns: Dict[str, Set[str]] = {}
+    cur.execute(
+        """
+        SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name
+        FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+        """
+    )
+    for row in cur.fetchall() or []:
+        columns.setdefault(_value(row, "table_name", 0), set()).add(_value(row, "column_name", 1))
+
+    indexes: Dict[str, Set[str]] = {}
+    cur.execute(
+        """
+        SELECT DISTINCT TABLE_NAME AS table_name, INDEX_NAME AS index_name
+        FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE()
+        """
+    )
+    for row in cur.fetchall() or []:
+        indexes.setdefault(_value(row, "table_name", 0), set()).add(_value(row, "index_name", 1))
+
+    return SchemaCapabilities(
+        columns=MappingProxyType({t: frozenset(c) for t, c in columns.items()}),
+        indexes=MappingProxyType({t: frozenset(i) for t, i in indexes.items()}),
+        versions=frozenset(versions or ()),
+        loaded=True,
+    )
+
+
+def _applied_versions(conn) -> Set[int]:
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT version FROM {MIGRATIONS_TABLE}")
+        return {int(_value(row, "version", 0)) for row in (cur.fetchall() or [])}
+
+
+def apply_pending_migrations(
+    conn,
+    migrations: Optional[List[Migration]] = None,
+    lock_timeout: int = 300,
+) -> Set[int]:
+    """
+    执行未记录的迁移（逐个提交），返回已执行的全部版本号。
+    有待执行迁移时先取 MySQL 咨询锁并复查版本，多个 worker 同时启动只有一个执行 DDL。
+    """
+    with conn.cursor() as cur:
+        cur.execute(MIGRATIONS_TABLE_DDL)
+    conn.commit()
+    registry = migrations if migrations is not None else _REGISTRY
+    applied = _applied_versions(conn)
+    if all(m.version in applied for m in registry):
+        return applied
+
+    with advisory_lock(conn, MIGRATIONS_LOCK, lock_timeout) as acquired:
+        if not acquired:
+            logger.warning("等待迁移锁 %s 超时（%ss），本次跳过迁移", MIGRATIONS_LOCK, lock_timeout)
+            return applied
+        applied = _applied_versions(conn)
+        for m in registry:
+            if m.version in applied:
+                continue
+            start = time.perf_counter()
+            try:
+                with conn.cursor() as cur:
+                    m.apply(cur)
+                    duration_ms = int((time.perf_counter() - start) * 1000)
+                    cur.execute(
+                        f"INSERT IGNORE INTO {MIGRATIONS_TABLE} (version, name, duration_ms) VALUES (%s, %s, %s)",
+                        (m.version, m.name, duration_ms),
+                    )
+                conn.commit()
+                applied.add(m.version)
+                logger.info(
+                    "schema migration applied version=%s name=%s duration_ms=%s", m.version, m.name, duration_ms
+                )
+            except Exception as e:
+                conn.rollback()
+                logger.warning("schema migration failed version=%s name=%s: %s", m.version, m.name, e)
+    return applied
+
+
+_capabilities: Optional[SchemaCapabilities] = None
+_capabilities_lock = threading.RLock()
+
+
+def run_migrations(connect: Callable[[], Any] = get_conn) -> SchemaCapabilities:
+    """执行待处理迁移并刷新进程级能力表（lifespan 中 create_tables() 之后调用一次）。"""
+    global _capabilities
+    with _capabilities_lock:
+        with connect() as conn:
+            versions = apply_pending_migrations(conn)
+            with conn.cursor() as cur:
+                caps = load_schema_capabilities(cur, versions)
+        _capabilities = caps
+    logger.info(
+        "schema capabilities loaded tables=%s migrations=%s", len(caps.columns), len(caps.versions)
+    )
+    return caps
+
+
+def get_schema_capabilities() -> SchemaCapabilities:
+    """进程级能力表；尚未加载时执行一次 run_migrations()，数据库不可用时返回空能力表（下次调用重试）。"""
+    caps = _capabilities
+    if caps is not None:
+        return caps
+    with _capabilities_lock:
+        if _capabilities is not None:
+            return _capabilities
+        try:
+            return run_migrations()
+        except Exception as e:
+            logger.warning("加载库结构能力表失败，按字段不存在处理: %s", e)
+            return EMPTY_CAPABILITIES
+
+
+def table_columns(cur, table: str) -> FrozenSet[str]:
+    """表的列集合：优先取能力表，快照中没有该表时用当前游标实时查询。"""
+    cached = get_schema_capabilities().columns_of(table)
+    if cached is not None:
+        return cached
+    cur.execute(f"SHOW COLUMNS FROM {table}")
+    return frozenset(_value(row, "Field", 0) for row in (cur.fetchall() or []))
@@ -0,0 +1,215 @@
+"""
+启动编排：把 lifespan 中的工作分成「就绪前必须完成」与「可延后的后台预热」。
+
+原 lifespan 依次阻塞执行建表、合同过期同步、完整的测试预测（插测试数据 + CBC 求解），每个 worker 都做一遍，
+全部结束后才开始接请求。现在：
+
+- 关键任务（建表、迁移）仍在 lifespan 中同步执行，失败只记日志、不中断启动（与原行为一致），但该进程不会就绪；
+- 预热任务在应用开始接请求后由后台任务逐个执行（同步函数放线程池，协程直接 await），
+  `leader_only=True` 的一次性任务只在选为 leader 的 worker 上执行；
+- leader 选举用 MySQL 咨询锁（`GET_LOCK(name, 0)`）：持锁连接在进程存活期间保持打开，进程退出即释放；
+  数据库不可用时不当 leader（一次性任务本来也依赖数据库）；连接可能被服务端断开（锁随之释放），
+  每个 leader-only 任务执行前复核锁仍归本连接，丢失则放弃 leader 身份，避免两个 worker 同时执行；
+- `/readyz` 只由关键任务决定：全部关键任务成功（DONE）后返回 200，任一失败或未完成返回 503；
+  预热进度（`warmup_finished` 与各任务状态）只在响应体中报告，不影响就绪；同时给出启动耗时与进程启动到首个请求的耗时。
+"""
+import asyncio
+import inspect
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from core.database import advisory_lock, get_conn
+
+logger = logging.getLogger(__name__)
+
+#: 进程启动时刻（导入本模块时）；time-to-first-request 以此为起点
+PROCESS_STARTED_AT = time.perf_counter()
+
+LEADER_LOCK_NAME = "pd_startup_leader"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+@dataclass
+class StartupTask:
+    name: str
+    func: Callable[[], Any]
+    critical: bool
+    leader_only: bool = False
+    state: str = PENDING
+    duration_ms: Optional[float] = None
+    error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"state": self.state, "critical": self.critical}
+        if self.leader_only:
+            out["leader_only"] = True
+        if self.duration_ms is not None:
+            out["duration_ms"] = self.duration_ms
+        if self.error:
+            out["error"] = self.error
+        return out
+
+
+class LeaderElection:
+    """
+    进程级 leader：首个拿到 MySQL 咨询锁的 worker；锁随持有连接存活。
+    持锁连接长时间空闲，可能被 wait_timeout 或网络中断断开（锁随之释放），leader-only 任务执行前须 `confirm()` 复核。
+    """
+
+    def __init__(self, name: str = LEADER_LOCK_NAME, connect: Callable[[], Any] = get_conn):
+        self.name = name
+        self._connect = connect
+        self._conn_cm = None
+        self._conn = None
+        self._lock_cm = None
+        self._confirm_lock = threading.Lock()
+        self.is_leader = False
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        try:
+            self._conn_cm = self._connect()
+            self._conn = self._conn_cm.__enter__()
+            self._lock_cm = advisory_lock(self._conn, self.name, 0)
+            self.is_leader = self._lock_cm.__enter__()
+        except Exception as e:
+            logger.warning("leader election skipped (database unavailable): %s", e)
+            self.is_leader = False
+        if not self.is_leader:
+            self.release()
+        return self.is_leader
+
+    def confirm(self) -> bool:
+        """
+        复核 leader 身份：持锁连接仍可用且锁仍归该连接（`IS_USED_LOCK(name) = CONNECTION_ID()`）。
+        锁已丢失时放弃 leader 身份并重新竞选一次（期间若已被其他 worker 拿走则成为 follower）。
+        """
+        with self._confirm_lock:
+            if not self.is_leader:
+                return False
+            try:
+                with self._conn.cursor() as cur:
+                    cur.execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID() AS held", (self.name,))
+                    row = cur.fetchone()
+                held = (row.get("held") if isinstance(row, dict) else row[0]) if row else None
+            except Exception as e:
+                logger.warning("leader lock check failed: %s", e)
+                held = None
+            if held == 1:
+                return True
+            logger.warning("leader lock lost, re-running election name=%s", self.name)
+            self.release()
+            return self.try_acquire()
+
+    def release(self) -> None:
+        lock_cm, conn_cm = self._lock_cm, self._conn_cm
+        self._lock_cm = self._conn_cm = self._conn = None
+        self.is_leader = False
+        for cm in (lock_cm, conn_cm):
+            if cm is not None:
+                try:
+                    cm.__exit__(None, None, None)
+                except Exception:
+                    pass
+
+
+class StartupOrchestrator:
+    def __init__(self, leader: Optional[LeaderElection] = None):
+        self.leader = leader or LeaderElection()
+        self.tasks: List[StartupTask] = []
+        self.startup_ms: Optional[float] = None
+        self.first_request_ms: Optional[float] = None
+        self._background: Optional[asyncio.Task] = None
+
+    def critical(self, name: str, func: Callable[[], Any]) -> None:
+        self.tasks.append(StartupTask(name, func, critical=True))
+
+    def deferred(self, name: str, func: Callable[[], Any], leader_only: bool = False) -> None:
+        self.tasks.append(StartupTask(name, func, critical=False, leader_only=leader_only))
+
+    async def _run(self, task: StartupTask) -> None:
+        if task.leader_only and not (self.leader.is_leader and await asyncio.to_thread(self.leader.confirm)):
+            task.state = SKIPPED
+            return
+        task.state = RUNNING
+        started = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(task.func):
+                await task.func()
+            elif task.critical:
+                task.func()
+            else:
+                await asyncio.to_thread(task.func)
+            task.state = DONE
+        except asyncio.CancelledError:
+            task.state = FAILED
+            task.error = "cancelled"
+            raise
+        except Exception as e:
+            task.state = FAILED
+            task.error = str(e)
+            logger.exception("startup task failed name=%s", task.name)
+        finally:
+            task.duration_ms = round((time.perf_counter() - started) * 1000, 1)
+            logger.info("startup task name=%s state=%s duration_ms=%s", task.name, task.state, task.duration_ms)
+
+    async def run_critical(self) -> None:
+        """按注册顺序执行关键任务（阻塞启动）；单个失败不阻断后续任务。"""
+        for task in self.tasks:
+            if task.critical:
+                await self._run(task)
+        self.leader.try_acquire()
+        self.startup_ms = round((time.perf_counter() - PROCESS_STARTED_AT) * 1000, 1)
+        logger.info("startup critical path finished startup_ms=%s leader=%s", self.startup_ms, self.leader.is_leader)
+
+    def start_deferred(self) -> None:
+        """在当前事件循环中后台逐个执行预热任务（不并发，避免与首批请求抢 CPU）。"""
+
+        async def run_all() -> None:
+            for task in self.tasks:
+                if not task.critical:
+                    await self._run(task)
+
+        self._background = asyncio.get_running_loop().create_task(run_all())
+
+    async def shutdown(self) -> None:
+        if self._background is not None and not self._background.done():
+            self._background.cancel()
+            try:
+                await self._background
+            except (asyncio.CancelledError, Exception):
+                pass
+        self.leader.release()
+
+    def mark_first_request(self) -> None:
+        if self.first_request_ms is None:
+            self.first_request_ms = round((time.perf_counter() - PROCESS_STARTED_AT) * 1000, 1)
+            logger.info("time_to_first_request_ms=%s", self.first_request_ms)
+
+    @property
+    def ready(self) -> bool:
+        """关键路径已走完且每个关键任务都成功（不可执行而跳过的也算）；预热任务不参与。"""
+        return self.startup_ms is not None and all(t.state in (DONE, SKIPPED) for t in self.tasks if t.critical)
+
+    @property
+    def warmup_finished(self) -> bool:
+        return all(t.state in (DONE, FAILED, SKIPPED) for t in self.tasks if not t.critical)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "warmup_finished": self.warmup_finished,
+            "leader": self.leader.is_leader,
+            "startup_ms": self.startup_ms,
+            "time_to_first_request_ms": self.first_request_ms,
+            "tasks": {t.name: t.as_dict() for t in self.tasks},
+        }
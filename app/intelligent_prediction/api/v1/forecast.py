@@ -2,10 +2,8 @@
 
 from __future__ import annotations
 
-import io
 from datetime import date, datetime, timedelta
 
-import pandas as pd
 from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -18,9 +16,15 @@ from app.core.exceptions import (
 from app.core.logging import get_logger
 from app.intelligent_prediction.api.audit_deps import AuditActor, get_audit_actor
 from app.intelligent_prediction.api.deps import get_prediction_db_session
-from app.intelligent_prediction.schemas.forecast import PrdForecastChartResponse, PrdForecastDetailResponse, PrdForecastQuery
+from app.intelligent_prediction.schemas.forecast import (
+    PrdForecastChartResponse,
+    PrdForecastDetailResponse,
+    PrdForecastDetailRow,
+    PrdForecastQuery,
+)
 from app.intelligent_prediction.services.audit_service import append_audit, write_audit_standalone
 from app.intelligent_prediction.services.prd_forecast_service import PrdForecastService, get_prd_forecast_service
+from app.utils.streaming_export import iter_export_bytes, streaming_export_response
 
 logger = get_logger(__name__)
 router = APIRouter()
@@ -156,7 +160,7 @@ async def prd_forecast_detail(
 @router.get(
     "/导出",
     summary="导出送货量预测 Excel",
-    description="按当前筛选条件导出全部明细为 xlsx 流。",
+    description="按当前筛选条件导出全部明细为 xlsx（write-only 流式写表）或 csv 流。",
 )
 async def prd_forecast_export(
     date_from: date | None = Query(None, description="预测区间起点"),
@@ -169,6 +173,7 @@ async def prd_forecast_export(
     product_varieties: list[str] = Query(default=[], description="品种（多值）"),
     smelter: str | None = Query(None, description="冶炼厂（单值）"),
     smelters: list[str] = Query(default=[], description="冶炼厂（多值）"),
+    file_format: str = Query("xlsx", pattern="^(xlsx|csv)$", description="导出格式：xlsx / csv"),
     session: AsyncSession = Depends(get_prediction_db_session),
     svc: PrdForecastService = Depends(get_prd_forecast_service),
     actor: AuditActor = Depends(get_audit_actor),
@@ -189,11 +194,7 @@ async def prd_forecast_export(
     )
     try:
         rows, _chart = await svc.compute(session, q)
-        fn = f"送货量预测_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        df = pd.DataFrame([r.model_dump() for r in rows])
-        buf = io.BytesIO()
-        df.to_excel(buf, index=False, engine="openpyxl")
-        buf.seek(0)
+        fn = f"送货量预测_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_format}"
         await append_audit(
             session,
             "prd_forecast_export",
@@ -201,12 +202,14 @@ async def prd_forecast_export(
             detail={"rows": len(rows), "date_from": str(q.date_from), "date_to": str(q.date_to)},
             actor=actor,
         )
-        headers = {"Content-Disposition": f'attachment; filename="{fn}"'}
-        return StreamingResponse(
-            buf,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers=headers,
+        columns = list(PrdForecastDetailRow.model_fields)
+        body = iter_export_bytes(
+            file_format,
+            columns,
+            ([getattr(r, c) for c in columns] for r in rows),
+            sheet_title="送货量预测",
         )
+        return streaming_export_response(body, fn, file_format)
     except BusinessException:
         raise
     except Exception as e:
@@ -202,7 +202,7 @@ class AIModelClient:
         """调用 Coze stream_run；将 system 与 user 合并为单条 query。"""
         combined = f"{system.strip()}\n\n{user.strip()}"
         t0 = time.perf_counter()
-        result = await asyncio.to_thread(run_coze_agent_chat, combined)
+        result = await run_coze_agent_chat(combined)
         latency_ms = (time.perf_counter() - t0) * 1000.0
         if not result.get("success"):
             err = str(result.get("error") or "unknown")
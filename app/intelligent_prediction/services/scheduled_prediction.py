@@ -17,6 +17,7 @@ from app.intelligent_prediction.services.audit_service import append_audit
 from app.intelligent_prediction.services.cache_manager import get_cache_manager
 from app.intelligent_prediction.services.prediction_service import get_prediction_service
 from app.intelligent_prediction.services.prompt_builder import PromptBuilder
+from app.services.coze_agent_service import run_closing_coze_session
 
 logger = get_logger(__name__)
 
@@ -79,7 +80,7 @@ def run_scheduled_intelligent_prediction_sync() -> None:
     if not settings.intelligent_prediction_schedule_enabled:
         return
     try:
-        asyncio.run(_run_scheduled_intelligent_prediction_async())
+        asyncio.run(run_closing_coze_session(_run_scheduled_intelligent_prediction_async()))
     except RuntimeError as e:
         if "未配置智能预测异步数据库" in str(e):
             logger.warning("scheduled intelligent prediction skipped: %s", e)
@@ -18,6 +18,7 @@ from app.intelligent_prediction.services.cache_manager import get_cache_manager
 from app.intelligent_prediction.services.prediction_service import PredictionService
 from app.intelligent_prediction.services.prompt_builder import PromptBuilder
 from app.intelligent_prediction.tasks.celery_app import celery_app
+from app.services.coze_agent_service import run_closing_coze_session
 
 logger = get_logger(__name__)
 
@@ -71,5 +72,5 @@ async def _run_batch_async(batch_id: str) -> None:
 
 @celery_app.task(name="intelligent_prediction.run_prediction_batch")
 def run_prediction_batch_task(batch_id: str) -> str:
-    asyncio.run(_run_batch_async(batch_id))
+    asyncio.run(run_closing_coze_session(_run_batch_async(batch_id)))
     return batch_id
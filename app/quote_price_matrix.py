@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+比价取价的列式计算内核（NumPy）。
+
+把「冶炼厂 × 品类 × 品类别名」的最新报价装成一个矩阵，一次性完成：
+- 按目标口径取价（直接取列 / 由基准正算 / 由其它含税档反算再正算），与 `TLService.get_comparison`
+  原逐格闭包的优先级与 `报价来源` 标签完全一致；
+- 统一反推「基准 + 含1%/3%/13%」（与 `derive_net_and_vat_from_quote_row` 一致）。
+
+税率换算公式与 `app.price_tax_utils` 相同（含 `round(x, 2)` 银行家舍入语义，见 `round_like_python`）。
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.price_tax_utils import merge_factory_rates
+
+# 矩阵最后一维的列顺序（与 quote_details 列名一致）
+PRICE_COLUMNS: Tuple[str, ...] = (
+    "unit_price",
+    "price_1pct_vat",
+    "price_3pct_vat",
+    "price_13pct_vat",
+    "price_normal_invoice",
+    "price_reverse_invoice",
+)
+COL_INDEX: Dict[str, int] = {c: i for i, c in enumerate(PRICE_COLUMNS)}
+
+# 税率档顺序；含税列下标 = 税率档下标 + 1
+TAX_KEYS: Tuple[str, ...] = ("1pct", "3pct", "13pct")
+TAX_INDEX: Dict[str, int] = {k: i for i, k in enumerate(TAX_KEYS)}
+
+# 取价来源编码 → 接口 `报价来源` 标签
+SOURCE_LABELS: Tuple[str, ...] = (
+    "direct",
+    "calc_from_base",
+    "calc_from_1pct",
+    "calc_from_3pct",
+    "calc_from_13pct",
+    "unavailable",
+)
+SOURCE_DIRECT = 0
+SOURCE_FROM_BASE = 1
+SOURCE_UNAVAILABLE = len(SOURCE_LABELS) - 1
+_UNRESOLVED = -1
+
+
+def round_like_python(values: np.ndarray, ndigits: int) -> np.ndarray:
+    """
+    逐元素等价于内置 `round(x, ndigits)`。
+
+    `np.round` 先乘 10**n 再取整，在 x·10**n 恰好接近 .5 时可能与 Python 的精确十进制舍入不同；
+    这些「近似平局」元素单独回退到内置 round，其余直接用 NumPy 结果。NaN 原样保留。
+    """
+    arr = np.asarray(values, dtype=float)
+    out = np.round(arr, ndigits)
+    scaled = arr * (10.0 ** ndigits)
+    with np.errstate(invalid="ignore"):
+        frac = np.abs(scaled - np.trunc(scaled))
+        near_tie = np.isfinite(arr) & (
+            np.abs(frac - 0.5) <= 1e-9 * np.maximum(1.0, np.abs(scaled))
+        )
+    if near_tie.any():
+        out = np.array(out, dtype=float, copy=True)
+        flat_out = out.reshape(-1)
+        flat_in = arr.reshape(-1)
+        for i in np.flatnonzero(near_tie.reshape(-1)):
+            flat_out[i] = round(float(flat_in[i]), ndigits)
+    return out
+
+
+class QuotePriceMatrix:
+    """
+    报价矩阵：`prices[f, c, k, col]` 为冶炼厂 f、品类 c 的第 k 个别名的最新报价（缺失为 NaN），
+    `present[f, c, k]` 表示该别名在报价表中有行；`rates[f, j]` 为合并后的 1%/3%/13% 税率。
+    """
+
+    def __init__(
+        self,
+        factory_ids: Sequence[int],
+        category_ids: Sequence[int],
+        prices: np.ndarray,
+        present: np.ndarray,
+        rates: np.ndarray,
+    ) -> None:
+        self.factory_ids = list(factory_ids)
+        self.category_ids = list(category_ids)
+        self.factory_pos: Dict[int, int] = {fid: i for i, fid in enumerate(self.factory_ids)}
+        self.category_pos: Dict[int, int] = {cid: i for i, cid in enumerate(self.category_ids)}
+        self.prices = prices
+        self.present = present
+        self.rates = rates
+
+    @classmethod
+    def build(
+        cls,
+        factory_ids: Sequence[int],
+        category_ids: Sequence[int],
+        cat_id_to_names: Dict[int, List[str]],
+        raw_price_map: Dict[tuple, Dict[str, Optional[float]]],
+        tax_rate_map: Dict[int, Dict[str, float]],
+    ) -> "QuotePriceMatrix":
+        """由 get_comparison 已查出的字典结构装配矩阵（别名按 cat_id_to_names 中的顺序）。"""
+        fids = list(dict.fromkeys(factory_ids))
+        cids = list(dict.fromkeys(category_ids))
+        n_slots = max((len(cat_id_to_names.get(cid, [])) for cid in cids), default=0)
+        n_slots = max(n_slots, 1)
+
+        prices = np.full((len(fids), len(cids), n_slots, len(PRICE_COLUMNS)), np.nan)
+        present = np.zeros((len(fids), len(cids), n_slots), dtype=bool)
+        rates = np.empty((len(fids), len(TAX_KEYS)))
+
+        for fi, fid in enumerate(fids):
+            merged = merge_factory_rates(tax_rate_map.get(fid, {}))
+            rates[fi] = [float(merged[k]) for k in TAX_KEYS]
+            for ci, cid in enumerate(cids):
+                for k, cat_name in enumerate(cat_id_to_names.get(cid, [])):
+                    row = raw_price_map.get((fid, cat_name))
+                    if not row:
+                        continue
+                    present[fi, ci, k] = True
+                    prices[fi, ci, k] = [
+                        np.nan if row.get(col) is None else float(row[col])
+                        for col in PRICE_COLUMNS
+                    ]
+        return cls(fids, cids, prices, present, rates)
+
+    def resolve_target_prices(
+        self, target_col: str, target_tax: Optional[str]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按目标口径取价，返回 (price[f, c], source_code[f, c])；无价为 NaN + SOURCE_UNAVAILABLE。
+
+        每个别名依次尝试：1. 目标列直接有值 → 2. 不含税基准正算目标税率 →
+        3. 目标为基准时由 1%/3%/13% 含税列反算 → 4. 由含税列反算后正算目标税率；
+        某别名四步都取不到时继续看下一个别名（与原逐格逻辑一致）。
+        """
+        prices, present = self.prices, self.present
+        price = np.full(present.shape, np.nan)
+        code = np.full(present.shape, _UNRESOLVED, dtype=np.int8)
+
+        def assign(values: np.ndarray, source: int) -> None:
+            mask = present & (code == _UNRESOLVED) & ~np.isnan(values)
+            price[mask] = values[mask]
+            code[mask] = source
+
+        tc = COL_INDEX[target_col]
+        assign(prices[..., tc], SOURCE_DIRECT)
+
+        rt = None
+        if target_tax:
+            rt = self.rates[:, None, None, TAX_INDEX[target_tax]]
+            assign(
+                round_like_python(prices[..., COL_INDEX["unit_price"]] * (1 + rt), 2),
+                SOURCE_FROM_BASE,
+            )
+
+        for j, tax in enumerate(TAX_KEYS):
+            if target_col != "unit_price" and rt is None:
+                break
+            net = prices[..., j + 1] / (1 + self.rates[:, None, None, j])
+            source = SOURCE_LABELS.index(f"calc_from_{tax}")
+            if target_col == "unit_price":
+                assign(round_like_python(net, 2), source)
+            else:
+                assign(round_like_python(net * (1 + rt), 2), source)
+
+        resolved = code != _UNRESOLVED
+        first = np.argmax(resolved, axis=2)[..., None]
+        out_price = np.take_along_axis(price, first, axis=2)[..., 0]
+        out_code = np.take_along_axis(code, first, axis=2)[..., 0]
+        has_any = resolved.any(axis=2)
+        out_price[~has_any] = np.nan
+        out_code = np.where(has_any, out_code, SOURCE_UNAVAILABLE).astype(np.int8)
+        return out_price, out_code
+
+    def quote_rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        """每格取第一个有报价行的别名：返回 (row[f, c, col], has_row[f, c])。"""
+        first = np.argmax(self.present, axis=2)
+        rows = np.take_along_axis(self.prices, first[..., None, None], axis=2)[:, :, 0, :]
+        return rows, self.present.any(axis=2)
+
+    def breakdown(self, rows: np.ndarray, has_row: np.ndarray) -> np.ndarray:
+        """
+        统一反推 (基准不含税, 含1%, 含3%, 含13%)，形状 [f, c, 4]；无法推算的格为 NaN。
+
+        优先级同 `derive_net_and_vat_from_quote_row`：基准 → 13%/3%/1% 含税列反算 → 普票/反向发票列。
+        """
+        shape = rows.shape[:2]
+        net = np.full(shape, np.nan)
+        net_out = np.full(shape, np.nan)
+        done = ~has_row
+
+        def take(mask: np.ndarray, raw: np.ndarray, shown: np.ndarray) -> None:
+            nonlocal done
+            net[mask] = raw[mask]
+            net_out[mask] = shown[mask]
+            done = done | mask
+
+        up = rows[..., COL_INDEX["unit_price"]]
+        take(~done & ~np.isnan(up), up, round_like_python(up, 2))
+        for tax in ("13pct", "3pct", "1pct"):
+            j = TAX_INDEX[tax]
+            n = rows[..., j + 1] / (1 + self.rates[:, None, j])
+            take(~done & ~np.isnan(n), n, round_like_python(n, 4))
+        for col in ("price_normal_invoice", "price_reverse_invoice"):
+            v = rows[..., COL_INDEX[col]]
+            take(~done & ~np.isnan(v), v, round_like_python(v, 2))
+
+        out = np.empty(shape + (4,))
+        out[..., 0] = net_out
+        for j in range(len(TAX_KEYS)):
+            out[..., j + 1] = round_like_python(net * (1 + self.rates[:, None, j]), 2)
+        return out
+
+
+def to_optional_list(values: np.ndarray) -> List[Optional[float]]:
+    """一维数组转 Python 列表，NaN → None（供 JSON 输出）。"""
+    return [None if v != v else v for v in np.asarray(values, dtype=float).tolist()]
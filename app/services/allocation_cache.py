@@ -0,0 +1,84 @@
+"""
+大区经理每日分配需求（`compute_manager_daily_allocation`）的进程内结果缓存。
+
+结果只取决于当日日期与订货计划、报货计划、报单、合同四张表，按日期缓存一份：
+
+- 本进程内订货计划 / 报货计划 / 报单的写操作提交后调用 `invalidate_manager_allocation()`，合同到期扫描通过
+  `add_expiry_listener` 触发同样的失效；
+- 其他 worker 的写入与直接改库无法通知到本进程，缓存项另设 TTL（`settings.manager_allocation_cache_ttl_seconds`，
+  0 = 不缓存）兜底；
+- 失效时代数加一：计算开始前记下代数，写回时代数已变（计算期间有写入）则丢弃结果，不把旧数据放进缓存。
+
+缓存的结果对象由所有调用方共享，调用方不得修改。
+"""
+import threading
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.contract_expiry import add_expiry_listener
+
+
+class DailyResultCache:
+    """按日期缓存的计算结果，带 TTL 与失效代数。"""
+
+    def __init__(self, ttl_seconds: Optional[float] = None, clock=time.monotonic):
+        self._ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: Dict[date, Tuple[float, Any]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def ttl_seconds(self) -> float:
+        return settings.manager_allocation_cache_ttl_seconds if self._ttl_seconds is None else self._ttl_seconds
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, day: date) -> Optional[Any]:
+        with self._lock:
+            hit = self._entries.get(day)
+            if hit is None:
+                return None
+            if hit[0] <= self._clock():
+                del self._entries[day]
+                return None
+            return hit[1]
+
+    def put(self, day: date, value: Any, generation: int) -> bool:
+        """写入 day 的结果；generation 须为计算开始前读到的代数，此后发生过失效则不写入。"""
+        ttl = self.ttl_seconds
+        if ttl <= 0:
+            return False
+        with self._lock:
+            if generation != self._generation:
+                return False
+            now = self._clock()
+            # 只保留未过期的日期（跨天后旧日期自然淘汰）
+            for stale in [d for d, (exp, _) in self._entries.items() if exp <= now]:
+                del self._entries[stale]
+            self._entries[day] = (now + ttl, value)
+            return True
+
+    def invalidate(self, *_args: Any) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+manager_allocation_cache = DailyResultCache()
+
+
+def invalidate_manager_allocation(*_args: Any) -> None:
+    """订货计划 / 报货计划 / 报单写入提交后调用（参数忽略，便于直接注册为回调）。"""
+    manager_allocation_cache.invalidate()
+
+
+def _on_contracts_expired(contract_nos: List[str]) -> None:
+    invalidate_manager_allocation()
+
+
+add_expiry_listener(_on_contracts_expired)
@@ -39,6 +39,8 @@ try:
 except ImportError as e:
     raise ImportError("缺少依赖 pulp，请先安装：pip install pulp") from e
 
+from app.services.allocation_cache import manager_allocation_cache
+
 
 TONS_PER_TRUCK: int = 35  # 每车吨数
 
@@ -1004,78 +1006,67 @@ def solve_dispatch_plan(
 _GRACE_DAYS_NO_END_DATE = 4
 
 
-def _contract_window_for_delivery_plan(delivery_plan_id: int) -> Optional[Tuple[date, date]]:
-    """
-    同一报货计划下所有「生效中」合同的生效起止（起取最早签订日，止取最晚截止日；
-    无 end_date 时按签订日 + 4 天截止，与合同失效逻辑一致）。
-    """
-    from app.services.contract_service import get_conn
-    from pymysql.cursors import DictCursor
+_DELIVERED_STATUSES = ('已发货', '已装车', '在途', '已签收')
+# IN 列表每批个数（订货计划上千条时分批查询）
+_IN_CHUNK_SIZE = 1000
 
-    try:
-        with get_conn() as conn:
-            with conn.cursor(DictCursor) as cur:
-                cur.execute(
-                    """
-                    SELECT contract_date, end_date
-                    FROM pd_contracts
-                    WHERE delivery_plan_id = %s AND status = '生效中'
-                    """,
-                    (delivery_plan_id,),
-                )
-                rows = cur.fetchall() or []
-    except Exception:
-        return None
 
-    if not rows:
-        return None
+def _as_date(value: Any) -> Optional[date]:
+    return value.date() if isinstance(value, datetime) else value
 
-    starts: List[date] = []
-    ends: List[date] = []
-    for r in rows:
-        cd = r.get("contract_date")
-        ed = r.get("end_date")
-        if hasattr(cd, "date"):
-            cd = cd.date()
-        if hasattr(ed, "date"):
-            ed = ed.date()
-        if cd is None:
-            continue
-        starts.append(cd)
-        if ed is not None:
-            ends.append(ed)
-        else:
-            ends.append(cd + timedelta(days=_GRACE_DAYS_NO_END_DATE))
 
-    if not starts or not ends:
-        return None
-
-    return min(starts), max(ends)
+def _chunks(ids: List[int]) -> List[List[int]]:
+    return [ids[i:i + _IN_CHUNK_SIZE] for i in range(0, len(ids), _IN_CHUNK_SIZE)]
 
 
-def _delivered_trucks_for_order_plan(order_plan_id: int) -> int:
-    """订货计划已发车辆（报单统计，与合同已发车口径一致）。"""
-    from app.services.contract_service import get_conn
-
-    try:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT COUNT(*) AS n
-                    FROM pd_deliveries
-                    WHERE order_plan_id = %s
-                      AND status IN ('已发货', '已装车', '在途', '已签收')
-                    """,
-                    (order_plan_id,),
-                )
-                row = cur.fetchone()
-                if not row:
-                    return 0
-                n = row["n"] if isinstance(row, dict) else row[0]
-                return int(n or 0)
-    except Exception:
-        return 0
+def _contract_windows_for_delivery_plans(cur, delivery_plan_ids: List[int]) -> Dict[int, Tuple[date, date]]:
+    """
+    各报货计划下所有「生效中」合同的生效起止（起取最早签订日，止取最晚截止日；
+    无 end_date 时按签订日 + 4 天截止，与合同失效逻辑一致），一次 GROUP BY 查询；无合同的计划不在结果中。
+    """
+    windows: Dict[int, Tuple[date, date]] = {}
+    for chunk in _chunks(sorted(set(delivery_plan_ids))):
+        placeholders = ",".join(["%s"] * len(chunk))
+        cur.execute(
+            f"""
+            SELECT
+                delivery_plan_id,
+                MIN(contract_date) AS start_date,
+                MAX(COALESCE(end_date, DATE_ADD(contract_date, INTERVAL {_GRACE_DAYS_NO_END_DATE} DAY))) AS end_date
+            FROM pd_contracts
+            WHERE delivery_plan_id IN ({placeholders})
+              AND status = '生效中'
+              AND contract_date IS NOT NULL
+            GROUP BY delivery_plan_id
+            """,
+            tuple(chunk),
+        )
+        for r in cur.fetchall() or []:
+            start, end = _as_date(r["start_date"]), _as_date(r["end_date"])
+            if start is not None and end is not None:
+                windows[int(r["delivery_plan_id"])] = (start, end)
+    return windows
+
+
+def _delivered_trucks_for_order_plans(cur, order_plan_ids: List[int]) -> Dict[int, int]:
+    """各订货计划已发车辆（报单统计，与合同已发车口径一致），一次 GROUP BY 查询；没有报单的计划不在结果中。"""
+    delivered: Dict[int, int] = {}
+    status_placeholders = ",".join(["%s"] * len(_DELIVERED_STATUSES))
+    for chunk in _chunks(sorted(set(order_plan_ids))):
+        placeholders = ",".join(["%s"] * len(chunk))
+        cur.execute(
+            f"""
+            SELECT order_plan_id, COUNT(*) AS n
+            FROM pd_deliveries
+            WHERE order_plan_id IN ({placeholders})
+              AND status IN ({status_placeholders})
+            GROUP BY order_plan_id
+            """,
+            tuple(chunk) + _DELIVERED_STATUSES,
+        )
+        for r in cur.fetchall() or []:
+            delivered[int(r["order_plan_id"])] = int(r["n"] or 0)
+    return delivered
 
 
 def _spread_integer_total(total: int, num_slots: int) -> List[int]:
@@ -1092,12 +1083,14 @@ def _spread_integer_total(total: int, num_slots: int) -> List[int]:
 def compute_manager_daily_allocation(
     *,
     today: Optional[date] = None,
+    use_cache: bool = True,
 ) -> Dict[str, Any]:
     """
     基于生效中合同在报货计划上的生效期限，以及审核中/审核通过的订货计划车数，
     将剩余车数在有效日区间内均分，得到每位大区经理每日运货量（吨）。
 
     仅包含「当日及未来」的日期；无订货计划或有效天数为 0 的不产出条目。
+    订货计划、合同生效期、已发车数共三次查询；成功结果按日期缓存（见 allocation_cache），use_cache=False 时强制重算。
     """
     from app.services.contract_service import get_conn
     from pymysql.cursors import DictCursor
@@ -1105,6 +1098,12 @@ def compute_manager_daily_allocation(
     if today is None:
         today = datetime.now().date()
 
+    if use_cache:
+        cached = manager_allocation_cache.get(today)
+        if cached is not None:
+            return cached
+    generation = manager_allocation_cache.generation
+
     # date_str -> manager_name -> { truck_count, tonnage, order_plan_ids }
     by_date_mgr: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(
         lambda: defaultdict(
@@ -1133,6 +1132,16 @@ def compute_manager_daily_allocation(
                     """
                 )
                 order_rows = cur.fetchall() or []
+                windows = _contract_windows_for_delivery_plans(
+                    cur, [int(r["delivery_plan_id"]) for r in order_rows]
+                )
+                delivered_by_plan = _delivered_trucks_for_order_plans(
+                    cur,
+                    [
+                        int(r["order_plan_id"]) for r in order_rows
+                        if int(r["delivery_plan_id"]) in windows and int(r.get("truck_count") or 0) > 0
+                    ],
+                )
     except Exception as e:
         return {
             "success": False,
@@ -1142,16 +1151,18 @@ def compute_manager_daily_allocation(
             "meta": {},
         }
 
+    today_str = today.strftime("%Y-%m-%d")
+    # 同一报货计划下的订货计划有效日区间相同，日期列表只生成一次
+    date_lists: Dict[Tuple[date, date], List[str]] = {}
+
     for row in order_rows:
         op_id = int(row["order_plan_id"])
         delivery_plan_id = int(row["delivery_plan_id"])
         truck_cap = int(row.get("truck_count") or 0)
         manager = (row.get("created_by_name") or "").strip() or "未指定"
-        psd = row.get("plan_start_date")
-        if hasattr(psd, "date"):
-            psd = psd.date()
+        psd = _as_date(row.get("plan_start_date"))
 
-        window = _contract_window_for_delivery_plan(delivery_plan_id)
+        window = windows.get(delivery_plan_id)
         if not window:
             continue
         eff_start, eff_end = window
@@ -1165,17 +1176,19 @@ def compute_manager_daily_allocation(
         if window_start > window_end:
             continue
 
-        date_list = _date_range(
-            window_start.strftime("%Y-%m-%d"),
-            window_end.strftime("%Y-%m-%d"),
-        )
-        # 再保险：只要 >= today
-        date_list = [d for d in date_list if d >= today.strftime("%Y-%m-%d")]
+        date_list = date_lists.get((window_start, window_end))
+        if date_list is None:
+            date_list = _date_range(
+                window_start.strftime("%Y-%m-%d"),
+                window_end.strftime("%Y-%m-%d"),
+            )
+            # 再保险：只要 >= today
+            date_list = date_lists[(window_start, window_end)] = [d for d in date_list if d >= today_str]
         n_days = len(date_list)
         if n_days == 0 or truck_cap <= 0:
             continue
 
-        delivered = _delivered_trucks_for_order_plan(op_id)
+        delivered = delivered_by_plan.get(op_id, 0)
         remaining = max(0, truck_cap - delivered)
         if remaining <= 0:
             continue
@@ -1221,7 +1234,7 @@ def compute_manager_daily_allocation(
             }
         )
 
-    return {
+    result = {
         "success": True,
         "tonnage_per_truck": TONS_PER_TRUCK,
         "days": days_out,
@@ -1230,5 +1243,7 @@ def compute_manager_daily_allocation(
             "date_count": len(days_out),
         },
     }
+    manager_allocation_cache.put(today, result, generation)
+    return result
 
 
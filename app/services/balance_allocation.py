@@ -0,0 +1,217 @@
+"""
+回单金额在多笔结余明细上的分配（按收款人批量核销）。
+
+原实现按创建时间逐笔扣减、每笔一条 UPDATE，没有前瞻：回单恰好等于其中几笔之和时也会把较早的明细结清、
+再把最后一笔打成部分支付。这里一次载入全部候选明细，在内存里按策略算出分配，调用方再整批写回：
+
+- `OLDEST_FIRST`：按创建时间从早到晚依次扣减（原行为），至多最后一笔部分支付；
+- `EXACT_FIRST`：先找金额之和恰好等于回单金额的明细子集（同等条件下优先较早的明细），整笔结清、没有部分支付；
+  找不到时退回 `OLDEST_FIRST`；
+- `MIN_PARTIALS`：在不超过回单金额的前提下尽量多地整笔结清（子集和最接近回单金额），
+  剩余金额只落在最早的一笔未结清明细上，部分支付金额最小。
+
+子集搜索按分计算：先用哈希查找至多三笔恰好凑齐的组合（最常见的合并打款），再做子集和状态扩展；
+状态数超过 `SUBSET_SEARCH_MAX_STATES` 时放弃搜索、退回按时间扣减，单次分配的耗时有上界。
+所有策略都满足：各笔分配金额 > 0 且不超过该笔结余，分配合计 + 未用金额 = 回单金额。
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+OLDEST_FIRST = "oldest_first"
+EXACT_FIRST = "exact_first"
+MIN_PARTIALS = "min_partials"
+ALLOCATION_POLICIES = (OLDEST_FIRST, EXACT_FIRST, MIN_PARTIALS)
+
+PAY_STATUS_PARTIAL = 1
+PAY_STATUS_SETTLED = 2
+
+#: 子集和搜索保留的可达金额（分）状态数上限；超过则退回按时间扣减
+SUBSET_SEARCH_MAX_STATES = 20_000
+
+_CENT = Decimal("0.01")
+
+
+@dataclass(frozen=True)
+class OpenBalance:
+    """候选结余明细；列表顺序即创建时间先后。"""
+    balance_id: int
+    payable: Decimal
+    paid: Decimal
+    balance: Decimal
+
+
+@dataclass
+class Allocation:
+    policy: str
+    amount: Decimal
+    #: [(结余明细ID, 本次分配金额)]，按候选明细顺序
+    items: List[Tuple[int, Decimal]] = field(default_factory=list)
+    #: 子集搜索是否因状态数超限而退回按时间扣减
+    fell_back: bool = False
+
+    @property
+    def allocated(self) -> Decimal:
+        return sum((amount for _, amount in self.items), Decimal("0"))
+
+    @property
+    def remaining(self) -> Decimal:
+        return self.amount - self.allocated
+
+
+def _cents(value: Decimal) -> int:
+    return int((value / _CENT).to_integral_value())
+
+
+def _oldest_first(balances: Sequence[OpenBalance], amount: Decimal, skip: Sequence[int] = ()) -> List[Tuple[int, Decimal]]:
+    skipped = set(skip)
+    items: List[Tuple[int, Decimal]] = []
+    remaining = amount
+    for index, b in enumerate(balances):
+        if remaining <= 0:
+            break
+        if index in skipped or b.balance <= 0:
+            continue
+        settle = min(b.balance, remaining)
+        items.append((b.balance_id, settle))
+        remaining -= settle
+    return items
+
+
+def small_exact_subset(cents: Sequence[int], target: int, max_size: int = 3) -> Optional[List[int]]:
+    """
+    至多 max_size（<= 3）笔、金额之和恰好等于 target 的下标集合：按笔数从少到多、同笔数优先最后一笔较早的组合。
+    一次打款合并少数几车货最常见，哈希查找比子集和状态扩展快得多，也不受状态数上限影响。
+    """
+    first: Dict[int, int] = {}
+    for index, c in enumerate(cents):
+        if c == target:
+            return [index]
+        first.setdefault(c, index)
+    if max_size >= 2:
+        for j, c in enumerate(cents):
+            i = first.get(target - c)
+            if i is not None and i < j:
+                return [i, j]
+    if max_size >= 3:
+        for k, ck in enumerate(cents):
+            seen: Dict[int, int] = {}
+            for j in range(k):
+                i = seen.get(target - ck - cents[j])
+                if i is not None:
+                    return [i, j, k]
+                seen.setdefault(cents[j], j)
+    return None
+
+
+def best_subset(cents: Sequence[int], target: int, max_states: int = SUBSET_SEARCH_MAX_STATES) -> Optional[List[int]]:
+    """
+    子集和不超过 target 且最接近 target 的下标集合（找到恰好等于的即停止）。
+    按顺序扩展，同一金额保留最先到达的路径，因此优先较早的元素；状态数超过 max_states 时返回 None。
+    """
+    parent: Dict[int, Optional[Tuple[int, int]]] = {0: None}
+    hit: Optional[int] = None
+    for index, c in enumerate(cents):
+        if c <= 0 or c > target:
+            continue
+        for s in list(parent):
+            t = s + c
+            if t <= target and t not in parent:
+                parent[t] = (s, index)
+                if t == target:
+                    hit = t
+                    break
+        if hit is not None:
+            break
+        if len(parent) > max_states:
+            return None
+    node = hit if hit is not None else max(parent)
+    chosen: List[int] = []
+    while parent[node] is not None:
+        node, index = parent[node]
+        chosen.append(index)
+    return sorted(chosen)
+
+
+def allocate(balances: Sequence[OpenBalance], amount: Decimal, policy: str = OLDEST_FIRST) -> Allocation:
+    """按策略把 amount 分配到 balances 上；不修改输入。"""
+    if policy not in ALLOCATION_POLICIES:
+        raise ValueError(f"不支持的分配策略: {policy}，有效值：{', '.join(ALLOCATION_POLICIES)}")
+    result = Allocation(policy=policy, amount=amount)
+    if amount <= 0:
+        return result
+
+    total = sum((b.balance for b in balances if b.balance > 0), Decimal("0"))
+    if policy == OLDEST_FIRST or total <= amount:
+        # 回单足够结清全部明细时各策略结果相同
+        result.items = _oldest_first(balances, amount)
+        return result
+
+    cents = [_cents(b.balance) if b.balance > 0 else 0 for b in balances]
+    target = _cents(amount)
+    subset = small_exact_subset(cents, target) or best_subset(cents, target)
+    if subset is None:
+        result.fell_back = True
+        result.items = _oldest_first(balances, amount)
+        return result
+
+    full = sum((balances[i].balance for i in subset), Decimal("0"))
+    if policy == EXACT_FIRST and full != amount:
+        result.items = _oldest_first(balances, amount)
+        return result
+
+    chosen = set(subset)
+    partial = _oldest_first(balances, amount - full, skip=subset)[:1]
+    partial_ids = {balance_id: settle for balance_id, settle in partial}
+    for index, b in enumerate(balances):
+        if index in chosen:
+            result.items.append((b.balance_id, b.balance))
+        elif b.balance_id in partial_ids:
+            result.items.append((b.balance_id, partial_ids[b.balance_id]))
+    return result
+
+
+def apply_allocation(cur, receipt_id: int, balances: Sequence[OpenBalance], allocation: Allocation) -> List[Dict]:
+    """
+    在调用方事务内整批写回：一条按 id 分支的 UPDATE 更新已付/结余/状态，一条多行 INSERT 写核销关联。
+    返回 [{balance_id, settled_amount, status}]。
+    """
+    if not allocation.items:
+        return []
+    by_id = {b.balance_id: b for b in balances}
+    updates: List[Tuple[int, Decimal, Decimal, int]] = []
+    for balance_id, settle in allocation.items:
+        b = by_id[balance_id]
+        new_paid = b.paid + settle
+        status = PAY_STATUS_SETTLED if new_paid >= b.payable else PAY_STATUS_PARTIAL
+        updates.append((balance_id, new_paid, b.payable - new_paid, status))
+
+    ids = [u[0] for u in updates]
+    branches = " ".join(["WHEN %s THEN %s"] * len(updates))
+    params: List = []
+    for column in (1, 2, 3):
+        for u in updates:
+            params.extend((u[0], u[column]))
+    params.extend(ids)
+    cur.execute(
+        f"""
+        UPDATE pd_balance_details
+        SET paid_amount = CASE id {branches} END,
+            balance_amount = CASE id {branches} END,
+            payment_status = CASE id {branches} END
+        WHERE id IN ({",".join(["%s"] * len(ids))})
+        """,
+        tuple(params),
+    )
+    cur.execute(
+        f"""
+        INSERT INTO pd_receipt_settlements (receipt_id, balance_id, settled_amount)
+        VALUES {",".join(["(%s, %s, %s)"] * len(allocation.items))}
+        ON DUPLICATE KEY UPDATE settled_amount = VALUES(settled_amount)
+        """,
+        tuple(v for balance_id, settle in allocation.items for v in (receipt_id, balance_id, settle)),
+    )
+    return [
+        {"balance_id": balance_id, "settled_amount": float(settle), "status": status}
+        for (balance_id, settle), (_, _, _, status) in zip(allocation.items, updates)
+    ]
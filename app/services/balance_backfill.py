@@ -0,0 +1,222 @@
+"""
+批量生成结余明细（价格修正后的回填）。
+
+`BalanceService.generate_balance_details` 逐行处理：每张磅单查一次仓库收款人、单条 INSERT，
+回填几千张磅单时一个连接要占用数分钟。这里按磅单主键分批：
+
+- 仓库收款人表在开始时整表读一次，按 (仓库, 收款人) 建映射，取代逐行 `_match_warehouse_payee` 查询；
+  同一键取 `is_active DESC, id ASC` 的第一行，与逐行匹配一致；
+- 每批按 `w.id > 水位` 取至多 chunk_size 张未生成结余的磅单，整批计算应付金额（与逐行生成共用 `payable_amount`），
+  一条多行 `INSERT IGNORE` 写入（`uk_weighbill` 兜住与逐行生成的并发），同一事务内刷新合同进度台账与收款人/报单人汇总；
+- 每批提交后推进水位，返回进度（扫描/生成条数、最后处理的磅单 ID、是否完成）；
+  传入上次返回的 `last_weighbill_id` 即可从断点继续，`max_chunks` 限制单次调用的批数。
+"""
+import logging
+from dataclasses import asdict, dataclass
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.core.schema_migrations import get_schema_capabilities
+from app.services.balance_party_summary import sync_balance_summaries
+from app.services.contract_progress import BALANCES, refresh_contract_progress
+from core.database import get_conn
+
+logger = logging.getLogger(__name__)
+
+#: 应付金额 = 净重 × 合同单价 / PAYABLE_PRICE_DIVISOR，四舍五入到分（与磅单、收款明细的应付口径一致）
+PAYABLE_PRICE_DIVISOR = Decimal("1.048")
+BALANCE_ELIGIBLE_OCR_STATUSES = ("待确认", "已确认", "已修正")
+PAY_STATUS_PENDING = 0
+
+_CENT = Decimal("0.01")
+
+
+def payable_amount(net_weight: Any, unit_price: Any) -> Decimal:
+    """单张磅单应付金额；空值按 0 计。"""
+    return (
+        Decimal(str(net_weight or 0)) * Decimal(str(unit_price or 0)) / PAYABLE_PRICE_DIVISOR
+    ).quantize(_CENT, rounding=ROUND_HALF_UP)
+
+
+def payable_amounts(rows: Iterable[Tuple[Any, Any]]) -> List[Decimal]:
+    """整批 (净重, 单价) 的应付金额。"""
+    return [payable_amount(net_weight, unit_price) for net_weight, unit_price in rows]
+
+
+def _normalize_text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    raw = str(value).strip()
+    return raw or None
+
+
+def _payee_key(warehouse_name: Optional[str], payee_name: Optional[str]) -> Tuple[str, str]:
+    # 库表比较按 utf8mb4_unicode_ci 不区分大小写，映射键同样折叠大小写
+    return warehouse_name.casefold(), payee_name.casefold()
+
+
+def load_warehouse_payees(cur) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """(仓库, 收款人) -> 仓库收款人行；同一键保留启用优先、ID 最小的一行。"""
+    cur.execute(
+        """
+        SELECT id, warehouse_name, payee_name, payee_account, payee_bank_name, is_active
+        FROM pd_warehouse_payees
+        ORDER BY is_active DESC, id ASC
+        """
+    )
+    mapping: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for row in cur.fetchall() or []:
+        record = dict(row) if isinstance(row, dict) else dict(zip([d[0] for d in cur.description], row))
+        warehouse, payee = _normalize_text(record.get("warehouse_name")), _normalize_text(record.get("payee_name"))
+        if warehouse and payee:
+            mapping.setdefault(_payee_key(warehouse, payee), record)
+    return mapping
+
+
+def resolve_payee_fields(
+    payees: Dict[Tuple[str, str], Dict[str, Any]], warehouse_name: Any, payee_name: Any
+) -> Dict[str, Any]:
+    """与 `BalanceService._resolve_balance_payee_fields` 同口径，只是从预加载的映射里匹配。"""
+    warehouse, payee = _normalize_text(warehouse_name), _normalize_text(payee_name)
+    matched = payees.get(_payee_key(warehouse, payee)) if warehouse and payee else None
+    return {
+        "warehouse_name": warehouse,
+        "payee_id": matched.get("id") if matched else None,
+        "payee_name": matched.get("payee_name") if matched else payee,
+        "payee_account": _normalize_text(matched.get("payee_account")) if matched else None,
+        "payee_bank_name": _normalize_text(matched.get("payee_bank_name")) if matched else None,
+        "matched": matched is not None,
+    }
+
+
+@dataclass
+class BalanceBackfillResult:
+    after_weighbill_id: int
+    last_weighbill_id: int
+    scanned: int = 0
+    generated: int = 0
+    matched_payees: int = 0
+    chunks: int = 0
+    done: bool = False
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _select_chunk(cur, after_id: int, contract_no: Optional[str], chunk_size: int) -> List[Dict[str, Any]]:
+    has_warehouse = get_schema_capabilities().has_column("pd_weighbills", "warehouse_name")
+    warehouse_select = "w.warehouse_name" if has_warehouse else "NULL"
+    statuses = ",".join(["%s"] * len(BALANCE_ELIGIBLE_OCR_STATUSES))
+    params: List[Any] = [after_id, *BALANCE_ELIGIBLE_OCR_STATUSES]
+    contract_sql = ""
+    if contract_no:
+        contract_sql = "AND w.contract_no = %s"
+        params.append(contract_no)
+    params.append(chunk_size)
+    cur.execute(
+        f"""
+        SELECT w.id AS weighbill_id, w.contract_no, w.delivery_id, w.vehicle_no, w.net_weight, w.unit_price,
+               COALESCE({warehouse_select}, d.warehouse) AS warehouse_name,
+               d.driver_name, d.driver_phone, d.payee
+        FROM pd_weighbills w
+        LEFT JOIN pd_deliveries d ON d.id = w.delivery_id
+        WHERE w.id > %s AND w.ocr_status IN ({statuses}) {contract_sql}
+          AND NOT EXISTS (SELECT 1 FROM pd_balance_details b WHERE b.weighbill_id = w.id)
+        ORDER BY w.id
+        LIMIT %s
+        """,
+        tuple(params),
+    )
+    rows = cur.fetchall() or []
+    if rows and not isinstance(rows[0], dict):
+        columns = [d[0] for d in cur.description]
+        rows = [dict(zip(columns, row)) for row in rows]
+    return list(rows)
+
+
+def _insert_chunk(cur, rows: List[Dict[str, Any]], payees, with_bank_name: bool) -> Tuple[int, int]:
+    """整批写入结余明细，返回 (写入条数, 匹配到仓库收款人的条数)。"""
+    fields = [
+        "contract_no", "delivery_id", "weighbill_id", "driver_name", "driver_phone", "vehicle_no",
+        "payee_id", "payee_name", "payee_account", "purchase_unit_price",
+        "payable_amount", "paid_amount", "balance_amount", "payment_status",
+    ]
+    if with_bank_name:
+        fields.insert(9, "payee_bank_name")
+    amounts = payable_amounts((r.get("net_weight"), r.get("unit_price")) for r in rows)
+    values: List[Any] = []
+    matched = 0
+    for row, payable in zip(rows, amounts):
+        payee = resolve_payee_fields(payees, row.get("warehouse_name"), row.get("payee") or row.get("driver_name"))
+        matched += payee["matched"]
+        record = [
+            row.get("contract_no"), row.get("delivery_id"), row.get("weighbill_id"), row.get("driver_name"),
+            row.get("driver_phone"), row.get("vehicle_no"),
+            payee["payee_id"], payee["payee_name"], payee["payee_account"], row.get("unit_price") or 0,
+            payable, 0, payable, PAY_STATUS_PENDING,
+        ]
+        if with_bank_name:
+            record.insert(9, payee["payee_bank_name"])
+        values.extend(record)
+    row_sql = "(" + ",".join(["%s"] * len(fields)) + ")"
+    cur.execute(
+        f"INSERT IGNORE INTO pd_balance_details ({', '.join(fields)}) VALUES " + ",".join([row_sql] * len(rows)),
+        tuple(values),
+    )
+    return cur.rowcount or 0, matched
+
+
+def _balance_ids_for(cur, weighbill_ids: List[int]) -> List[int]:
+    placeholders = ",".join(["%s"] * len(weighbill_ids))
+    cur.execute(f"SELECT id FROM pd_balance_details WHERE weighbill_id IN ({placeholders})", tuple(weighbill_ids))
+    return [row["id"] if isinstance(row, dict) else row[0] for row in cur.fetchall() or []]
+
+
+def backfill_balance_details(
+    after_weighbill_id: int = 0,
+    contract_no: Optional[str] = None,
+    chunk_size: int = 500,
+    max_chunks: Optional[int] = None,
+    on_chunk: Optional[Callable[[BalanceBackfillResult], None]] = None,
+    connect: Callable[[], Any] = get_conn,
+) -> BalanceBackfillResult:
+    """按磅单主键分批生成结余明细；每批单独提交，返回的 last_weighbill_id 可作为下次的 after_weighbill_id。"""
+    chunk_size = max(1, chunk_size)
+    with_bank_name = get_schema_capabilities().has_column("pd_balance_details", "payee_bank_name")
+    result = BalanceBackfillResult(after_weighbill_id=after_weighbill_id, last_weighbill_id=after_weighbill_id)
+
+    with connect() as conn:
+        with conn.cursor() as cur:
+            payees = load_warehouse_payees(cur)
+        while max_chunks is None or result.chunks < max_chunks:
+            conn.begin()
+            try:
+                with conn.cursor() as cur:
+                    rows = _select_chunk(cur, result.last_weighbill_id, contract_no, chunk_size)
+                    if rows:
+                        generated, matched = _insert_chunk(cur, rows, payees, with_bank_name)
+                        weighbill_ids = [r["weighbill_id"] for r in rows]
+                        refresh_contract_progress(cur, [r.get("contract_no") for r in rows], parts=(BALANCES,))
+                        sync_balance_summaries(cur, _balance_ids_for(cur, weighbill_ids))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if not rows:
+                result.done = True
+                break
+            result.chunks += 1
+            result.scanned += len(rows)
+            result.generated += generated
+            result.matched_payees += matched
+            result.last_weighbill_id = weighbill_ids[-1]
+            logger.info(
+                "balance backfill chunk=%s last_weighbill_id=%s generated=%s",
+                result.chunks, result.last_weighbill_id, result.generated,
+            )
+            if on_chunk:
+                on_chunk(result)
+            if len(rows) < chunk_size:
+                result.done = True
+                break
+    return result
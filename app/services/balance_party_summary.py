@@ -0,0 +1,171 @@
+"""
+结余按收款人 / 报单人汇总（`pd_balance_party_summary`）。
+
+原来「按收款人汇总」「按报单人汇总」列表对 `COALESCE(NULLIF(TRIM(payee_name),''), ...)` 这类计算表达式分组，
+每翻一页都要对全部未结清结余跑一次分组 COUNT 和一次分组分页查询，无法走索引。现在：
+
+- `pd_balance_details` 存规范化后的分组键 `payee_key` / `reporter_key`（与原表达式同口径，带索引）；
+- 汇总表每个 (类型, 分组键, 司机电话) 一行，只统计列表默认口径的结余：待支付/部分支付且结余 >= 0.01；
+- 生成结余、核销、重算结余、回写收款人时在同一事务内调用 `sync_balance_summaries`，
+  先取这些结余改写前的分组键，再刷新键、按新旧分组键重算汇总行（只扫这些键的结余）；
+- `rebuild_balance_summaries()` 全量刷新分组键并重建汇总表（迁移回填、每日定时核对），
+  修正报单人姓名变更等不经过结余写入路径的变化。
+
+列表在默认筛选（不按支付状态/排款日期/关键字筛选、最小结余为默认值）时读汇总表；其余筛选按分组键列现场分组。
+"""
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from core.database import get_conn
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_TABLE = "pd_balance_party_summary"
+PAYEE = "payee"
+REPORTER = "reporter"
+
+#: 汇总表统计口径：与列表默认筛选一致
+SUMMARY_MIN_BALANCE = 0.01
+OPEN_BALANCE_SQL = "b.payment_status IN (0, 1) AND b.balance_amount >= 0.01"
+
+PAYEE_KEY_SQL = (
+    "COALESCE(NULLIF(TRIM(b.payee_name), ''), "
+    "NULLIF(TRIM(b.driver_name), ''), "
+    "CONCAT('未匹配收款人#', b.id))"
+)
+REPORTER_KEY_SQL = (
+    "COALESCE(NULLIF(TRIM(d.reporter_name), ''), "
+    "NULLIF(TRIM(d.shipper), ''), "
+    "CONCAT('未关联发货人#', b.delivery_id))"
+)
+SCHEDULE_DATE_SQL = "COALESCE(b.schedule_date, w.payment_schedule_date)"
+
+# 类型 -> (结余表分组键列, 是否按司机电话再分组)
+_PARTIES = {
+    PAYEE: ("payee_key", True),
+    REPORTER: ("reporter_key", False),
+}
+
+
+def _placeholders(values: List[Any]) -> str:
+    return ",".join(["%s"] * len(values))
+
+
+def _value(row: Any, key: str, index: int) -> Any:
+    return row.get(key) if isinstance(row, dict) else row[index]
+
+
+def party_keys_for(cur, balance_ids: Iterable[int]) -> Dict[str, Set[str]]:
+    """这些结余当前存储的分组键 {类型: 键集合}（键尚未回填的行不计）。"""
+    ids = sorted({int(i) for i in balance_ids if i is not None})
+    keys: Dict[str, Set[str]] = {PAYEE: set(), REPORTER: set()}
+    if not ids:
+        return keys
+    cur.execute(
+        f"SELECT payee_key, reporter_key FROM pd_balance_details WHERE id IN ({_placeholders(ids)})",
+        tuple(ids),
+    )
+    for row in cur.fetchall() or []:
+        payee, reporter = _value(row, "payee_key", 0), _value(row, "reporter_key", 1)
+        if payee:
+            keys[PAYEE].add(payee)
+        if reporter:
+            keys[REPORTER].add(reporter)
+    return keys
+
+
+def refresh_balance_keys(cur, balance_ids: Optional[Iterable[int]] = None) -> None:
+    """按收款人/司机、报单人/发货人重算结余的分组键；balance_ids 为 None 时刷新全表。"""
+    where_sql, params = "", ()
+    if balance_ids is not None:
+        ids = sorted({int(i) for i in balance_ids if i is not None})
+        if not ids:
+            return
+        where_sql, params = f"WHERE b.id IN ({_placeholders(ids)})", tuple(ids)
+    cur.execute(
+        f"""
+        UPDATE pd_balance_details b
+        LEFT JOIN pd_deliveries d ON d.id = b.delivery_id
+        SET b.payee_key = {PAYEE_KEY_SQL}, b.reporter_key = {REPORTER_KEY_SQL}
+        {where_sql}
+        """,
+        params,
+    )
+
+
+def _rebuild_party_rows(cur, party: str, keys: Optional[List[str]]) -> None:
+    key_column, by_phone = _PARTIES[party]
+    key_filter, params = "", []
+    if keys is not None:
+        key_filter = f"AND b.{key_column} IN ({_placeholders(keys)})"
+        params = list(keys)
+        cur.execute(
+            f"DELETE FROM {SUMMARY_TABLE} WHERE party_type = %s AND party_key IN ({_placeholders(keys)})",
+            tuple([party] + params),
+        )
+    else:
+        cur.execute(f"DELETE FROM {SUMMARY_TABLE} WHERE party_type = %s", (party,))
+    phone_sql = "b.driver_phone" if by_phone else "NULL"
+    group_sql = f"b.{key_column}, b.driver_phone" if by_phone else f"b.{key_column}"
+    cur.execute(
+        f"""
+        INSERT INTO {SUMMARY_TABLE} (
+            party_type, party_key, driver_phone, payment_schedule_date, bill_count,
+            total_payable, total_paid, total_balance, related_contracts, related_vehicles,
+            first_bill_date, last_bill_date, pending_count, partial_count
+        )
+        SELECT
+            %s, b.{key_column}, {phone_sql}, MAX({SCHEDULE_DATE_SQL}), COUNT(*),
+            SUM(b.payable_amount), SUM(b.paid_amount), SUM(b.balance_amount),
+            GROUP_CONCAT(DISTINCT b.contract_no ORDER BY b.contract_no SEPARATOR ', '),
+            GROUP_CONCAT(DISTINCT b.vehicle_no ORDER BY b.vehicle_no SEPARATOR ', '),
+            MIN(b.created_at), MAX(b.created_at),
+            SUM(CASE WHEN b.payment_status = 0 THEN 1 ELSE 0 END),
+            SUM(CASE WHEN b.payment_status = 1 THEN 1 ELSE 0 END)
+        FROM pd_balance_details b
+        LEFT JOIN pd_weighbills w ON w.id = b.weighbill_id
+        WHERE {OPEN_BALANCE_SQL} AND b.{key_column} IS NOT NULL {key_filter}
+        GROUP BY {group_sql}
+        """,
+        tuple([party] + params),
+    )
+
+
+def sync_balance_summaries(cur, balance_ids: Iterable[int]) -> Dict[str, List[str]]:
+    """
+    在调用方事务内刷新这些结余的分组键，并按改写前后的分组键重算汇总行；返回重算的 {类型: 键列表}。
+    须在结余写入之后、提交之前调用；分组键可能变化（回写收款人）时改写前的键取自本次调用前的存储值。
+    """
+    ids = sorted({int(i) for i in balance_ids if i is not None})
+    if not ids:
+        return {PAYEE: [], REPORTER: []}
+    before = party_keys_for(cur, ids)
+    refresh_balance_keys(cur, ids)
+    after = party_keys_for(cur, ids)
+    touched: Dict[str, List[str]] = {}
+    for party in (PAYEE, REPORTER):
+        keys = sorted(before[party] | after[party])
+        touched[party] = keys
+        if keys:
+            _rebuild_party_rows(cur, party, keys)
+    return touched
+
+
+def rebuild_summary_rows(cur) -> None:
+    refresh_balance_keys(cur)
+    for party in (PAYEE, REPORTER):
+        _rebuild_party_rows(cur, party, None)
+
+
+def rebuild_balance_summaries(connect: Callable[[], Any] = get_conn) -> None:
+    """全量刷新分组键并重建汇总表（定时核对任务）。"""
+    with connect() as conn:
+        conn.begin()
+        try:
+            with conn.cursor() as cur:
+                rebuild_summary_rows(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    logger.info("balance party summaries rebuilt")
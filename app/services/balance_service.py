@@ -3,9 +3,11 @@
 """
 import json
 import logging
+import re
 import tempfile
-from decimal import Decimal, ROUND_HALF_UP
-from typing import Dict, List, Optional, Any
+import threading
+from decimal import Decimal
+from typing import Dict, List, Optional, Any, Sequence, Union
 
 from PIL import Image, ImageEnhance, ImageFilter
 
@@ -16,22 +18,150 @@ try:
 except ImportError:
     RAPIDOCR_AVAILABLE = False
 
+from app.core.config import settings
 from app.core.paths import UPLOADS_DIR
+from app.core.schema_migrations import get_schema_capabilities
+from app.services.balance_allocation import (
+    ALLOCATION_POLICIES,
+    OLDEST_FIRST,
+    OpenBalance,
+    allocate,
+    apply_allocation,
+)
+from app.services.balance_backfill import payable_amount
+from app.services.balance_party_summary import (
+    SUMMARY_MIN_BALANCE,
+    SUMMARY_TABLE,
+    sync_balance_summaries,
+)
+from app.services.contract_progress import BALANCES, contract_nos_for, refresh_contract_progress
 from app.services.contract_service import get_conn
+from app.services.receipt_reconciliation import (
+    DEFAULT_AMOUNT_TOLERANCE,
+    ReceiptInput,
+    load_pending_balances,
+    reconcile,
+)
+from app.services.weighbill_ocr_pipeline import ImageSource, OcrEnginePool, run_ocr_pipeline
+from app.utils.fulltext_search import keyword_filter
+from app.utils.keyset_cursor import (
+    count_total,
+    decode_cursor,
+    keyset_before_params,
+    keyset_before_sql,
+    split_page,
+    validate_count_mode,
+)
+from app.utils.ocr_fields import FieldExtractor
 
 logger = logging.getLogger(__name__)
 
 UPLOAD_DIR = UPLOADS_DIR / "payment_receipts"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+_AMOUNT = r"[¥￥]?\s*([\d,]+\.?\d{0,2})"
+
+# 回单带标签字段 → 候选模式（按优先级）
+_RECEIPT_FIELDS = FieldExtractor({
+    "receipt_no": [
+        r"网银流水号[：:]?\s*(\d{16,20})",
+        r"回单编号[：:]?\s*(\d{16,20})",
+        r"交易单号[：:]?\s*(\d{16,20})",
+        r"流水号[：:]?\s*(\d{16,20})",
+    ],
+    "payment_datetime": [
+        r"交易时间[：:]?\s*(\d{4}[-/年]\d{1,2}[-/月]\d{1,2})[日\s]*(\d{1,2}:\d{2}:\d{2})?",
+        r"(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})",
+    ],
+    "amount": [
+        rf"转账金额[（(]小写[）)]?[：:]?\s*{_AMOUNT}",
+        rf"转账金额[：:]?\s*{_AMOUNT}",
+        rf"交易金额[：:]?\s*{_AMOUNT}",
+        rf"汇款金额[：:]?\s*{_AMOUNT}",
+    ],
+    "fee": [rf"手续费[：:]?\s*{_AMOUNT}", rf"费用[：:]?\s*{_AMOUNT}"],
+    "total_amount": [
+        rf"合计[（(]小写[）)]?[：:]?\s*{_AMOUNT}",
+        rf"合计金额[：:]?\s*{_AMOUNT}",
+        rf"总计[：:]?\s*{_AMOUNT}",
+    ],
+    "payer_name": [r"账户户名[：:]?\s*([*＊][\u4e00-\u9fa5]+)"],
+    "payer_account": [
+        r"付款账户[：:]?\s*(\d{6,8}[*＊]+\d{3,4})",
+        r"付款账号[：:]?\s*(\d{6,8}[*＊]+\d{3,4})",
+    ],
+    "masked_account": [r"(\d{4,6}[*＊]{2,6}\d{3,4})"],
+    "payee_name": [r"收款方[：:]?\s*([\u4e00-\u9fa5]{2,4})"],
+    "payee_account": [r"收款账户[：:]?\s*(\d{16,19})", r"收款账号[：:]?\s*(\d{16,19})"],
+})
+
+_REMARK_PATTERNS = tuple(re.compile(p) for p in (
+    r"附言[：:]?\s*([^\n]+)",
+    r"备注[：:]?\s*([^\n]+)",
+    r"用途[：:]?\s*([^\n]+)",
+))
+_REMARK_NOISE = ("致电商", "客服热线", "不作为", "重要提示", "上列款项")
+
+_LONG_NUMBER = re.compile(r"\b(\d{16,20})\b")
+_TIMESTAMP_NUMBER = re.compile(r"^(20\d{12})$")
+_CARD_NUMBER = re.compile(r"\b(\d{16,19})\b")
+_MASKED_NAME = re.compile(r"^[*＊][\u4e00-\u9fa5a-zA-Z]+$")
+_CN_NAME = re.compile(r"^[\u4e00-\u9fa5]{2,4}$")
+_BANK_NAME = re.compile(r"^[中国工农建邮储交通招商民生中信光大浦发平安华夏兴业广发]+银行")
+
+
+def _amount_value(value: Optional[str]) -> Optional[float]:
+    """金额文本（可带千分位）转 float；形如 "," 的残片视为未识别"""
+    if value is None:
+        return None
+    try:
+        return float(value.replace(',', ''))
+    except ValueError:
+        return None
+
+
+def delivery_balance_summary_sql(id_count: int) -> str:
+    """
+    按报单汇总结余明细（报单 d.* + 条数/各支付状态条数/应付/已付/结余合计）。
+    先对本页报单 ID 做一次 GROUP BY delivery_id 条件聚合，再 LEFT JOIN 回报单，
+    替代每行 7 个相关子查询；参数为两遍报单 ID 列表（派生表一遍、外层一遍）。
+    """
+    id_ph = ",".join(["%s"] * id_count)
+    return f"""
+        SELECT d.*,
+               COALESCE(agg.total_items, 0) AS total_items,
+               COALESCE(agg.pending_items, 0) AS pending_items,
+               COALESCE(agg.partial_items, 0) AS partial_items,
+               COALESCE(agg.settled_items, 0) AS settled_items,
+               COALESCE(agg.total_payable, 0) AS total_payable,
+               COALESCE(agg.total_paid, 0) AS total_paid,
+               COALESCE(agg.total_balance, 0) AS total_balance
+        FROM pd_deliveries d
+        LEFT JOIN (
+            SELECT delivery_id,
+                   COUNT(*) AS total_items,
+                   COUNT(CASE WHEN payment_status = 0 THEN 1 END) AS pending_items,
+                   COUNT(CASE WHEN payment_status = 1 THEN 1 END) AS partial_items,
+                   COUNT(CASE WHEN payment_status = 2 THEN 1 END) AS settled_items,
+                   SUM(payable_amount) AS total_payable,
+                   SUM(paid_amount) AS total_paid,
+                   SUM(balance_amount) AS total_balance
+            FROM pd_balance_details
+            WHERE delivery_id IN ({id_ph})
+            GROUP BY delivery_id
+        ) agg ON agg.delivery_id = d.id
+        WHERE d.id IN ({id_ph})
+        ORDER BY d.created_at DESC
+    """
+
 
 class BalanceService:
     """磅单结余服务"""
 
     def __init__(self):
         self.ocr = None
-        self._balance_has_payee_bank_name = None
-        self._weighbill_has_warehouse_name = None
+        self._ocr_pool: Optional[OcrEnginePool] = None
+        self._ocr_pool_lock = threading.Lock()
         if RAPIDOCR_AVAILABLE:
             try:
                 self.ocr = RapidOCR()
@@ -39,35 +169,21 @@ class BalanceService:
             except Exception as e:
                 logger.error(f"支付回单OCR初始化失败: {e}")
 
-    def _has_balance_payee_bank_name_column(self) -> bool:
-        if self._balance_has_payee_bank_name is not None:
-            return self._balance_has_payee_bank_name
-
-        try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SHOW COLUMNS FROM pd_balance_details LIKE 'payee_bank_name'")
-                    self._balance_has_payee_bank_name = cur.fetchone() is not None
-        except Exception as e:
-            logger.warning(f"检查 pd_balance_details.payee_bank_name 字段失败: {e}")
-            self._balance_has_payee_bank_name = False
+    def _get_ocr_engine_pool(self, size: int) -> OcrEnginePool:
+        """批量对账用的引擎池：首个引擎复用 self.ocr，其余按需创建后常驻。"""
+        with self._ocr_pool_lock:
+            if self._ocr_pool is None:
+                factory = RapidOCR if (RAPIDOCR_AVAILABLE and self.ocr is not None) else (lambda: None)
+                self._ocr_pool = OcrEnginePool(factory, size, preloaded=[self.ocr] if self.ocr else None)
+            else:
+                self._ocr_pool.resize(size)
+            return self._ocr_pool
 
-        return self._balance_has_payee_bank_name
+    def _has_balance_payee_bank_name_column(self) -> bool:
+        return get_schema_capabilities().has_column("pd_balance_details", "payee_bank_name")
 
     def _has_weighbill_warehouse_name_column(self) -> bool:
-        if self._weighbill_has_warehouse_name is not None:
-            return self._weighbill_has_warehouse_name
-
-        try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SHOW COLUMNS FROM pd_weighbills LIKE 'warehouse_name'")
-                    self._weighbill_has_warehouse_name = cur.fetchone() is not None
-        except Exception as e:
-            logger.warning(f"检查 pd_weighbills.warehouse_name 字段失败: {e}")
-            self._weighbill_has_warehouse_name = False
-
-        return self._weighbill_has_warehouse_name
+        return get_schema_capabilities().has_column("pd_weighbills", "warehouse_name")
 
     @staticmethod
     def _normalize_text(value: Optional[Any]) -> Optional[str]:
@@ -155,10 +271,13 @@ class BalanceService:
                                  weighbill_id: int = None) -> Dict[str, Any]:
         """
         根据磅单数据自动生成结余明细
-        应付金额 = (净重 × 合同单价) / 1.03，默认保留两位小数
+        应付金额 = (净重 × 合同单价) / 1.048，四舍五入保留两位小数
+        大批量回填（价格修正后）走 `balance_backfill.backfill_balance_details`
         """
         try:
             with get_conn() as conn:
+                # 结余明细与合同进度台账同一事务写入
+                conn.begin()
                 with conn.cursor() as cur:
                     warehouse_select = "w.warehouse_name" if self._has_weighbill_warehouse_name_column() else "NULL"
 
@@ -207,13 +326,9 @@ class BalanceService:
                     for row in rows:
                         data = dict(zip(columns, row))
 
-                        # 计算应付金额
-                        net_weight = data.get('net_weight') or 0
+                        # 计算应付金额（与批量回填共用同一换算口径）
                         unit_price = data.get('unit_price') or 0
-                        # 应付金额按税率换算并保留两位小数
-                        payable = (
-                            Decimal(str(net_weight)) * Decimal(str(unit_price)) / Decimal('1.048')
-                        ).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+                        payable = payable_amount(data.get('net_weight'), unit_price)
 
                         # 确定收款人姓名：优先payee，否则driver_name
                         receiver_name = data.get('payee') if data.get('payee') else data.get('driver_name')
@@ -270,6 +385,11 @@ class BalanceService:
                             'payable_amount': float(payable)
                         })
 
+                    refresh_contract_progress(cur, [dict(zip(columns, row)).get('contract_no') for row in rows],
+                                              parts=(BALANCES,))
+                    sync_balance_summaries(cur, [g['balance_id'] for g in generated])
+                    conn.commit()
+
                     if not generated:
                         message = "没有符合条件的磅单可生成结余"
                         if weighbill_id:
@@ -307,6 +427,7 @@ class BalanceService:
         """根据磅单仓库和收款人姓名回写结余明细的收款账号与收款银行。"""
         try:
             with get_conn() as conn:
+                conn.begin()
                 with conn.cursor() as cur:
                     warehouse_select = "w.warehouse_name" if self._has_weighbill_warehouse_name_column() else "NULL"
                     cur.execute(
@@ -338,6 +459,8 @@ class BalanceService:
                         context.get("payee_name"),
                     )
                     self._update_balance_payee_row(cur, int(context["balance_id"]), payee_fields)
+                    sync_balance_summaries(cur, [context["balance_id"]])
+                    conn.commit()
 
                     return {
                         "success": True,
@@ -357,6 +480,7 @@ class BalanceService:
         """重新计算结余金额和状态"""
         try:
             with get_conn() as conn:
+                conn.begin()
                 with conn.cursor() as cur:
                     # 获取当前数据
                     cur.execute("""
@@ -386,6 +510,8 @@ class BalanceService:
                         SET balance_amount = %s, payment_status = %s 
                         WHERE id = %s
                     """, (balance, status, balance_id))
+                    sync_balance_summaries(cur, [balance_id])
+                    conn.commit()
 
                     return {
                         "success": True,
@@ -520,12 +646,13 @@ class BalanceService:
             logger.error(f"预处理失败: {e}")
             return image_path
 
-    def recognize_payment_receipt(self, image_path: str) -> Dict[str, Any]:
+    def recognize_payment_receipt(self, image_path: Union[str, bytes], ocr_engine: Any = None) -> Dict[str, Any]:
         """
-        OCR识别支付回单
+        OCR识别支付回单（image_path 可为文件路径或图片字节；ocr_engine 缺省用实例自带引擎）
         支持格式：农业银行等标准转账回单格式
         """
-        if not self.ocr:
+        engine = ocr_engine or self.ocr
+        if not engine:
             return {
                 "success": True,
                 "data": self._empty_receipt_result("OCR未初始化"),
@@ -533,7 +660,7 @@ class BalanceService:
             }
 
         try:
-            result, elapse = self.ocr(image_path)
+            result, elapse = engine(image_path)
             total_elapse = sum(elapse) if isinstance(elapse, list) else float(elapse or 0)
 
             if not result:
@@ -606,121 +733,58 @@ class BalanceService:
     def _parse_receipt_text(self, full_text: str, text_lines: List[Dict]) -> Dict[str, Any]:
         """
         解析回单文本，提取关键字段
-        适配标准银行转账回单格式（农行等）
+        适配标准银行转账回单格式（农行等）；带标签的字段走预编译字段表，按需抽取
         """
-        import re
-
         result = {}
         lines = [line["text"] for line in text_lines]
-
-        # 构建位置映射（用于处理跨行字段和表格结构）
-        line_map = {i: line["text"].strip() for i, line in enumerate(text_lines)}
+        found = _RECEIPT_FIELDS.search(full_text)
 
         # ========== 1. 基础信息 ==========
 
         # 网银流水号
-        receipt_patterns = [
-            r'网银流水号[：:]?\s*(\d{16,20})',
-            r'回单编号[：:]?\s*(\d{16,20})',
-            r'交易单号[：:]?\s*(\d{16,20})',
-            r'流水号[：:]?\s*(\d{16,20})',
-        ]
-        for pattern in receipt_patterns:
-            match = re.search(pattern, full_text)
-            if match:
-                result["receipt_no"] = match.group(1)
-                break
+        receipt_no = found.group("receipt_no")
+        if receipt_no:
+            result["receipt_no"] = receipt_no
 
         # 备用：找16-20位数字（排除日期时间）
         if not result.get("receipt_no"):
             for line in lines:
-                nums = re.findall(r'\b(\d{16,20})\b', line)
-                for num in nums:
-                    if not re.match(r'^(20\d{12})$', num):  # 排除时间戳
+                for num in _LONG_NUMBER.findall(line):
+                    if not _TIMESTAMP_NUMBER.match(num):  # 排除时间戳
                         result["receipt_no"] = num
                         break
                 if result.get("receipt_no"):
                     break
 
         # 交易日期和时间
-        datetime_patterns = [
-            r'交易时间[：:]?\s*(\d{4}[-/年]\d{1,2}[-/月]\d{1,2})[日\s]*(\d{1,2}:\d{2}:\d{2})?',
-            r'(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})',
-        ]
-        for pattern in datetime_patterns:
-            match = re.search(pattern, full_text)
-            if match:
-                date_str = match.group(1).replace('年', '-').replace('月', '-').replace('/', '-').rstrip('-')
-                parts = date_str.split('-')
-                if len(parts) == 3:
-                    date_str = f"{parts[0]}-{int(parts[1]):02d}-{int(parts[2]):02d}"
-                result["payment_date"] = date_str
-                if len(match.groups()) > 1 and match.group(2):
-                    result["payment_time"] = match.group(2)
-                break
+        match = found.match("payment_datetime")
+        if match:
+            date_str = match.group(1).replace('年', '-').replace('月', '-').replace('/', '-').rstrip('-')
+            parts = date_str.split('-')
+            if len(parts) == 3:
+                date_str = f"{parts[0]}-{int(parts[1]):02d}-{int(parts[2]):02d}"
+            result["payment_date"] = date_str
+            if len(match.groups()) > 1 and match.group(2):
+                result["payment_time"] = match.group(2)
 
         # ========== 2. 金额相关（区分转账金额、手续费、合计） ==========
 
         # 2.1 转账金额（小写）- 优先匹配"转账金额"关键词
-        transfer_amount = None
-        transfer_patterns = [
-            r'转账金额[（(]小写[）)]?[：:]?\s*[¥￥]?\s*([\d,]+\.?\d{0,2})',
-            r'转账金额[：:]?\s*[¥￥]?\s*([\d,]+\.?\d{0,2})',
-            r'交易金额[：:]?\s*[¥￥]?\s*([\d,]+\.?\d{0,2})',
-            r'汇款金额[：:]?\s*[¥￥]?\s*([\d,]+\.?\d{0,2})',
-        ]
-        for pattern in transfer_patterns:
-            match = re.search(pattern, full_text)
-            if match:
-                amount_str = match.group(1).replace(',', '')
-                try:
-                    transfer_amount = float(amount_str)
-                    result["amount"] = transfer_amount
-                except ValueError:
-                    pass
-                break
-
-        # 2.2 手续费
-        fee_amount = 0.0
-        fee_patterns = [
-            r'手续费[：:]?\s*[¥￥]?\s*([\d,]+\.?\d{0,2})',
-            r'费用[：:]?\s*[¥￥]?\s*([\d,]+\.?\d{0,2})',
-        ]
-        for pattern in fee_patterns:
-            match = re.search(pattern, full_text)
-            if match:
-                fee_str = match.group(1).replace(',', '')
-                try:
-                    fee_amount = float(fee_str)
-                    result["fee"] = fee_amount
-                except ValueError:
-                    pass
-                break
-
-        # 如果没识别到手续费，默认为0
-        if "fee" not in result:
-            result["fee"] = 0.0
-
-        # 2.3 合计（小写）- 新增字段
-        total_amount = None
-        total_patterns = [
-            r'合计[（(]小写[）)]?[：:]?\s*[¥￥]?\s*([\d,]+\.?\d{0,2})',
-            r'合计金额[：:]?\s*[¥￥]?\s*([\d,]+\.?\d{0,2})',
-            r'总计[：:]?\s*[¥￥]?\s*([\d,]+\.?\d{0,2})',
-        ]
-        for pattern in total_patterns:
-            match = re.search(pattern, full_text)
-            if match:
-                total_str = match.group(1).replace(',', '')
-                try:
-                    total_amount = float(total_str)
-                    result["total_amount"] = total_amount
-                except ValueError:
-                    pass
-                break
-
+        transfer_amount = _amount_value(found.group("amount"))
+        if transfer_amount is not None:
+            result["amount"] = transfer_amount
+
+        # 2.2 手续费；没识别到默认为0
+        fee_amount = _amount_value(found.group("fee"))
+        result["fee"] = fee_amount if fee_amount is not None else 0.0
+        fee_amount = result["fee"]
+
+        # 2.3 合计（小写）
+        total_amount = _amount_value(found.group("total_amount"))
+        if total_amount is not None:
+            result["total_amount"] = total_amount
         # 如果合计没识别到，但识别到了转账金额和手续费，自动计算
-        if total_amount is None and transfer_amount is not None:
+        elif transfer_amount is not None:
             result["total_amount"] = transfer_amount + fee_amount
 
         # ========== 3. 付款方信息 ==========
@@ -732,40 +796,28 @@ class BalanceService:
                 for j in range(i + 1, min(i + 3, len(lines))):
                     next_line = lines[j].strip()
                     # 脱敏名：*开源
-                    if re.match(r'^[*＊][\u4e00-\u9fa5a-zA-Z]+$', next_line):
+                    if _MASKED_NAME.match(next_line):
                         payer_name = next_line.replace('＊', '*')
                         break
                     # 纯中文名
-                    elif re.match(r'^[\u4e00-\u9fa5]{2,4}$', next_line) and next_line not in ['收款方', '付款方',
-                                                                                              '开户行']:
+                    elif _CN_NAME.match(next_line) and next_line not in ['收款方', '付款方', '开户行']:
                         payer_name = next_line
                         break
             if payer_name:
                 break
 
         if not payer_name:
-            match = re.search(r'账户户名[：:]?\s*([*＊][\u4e00-\u9fa5]+)', full_text)
-            if match:
-                payer_name = match.group(1).replace('＊', '*')
+            payer_name = found.group("payer_name")
+            if payer_name:
+                payer_name = payer_name.replace('＊', '*')
 
         if payer_name:
             result["payer_name"] = payer_name
 
         # 付款账户（脱敏卡号）
-        payer_account_patterns = [
-            r'付款账户[：:]?\s*(\d{6,8}[*＊]+\d{3,4})',
-            r'付款账号[：:]?\s*(\d{6,8}[*＊]+\d{3,4})',
-        ]
-        for pattern in payer_account_patterns:
-            match = re.search(pattern, full_text)
-            if match:
-                result["payer_account"] = match.group(1).replace('＊', '*')
-                break
-
-        if not result.get("payer_account"):
-            match = re.search(r'(\d{4,6}[*＊]{2,6}\d{3,4})', full_text)
-            if match:
-                result["payer_account"] = match.group(1).replace('＊', '*')
+        payer_account = found.group("payer_account") or found.group("masked_account")
+        if payer_account:
+            result["payer_account"] = payer_account.replace('＊', '*')
 
         # ========== 4. 收款方信息 ==========
 
@@ -775,40 +827,29 @@ class BalanceService:
             if line == '收款方' and i < len(lines) - 1:
                 for j in range(i + 1, min(i + 3, len(lines))):
                     next_line = lines[j].strip()
-                    if re.match(r'^[\u4e00-\u9fa5]{2,4}$', next_line) and next_line not in ['付款方', '收款方',
-                                                                                            '开户行', '账户户名']:
+                    if _CN_NAME.match(next_line) and next_line not in ['付款方', '收款方', '开户行', '账户户名']:
                         payee_name = next_line
                         break
-                    elif re.match(r'^[*＊][\u4e00-\u9fa5]+$', next_line):
+                    elif _MASKED_NAME.match(next_line):
                         payee_name = next_line.replace('＊', '*')
                         break
             if payee_name:
                 break
 
         if not payee_name:
-            match = re.search(r'收款方[：:]?\s*([\u4e00-\u9fa5]{2,4})', full_text)
-            if match:
-                payee_name = match.group(1)
+            payee_name = found.group("payee_name")
 
         if payee_name:
             result["payee_name"] = payee_name
 
         # 收款账户（完整卡号）
-        payee_account_patterns = [
-            r'收款账户[：:]?\s*(\d{16,19})',
-            r'收款账号[：:]?\s*(\d{16,19})',
-        ]
-        for pattern in payee_account_patterns:
-            match = re.search(pattern, full_text)
-            if match:
-                result["payee_account"] = match.group(1)
-                break
-
-        if not result.get("payee_account"):
-            all_cards = re.findall(r'\b(\d{16,19})\b', full_text)
-            valid_cards = [c for c in all_cards if 16 <= len(c) <= 19]
-            if valid_cards:
-                result["payee_account"] = valid_cards[0]
+        payee_account = found.group("payee_account")
+        if payee_account:
+            result["payee_account"] = payee_account
+        else:
+            all_cards = _CARD_NUMBER.findall(full_text)
+            if all_cards:
+                result["payee_account"] = all_cards[0]
 
         # ========== 5. 银行信息（付款行 + 收款行） ==========
 
@@ -818,7 +859,7 @@ class BalanceService:
             if '开户行' in line and i < len(lines) - 1:
                 next_line = lines[i + 1].strip()
                 # 匹配标准银行名称
-                if re.match(r'^[中国工农建邮储交通招商民生中信光大浦发平安华夏兴业广发]+银行', next_line):
+                if _BANK_NAME.match(next_line):
                     bank_list.append({"index": i, "name": next_line})
 
         # 第一个开户行 = 付款行
@@ -834,23 +875,19 @@ class BalanceService:
                 if '收款方' in line:
                     # 向后查找银行名
                     for j in range(i, min(i + 5, len(lines))):
-                        if re.match(r'^[中国工农建邮储交通招商民生中信光大浦发平安华夏兴业广发]+银行', lines[j]):
+                        if _BANK_NAME.match(lines[j]):
                             result["payee_bank_name"] = lines[j]
                             break
                     break
 
         # ========== 6. 附言/备注 ==========
 
-        remark_patterns = [
-            r'附言[：:]?\s*([^\n]+)',
-            r'备注[：:]?\s*([^\n]+)',
-            r'用途[：:]?\s*([^\n]+)',
-        ]
-        for pattern in remark_patterns:
-            match = re.search(pattern, full_text)
+        # 命中的是回单底部提示语时继续尝试下一个标签
+        for pattern in _REMARK_PATTERNS:
+            match = pattern.search(full_text)
             if match:
                 remark = match.group(1).strip()
-                if not any(x in remark for x in ['致电商', '客服热线', '不作为', '重要提示', '上列款项']):
+                if not any(x in remark for x in _REMARK_NOISE):
                     result["remark"] = remark
                     break
 
@@ -915,6 +952,44 @@ class BalanceService:
             logger.error(f"匹配待支付数据失败: {e}")
             return []
 
+    def reconcile_payment_receipts(
+            self,
+            image_files: Sequence[ImageSource],
+            date_range: int = 30,
+            amount_tolerance: float = float(DEFAULT_AMOUNT_TOLERANCE),
+            max_workers: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        批量回单对账：并行 OCR 全部回单，一次查询载入涉及收款人的待支付结余，全局求解回单与结余的匹配。
+        只返回建议（含置信度），确认后由前端逐张保存回单并调用核销接口。
+        """
+        workers = max(int(max_workers if max_workers is not None else settings.weighbill_batch_max_workers), 1)
+        ocr_results = run_ocr_pipeline(
+            image_files,
+            lambda image, engine: self.recognize_payment_receipt(image, ocr_engine=engine),
+            self._get_ocr_engine_pool(workers),
+            workers,
+        )
+        receipts = [
+            ReceiptInput.from_ocr(i, r.get("data") or {}) for i, r in enumerate(ocr_results)
+        ]
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    balances = load_pending_balances(cur, [r.payee_name for r in receipts], date_range)
+        except Exception as e:
+            logger.error(f"批量对账载入结余失败: {e}")
+            return {"success": False, "error": str(e)}
+
+        proposals = reconcile(receipts, balances, Decimal(str(amount_tolerance)), date_range)
+        data = []
+        for result, proposal in zip(ocr_results, proposals):
+            receipt = result.get("data") or self._empty_receipt_result(result.get("error") or "识别失败")
+            data.append({**proposal, "ocr_success": bool(result.get("ocr_success")), "receipt": receipt})
+        summary = {status: sum(1 for p in proposals if p["status"] == status)
+                   for status in ("confident", "review", "unmatched")}
+        return {"success": True, "total": len(data), "summary": summary, "data": data}
+
     def verify_payment(self, receipt_id: int, balance_items: List[Dict]) -> Dict[str, Any]:
         """
         核销支付（支持分批核销）
@@ -922,6 +997,7 @@ class BalanceService:
         """
         try:
             with get_conn() as conn:
+                conn.begin()
                 with conn.cursor() as cur:
                     # 获取回单信息
                     cur.execute("""
@@ -997,6 +1073,13 @@ class BalanceService:
                             'status': new_status
                         })
 
+                    refresh_contract_progress(
+                        cur,
+                        contract_nos_for(cur, "pd_balance_details", "id", [i["balance_id"] for i in settled_items]),
+                        parts=(BALANCES,),
+                    )
+                    sync_balance_summaries(cur, [i["balance_id"] for i in settled_items])
+
                     # 更新回单状态
                     new_receipt_status = self.OCR_STATUS_VERIFIED if total_settled >= receipt_amount else self.OCR_STATUS_CONFIRMED
                     cur.execute("""
@@ -1005,6 +1088,8 @@ class BalanceService:
                         WHERE id = %s
                     """, (new_receipt_status, receipt_id))
 
+                    conn.commit()
+
                     return {
                         "success": True,
                         "message": f"成功核销 {len(settled_items)} 条明细",
@@ -1420,6 +1505,98 @@ class BalanceService:
 
     # ========== 按收款人汇总统计 ==========
 
+    @staticmethod
+    def _can_use_party_summary(payment_status, min_balance, payment_schedule_date, fuzzy_keywords) -> bool:
+        """汇总表只统计默认口径（待支付/部分支付、结余 >= 0.01），其余筛选须现场分组。"""
+        return (
+            payment_status is None
+            and not payment_schedule_date
+            and not fuzzy_keywords
+            and min_balance is not None
+            and float(min_balance) == SUMMARY_MIN_BALANCE
+        )
+
+    @staticmethod
+    def _query_party_summary(cur, party_type: str, name_column: str, filters, page: int, page_size: int):
+        """读汇总表的一页，列名与现场分组查询一致；返回 (总数, 行字典列表)。"""
+        where_sql = " AND ".join(["s.party_type = %s"] + [clause for clause, _ in filters])
+        params = [party_type] + [value for _, value in filters]
+        cur.execute(f"SELECT COUNT(*) FROM {SUMMARY_TABLE} s WHERE {where_sql}", tuple(params))
+        total = cur.fetchone()[0]
+        phone_sql = "s.driver_phone," if party_type == "payee" else ""
+        cur.execute(
+            f"""
+            SELECT
+                s.party_key as {name_column},
+                {phone_sql}
+                s.payment_schedule_date,
+                s.bill_count,
+                s.total_payable,
+                s.total_paid,
+                s.total_balance,
+                s.related_contracts,
+                s.related_vehicles,
+                s.first_bill_date,
+                s.last_bill_date,
+                s.pending_count,
+                s.partial_count
+            FROM {SUMMARY_TABLE} s
+            WHERE {where_sql}
+            ORDER BY s.total_balance DESC, s.last_bill_date DESC
+            LIMIT %s OFFSET %s
+            """,
+            tuple(params + [page_size, (page - 1) * page_size]),
+        )
+        columns = [desc[0] for desc in cur.description]
+        return total, [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    @staticmethod
+    def _format_party_summary(rows, total: int, page: int, page_size: int, total_key: str,
+                              with_payable_total: bool = False) -> Dict[str, Any]:
+        data = []
+        for item in rows:
+            # 转换金额为float
+            for key in ['total_payable', 'total_paid', 'total_balance']:
+                if item.get(key) is not None:
+                    item[key] = float(item[key])
+
+            # 兼容前端字段：应打款金额
+            item['payable_amount'] = item.get('total_payable', 0.0)
+
+            # 转换时间
+            for key in ['payment_schedule_date', 'first_bill_date', 'last_bill_date']:
+                if item.get(key):
+                    item[key] = str(item[key])
+
+            # 添加状态标签
+            pending = item.get('pending_count', 0)
+            partial = item.get('partial_count', 0)
+            if pending > 0 and partial > 0:
+                item['status_summary'] = f"{pending}笔待支付,{partial}笔部分支付"
+            elif pending > 0:
+                item['status_summary'] = f"{pending}笔待支付"
+            elif partial > 0:
+                item['status_summary'] = f"{partial}笔部分支付"
+            else:
+                item['status_summary'] = "全部结清"
+
+            data.append(item)
+
+        summary = {
+            total_key: total,
+            "total_balance": sum(d.get('total_balance', 0) for d in data),
+        }
+        if with_payable_total:
+            summary["total_payable_amount"] = sum(d.get('payable_amount', 0) for d in data)
+        return {
+            "success": True,
+            "data": data,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "summary": summary,
+        }
+
     def list_balance_summary_by_payee(
             self,
             payee_name: str = None,
@@ -1440,15 +1617,24 @@ class BalanceService:
         - 涉及磅单数
         - 总应付、总已付、总结余
         - 关联的合同列表
+
+        默认筛选读汇总表 pd_balance_party_summary，其余筛选按结余表存储的收款人分组键 payee_key 现场分组。
         """
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    payee_expr = (
-                        "COALESCE(NULLIF(TRIM(b.payee_name), ''), "
-                        "NULLIF(TRIM(b.driver_name), ''), "
-                        "CONCAT('未匹配收款人#', b.id))"
-                    )
+                    if self._can_use_party_summary(payment_status, min_balance, payment_schedule_date, fuzzy_keywords):
+                        filters = []
+                        if payee_name:
+                            filters.append(("s.party_key = %s", payee_name))
+                        if driver_phone:
+                            filters.append(("s.driver_phone = %s", driver_phone))
+                        total, rows = self._query_party_summary(
+                            cur, "payee", "payee_name", filters, page, page_size
+                        )
+                        return self._format_party_summary(rows, total, page, page_size, "total_payees")
+
+                    payee_expr = "b.payee_key"
                     schedule_date_expr = "COALESCE(b.schedule_date, w.payment_schedule_date)"
 
                     # 构建WHERE条件（在分组前过滤）
@@ -1536,51 +1722,8 @@ class BalanceService:
                     """
 
                     cur.execute(query_sql, tuple(params + [page_size, offset]))
-
-                    columns = [desc[0] for desc in cur.description]
-                    data = []
-
-                    for row in cur.fetchall():
-                        item = dict(zip(columns, row))
-
-                        # 转换金额为float
-                        for key in ['total_payable', 'total_paid', 'total_balance']:
-                            if item.get(key) is not None:
-                                item[key] = float(item[key])
-
-                        # 兼容前端字段：应打款金额
-                        item['payable_amount'] = item.get('total_payable', 0.0)
-
-                        # 转换时间
-                        for key in ['payment_schedule_date', 'first_bill_date', 'last_bill_date']:
-                            if item.get(key):
-                                item[key] = str(item[key])
-
-                        # 添加状态标签
-                        pending = item.get('pending_count', 0)
-                        partial = item.get('partial_count', 0)
-                        if pending > 0 and partial > 0:
-                            item['status_summary'] = f"{pending}笔待支付,{partial}笔部分支付"
-                        elif pending > 0:
-                            item['status_summary'] = f"{pending}笔待支付"
-                        elif partial > 0:
-                            item['status_summary'] = f"{partial}笔部分支付"
-                        else:
-                            item['status_summary'] = "全部结清"
-
-                        data.append(item)
-
-                    return {
-                        "success": True,
-                        "data": data,
-                        "total": total,
-                        "page": page,
-                        "page_size": page_size,
-                        "summary": {
-                            "total_payees": total,
-                            "total_balance": sum(d.get('total_balance', 0) for d in data)
-                        }
-                    }
+                    rows = [dict(zip([desc[0] for desc in cur.description], row)) for row in cur.fetchall()]
+                    return self._format_party_summary(rows, total, page, page_size, "total_payees")
 
         except Exception as e:
             # 偶发 MySQL 通信包序异常时，重建连接后重试一次
@@ -1611,12 +1754,20 @@ class BalanceService:
                                      date_from: str = None,
                                      date_to: str = None,
                                      page: int = 1,
-                                     page_size: int = 20) -> Dict[str, Any]:
+                                     page_size: int = 20,
+                                     cursor: str = None,
+                                     cursor_mode: bool = False,
+                                     count_mode: str = "exact") -> Dict[str, Any]:
         """
         查询结余明细列表（按报单分组，包含完整关联信息）
         支持已排期和未排期的所有信息
+
+        cursor_mode=True 或传入 cursor 时按分组 (MAX(created_at), delivery_id) 键集分页，返回 next_cursor / has_more。
         """
         try:
+            validate_count_mode(count_mode)
+            use_cursor = cursor_mode or bool(cursor)
+            after_key = decode_cursor(cursor) if cursor else None
             with get_conn() as conn:
                 with conn.cursor() as cur:
                     # 构建WHERE条件
@@ -1647,62 +1798,88 @@ class BalanceService:
                     if fuzzy_keywords:
                         tokens = [t for t in fuzzy_keywords.split() if t]
                         or_clauses = []
+                        like_params = []
                         for token in tokens:
                             like = f"%{token}%"
                             or_clauses.append(
                                 "(b.contract_no LIKE %s OR b.driver_name LIKE %s OR b.driver_phone LIKE %s OR b.vehicle_no LIKE %s OR b.payee_name LIKE %s)"
                             )
-                            params.extend([like, like, like, like, like])
+                            like_params.extend([like, like, like, like, like])
                         if or_clauses:
-                            conditions.append("(" + " OR ".join(or_clauses) + ")")
+                            # 有 ngram 全文索引时先 MATCH 取候选行，再由 LIKE 精确过滤
+                            keyword_sql, keyword_params = keyword_filter(
+                                cur, "pd_balance_details", "b", tokens,
+                                "(" + " OR ".join(or_clauses) + ")", like_params,
+                            )
+                            conditions.append(keyword_sql)
+                            params.extend(keyword_params)
 
                     where_sql = " AND ".join(conditions)
 
                     # 查询报单分组总数
-                    cur.execute(f"""
+                    total = count_total(
+                        cur,
+                        f"""
                         SELECT COUNT(DISTINCT b.delivery_id) 
                         FROM pd_balance_details b
                         WHERE {where_sql}
-                    """, tuple(params))
-                    total = cur.fetchone()[0]
+                    """,
+                        params,
+                        count_mode,
+                        estimate_sql=f"SELECT b.delivery_id FROM pd_balance_details b WHERE {where_sql}",
+                    )
 
                     # 分页查询报单ID列表
-                    offset = (page - 1) * page_size
-                    cur.execute(f"""
-                        SELECT DISTINCT b.delivery_id, MAX(b.created_at) as max_created_at
-                        FROM pd_balance_details b
-                        WHERE {where_sql}
-                        GROUP BY b.delivery_id
-                        ORDER BY max_created_at DESC
-                        LIMIT %s OFFSET %s
-                    """, tuple(params + [page_size, offset]))
-                    delivery_rows = cur.fetchall()
+                    next_cursor = None
+                    if use_cursor:
+                        having_sql = ""
+                        page_params = list(params)
+                        if after_key is not None:
+                            having_sql = "HAVING " + keyset_before_sql("max_created_at", "b.delivery_id")
+                            page_params.extend(keyset_before_params(after_key))
+                        cur.execute(f"""
+                            SELECT b.delivery_id, MAX(b.created_at) as max_created_at
+                            FROM pd_balance_details b
+                            WHERE {where_sql}
+                            GROUP BY b.delivery_id
+                            {having_sql}
+                            ORDER BY max_created_at DESC, b.delivery_id DESC
+                            LIMIT %s
+                        """, tuple(page_params + [page_size + 1]))
+                        delivery_rows, next_cursor = split_page(
+                            cur.fetchall(), page_size, lambda r: (r[1], r[0])
+                        )
+                    else:
+                        offset = (page - 1) * page_size
+                        cur.execute(f"""
+                            SELECT DISTINCT b.delivery_id, MAX(b.created_at) as max_created_at
+                            FROM pd_balance_details b
+                            WHERE {where_sql}
+                            GROUP BY b.delivery_id
+                            ORDER BY max_created_at DESC
+                            LIMIT %s OFFSET %s
+                        """, tuple(params + [page_size, offset]))
+                        delivery_rows = cur.fetchall()
                     delivery_ids = [row[0] for row in delivery_rows] if delivery_rows else []
 
                     if not delivery_ids:
-                        return {
+                        empty = {
                             "success": True,
                             "data": [],
-                            "total": 0,
-                            "page": page,
+                            "total": 0 if total is not None else None,
+                            "page": None if use_cursor else page,
                             "page_size": page_size
                         }
+                        if use_cursor:
+                            empty.update({"next_cursor": None, "has_more": False})
+                        return empty
 
-                    # 查询报单详细信息
+                    # 查询报单详细信息（本页报单的结余汇总：一次 GROUP BY delivery_id 条件聚合后关联）
                     format_ids = ','.join(['%s'] * len(delivery_ids))
-                    cur.execute(f"""
-                        SELECT d.*,
-                               (SELECT COUNT(*) FROM pd_balance_details WHERE delivery_id = d.id) as total_items,
-                               (SELECT COUNT(*) FROM pd_balance_details WHERE delivery_id = d.id AND payment_status = 0) as pending_items,
-                               (SELECT COUNT(*) FROM pd_balance_details WHERE delivery_id = d.id AND payment_status = 1) as partial_items,
-                               (SELECT COUNT(*) FROM pd_balance_details WHERE delivery_id = d.id AND payment_status = 2) as settled_items,
-                               (SELECT COALESCE(SUM(payable_amount), 0) FROM pd_balance_details WHERE delivery_id = d.id) as total_payable,
-                               (SELECT COALESCE(SUM(paid_amount), 0) FROM pd_balance_details WHERE delivery_id = d.id) as total_paid,
-                               (SELECT COALESCE(SUM(balance_amount), 0) FROM pd_balance_details WHERE delivery_id = d.id) as total_balance
-                        FROM pd_deliveries d
-                        WHERE d.id IN ({format_ids})
-                        ORDER BY d.created_at DESC
-                    """, tuple(delivery_ids))
+                    cur.execute(
+                        delivery_balance_summary_sql(len(delivery_ids)),
+                        tuple(delivery_ids) + tuple(delivery_ids),
+                    )
 
                     delivery_columns = [desc[0] for desc in cur.description]
                     delivery_rows = cur.fetchall()
@@ -2053,13 +2230,17 @@ class BalanceService:
                             'balance_items': balance_items
                         })
 
-                    return {
+                    result = {
                         "success": True,
                         "data": result_data,
                         "total": total,
-                        "page": page,
+                        "page": None if use_cursor else page,
                         "page_size": page_size
                     }
+                    if use_cursor:
+                        result["next_cursor"] = next_cursor
+                        result["has_more"] = next_cursor is not None
+                    return result
 
         except Exception as e:
             logger.error(f"查询分组结余列表失败: {e}")
@@ -2080,15 +2261,22 @@ class BalanceService:
     ) -> Dict[str, Any]:
         """
         按报单人/发货人汇总统计结余
+
+        默认筛选读汇总表 pd_balance_party_summary，其余筛选按结余表存储的报单人分组键 reporter_key 现场分组。
         """
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    reporter_expr = (
-                        "COALESCE(NULLIF(TRIM(d.reporter_name), ''), "
-                        "NULLIF(TRIM(d.shipper), ''), "
-                        "CONCAT('未关联发货人#', b.delivery_id))"
-                    )
+                    if self._can_use_party_summary(payment_status, min_balance, payment_schedule_date, fuzzy_keywords):
+                        filters = [("s.party_key = %s", reporter_name)] if reporter_name else []
+                        total, rows = self._query_party_summary(
+                            cur, "reporter", "reporter_name", filters, page, page_size
+                        )
+                        return self._format_party_summary(
+                            rows, total, page, page_size, "total_reporters", with_payable_total=True
+                        )
+
+                    reporter_expr = "b.reporter_key"
                     schedule_date_expr = "COALESCE(b.schedule_date, w.payment_schedule_date)"
                     where_clauses = ["1=1"]
                     params = []
@@ -2130,7 +2318,6 @@ class BalanceService:
                         SELECT COUNT(*) FROM (
                             SELECT {reporter_expr} as reporter_name
                             FROM pd_balance_details b
-                            LEFT JOIN pd_deliveries d ON d.id = b.delivery_id
                             LEFT JOIN pd_weighbills w ON w.id = b.weighbill_id
                             WHERE {where_sql}
                             GROUP BY {reporter_expr}
@@ -2155,7 +2342,6 @@ class BalanceService:
                             SUM(CASE WHEN b.payment_status = 0 THEN 1 ELSE 0 END) as pending_count,
                             SUM(CASE WHEN b.payment_status = 1 THEN 1 ELSE 0 END) as partial_count
                         FROM pd_balance_details b
-                        LEFT JOIN pd_deliveries d ON d.id = b.delivery_id
                         LEFT JOIN pd_weighbills w ON w.id = b.weighbill_id
                         WHERE {where_sql}
                         GROUP BY {reporter_expr}
@@ -2163,48 +2349,10 @@ class BalanceService:
                         LIMIT %s OFFSET %s
                     """
                     cur.execute(query_sql, tuple(params + [page_size, offset]))
-
-                    columns = [desc[0] for desc in cur.description]
-                    data = []
-                    for row in cur.fetchall():
-                        item = dict(zip(columns, row))
-
-                        for key in ['total_payable', 'total_paid', 'total_balance']:
-                            if item.get(key) is not None:
-                                item[key] = float(item[key])
-
-                        # 应打款金额（按报单人汇总）
-                        item['payable_amount'] = item.get('total_payable', 0.0)
-
-                        for key in ['payment_schedule_date', 'first_bill_date', 'last_bill_date']:
-                            if item.get(key):
-                                item[key] = str(item[key])
-
-                        pending = item.get('pending_count', 0)
-                        partial = item.get('partial_count', 0)
-                        if pending > 0 and partial > 0:
-                            item['status_summary'] = f"{pending}笔待支付,{partial}笔部分支付"
-                        elif pending > 0:
-                            item['status_summary'] = f"{pending}笔待支付"
-                        elif partial > 0:
-                            item['status_summary'] = f"{partial}笔部分支付"
-                        else:
-                            item['status_summary'] = "全部结清"
-
-                        data.append(item)
-
-                    return {
-                        "success": True,
-                        "data": data,
-                        "total": total,
-                        "page": page,
-                        "page_size": page_size,
-                        "summary": {
-                            "total_reporters": total,
-                            "total_balance": sum(d.get('total_balance', 0) for d in data),
-                            "total_payable_amount": sum(d.get('payable_amount', 0) for d in data)
-                        }
-                    }
+                    rows = [dict(zip([desc[0] for desc in cur.description], row)) for row in cur.fetchall()]
+                    return self._format_party_summary(
+                        rows, total, page, page_size, "total_reporters", with_payable_total=True
+                    )
 
         except Exception as e:
             if "Packet sequence number wrong" in str(e) and _retry_count < 1:
@@ -2345,11 +2493,8 @@ class BalanceService:
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    reporter_expr = (
-                        "COALESCE(NULLIF(TRIM(d.reporter_name), ''), "
-                        "NULLIF(TRIM(d.shipper), ''), "
-                        "CONCAT('未关联发货人#', b.delivery_id))"
-                    )
+                    # 与按报单人汇总列表同一分组键（带索引）
+                    reporter_expr = "b.reporter_key"
                     where_sql = f"{reporter_expr} = %s"
                     params = [reporter_name]
 
@@ -2448,21 +2593,27 @@ class BalanceService:
             payee_name: str,
             receipt_id: int,
             driver_phone: str = None,
-            max_amount: float = None
+            max_amount: float = None,
+            policy: str = OLDEST_FIRST
     ) -> Dict[str, Any]:
         """
         按收款人批量核销
 
-        将一个支付回单的金额，自动分配到该收款人的多笔结余明细上
+        将一个支付回单的金额（不超过 max_amount），按分配策略一次算好分到该收款人的多笔结余明细上，
+        再整批写回结余明细与核销关联。默认按创建时间从早到晚扣减（原行为），exact_first / min_partials 需显式指定
         """
+        if policy not in ALLOCATION_POLICIES:
+            return {"success": False, "error": f"不支持的分配策略: {policy}"}
         try:
             with get_conn() as conn:
+                conn.begin()
                 with conn.cursor() as cur:
                     # 获取支付回单信息
                     cur.execute("""
                         SELECT amount, ocr_status 
                         FROM pd_payment_receipts 
                         WHERE id = %s
+                        FOR UPDATE
                     """, (receipt_id,))
 
                     row = cur.fetchone()
@@ -2474,7 +2625,11 @@ class BalanceService:
                     if ocr_status == self.OCR_STATUS_VERIFIED:
                         return {"success": False, "error": "该回单已核销"}
 
-                    # 查询该收款人所有待支付的结余明细
+                    amount = receipt_amount
+                    if max_amount is not None:
+                        amount = min(amount, Decimal(str(max_amount)))
+
+                    # 查询该收款人所有待支付的结余明细（加锁，分配期间金额不被并发核销改动）
                     where_sql = "driver_name = %s AND payment_status IN (0, 1)"
                     params = [payee_name]
 
@@ -2486,60 +2641,30 @@ class BalanceService:
                         SELECT id, payable_amount, paid_amount, balance_amount
                         FROM pd_balance_details
                         WHERE {where_sql}
-                        ORDER BY created_at ASC
+                        ORDER BY created_at ASC, id ASC
+                        FOR UPDATE
                     """, tuple(params))
 
                     balance_items = cur.fetchall()
                     if not balance_items:
                         return {"success": False, "error": "该收款人没有待支付的结余明细"}
 
-                    # 自动分配核销金额
-                    remaining_amount = receipt_amount
-                    settled_items = []
-
-                    for balance_id, payable, paid, balance in balance_items:
-                        if remaining_amount <= 0:
-                            break
-
-                        payable_d = Decimal(str(payable))
-                        paid_d = Decimal(str(paid))
-                        balance_d = Decimal(str(balance))
-
-                        # 本次可核销金额
-                        settle_amount = min(balance_d, remaining_amount)
-                        new_paid = paid_d + settle_amount
-                        new_balance = payable_d - new_paid
-
-                        # 确定新状态
-                        if new_paid >= payable_d:
-                            new_status = self.PAY_STATUS_SETTLED
-                        else:
-                            new_status = self.PAY_STATUS_PARTIAL
-
-                        # 更新结余明细
-                        cur.execute("""
-                            UPDATE pd_balance_details 
-                            SET paid_amount = %s, balance_amount = %s, payment_status = %s 
-                            WHERE id = %s
-                        """, (float(new_paid), float(new_balance), new_status, balance_id))
-
-                        # 插入关联表
-                        cur.execute("""
-                            INSERT INTO pd_receipt_settlements 
-                            (receipt_id, balance_id, settled_amount)
-                            VALUES (%s, %s, %s)
-                            ON DUPLICATE KEY UPDATE settled_amount = %s
-                        """, (receipt_id, balance_id, float(settle_amount), float(settle_amount)))
+                    candidates = [
+                        OpenBalance(balance_id, Decimal(str(payable)), Decimal(str(paid)), Decimal(str(balance)))
+                        for balance_id, payable, paid, balance in balance_items
+                    ]
+                    allocation = allocate(candidates, amount, policy)
+                    settled_items = apply_allocation(cur, receipt_id, candidates, allocation)
 
-                        settled_items.append({
-                            'balance_id': balance_id,
-                            'settled_amount': float(settle_amount),
-                            'status': new_status
-                        })
-
-                        remaining_amount -= settle_amount
+                    refresh_contract_progress(
+                        cur,
+                        contract_nos_for(cur, "pd_balance_details", "id", [i["balance_id"] for i in settled_items]),
+                        parts=(BALANCES,),
+                    )
+                    sync_balance_summaries(cur, [i["balance_id"] for i in settled_items])
 
                     # 更新回单状态
+                    remaining_amount = receipt_amount - allocation.allocated
                     new_receipt_status = self.OCR_STATUS_VERIFIED if remaining_amount <= 0 else self.OCR_STATUS_CONFIRMED
                     cur.execute("""
                         UPDATE pd_payment_receipts 
@@ -2547,13 +2672,16 @@ class BalanceService:
                         WHERE id = %s
                     """, (new_receipt_status, receipt_id))
 
+                    conn.commit()
+
                     return {
                         "success": True,
                         "message": f"成功核销 {len(settled_items)} 条明细",
                         "data": {
                             'receipt_id': receipt_id,
                             'payee_name': payee_name,
-                            'total_settled': float(receipt_amount - remaining_amount),
+                            'policy': allocation.policy,
+                            'total_settled': float(allocation.allocated),
                             'remaining_unused': float(remaining_amount) if remaining_amount > 0 else 0,
                             'receipt_status': new_receipt_status,
                             'items': settled_items
@@ -0,0 +1,142 @@
+"""
+合同车数台账：每个合同已审核通过报单的车数合计（`pd_contract_capacity.used_trucks`）。
+
+原来报单匹配合同时，对每个候选合同单独 `SUM(planned_trucks)` 扫一遍 `pd_deliveries`；审核通过时也不复核合同余量，
+两张同时待审的报单都按「余量充足」匹配到同一合同后，先后审核通过即可超出合同车数。现在：
+
+- 报单新建、审核状态、车数、合同变更及删除时，在同一事务内按差额更新台账（`apply_delivery_change`）；
+- 变为「审核通过」（或审核通过报单增加车数/换合同）时，先 `SELECT ... FOR UPDATE` 锁住台账行，
+  已用 + 本单超出合同车数（CEIL(总吨数/35)）则拒绝，并发审核在行锁上串行；
+- 匹配合同时候选合同与台账一次联表读出，不再逐个求和；
+- `rebuild_contract_capacity()` 按报单表重算台账（迁移时回填、每日定时核对），修正直接改库等绕过服务层的写入。
+
+合同总车数与品种单价仍取自 `pd_contracts` / `pd_contract_products`（联表读取），台账只保存由报单派生的已用车数。
+"""
+import logging
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from core.database import get_conn
+
+logger = logging.getLogger(__name__)
+
+CAPACITY_TABLE = "pd_contract_capacity"
+APPROVED = "审核通过"
+
+
+def _get(row: Any, key: str) -> Any:
+    return row.get(key) if row else None
+
+
+def approved_contribution(row: Optional[Dict[str, Any]]) -> Optional[Tuple[str, int]]:
+    """报单对台账的贡献：审核通过且有合同编号时为 (合同编号, 车数)。"""
+    if not row or _get(row, "status") != APPROVED or not _get(row, "contract_no"):
+        return None
+    return str(row["contract_no"]), int(_get(row, "planned_trucks") or 0)
+
+
+def capacity_deltas(
+    old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]
+) -> Dict[str, int]:
+    """报单由 old 变为 new（None 表示不存在）时各合同已用车数的变化，省略为 0 的项。"""
+    deltas: Dict[str, int] = {}
+    before, after = approved_contribution(old), approved_contribution(new)
+    if before:
+        deltas[before[0]] = deltas.get(before[0], 0) - before[1]
+    if after:
+        deltas[after[0]] = deltas.get(after[0], 0) + after[1]
+    return {no: d for no, d in deltas.items() if d}
+
+
+def lock_capacity(cur, contract_nos: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """锁定台账行（不存在时以 0 补建），返回 {合同编号: {used_trucks, total_trucks}}；按编号排序加锁避免死锁。"""
+    nos = sorted(set(contract_nos))
+    if not nos:
+        return {}
+    cur.executemany(
+        f"INSERT IGNORE INTO {CAPACITY_TABLE} (contract_no, used_trucks) VALUES (%s, 0)",
+        [(no,) for no in nos],
+    )
+    placeholders = ",".join(["%s"] * len(nos))
+    cur.execute(
+        f"""
+        SELECT cap.contract_no, cap.used_trucks, CEIL(c.total_quantity / 35) AS total_trucks
+        FROM {CAPACITY_TABLE} cap
+        LEFT JOIN pd_contracts c ON c.contract_no = cap.contract_no
+        WHERE cap.contract_no IN ({placeholders})
+        ORDER BY cap.contract_no
+        FOR UPDATE
+        """,
+        tuple(nos),
+    )
+    return {
+        row["contract_no"]: {
+            "used_trucks": int(row.get("used_trucks") or 0),
+            "total_trucks": int(row["total_trucks"]) if row.get("total_trucks") is not None else None,
+        }
+        for row in (cur.fetchall() or [])
+    }
+
+
+def apply_delivery_change(
+    cur,
+    old: Optional[Dict[str, Any]],
+    new: Optional[Dict[str, Any]],
+    enforce: bool = True,
+) -> Optional[str]:
+    """
+    在调用方事务内按报单变化更新台账；enforce=True 时已用车数增加的合同不得超过合同车数，
+    超出时不做任何更新并返回错误信息（调用方负责回滚）。
+    """
+    deltas = capacity_deltas(old, new)
+    if not deltas:
+        return None
+    ledger = lock_capacity(cur, deltas)
+    if enforce:
+        for no, delta in deltas.items():
+            entry = ledger.get(no) or {}
+            total, used = entry.get("total_trucks"), entry.get("used_trucks", 0)
+            if delta > 0 and total is not None and used + delta > total:
+                return f"合同 {no} 车数不足：合同共{total}车，已审核通过{used}车，本单{delta}车"
+    cur.executemany(
+        f"UPDATE {CAPACITY_TABLE} SET used_trucks = used_trucks + %s WHERE contract_no = %s",
+        [(delta, no) for no, delta in sorted(deltas.items())],
+    )
+    return None
+
+
+def rebuild_contract_capacity(connect: Callable[[], Any] = get_conn) -> int:
+    """按报单表重算台账，返回台账变动行数（MySQL 计数口径，0 表示台账与报单一致）。"""
+    with connect() as conn:
+        with conn.cursor() as cur:
+            corrected = rebuild_capacity_rows(cur)
+        conn.commit()
+    logger.info("contract capacity rebuilt corrected=%s", corrected)
+    return corrected
+
+
+def rebuild_capacity_rows(cur) -> int:
+    cur.execute(
+        f"""
+        INSERT INTO {CAPACITY_TABLE} (contract_no, used_trucks)
+        SELECT contract_no, COALESCE(SUM(planned_trucks), 0)
+        FROM pd_deliveries
+        WHERE status = %s AND contract_no IS NOT NULL AND contract_no <> ''
+        GROUP BY contract_no
+        ON DUPLICATE KEY UPDATE used_trucks = VALUES(used_trucks)
+        """,
+        (APPROVED,),
+    )
+    corrected = cur.rowcount or 0
+    cur.execute(
+        f"""
+        UPDATE {CAPACITY_TABLE} cap
+        LEFT JOIN (
+            SELECT DISTINCT contract_no FROM pd_deliveries WHERE status = %s
+        ) d ON d.contract_no = cap.contract_no
+        SET cap.used_trucks = 0
+        WHERE d.contract_no IS NULL AND cap.used_trucks <> 0
+        """,
+        (APPROVED,),
+    )
+    return corrected + (cur.rowcount or 0)
+
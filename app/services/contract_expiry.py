@@ -0,0 +1,180 @@
+"""
+合同失效扫描：按截止日期范围增量、分批把到期的「生效中」合同置为「已失效」，并通知订阅者本次新失效的合同号。
+
+原实现每次对全表执行一条 `UPDATE ... WHERE TIMESTAMP(end_date, '23:59:59') <= NOW()`：条件包在函数里用不上索引，
+一条语句锁住全部命中行。现在：
+
+- 「截止日 23:59:59 已过」等价于 `end_date <= 截止基准日`（基准日 = 当前时间减 23:59:59 的日期），无截止日期的合同
+  等价于 `contract_date <= 基准日 - grace_days`，都是 `(status, 日期)` 索引上的范围条件；
+- 水位线记在 `pd_sweep_watermarks`：增量扫描只看 `(水位线 - 回看天数, 基准日]`，回看覆盖补录或改了日期的合同；
+  没有水位线或 `full=True` 时不设下界（启动时做一次全量核对）；
+- 每批 `SELECT ... FOR UPDATE` 取至多 chunk_size 行再按主键更新并提交，行锁只在单批事务内持有；
+- 扫描结束后把新失效的合同号交给 `add_expiry_listener()` 注册的回调（进程内缓存据此只失效变化的部分）。
+
+创建/编辑合同时已按日期直接写入「已失效」（`ContractService._resolve_contract_status`），扫描只需处理随时间到期的合同。
+"""
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, List, Optional, Tuple
+
+from app.core.config import settings
+from core.database import get_conn
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = "contract_expiry"
+
+_listeners: List[Callable[[List[str]], None]] = []
+_listeners_lock = threading.Lock()
+
+
+def add_expiry_listener(listener: Callable[[List[str]], None]) -> None:
+    """注册新失效合同号的回调（同一进程内；回调异常只记日志）。"""
+    with _listeners_lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+
+def remove_expiry_listener(listener: Callable[[List[str]], None]) -> None:
+    with _listeners_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def publish_expired_contracts(contract_nos: List[str]) -> None:
+    if not contract_nos:
+        return
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(list(contract_nos))
+        except Exception:
+            logger.exception("contract expiry listener failed listener=%r", listener)
+
+
+def expiry_cutoff(now: Optional[datetime] = None) -> date:
+    """截止日当天 23:59:59 已过（<= now）的最大截止日。"""
+    now = now or datetime.now()
+    return (now - timedelta(hours=23, minutes=59, seconds=59)).date()
+
+
+@dataclass
+class ExpirySweepResult:
+    cutoff: date
+    lower_bound: Optional[date]
+    expired_contract_nos: List[str] = field(default_factory=list)
+    chunks: int = 0
+
+    @property
+    def expired(self) -> int:
+        return len(self.expired_contract_nos)
+
+
+def _value(row: Any, key: str, index: int = 0) -> Any:
+    return row[key] if isinstance(row, dict) else row[index]
+
+
+def _read_watermark(cur) -> Optional[date]:
+    cur.execute("SELECT watermark FROM pd_sweep_watermarks WHERE name = %s", (WATERMARK_NAME,))
+    row = cur.fetchone()
+    return _value(row, "watermark") if row else None
+
+
+def _write_watermark(cur, watermark: date) -> None:
+    cur.execute(
+        """
+        INSERT INTO pd_sweep_watermarks (name, watermark) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE watermark = GREATEST(watermark, VALUES(watermark))
+        """,
+        (WATERMARK_NAME, watermark),
+    )
+
+
+def _branches(cutoff: date, lower: Optional[date], grace_days: int) -> List[Tuple[str, tuple]]:
+    """两类到期条件：有截止日期按 end_date；无截止日期按 contract_date + grace_days。"""
+    by_end = "end_date <= %s"
+    end_params: tuple = (cutoff,)
+    by_sign = "end_date IS NULL AND contract_date <= %s"
+    sign_params: tuple = (cutoff - timedelta(days=grace_days),)
+    if lower is not None:
+        by_end += " AND end_date > %s"
+        end_params += (lower,)
+        by_sign += " AND contract_date > %s"
+        sign_params += (lower - timedelta(days=grace_days),)
+    return [(by_end, end_params), (by_sign, sign_params)]
+
+
+def _expire_chunk(conn, condition: str, params: tuple, after_id: int, chunk_size: int) -> Tuple[List[Any], List[str]]:
+    """单批事务：锁定至多 chunk_size 行并置为已失效，返回 (主键, 合同号)。"""
+    conn.begin()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT id, contract_no FROM pd_contracts
+                WHERE status = '生效中' AND {condition} AND id > %s
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE
+                """,
+                params + (after_id, chunk_size),
+            )
+            rows = cur.fetchall() or []
+            ids = [_value(r, "id", 0) for r in rows]
+            if ids:
+                placeholders = ",".join(["%s"] * len(ids))
+                cur.execute(
+                    f"UPDATE pd_contracts SET status = '已失效' WHERE id IN ({placeholders}) AND status = '生效中'",
+                    tuple(ids),
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return ids, [_value(r, "contract_no", 1) for r in rows]
+
+
+def sweep_expired_contracts(
+    grace_days: int = 4,
+    full: bool = False,
+    chunk_size: Optional[int] = None,
+    lookback_days: Optional[int] = None,
+    now: Optional[datetime] = None,
+    connect: Callable[[], Any] = get_conn,
+) -> ExpirySweepResult:
+    """执行一次失效扫描并推进水位线；返回本次新失效的合同号。"""
+    chunk_size = max(1, chunk_size or settings.contract_expiry_chunk_size)
+    lookback_days = settings.contract_expiry_lookback_days if lookback_days is None else lookback_days
+    cutoff = expiry_cutoff(now)
+
+    with connect() as conn:
+        with conn.cursor() as cur:
+            watermark = None if full else _read_watermark(cur)
+        lower = watermark - timedelta(days=lookback_days) if watermark is not None else None
+        result = ExpirySweepResult(cutoff=cutoff, lower_bound=lower)
+
+        for condition, params in _branches(cutoff, lower, grace_days):
+            after_id = 0
+            while True:
+                ids, contract_nos = _expire_chunk(conn, condition, params, after_id, chunk_size)
+                if not ids:
+                    break
+                result.chunks += 1
+                result.expired_contract_nos.extend(contract_nos)
+                after_id = ids[-1]
+                if len(ids) < chunk_size:
+                    break
+
+        with conn.cursor() as cur:
+            _write_watermark(cur, cutoff)
+        conn.commit()
+
+    logger.info(
+        "contract expiry sweep cutoff=%s lower=%s expired=%s chunks=%s",
+        cutoff, lower, result.expired, result.chunks,
+    )
+    publish_expired_contracts(result.expired_contract_nos)
+    return result
@@ -0,0 +1,216 @@
+"""
+合同发运/回款进度台账（`pd_contract_progress`）：每个合同一行，保存由磅单、报单、收款明细、结余明细派生的合计。
+
+原来合同发运进度列表对每个合同跑三条 `pd_weighbills` 相关子查询，合同回款汇总每次对收款明细全表分组，
+`/allocation/status` 逐个合同 COUNT 报单。现在三个接口都联表读取台账，台账由写入路径维护：
+
+- 磅单、报单、收款明细/回款记录、结余明细写入后，在同一连接（事务）内调用 `refresh_contract_progress`，
+  按受影响的合同编号重算对应分组（走各表 `contract_no` 索引，只扫该合同的行），而不是按差额加减，
+  写入路径里金额/状态改法各不相同，重算避免了逐处推导差额；
+- 台账行先按合同编号排序 `FOR UPDATE` 锁住，同一合同的并发写入在行锁上串行；
+- `rebuild_contract_progress()` 不带合同编号按源表全量重算（迁移时回填、每日定时核对），修正直接改库等绕过服务层的写入。
+
+各列口径沿用原接口：已发车/吨数/最后发运日取 OCR 状态为「已上传磅单」「已确认」的磅单；报单数为该合同全部报单；
+回款合计取收款明细，最后回款日取回款记录；结余应付/已付取结余明细。
+"""
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from core.database import get_conn
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_TABLE = "pd_contract_progress"
+SHIPPED_OCR_STATUSES = ("已上传磅单", "已确认")
+
+SHIPPING = "shipping"
+DELIVERIES = "deliveries"
+PAYMENTS = "payments"
+BALANCES = "balances"
+ALL_PARTS = (SHIPPING, DELIVERIES, PAYMENTS, BALANCES)
+
+_SHIPPED_IN = ",".join(["%s"] * len(SHIPPED_OCR_STATUSES))
+
+# 分组 -> [(派生表 SQL（{filter} 处插入合同编号条件）, 派生表固定参数, 合同编号列, SET 子句)]
+_PARTS: Dict[str, List[Tuple[str, Tuple[Any, ...], str, str]]] = {
+    SHIPPING: [(
+        f"""
+        SELECT contract_no, COUNT(*) AS trucks, COALESCE(SUM(net_weight), 0) AS weight,
+               MAX(weigh_date) AS last_date
+        FROM pd_weighbills
+        WHERE ocr_status IN ({_SHIPPED_IN}) {{filter}}
+        GROUP BY contract_no
+        """,
+        SHIPPED_OCR_STATUSES,
+        "contract_no",
+        """
+        p.shipped_trucks = COALESCE(s.trucks, 0),
+        p.shipped_weight = COALESCE(s.weight, 0),
+        p.last_ship_date = s.last_date
+        """,
+    )],
+    DELIVERIES: [(
+        """
+        SELECT contract_no, COUNT(*) AS cnt
+        FROM pd_deliveries
+        WHERE 1=1 {filter}
+        GROUP BY contract_no
+        """,
+        (),
+        "contract_no",
+        "p.delivery_count = COALESCE(s.cnt, 0)",
+    )],
+    PAYMENTS: [(
+        """
+        SELECT contract_no,
+               MAX(smelter_name) AS smelter_name,
+               SUM(total_amount) AS receivable,
+               SUM(paid_amount) AS received,
+               SUM(unpaid_amount) AS unreceived,
+               COUNT(*) AS cnt,
+               SUM(CASE WHEN status = 0 THEN 1 ELSE 0 END) AS unpaid_cnt,
+               SUM(CASE WHEN status = 1 THEN 1 ELSE 0 END) AS partial_cnt,
+               SUM(CASE WHEN status = 2 THEN 1 ELSE 0 END) AS paid_cnt,
+               SUM(CASE WHEN status = 3 THEN 1 ELSE 0 END) AS overpaid_cnt
+        FROM pd_payment_details
+        WHERE 1=1 {filter}
+        GROUP BY contract_no
+        """,
+        (),
+        "contract_no",
+        """
+        p.smelter_name = COALESCE(s.smelter_name, p.smelter_name),
+        p.receivable_amount = COALESCE(s.receivable, 0),
+        p.received_amount = COALESCE(s.received, 0),
+        p.unreceived_amount = COALESCE(s.unreceived, 0),
+        p.payment_detail_count = COALESCE(s.cnt, 0),
+        p.unpaid_count = COALESCE(s.unpaid_cnt, 0),
+        p.partial_count = COALESCE(s.partial_cnt, 0),
+        p.paid_count = COALESCE(s.paid_cnt, 0),
+        p.overpaid_count = COALESCE(s.overpaid_cnt, 0)
+        """,
+    ), (
+        # 回款记录单独分组：与明细联表后再求和会按记录条数重复累计金额
+        """
+        SELECT pd.contract_no, MAX(pr.payment_date) AS last_date
+        FROM pd_payment_records pr
+        JOIN pd_payment_details pd ON pd.id = pr.payment_detail_id
+        WHERE 1=1 {filter}
+        GROUP BY pd.contract_no
+        """,
+        (),
+        "pd.contract_no",
+        "p.last_payment_date = s.last_date",
+    )],
+    BALANCES: [(
+        """
+        SELECT contract_no, COALESCE(SUM(payable_amount), 0) AS payable,
+               COALESCE(SUM(paid_amount), 0) AS paid
+        FROM pd_balance_details
+        WHERE 1=1 {filter}
+        GROUP BY contract_no
+        """,
+        (),
+        "contract_no",
+        """
+        p.balance_payable_amount = COALESCE(s.payable, 0),
+        p.balance_paid_amount = COALESCE(s.paid, 0)
+        """,
+    )],
+}
+
+_SOURCE_TABLES = ("pd_contracts", "pd_weighbills", "pd_deliveries", "pd_payment_details", "pd_balance_details")
+
+
+def _normalize(contract_nos: Iterable[Optional[str]]) -> List[str]:
+    return sorted({str(no).strip() for no in contract_nos if no and str(no).strip()})
+
+
+def _refresh_part(cur, part: str, nos: Optional[Sequence[str]]) -> int:
+    return sum(_refresh_derived(cur, *spec, nos) for spec in _PARTS[part])
+
+
+def _refresh_derived(
+    cur, derived: str, fixed_params: Tuple[Any, ...], column: str, assignments: str, nos: Optional[Sequence[str]]
+) -> int:
+    params: List[Any] = list(fixed_params)
+    if nos is None:
+        derived_sql = derived.format(filter="")
+        where_sql = ""
+    else:
+        placeholders = ",".join(["%s"] * len(nos))
+        derived_sql = derived.format(filter=f"AND {column} IN ({placeholders})")
+        params.extend(nos)
+        where_sql = f"WHERE p.contract_no IN ({placeholders})"
+        params.extend(nos)
+    cur.execute(
+        f"""
+        UPDATE {PROGRESS_TABLE} p
+        LEFT JOIN ({derived_sql}) s ON s.contract_no = p.contract_no
+        SET {assignments}
+        {where_sql}
+        """,
+        tuple(params),
+    )
+    return cur.rowcount or 0
+
+
+def refresh_contract_progress(
+    cur, contract_nos: Iterable[Optional[str]], parts: Sequence[str] = ALL_PARTS
+) -> List[str]:
+    """
+    在调用方事务内按源表重算这些合同的台账分组（parts），返回实际处理的合同编号。
+    空编号被忽略；台账行不存在时先补建，再按编号排序加行锁。
+    """
+    nos = _normalize(contract_nos)
+    if not nos:
+        return []
+    cur.executemany(f"INSERT IGNORE INTO {PROGRESS_TABLE} (contract_no) VALUES (%s)", [(no,) for no in nos])
+    placeholders = ",".join(["%s"] * len(nos))
+    cur.execute(
+        f"SELECT contract_no FROM {PROGRESS_TABLE} WHERE contract_no IN ({placeholders}) "
+        "ORDER BY contract_no FOR UPDATE",
+        tuple(nos),
+    )
+    cur.fetchall()
+    for part in parts:
+        _refresh_part(cur, part, nos)
+    return nos
+
+
+def contract_nos_for(cur, table: str, column: str, values: Iterable[Any]) -> List[str]:
+    """按 id / weighbill_id 等列查出源表行的合同编号，供只知道行 id 的写入路径在改写前后调用。"""
+    keys = sorted({v for v in values if v is not None})
+    if not keys:
+        return []
+    placeholders = ",".join(["%s"] * len(keys))
+    cur.execute(f"SELECT DISTINCT contract_no FROM {table} WHERE {column} IN ({placeholders})", tuple(keys))
+    rows = cur.fetchall() or []
+    return _normalize(row["contract_no"] if isinstance(row, dict) else row[0] for row in rows)
+
+
+def rebuild_progress_rows(cur) -> int:
+    """补齐所有源表出现过的合同编号，并全量重算各分组，返回 MySQL 计数口径的变动行数。"""
+    union_sql = " UNION ".join(
+        f"SELECT contract_no FROM {t} WHERE contract_no IS NOT NULL AND contract_no <> ''" for t in _SOURCE_TABLES
+    )
+    cur.execute(f"INSERT IGNORE INTO {PROGRESS_TABLE} (contract_no) {union_sql}")
+    changed = cur.rowcount or 0
+    for part in ALL_PARTS:
+        changed += _refresh_part(cur, part, None)
+    return changed
+
+
+def rebuild_contract_progress(connect: Callable[[], Any] = get_conn) -> int:
+    """按源表全量重算台账（定时核对任务）。"""
+    with connect() as conn:
+        conn.begin()
+        try:
+            with conn.cursor() as cur:
+                changed = rebuild_progress_rows(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    logger.info("contract progress rebuilt changed=%s", changed)
+    return changed
@@ -7,7 +7,7 @@ import re
 import logging
 import tempfile
 from decimal import Decimal, ROUND_FLOOR, ROUND_HALF_UP
-from typing import List, Dict, Optional, Any, Tuple
+from typing import Iterator, List, Dict, Optional, Any, Tuple
 from contextlib import contextmanager
 from datetime import datetime, timedelta, date
 import cv2  # 新增导入
@@ -18,6 +18,9 @@ from PIL import Image, ImageEnhance, ImageFilter
 from pathlib import Path
 
 from app.core.logging import log_price_change
+from app.services.contract_expiry import sweep_expired_contracts
+from app.utils.ocr_fields import FieldExtractor, FieldMatches
+from app.utils.streaming_export import iter_keyset_pages
 
 try:
     from rapidocr_onnxruntime import RapidOCR
@@ -30,6 +33,52 @@ logger = logging.getLogger(__name__)
 
 PRODUCT_TYPES = ["电动车", "黑皮", "新能源", "通信", "摩托车", "大白", "牵引"]
 
+# 常见 OCR 误识别 → 修正
+_OCR_CORRECTIONS = {
+    "方：": "甲方：",
+    "方:": "甲方:",
+    "乙万": "乙方",
+    "合司": "合同",
+    "编亏": "编号",
+    "金辆": "金铅",
+}
+_OCR_CORRECTION_RE = re.compile("|".join(re.escape(k) for k in sorted(_OCR_CORRECTIONS, key=len, reverse=True)))
+
+_CONTRACT_DATE = r"(\d{4}[-年]\d{1,2}[-月]\d{1,2})"
+
+# 合同字段 → 候选模式（按优先级）
+_CONTRACT_FIELDS = FieldExtractor({
+    "contract_no": [
+        r"合同编号[：:]\s*([A-Za-z0-9\-]+)",
+        r"编号[：:]\s*([A-Za-z0-9\-]+)",
+        r"([A-Z]{2,6}-\d{6,12})",
+    ],
+    "contract_date": [rf"签订时间[：:]\s*{_CONTRACT_DATE}", rf"签订日期[：:]\s*{_CONTRACT_DATE}"],
+    "end_date": [
+        rf"合同期限.*?{_CONTRACT_DATE}",
+        rf"有效期至[：:]\s*{_CONTRACT_DATE}",
+        rf"截止日期[：:]\s*{_CONTRACT_DATE}",
+    ],
+    "smelter": [r"甲方[：:]\s*(.+?)(?:\n|$)"],
+    "delivery_place": [r"交货地点[：:]\s*(.+?)(?:\n|$)"],
+    # 预付比例（如 甲方预付合同80%）
+    "prepayment_ratio": [r"预付.*?(\d+)%", r"甲方预付合同(\d+)%", r"预付款.*?(\d+)%"],
+    # 到货款比例
+    "arrival_ratio": [r"到货款.*?(\d+)%", r"付到货款.*?(\d+)%", r"(\d+)%.*到货款", r"结算付到货款的(\d+)%"],
+})
+
+# 品种表格：数量列表头关键词（已转小写）与纯数字单元格
+_QTY_KEYWORDS = ("数量", "数", "总数量", "合计", "总计", "数量(吨)", "数(吨)", "吨", "qty", "quantity")
+_NUMBER_CELL = re.compile(r"^(\d+\.?\d*)$")
+
+
+def _date_value(value: Optional[str]) -> Optional[str]:
+    return value.replace("年", "-").replace("月", "-").replace("日", "") if value else None
+
+
+def _ratio_value(value: Optional[str]) -> Optional[Decimal]:
+    return Decimal(str(int(value) / 100)) if value else None
+
 
 # ============ 数据库 ============
 
@@ -61,73 +110,6 @@ def get_conn():
         connection.close()
 
 
-_CONTRACT_DELIVERY_PLAN_ID_ENSURED = False
-
-
-def _ensure_contract_delivery_plan_id_column() -> None:
-    """旧库补全合同关联报货计划字段、索引与外键（仅执行一次）。"""
-    global _CONTRACT_DELIVERY_PLAN_ID_ENSURED
-    if _CONTRACT_DELIVERY_PLAN_ID_ENSURED:
-        return
-    try:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
-                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'pd_contracts'
-                    """
-                )
-                existing_cols = {row[0] for row in (cur.fetchall() or [])}
-                if "delivery_plan_id" not in existing_cols:
-                    cur.execute(
-                        """
-                        ALTER TABLE pd_contracts
-                        ADD COLUMN delivery_plan_id BIGINT DEFAULT NULL
-                        COMMENT '报货计划ID（关联pd_delivery_plans.id）'
-                        """
-                    )
-                cur.execute(
-                    """
-                    SELECT 1 FROM INFORMATION_SCHEMA.STATISTICS
-                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'pd_contracts'
-                      AND INDEX_NAME = 'idx_contract_delivery_plan_id'
-                    LIMIT 1
-                    """
-                )
-                if not cur.fetchone():
-                    try:
-                        cur.execute(
-                            "CREATE INDEX idx_contract_delivery_plan_id ON pd_contracts(delivery_plan_id)"
-                        )
-                    except Exception as ie:
-                        logger.warning("create idx_contract_delivery_plan_id skipped: %s", ie)
-                cur.execute(
-                    """
-                    SELECT CONSTRAINT_NAME FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS
-                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'pd_contracts'
-                      AND CONSTRAINT_TYPE = 'FOREIGN KEY'
-                      AND CONSTRAINT_NAME = 'fk_pd_contracts_delivery_plan'
-                    """
-                )
-                if not cur.fetchone():
-                    try:
-                        cur.execute(
-                            """
-                            ALTER TABLE pd_contracts
-                            ADD CONSTRAINT fk_pd_contracts_delivery_plan
-                            FOREIGN KEY (delivery_plan_id) REFERENCES pd_delivery_plans(id)
-                            ON DELETE RESTRICT
-                            """
-                        )
-                    except Exception as fe:
-                        logger.warning("add fk_pd_contracts_delivery_plan skipped/failed: %s", fe)
-            conn.commit()
-        _CONTRACT_DELIVERY_PLAN_ID_ENSURED = True
-    except Exception as e:
-        logger.warning("ensure_contract_delivery_plan_id_column: %s", e)
-
-
 def _validate_contract_qty_vs_planned_tonnage(
     delivery_plan_id: Optional[int],
     total_quantity: Any,
@@ -358,40 +340,20 @@ class ContractService:
             }
 
     def _fix_common_ocr_errors(self, text: str) -> str:
-        """修正常见OCR识别错误"""
-        corrections = {
-            "方：": "甲方：",
-            "方:": "甲方:",
-            "乙万": "乙方",
-            "合司": "合同",
-            "编亏": "编号",
-            "金辆": "金铅",
-        }
-        for wrong, right in corrections.items():
-            text = text.replace(wrong, right)
-        return text
-
-    def _extract_prepayment_ratio(self, text: str) -> Optional[Decimal]:
-        """提取预付比例（如 甲方预付合同80%）"""
-        patterns = [
-            r"预付.*?(\d+)%",  # 通用预付模式
-            r"甲方预付合同(\d+)%",  # 具体甲方预付
-            r"预付款.*?(\d+)%",  # 预付款模式
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return Decimal(str(int(match.group(1)) / 100))
-        return None
+        """修正常见OCR识别错误（纠错表编译为一条交替式，一次替换）"""
+        return _OCR_CORRECTION_RE.sub(lambda m: _OCR_CORRECTIONS[m.group(0)], text)
+
     def _parse_contract(self, text_lines: List[Dict], full_text: str) -> Dict:
         """解析合同信息 - 缺失字段留空"""
 
-        contract_no = self._extract_contract_no(full_text)
-        contract_date = self._extract_contract_date(full_text)
-        end_date = self._extract_end_date(full_text) or self._infer_end_date(contract_date)
-        smelter = self._extract_smelter(full_text)
-        prepayment_ratio = self._extract_prepayment_ratio(full_text)
-        arrival_ratio = self._extract_payment_ratio(full_text)
+        found = _CONTRACT_FIELDS.search(full_text)
+        contract_no = found.group("contract_no")
+        contract_no = contract_no.strip() if contract_no else None
+        contract_date = _date_value(found.group("contract_date"))
+        end_date = _date_value(found.group("end_date")) or self._infer_end_date(contract_date)
+        smelter = self._extract_smelter(found)
+        prepayment_ratio = _ratio_value(found.group("prepayment_ratio"))
+        arrival_ratio = _ratio_value(found.group("arrival_ratio"))
 
         try:
             products, total_quantity = self._extract_products_multiline(text_lines)
@@ -460,46 +422,6 @@ class ContractService:
             return f"已识别，以下字段缺失需手动填写: {', '.join(missing)}"
         return "识别完成"
 
-    def _extract_contract_no(self, text: str) -> Optional[str]:
-        """提取合同编号"""
-        patterns = [
-            r"合同编号[：:]\s*([A-Za-z0-9\-]+)",
-            r"编号[：:]\s*([A-Za-z0-9\-]+)",
-            r"([A-Z]{2,6}-\d{6,12})",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return match.group(1).strip()
-        return None
-
-    def _extract_contract_date(self, text: str) -> Optional[str]:
-        """提取签订日期"""
-        patterns = [
-            r"签订时间[：:]\s*(\d{4}[-年]\d{1,2}[-月]\d{1,2})",
-            r"签订日期[：:]\s*(\d{4}[-年]\d{1,2}[-月]\d{1,2})",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                date_str = match.group(1).replace("年", "-").replace("月", "-").replace("日", "")
-                return date_str
-        return None
-
-    def _extract_end_date(self, text: str) -> Optional[str]:
-        """提取截止日期"""
-        patterns = [
-            r"合同期限.*?(\d{4}[-年]\d{1,2}[-月]\d{1,2})",
-            r"有效期至[：:]\s*(\d{4}[-年]\d{1,2}[-月]\d{1,2})",
-            r"截止日期[：:]\s*(\d{4}[-年]\d{1,2}[-月]\d{1,2})",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                date_str = match.group(1).replace("年", "-").replace("月", "-").replace("日", "")
-                return date_str
-        return None
-
     def _infer_end_date(self, start_date: Optional[str]) -> Optional[str]:
         """根据签订日期推断截止日期（默认5天）"""
         if not start_date:
@@ -587,34 +509,20 @@ class ContractService:
 
         return None
 
-    def _extract_smelter(self, text: str) -> Optional[str]:
+    def _extract_smelter(self, found: FieldMatches) -> Optional[str]:
         """提取冶炼公司"""
-        match = re.search(r"甲方[：:]\s*(.+?)(?:\n|$)", text)
-        if match:
-            return match.group(1).strip()
+        smelter = found.group("smelter")
+        if smelter is not None:
+            return smelter.strip()
 
-        match = re.search(r"交货地点[：:]\s*(.+?)(?:\n|$)", text)
-        if match:
-            location = match.group(1).strip()
+        location = found.group("delivery_place")
+        if location is not None:
+            location = location.strip()
             if "再生铅" in location or "分厂" in location:
                 return "河南金利金铅集团有限公司"
 
         return None
 
-    def _extract_payment_ratio(self, text: str) -> Optional[Decimal]:
-        """提取到货款比例"""
-        patterns = [
-            r"到货款.*?(\d+)%",
-            r"付到货款.*?(\d+)%",
-            r"(\d+)%.*到货款",
-            r"结算付到货款的(\d+)%",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return Decimal(str(int(match.group(1)) / 100))
-        return None
-
     def _extract_products_multiline(self, text_lines: List[Dict]) -> Tuple[List[Dict], Optional[Decimal]]:
         """提取产品列表和总数量"""
         products = []
@@ -622,13 +530,6 @@ class ContractService:
 
         name_start = name_end = price_start = price_end = qty_start = None
 
-        # 更健壮的数量关键词列表
-        qty_keywords = [
-            "数量", "数", "总数量", "合计", "总计",
-            "数量（吨）", "数(吨)", "吨",
-            "qty", "QTY", "Quantity"
-        ]
-
         for i, line in enumerate(text_lines):
             text = line["text"]
             if text == "品名":
@@ -639,7 +540,7 @@ class ContractService:
             elif price_start is not None and price_end is None:
                 # 放宽数量查找条件：检查是否包含任何数量相关关键词
                 text_clean = text.replace(" ", "").replace("（", "(").replace("）", ")").lower()
-                if any(kw in text_clean or kw.lower() in text_clean for kw in qty_keywords):
+                if any(kw in text_clean for kw in _QTY_KEYWORDS):
                     price_end = i
                     qty_start = i
 
@@ -654,14 +555,14 @@ class ContractService:
             if price_start is not None and price_end is not None:
                 for i in range(price_start + 1, price_end):
                     text = text_lines[i]["text"]
-                    match = re.match(r'^(\d+\.?\d*)$', text)
+                    match = _NUMBER_CELL.match(text)
                     if match:
                         prices.append(match.group(1))
 
             if qty_start is not None:
                 for i in range(qty_start + 1, len(text_lines)):
                     text = text_lines[i]["text"]
-                    match = re.match(r'^(\d+\.?\d*)$', text)
+                    match = _NUMBER_CELL.match(text)
                     if match:
                         val = Decimal(match.group(1))
                         if val >= 50:
@@ -707,7 +608,6 @@ class ContractService:
     def create_contract(self, data: Dict, products: List[Dict]) -> Dict[str, Any]:
         """创建合同（包含品种明细）"""
         try:
-            _ensure_contract_delivery_plan_id_column()
             plan_no = (data.get("plan_no") or "").strip()
             if not plan_no:
                 return {"success": False, "error": "必须指定报货计划编号 plan_no"}
@@ -828,7 +728,6 @@ class ContractService:
     def update_contract(self, contract_id: int, data: Dict, products: List[Dict] = None) -> Dict[str, Any]:
         """更新合同（含图片重命名）"""
         try:
-            _ensure_contract_delivery_plan_id_column()
             delivery_plan_link_updated = "plan_no" in data or "delivery_plan_id" in data
             if "plan_no" in data:
                 raw_pn = data.pop("plan_no")
@@ -1267,62 +1166,83 @@ class ContractService:
             return {"success": False, "error": str(e)}
 
     def export_contracts(self, contract_ids: List[int] = None) -> List[Dict]:
-        """导出合同"""
+        """导出合同（一次性列表，查询失败记日志并返回空列表；大批量请用 iter_export_contracts 流式导出）"""
         try:
+            return list(self.iter_export_contracts(contract_ids))
+        except Exception:
+            return []
+
+    def iter_export_contracts(
+        self, contract_ids: List[int] = None, page_size: int = 500
+    ) -> Iterator[Dict]:
+        """
+        流式导出合同：按 (seq_no, id) 键集分页读取合同，每页一次性取该页合同的品种，
+        逐行产出「合同字段 + product_name + unit_price」（无品种的合同产出一行空品种，与 LEFT JOIN 一致）。
+        """
+
+        def fetch_page(after: Optional[Tuple], limit: int) -> List[Tuple[Dict, List[Tuple]]]:
+            conditions: List[str] = []
+            params: List[Any] = []
+            if contract_ids:
+                conditions.append(f"c.id IN ({','.join(['%s'] * len(contract_ids))})")
+                params.extend(contract_ids)
+            if after is not None:
+                # MySQL 升序 NULL 在前：seq_no 为空的合同先按 id 走完，再进入有序号的部分
+                after_seq, after_id = after
+                if after_seq is None:
+                    conditions.append("(c.seq_no IS NOT NULL OR c.id > %s)")
+                    params.append(after_id)
+                else:
+                    conditions.append("(c.seq_no > %s OR (c.seq_no = %s AND c.id > %s))")
+                    params.extend([after_seq, after_seq, after_id])
+            where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    if contract_ids:
-                        format_ids = ','.join(['%s'] * len(contract_ids))
-                        cur.execute(f"""
-                            SELECT c.*, p.product_name, p.unit_price
-                            FROM pd_contracts c
-                            LEFT JOIN pd_contract_products p ON c.id = p.contract_id
-                            WHERE c.id IN ({format_ids})
-                            ORDER BY c.seq_no
-                        """, tuple(contract_ids))
-                    else:
-                        cur.execute("""
-                            SELECT c.*, p.product_name, p.unit_price
-                            FROM pd_contracts c
-                            LEFT JOIN pd_contract_products p ON c.id = p.contract_id
-                            ORDER BY c.seq_no
-                        """)
-
+                    cur.execute(
+                        f"SELECT c.* FROM pd_contracts c {where_sql} "
+                        f"ORDER BY c.seq_no, c.id LIMIT %s",
+                        tuple(params) + (limit,),
+                    )
                     columns = [desc[0] for desc in cur.description]
-                    return [dict(zip(columns, row)) for row in cur.fetchall()]
-
+                    contracts = [dict(zip(columns, row)) for row in cur.fetchall()]
+                    products: Dict[int, List[Tuple]] = {}
+                    if contracts:
+                        ids = [c["id"] for c in contracts]
+                        cur.execute(
+                            f"""
+                            SELECT contract_id, product_name, unit_price
+                            FROM pd_contract_products
+                            WHERE contract_id IN ({','.join(['%s'] * len(ids))})
+                            ORDER BY contract_id, id
+                            """,
+                            tuple(ids),
+                        )
+                        for cid, name, price in cur.fetchall():
+                            products.setdefault(cid, []).append((name, price))
+            return [(c, products.get(c["id"], [])) for c in contracts]
+
+        pages = iter_keyset_pages(
+            fetch_page,
+            key_of=lambda item: (item[0]["seq_no"], item[0]["id"]),
+            page_size=page_size,
+        )
+        try:
+            for contract, products in pages:
+                for name, price in products or [(None, None)]:
+                    yield {**contract, "product_name": name, "unit_price": price}
         except Exception as e:
+            # 中途失败须中断响应流，不能让客户端收到一份截断却状态正常的文件
             logger.error(f"导出失败: {e}")
-            return []
+            raise
 
 
 _contract_service = None
 
 
-def expire_contracts_after_grace(grace_days: int = 4) -> int:
-    """按截止日期当天23:59:59失效合同；无截止日期时按签订日期+4天的23:59:59失效"""
+def expire_contracts_after_grace(grace_days: int = 4, full: bool = False) -> int:
+    """按截止日期当天23:59:59失效合同；无截止日期时按签订日期+4天的23:59:59失效（增量分批，见 contract_expiry）"""
     try:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                # 修改：使用 DATE_ADD 加上 23:59:59 的时间
-                cur.execute(
-                    """
-                    UPDATE pd_contracts
-                    SET status = '已失效'
-                    WHERE status = '生效中'
-                      AND (
-                        (end_date IS NOT NULL 
-                         AND TIMESTAMP(end_date, '23:59:59') <= NOW())
-                        OR (
-                          end_date IS NULL
-                          AND contract_date IS NOT NULL
-                          AND TIMESTAMP(DATE_ADD(contract_date, INTERVAL %s DAY), '23:59:59') <= NOW()
-                        )
-                      )
-                    """,
-                    (grace_days,),
-                )
-                return cur.rowcount
+        return sweep_expired_contracts(grace_days=grace_days, full=full).expired
     except Exception as e:
         logger.error(f"合同自动失效失败: {e}")
         return 0
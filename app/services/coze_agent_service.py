@@ -1,16 +1,37 @@
 """
-Coze 托管智能体：流式请求 stream_run，聚合为纯文本输出。
+Coze 托管智能体：流式请求 stream_run，逐段产出文本（SSE 透传）或聚合为纯文本输出。
 配置来自环境变量（见 app.core.config.Settings）。
+
+使用 aiohttp 在事件循环内异步读取上游 SSE，每个事件循环共用一个 ClientSession（惰性创建）；会话只能在所属循环内关闭，
+所以各循环结束前须自行 `close_coze_session()`：服务进程在 lifespan 结束时关闭，定时任务 / Celery 任务这类
+`asyncio.run` 入口用 `run_closing_coze_session` 包一层。调用方中途停止迭代（如浏览器断开）时立即关闭上游连接。
 """
 from __future__ import annotations
 
+import asyncio
 import json
-from typing import Any
+import logging
+import weakref
+from typing import Any, AsyncIterator, Awaitable, TypeVar
 
-import requests
+import aiohttp
 
 from app.core.config import settings
 
+#: 与原 requests 超时 (15, 300) 一致：建连 15 秒，两次读取之间最长 300 秒
+COZE_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=15, sock_read=300)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+#: 事件循环 → 该循环上的会话；APScheduler 线程里的 asyncio.run 与服务主循环各用各的，互不替换
+_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+
+class CozeAgentError(Exception):
+    """配置缺失、上游 HTTP 错误或流中的 error 事件。"""
+
 
 def _fragments_from_obj(obj: Any) -> list[str]:
     """从单条 SSE JSON 中尽量提取可拼接的文本片段（兼容多种嵌套结构）。"""
@@ -64,75 +85,120 @@ def _merge_payload(user_text: str) -> dict[str, Any]:
     }
 
 
-def run_coze_agent_chat(user_text: str) -> dict[str, Any]:
-    """
-    调用 Coze stream_run，返回 {"success": bool, "text"?: str, "error"?: str}。
-    """
+async def get_coze_session() -> aiohttp.ClientSession:
+    """当前事件循环共用的会话，不存在或已关闭时新建。"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        _drop_sessions_of_closed_loops()
+        session = _sessions[loop] = aiohttp.ClientSession(timeout=COZE_TIMEOUT)
+    return session
+
+
+async def close_coze_session() -> None:
+    """关闭当前事件循环上的会话（其他循环的会话不动）。"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+async def run_closing_coze_session(awaitable: Awaitable[T]) -> T:
+    """`asyncio.run` 入口用：执行完（无论成败）关闭本循环的会话，循环关闭后就无法再关了。"""
+    try:
+        return await awaitable
+    finally:
+        await close_coze_session()
+
+
+def _drop_sessions_of_closed_loops() -> None:
+    for loop in [lp for lp in list(_sessions) if lp.is_closed()]:
+        session = _sessions.pop(loop, None)
+        if session is not None and not session.closed:
+            logger.warning("Coze 会话所属事件循环已关闭但会话未关闭，连接无法回收；asyncio.run 入口须调用 close_coze_session")
+
+
+def _request_parts(user_text: str) -> tuple[str, dict[str, str], dict[str, Any]]:
     url = (settings.coze_stream_url or "").strip()
     token = (settings.coze_bearer_token or "").strip()
     if not url or not token:
-        return {
-            "success": False,
-            "error": "缺少 Coze 配置：请在 .env 中设置 Coze_url 与 YOUR_TOKEN",
-        }
+        raise CozeAgentError("缺少 Coze 配置：请在 .env 中设置 Coze_url 与 YOUR_TOKEN")
     if not settings.coze_project_id or not settings.coze_session_id:
-        return {
-            "success": False,
-            "error": "缺少 Coze 配置：请在 .env 中设置 project_id 与 session_id",
-        }
-
+        raise CozeAgentError("缺少 Coze 配置：请在 .env 中设置 project_id 与 session_id")
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json",
         "Accept": "text/event-stream",
     }
-    payload = _merge_payload(user_text)
+    return url, headers, _merge_payload(user_text)
 
+
+async def _iter_sse_lines(resp: aiohttp.ClientResponse) -> AsyncIterator[str]:
+    """按到达的数据块切行（不受 StreamReader 单行长度上限影响）。"""
+    buf = b""
+    async for chunk in resp.content.iter_any():
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r").decode("utf-8", errors="replace")
+    if buf:
+        yield buf.rstrip(b"\r").decode("utf-8", errors="replace")
+
+
+async def stream_coze_agent(user_text: str) -> AsyncIterator[str]:
+    """
+    调用 Coze stream_run，按到达顺序产出文本片段；失败抛 CozeAgentError。
+    迭代被提前结束（aclose / 任务取消）时关闭上游连接而不是读完剩余事件。
+    """
+    url, headers, payload = _request_parts(user_text)
+    session = await get_coze_session()
     try:
-        response = requests.post(
-            url,
-            headers=headers,
-            json=payload,
-            stream=True,
-            timeout=(15, 300),
-        )
-    except requests.RequestException as e:
-        return {"success": False, "error": f"请求智能体失败: {e}"}
+        resp = await session.post(url, headers=headers, json=payload)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise CozeAgentError(f"请求智能体失败: {e!r}") from e
 
+    finished = False
     try:
-        response.raise_for_status()
-    except requests.HTTPError:
+        if resp.status >= 400:
+            body = (await resp.text(errors="replace"))[:2000]
+            raise CozeAgentError(f"智能体接口 HTTP {resp.status}: {body or resp.reason}")
         try:
-            body = response.text[:2000]
-        except Exception:
-            body = ""
-        return {
-            "success": False,
-            "error": f"智能体接口 HTTP {response.status_code}: {body or response.reason}",
-        }
-
+            async for line in _iter_sse_lines(resp):
+                if not line or not line.startswith("data:"):
+                    continue
+                data_text = line[5:].strip()
+                if not data_text or data_text == "[DONE]":
+                    continue
+                try:
+                    parsed = json.loads(data_text)
+                except json.JSONDecodeError:
+                    yield data_text
+                    continue
+
+                if isinstance(parsed, dict) and parsed.get("error") is not None:
+                    raise CozeAgentError(str(parsed.get("error")))
+
+                for fragment in _fragments_from_obj(parsed):
+                    yield fragment
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise CozeAgentError(f"读取智能体响应失败: {e!r}") from e
+        finished = True
+    finally:
+        if finished:
+            resp.release()
+        else:
+            resp.close()
+
+
+async def run_coze_agent_chat(user_text: str) -> dict[str, Any]:
+    """
+    调用 Coze stream_run 并聚合，返回 {"success": bool, "text"?: str, "error"?: str}。
+    """
     parts: list[str] = []
-    for line in response.iter_lines(decode_unicode=True):
-        if not line or not line.startswith("data:"):
-            continue
-        data_text = line[5:].strip()
-        if not data_text or data_text == "[DONE]":
-            continue
-        try:
-            parsed = json.loads(data_text)
-        except json.JSONDecodeError:
-            parts.append(data_text)
-            continue
-
-        if isinstance(parsed, dict) and parsed.get("error") is not None:
-            return {
-                "success": False,
-                "error": str(parsed.get("error")),
-            }
-
-        fr = _fragments_from_obj(parsed)
-        if fr:
-            parts.extend(fr)
+    try:
+        async for fragment in stream_coze_agent(user_text):
+            parts.append(fragment)
+    except CozeAgentError as e:
+        return {"success": False, "error": str(e)}
 
     full = "".join(parts).strip()
     if not full:
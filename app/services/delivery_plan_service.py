@@ -54,6 +54,7 @@ def normalize_planned_tonnage_for_db(value: Any) -> Tuple[Optional[Decimal], Opt
 
 from pymysql.cursors import DictCursor
 
+from app.services.allocation_cache import invalidate_manager_allocation
 from app.services.contract_service import get_conn
 
 logger = logging.getLogger(__name__)
@@ -64,82 +65,6 @@ def _mysql_duplicate_entry_value(err_msg: str) -> Optional[str]:
     m = re.search(r"Duplicate entry '([^']+)' for key", err_msg)
     return m.group(1) if m else None
 
-_PLAN_AUDIT_COLS_ENSURED = False
-_PLAN_LEGACY_FULLINVALID_REPAIRED = False
-
-
-def _ensure_plan_audit_columns() -> None:
-    """旧库补全报货计划操作人相关字段（仅执行一次）。"""
-    global _PLAN_AUDIT_COLS_ENSURED, _PLAN_LEGACY_FULLINVALID_REPAIRED
-    if _PLAN_AUDIT_COLS_ENSURED:
-        return
-    repair_legacy_full_invalid = False
-    try:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT COLUMN_NAME, COLUMN_TYPE FROM INFORMATION_SCHEMA.COLUMNS
-                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'pd_delivery_plans'
-                    """
-                )
-                rows = cur.fetchall() or []
-                existing = {row[0] for row in rows}
-                col_type_norm = {
-                    row[0]: (row[1] or "").lower().replace(" ", "") for row in rows
-                }
-                parts: list[str] = []
-                if "created_by" not in existing:
-                    parts.append(
-                        "ADD COLUMN created_by BIGINT DEFAULT NULL COMMENT '创建人用户ID'"
-                    )
-                if "created_by_name" not in existing:
-                    parts.append(
-                        "ADD COLUMN created_by_name VARCHAR(64) DEFAULT NULL COMMENT '创建人姓名'"
-                    )
-                if "updated_by" not in existing:
-                    parts.append(
-                        "ADD COLUMN updated_by BIGINT DEFAULT NULL COMMENT '最后修改人用户ID'"
-                    )
-                if "updated_by_name" not in existing:
-                    parts.append(
-                        "ADD COLUMN updated_by_name VARCHAR(64) DEFAULT NULL COMMENT '最后修改人姓名'"
-                    )
-                if "planned_tonnage" not in existing:
-                    parts.append(
-                        "ADD COLUMN planned_tonnage DECIMAL(12, 3) NOT NULL DEFAULT 0.000 COMMENT '计划吨数' AFTER planned_trucks"
-                    )
-                elif col_type_norm.get("planned_tonnage") != "decimal(12,3)":
-                    parts.append(
-                        "MODIFY COLUMN planned_tonnage DECIMAL(12, 3) NOT NULL DEFAULT 0.000 COMMENT '计划吨数'"
-                    )
-                if parts:
-                    cur.execute("ALTER TABLE pd_delivery_plans " + ", ".join(parts))
-                # 历史：满额时曾自动将 plan_status 置为「已失效」，与业务期望不符；commit 成功后标记已执行
-                if not _PLAN_LEGACY_FULLINVALID_REPAIRED:
-                    cur.execute(
-                        """
-                        UPDATE pd_delivery_plans
-                        SET plan_status = '生效中'
-                        WHERE plan_status = '已失效'
-                          AND planned_trucks > 0
-                          AND confirmed_trucks >= planned_trucks
-                        """
-                    )
-                    aff = cur.rowcount or 0
-                    if aff:
-                        logger.info(
-                            "pd_delivery_plans: corrected %s rows from mistaken 已失效 (quota full)",
-                            aff,
-                        )
-                    repair_legacy_full_invalid = True
-            conn.commit()
-        if repair_legacy_full_invalid:
-            _PLAN_LEGACY_FULLINVALID_REPAIRED = True
-        _PLAN_AUDIT_COLS_ENSURED = True
-    except Exception as e:
-        logger.warning("ensure_plan_audit_columns skipped/failed: %s", e)
-
 
 def apply_increment_confirmed_trucks(
     cur,
@@ -161,7 +86,6 @@ def apply_increment_confirmed_trucks(
     """
     if truck_count < 1:
         return
-    _ensure_plan_audit_columns()
     cur.execute(
         """
         UPDATE pd_delivery_plans
@@ -193,7 +117,6 @@ def apply_adjust_confirmed_trucks(
     """
     if delta == 0:
         return
-    _ensure_plan_audit_columns()
     cur.execute(
         """
         UPDATE pd_delivery_plans
@@ -335,7 +258,6 @@ class DeliveryPlanService:
         confirmed_v = int(data.get("confirmed_trucks", 0) or 0)
         unconfirmed_v = max(0, planned_trucks_v - confirmed_v)
 
-        _ensure_plan_audit_columns()
         try:
             with get_conn() as conn:
                 prev_ac = conn.get_autocommit()
@@ -378,6 +300,7 @@ class DeliveryPlanService:
                                 (plan_id, cat, price, sort_order),
                             )
                     conn.commit()
+                    invalidate_manager_allocation()
                 except Exception:
                     conn.rollback()
                     raise
@@ -441,6 +364,7 @@ class DeliveryPlanService:
                     except ValueError as e:
                         return {"success": False, "error": str(e)}
                     conn.commit()
+                    invalidate_manager_allocation()
                     cur.execute(
                         f"""
                         SELECT {self._PLAN_SELECT.strip()}
@@ -461,7 +385,6 @@ class DeliveryPlanService:
             return {"success": False, "error": str(e)}
 
     def get_plan(self, plan_id: int) -> Dict[str, Any]:
-        _ensure_plan_audit_columns()
         try:
             with get_conn() as conn:
                 with conn.cursor(DictCursor) as cur:
@@ -490,7 +413,6 @@ class DeliveryPlanService:
         page: int = 1,
         page_size: int = 20,
     ) -> Dict[str, Any]:
-        _ensure_plan_audit_columns()
         try:
             with get_conn() as conn:
                 with conn.cursor(DictCursor) as cur:
@@ -585,7 +507,6 @@ class DeliveryPlanService:
         except ValueError as e:
             return {"success": False, "error": str(e)}
 
-        _ensure_plan_audit_columns()
         try:
             with get_conn() as conn:
                 prev_ac = conn.get_autocommit()
@@ -665,6 +586,7 @@ class DeliveryPlanService:
                             return {"success": False, "error": "没有要更新的字段"}
 
                     conn.commit()
+                    invalidate_manager_allocation()
                 except Exception:
                     conn.rollback()
                     raise
@@ -708,6 +630,7 @@ class DeliveryPlanService:
                     if cur.rowcount == 0:
                         return {"success": False, "error": f"报货计划 ID {plan_id} 不存在"}
                     conn.commit()
+                    invalidate_manager_allocation()
                     return {"success": True, "message": "报货计划已删除", "data": {"id": plan_id}}
         except Exception as e:
             logger.error("delete delivery plan failed: %s", e)
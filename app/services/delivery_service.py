@@ -6,69 +6,41 @@ import json
 import logging
 import os
 import re
+import copy
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from decimal import Decimal, ROUND_FLOOR
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Sequence, Set, Tuple
 from datetime import datetime
+from app.core.config import settings
 from app.core.paths import UPLOADS_DIR
+from app.core.schema_migrations import get_schema_capabilities
+from app.services.allocation_cache import invalidate_manager_allocation
+from app.services.contract_capacity import apply_delivery_change
+from app.services.contract_progress import DELIVERIES, refresh_contract_progress
+from app.services.image_store import ImageSource, copy_image_source, release_image, save_image
 from app.services.delivery_contract_price_service import get_delivery_contract_price_service
+from app.services.driver_duplicate_window import (
+    driver_identifiers,
+    get_duplicate_window,
+    indexed_recent_orders_params,
+    indexed_recent_orders_sql,
+)
+from app.utils.fulltext_search import keyword_filter
+from app.utils.keyset_cursor import (
+    count_total,
+    decode_cursor,
+    keyset_before_params,
+    keyset_before_sql,
+    split_page,
+    validate_count_mode,
+)
 from app.utils.product_mapping import convert_to_mill_product
 from core.database import get_conn
 
 logger = logging.getLogger(__name__)
 
-_DELIVERY_ORDER_PLAN_COLUMNS_ENSURED = False
-
-
-def _ensure_delivery_order_plan_columns() -> None:
-    """旧库补全报单订货计划关联字段。"""
-    global _DELIVERY_ORDER_PLAN_COLUMNS_ENSURED
-    if _DELIVERY_ORDER_PLAN_COLUMNS_ENSURED:
-        return
-    try:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
-                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'pd_deliveries'
-                    """
-                )
-                existing = {row["COLUMN_NAME"] for row in (cur.fetchall() or [])}
-                if "order_plan_id" not in existing:
-                    cur.execute(
-                        """
-                        ALTER TABLE pd_deliveries
-                        ADD COLUMN order_plan_id BIGINT DEFAULT NULL
-                            COMMENT '关联订货计划ID（与报单人、合同报货计划对应）'
-                        """
-                    )
-                if "is_last_truck_for_order_plan" not in existing:
-                    cur.execute(
-                        """
-                        ALTER TABLE pd_deliveries
-                        ADD COLUMN is_last_truck_for_order_plan TINYINT DEFAULT 0
-                            COMMENT '是否订货计划最后一车'
-                        """
-                    )
-                cur.execute(
-                    "SHOW INDEX FROM pd_deliveries WHERE Key_name = %s",
-                    ("idx_order_plan_id",),
-                )
-                if not cur.fetchone():
-                    try:
-                        cur.execute(
-                            "CREATE INDEX idx_order_plan_id ON pd_deliveries(order_plan_id)"
-                        )
-                    except Exception as ie:
-                        logger.warning("create idx_order_plan_id skipped: %s", ie)
-            conn.commit()
-        _DELIVERY_ORDER_PLAN_COLUMNS_ENSURED = True
-    except Exception as e:
-        logger.warning("ensure_delivery_order_plan_columns skipped/failed: %s", e)
-
-
 # 使用绝对路径，避免工作目录变化导致的问题
 UPLOAD_DIR = UPLOADS_DIR / "delivery_orders"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
@@ -76,6 +48,87 @@ UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 # 标准车容量（吨）
 STANDARD_TRUCK_CAPACITY = Decimal('35')
 
+# 文本提取结果校验用的正则（模块加载时编译一次）
+_JSON_BLOCK = re.compile(r'\{.*\}', re.DOTALL)
+_PLATE = re.compile(r'[京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6}')
+_DRIVER_NAME = re.compile(r'^[\u4e00-\u9fa5a-zA-Z·]+$')
+_NON_DIGITS = re.compile(r'\D')
+_ID_CARD = re.compile(r'^\d{17}[\dXx]$')
+
+# 工厂简称 → 合同甲方名称中可能出现的写法
+FACTORY_ALIASES = {
+    '金利': ['金利', '河南金利', '金利金铅'],
+    '豫光': ['豫光', '河南豫光', '豫光金铅'],
+    '万洋': ['万洋', '河南万洋'],
+    '大华': ['大华', '河北大华'],
+    '金凤': ['金凤', '河北金凤'],
+    '南方': ['南方', '广东南方'],
+    '中原': ['中原', '河南中原'],
+    '华铂': ['华铂', '安徽华铂'],
+}
+
+# 合同匹配候选列：(工厂, 品种) 单条匹配与批量匹配共用
+_CONTRACT_MATCH_COLUMNS = """
+    c.id,
+    c.contract_no,
+    c.smelter_company,
+    p.unit_price,
+    p.product_name as matched_product,
+    c.contract_date,
+    c.end_date
+"""
+
+_RECENT_ORDER_COLUMNS = (
+    'id', 'contract_no', 'report_date', 'vehicle_no', 'driver_name', 'driver_phone', 'driver_id_card', 'created_at',
+)
+
+
+def factory_keywords(factory_name: str) -> List[str]:
+    """工厂名 + 其命中的简称别名（去重保序），用于 smelter_company LIKE 匹配"""
+    keywords = [factory_name]
+    for key, aliases in FACTORY_ALIASES.items():
+        if key in factory_name:
+            keywords.extend(aliases)
+    return list(dict.fromkeys(keywords))
+
+
+def _contract_match_from_row(row: Any, match_type: str) -> Dict[str, Any]:
+    unit_price_val = row['unit_price'] if isinstance(row, dict) else row[3]
+    return {
+        'matched': True,
+        'contract_no': row['contract_no'] if isinstance(row, dict) else row[1],
+        'contract_id': row['id'] if isinstance(row, dict) else row[0],
+        'unit_price': float(unit_price_val) if unit_price_val is not None else None,
+        'smelter_company': row['smelter_company'] if isinstance(row, dict) else row[2],
+        'match_type': match_type,
+        'matched_product': row['matched_product'] if isinstance(row, dict) else row[4],
+    }
+
+
+def _contract_unmatched(match_type: str, reason: str) -> Dict[str, Any]:
+    return {
+        'matched': False,
+        'contract_no': None,
+        'contract_id': None,
+        'unit_price': None,
+        'smelter_company': None,
+        'match_type': match_type,
+        'reason': reason,
+    }
+
+
+def _recent_order(row: Any) -> Dict[str, Any]:
+    order = dict(row) if isinstance(row, dict) else dict(zip(_RECENT_ORDER_COLUMNS, row))
+    for key in ['report_date', 'created_at']:
+        if order.get(key):
+            order[key] = str(order[key])
+    return order
+
+
+def _order_matches_identifiers(order: Dict[str, Any], keys: Set[str]) -> bool:
+    """报单的手机号或身份证号（规范化后）是否在 keys（`driver_identifiers` 的结果）中。"""
+    return bool(keys.intersection(driver_identifiers(order.get('driver_phone'), order.get('driver_id_card'))))
+
 
 def _attach_contract_product_prices_to_delivery_rows(data: List[dict]) -> None:
     """为列表行附加 contract_product_prices（来自 pd_delivery_contract_product_prices）。"""
@@ -186,101 +239,20 @@ class DeliveryService:
         return raw
 
     def _delivery_has_products_column(self) -> bool:
-        """兼容旧库：动态检测 pd_deliveries 是否存在 products 列。"""
-        cached = getattr(self, "_products_column_exists", None)
-        if cached is not None:
-            return cached
-
-        exists = False
-        try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        SELECT 1
-                        FROM information_schema.COLUMNS
-                        WHERE TABLE_SCHEMA = DATABASE()
-                          AND TABLE_NAME = 'pd_deliveries'
-                          AND COLUMN_NAME = 'products'
-                        LIMIT 1
-                        """
-                    )
-                    exists = cur.fetchone() is not None
-        except Exception as e:
-            logger.warning(f"检测 pd_deliveries.products 字段失败，将按不存在处理: {e}")
-
-        self._products_column_exists = exists
-        return exists
+        """兼容旧库：pd_deliveries 是否存在 products 列（读启动时的库结构能力表）。"""
+        return get_schema_capabilities().has_column("pd_deliveries", "products")
 
     def _weighbill_has_warehouse_name_column(self) -> bool:
-        """兼容旧库：动态检测 pd_weighbills 是否存在 warehouse_name 列。"""
-        cached = getattr(self, "_weighbill_warehouse_name_exists", None)
-        if cached is not None:
-            return cached
-
-        exists = False
-        try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SHOW COLUMNS FROM pd_weighbills LIKE 'warehouse_name'")
-                    exists = cur.fetchone() is not None
-        except Exception as e:
-            logger.warning(f"检测 pd_weighbills.warehouse_name 字段失败，将按不存在处理: {e}")
-
-        self._weighbill_warehouse_name_exists = exists
-        return exists
+        """兼容旧库：pd_weighbills 是否存在 warehouse_name 列。"""
+        return get_schema_capabilities().has_column("pd_weighbills", "warehouse_name")
 
     def _weighbill_has_audit_columns(self) -> bool:
-        """兼容旧库：检测 pd_weighbills 是否有 audit_status 列"""
-        cached = getattr(self, "_weighbill_audit_columns_exists", None)
-        if cached is not None:
-            return cached
-        exists = False
-        try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SHOW COLUMNS FROM pd_weighbills LIKE 'audit_status'")
-                    exists = cur.fetchone() is not None
-        except Exception as e:
-            logger.warning("检测 pd_weighbills.audit_status 字段失败: %s", e)
-        self._weighbill_audit_columns_exists = exists
-        return exists
+        """兼容旧库：pd_weighbills 是否有 audit_status 列"""
+        return get_schema_capabilities().has_column("pd_weighbills", "audit_status")
 
     def _weighbill_has_order_plan_last_column(self) -> bool:
-        """兼容旧库：pd_weighbills.is_last_truck_for_order_plan"""
-        cached = getattr(self, "_weighbill_order_plan_last_exists", None)
-        if cached is not None:
-            return cached
-        exists = False
-        try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "SHOW COLUMNS FROM pd_weighbills LIKE 'is_last_truck_for_order_plan'"
-                    )
-                    exists = cur.fetchone() is not None
-        except Exception as e:
-            logger.warning("检测 pd_weighbills.is_last_truck_for_order_plan 失败: %s", e)
-        self._weighbill_order_plan_last_exists = exists
-        return exists
-
-    def _ensure_weighbill_order_plan_last_column(self) -> None:
-        if self._weighbill_has_order_plan_last_column():
-            return
-        try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        ALTER TABLE pd_weighbills
-                        ADD COLUMN is_last_truck_for_order_plan TINYINT DEFAULT 0
-                            COMMENT '是否为订货计划最后一车'
-                        """
-                    )
-                conn.commit()
-            self._weighbill_order_plan_last_exists = True
-        except Exception as e:
-            logger.warning("ensure_weighbill_order_plan_last_column skipped/failed: %s", e)
+        """兼容旧库：pd_weighbills.is_last_truck_for_order_plan（迁移 6 补建）"""
+        return get_schema_capabilities().has_column("pd_weighbills", "is_last_truck_for_order_plan")
 
     def _get_upload_status(self, image_path: Optional[str]) -> str:
         if image_path and os.path.exists(image_path):
@@ -360,9 +332,11 @@ class DeliveryService:
                     if exact_contract_no:
                         cur.execute("""
                             SELECT c.id, c.contract_no, p.unit_price, c.total_quantity,
-                                CEIL(c.total_quantity / 35) as contract_trucks
+                                CEIL(c.total_quantity / 35) as contract_trucks,
+                                COALESCE(cap.used_trucks, 0) AS used_trucks
                             FROM pd_contracts c
                             JOIN pd_contract_products p ON p.contract_id = c.id
+                            LEFT JOIN pd_contract_capacity cap ON cap.contract_no = c.contract_no
                             WHERE c.contract_no = %s
                             AND c.status = '生效中'
                             AND p.product_name = %s
@@ -383,15 +357,8 @@ class DeliveryService:
                             unit_price = match["unit_price"]
                             contract_trucks = int(match.get("contract_trucks") or 0)
                             
-                            # 统计已用车数
-                            cur.execute("""
-                                SELECT COALESCE(SUM(planned_trucks), 0) as used_trucks
-                                FROM pd_deliveries
-                                WHERE contract_no = %s AND contract_id = %s
-                                AND status = '审核通过'
-                            """, (contract_no, match["id"]))
-                            
-                            used_trucks = int(cur.fetchone()['used_trucks'] or 0)
+                            # 已用车数取自合同车数台账（审核通过报单合计）
+                            used_trucks = int(match.get("used_trucks") or 0)
                             remaining = contract_trucks - used_trucks
                             
                             if planned_trucks <= remaining:
@@ -422,9 +389,11 @@ class DeliveryService:
                         SELECT c.id AS contract_id, c.contract_no, p.unit_price, c.total_quantity,
                                FLOOR(c.total_quantity / 35) as contract_trucks,
                                c.contract_date,
-                               c.end_date
+                               c.end_date,
+                               COALESCE(cap.used_trucks, 0) AS used_trucks
                         FROM pd_contracts c
                         JOIN pd_contract_products p ON p.contract_id = c.id
+                        LEFT JOIN pd_contract_capacity cap ON cap.contract_no = c.contract_no
                         WHERE c.smelter_company = %s
                         AND p.product_name = %s
                         AND p.unit_price > 0              -- 只匹配有效价格（价格>0）
@@ -503,15 +472,8 @@ class DeliveryService:
                             except (ValueError, TypeError):
                                 pass
 
-                        # 统计该合同已匹配的报单车数总和
-                        cur.execute("""
-                            SELECT COALESCE(SUM(planned_trucks), 0) as used_trucks
-                            FROM pd_deliveries
-                            WHERE contract_no = %s
-                            AND status = '审核通过'
-                        """, (contract_no,))
-                        
-                        used_trucks = int(cur.fetchone()['used_trucks'] or 0)
+                        # 该合同已审核通过的报单车数（随候选合同一次读出）
+                        used_trucks = int(contract.get("used_trucks") or 0)
                         remaining = contract_trucks - used_trucks
 
                         # 检查车数是否足够
@@ -948,66 +910,93 @@ class DeliveryService:
             logger.error(f"审核额度校验异常: {e}")
             return f"额度校验失败: {str(e)}"
 
+    def _recent_orders_by_identifiers(
+            self, identifiers: Sequence[str], exclude_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        近 24 小时手机号或身份证号命中 identifiers 中任一号码的报单（创建时间倒序）。
+        号码窗口可用时只按主键复核窗口给出的候选（没有候选免查库），否则走两条索引查询的 UNION。
+        """
+        if not identifiers:
+            return []
+        columns = ", ".join(_RECENT_ORDER_COLUMNS)
+        window = get_duplicate_window()
+        candidates = window.candidates(identifiers) if window else None
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                if candidates is None:
+                    cur.execute(
+                        indexed_recent_orders_sql(columns, len(identifiers), exclude_id),
+                        indexed_recent_orders_params(identifiers, exclude_id),
+                    )
+                    return [_recent_order(row) for row in cur.fetchall()]
+                candidates = [c for c in candidates if c != exclude_id]
+                if not candidates:
+                    return []
+                placeholders = ",".join(["%s"] * len(candidates))
+                cur.execute(f"""
+                    SELECT {columns}
+                    FROM pd_deliveries
+                    WHERE id IN ({placeholders}) AND created_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR)
+                    ORDER BY created_at DESC
+                """, tuple(candidates))
+                orders = [_recent_order(row) for row in cur.fetchall()]
+        keys = set(driver_identifiers(*identifiers))
+        return [o for o in orders if _order_matches_identifiers(o, keys)]
+
     def check_duplicate_in_24h(self, driver_phone: str, driver_id_card: str, exclude_id: int = None) -> Dict[str, Any]:
         """
-        检查同一司机24小时内是否已报单
+        检查同一司机24小时内是否已报单（手机号、身份证号任一命中即算）
         """
         try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    conditions = ["created_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR)"]
-                    params = []
-
-                    if driver_phone:
-                        conditions.append("(driver_phone = %s OR driver_id_card = %s)")
-                        params.extend([driver_phone, driver_phone])
-                    if driver_id_card:
-                        conditions.append("(driver_phone = %s OR driver_id_card = %s)")
-                        params.extend([driver_id_card, driver_id_card])
-
-                    if exclude_id:
-                        conditions.append("id != %s")
-                        params.append(exclude_id)
-
-                    where_sql = "(" + " OR ".join(conditions[1:]) + ")" if len(conditions) > 1 else "1=1"
-                    where_sql = f"{conditions[0]} AND ({where_sql})"
+            existing_orders = self._recent_orders_by_identifiers(
+                driver_identifiers(driver_phone, driver_id_card), exclude_id
+            )
+            return {
+                "is_duplicate": len(existing_orders) > 0,
+                "existing_orders": existing_orders,
+                "duplicate_count": len(existing_orders)
+            }
 
-                    cur.execute(f"""
-                        SELECT id, contract_no, report_date, vehicle_no, driver_name, 
-                               driver_phone, driver_id_card, created_at
-                        FROM pd_deliveries
-                        WHERE {where_sql}
-                        ORDER BY created_at DESC
-                    """, tuple(params))
+        except Exception as e:
+            logger.error(f"检查重复报单失败: {e}")
+            return {"is_duplicate": False, "existing_orders": [], "duplicate_count": 0, "error": str(e)}
 
-                    rows = cur.fetchall()
+    def check_duplicates_in_24h_batch(
+            self, drivers: Sequence[Tuple[Optional[str], Optional[str]]]
+    ) -> List[Dict[str, Any]]:
+        """
+        批量版 check_duplicate_in_24h：drivers 为 (手机号, 身份证号) 列表，
+        全部号码合成一次查询，再按每个司机的号码分拣；返回与输入同序、结构相同的结果。
+        两个号码都为空的司机不做校验。
+        """
+        keys = [set(driver_identifiers(*pair)) for pair in drivers]
+        identifiers = driver_identifiers(*(v for pair in drivers for v in pair))
+        if not identifiers:
+            return [{"is_duplicate": False, "existing_orders": [], "duplicate_count": 0} for _ in drivers]
 
-                    existing_orders = []
-                    for row in rows:
-                        order = dict(row) if isinstance(row, dict) else {
-                            'id': row[0],
-                            'contract_no': row[1],
-                            'report_date': row[2],
-                            'vehicle_no': row[3],
-                            'driver_name': row[4],
-                            'driver_phone': row[5],
-                            'driver_id_card': row[6],
-                            'created_at': row[7],
-                        }
-                        for key in ['report_date', 'created_at']:
-                            if order.get(key):
-                                order[key] = str(order[key])
-                        existing_orders.append(order)
+        try:
+            orders = self._recent_orders_by_identifiers(identifiers)
+        except Exception as e:
+            logger.error(f"批量检查重复报单失败: {e}")
+            return [
+                {"is_duplicate": False, "existing_orders": [], "duplicate_count": 0, "error": str(e)}
+                for _ in drivers
+            ]
 
-                    return {
-                        "is_duplicate": len(existing_orders) > 0,
-                        "existing_orders": existing_orders,
-                        "duplicate_count": len(existing_orders)
-                    }
+        results = []
+        for driver_keys in keys:
+            matched = [o for o in orders if driver_keys and _order_matches_identifiers(o, driver_keys)]
+            results.append({"is_duplicate": bool(matched), "existing_orders": matched, "duplicate_count": len(matched)})
+        return results
 
-        except Exception as e:
-            logger.error(f"检查重复报单失败: {e}")
-            return {"is_duplicate": False, "existing_orders": [], "duplicate_count": 0, "error": str(e)}
+    @staticmethod
+    def _record_duplicate_window(delivery_id: Optional[int], driver_phone: Optional[str],
+                                 driver_id_card: Optional[str]) -> None:
+        """新报单或改了号码的报单写入号码窗口（窗口未启用时不做任何事）。"""
+        window = get_duplicate_window()
+        if window is not None:
+            window.record(delivery_id, driver_phone, driver_id_card)
 
     def _build_operations(self, has_delivery_order: str, upload_status: str, image_path: Optional[str]) -> Dict[str, bool]:
         """
@@ -1046,32 +1035,19 @@ class DeliveryService:
 
         return products
 
-    def _save_delivery_image(self, image_bytes: bytes, vehicle_no: str) -> str:
-        """保存单张联单图片，返回路径"""
-        safe_name = re.sub(r'[^\w\-]', '_', str(vehicle_no or 'unknown'))
-        filename = f"delivery_{safe_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
-        file_path = UPLOAD_DIR / filename
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
-        return str(file_path)
-
-    def _save_voucher_image(self, image_bytes: bytes, vehicle_no: str, index: int) -> str:
-        """保存单张凭证图片，返回路径"""
-        safe_name = re.sub(r'[^\w\-]', '_', str(vehicle_no or 'unknown'))
-        filename = f"voucher_{safe_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{index}_{uuid.uuid4().hex[:4]}.jpg"
-        # 存放在 UPLOAD_DIR/vouchers/ 子目录下
-        file_path = UPLOAD_DIR / 'vouchers' / filename
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
-        return str(file_path)
+    def _save_delivery_image(self, image_bytes: ImageSource, vehicle_no: str) -> str:
+        """保存单张联单图片（内容寻址，同图复用），返回路径"""
+        return save_image(image_bytes, "delivery_orders")
+
+    def _save_voucher_image(self, image_bytes: ImageSource, vehicle_no: str, index: int) -> str:
+        """保存单张凭证图片（内容寻址，同图复用），返回路径"""
+        return save_image(image_bytes, "vouchers")
 
     def create_delivery(
             self,
             data: Dict,
-            delivery_order_image: bytes = None,
-            voucher_images: List[bytes] = None,
+            delivery_order_image: ImageSource = None,
+            voucher_images: List[ImageSource] = None,
             current_user: dict = None,
             confirm_flag: bool = False
     ) -> Dict[str, Any]:
@@ -1219,7 +1195,6 @@ class DeliveryService:
             data['contract_unit_price'] = unit_price
             data['total_amount'] = total_amount
 
-            _ensure_delivery_order_plan_columns()
             op_match = self._match_order_plan_for_delivery(
                 contract_id, reporter_id, planned_trucks
             )
@@ -1271,6 +1246,7 @@ class DeliveryService:
                         'position',
                     ]
                     main_product = products[0] if products else data.get('product_name')
+                    status = data.get('status', '待审核')
                     # 确保主品种也经过映射
                     values = [
                         data.get('report_date'),
@@ -1297,7 +1273,7 @@ class DeliveryService:
                         order_plan_flag_int,
                         unit_price,
                         total_amount,
-                        data.get('status', '待审核'),
+                        status,
                         uploader_id,
                         uploader_name,
                         reporter_id,
@@ -1317,12 +1293,29 @@ class DeliveryService:
                         ({fields_str}, uploaded_at)
                         VALUES ({placeholders}, NOW())
                     """
-                    cur.execute(sql, tuple(values))
-                    delivery_id = cur.lastrowid
+                    # 新单与合同车数台账同一事务：以审核通过状态写入时锁台账行复核余量，超出则整单回滚
+                    conn.begin()
+                    try:
+                        cur.execute(sql, tuple(values))
+                        delivery_id = cur.lastrowid
+                        capacity_error = apply_delivery_change(
+                            cur, None, {"status": status, "contract_no": contract_no, "planned_trucks": planned_trucks}
+                        )
+                        if capacity_error:
+                            conn.rollback()
+                            for f in temp_files:
+                                release_image(f)
+                            return {"success": False, "error": capacity_error}
+                        refresh_contract_progress(cur, [contract_no], parts=(DELIVERIES,))
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    self._record_duplicate_window(delivery_id, driver_phone, driver_id_card)
+                    invalidate_manager_allocation()
 
                     # 创建磅单记录（原有逻辑）
                     if products and contract_no:
-                        self._ensure_weighbill_order_plan_last_column()
                         self._create_weighbills(
                             delivery_id=delivery_id,
                             contract_no=contract_no,
@@ -1409,11 +1402,7 @@ class DeliveryService:
         except Exception as e:
             # 异常时清理已保存的临时文件
             for f in temp_files:
-                try:
-                    if os.path.exists(f):
-                        os.remove(f)
-                except:
-                    pass
+                release_image(f)
             logger.exception(f"【DEBUG】创建报货订单异常: {e}")
             return {"success": False, "error": str(e)}
 
@@ -1421,8 +1410,8 @@ class DeliveryService:
             self,
             delivery_id: int,
             data: Dict,
-            delivery_order_image: bytes = None,
-            voucher_images: List[bytes] = None,
+            delivery_order_image: ImageSource = None,
+            voucher_images: List[ImageSource] = None,
             delete_image: bool = False,
             uploaded_by: str = None,
             current_user: dict = None
@@ -1603,15 +1592,45 @@ class DeliveryService:
                     set_clause = ', '.join([f"{f}=%s" for f in fields])
                     params = [update_data[f] for f in fields]
                     params.append(delivery_id)
-                    cur.execute(f"UPDATE pd_deliveries SET {set_clause} WHERE id = %s", tuple(params))
+
+                    # 审核状态/车数/合同变化时与合同车数台账同一事务更新；报单行与台账行加锁，并发审核串行复核余量
+                    conn.begin()
+                    try:
+                        cur.execute(
+                            "SELECT status, contract_no, planned_trucks FROM pd_deliveries WHERE id = %s FOR UPDATE",
+                            (delivery_id,),
+                        )
+                        locked = cur.fetchone()
+                        after = (
+                            {k: update_data.get(k, locked.get(k)) for k in ("status", "contract_no", "planned_trucks")}
+                            if locked else None
+                        )
+                        capacity_error = apply_delivery_change(cur, locked, after)
+                        if capacity_error:
+                            conn.rollback()
+                            for f in temp_new_files:
+                                release_image(f)
+                            return {"success": False, "error": capacity_error}
+                        cur.execute(f"UPDATE pd_deliveries SET {set_clause} WHERE id = %s", tuple(params))
+                        if 'driver_phone' in update_data or 'driver_id_card' in update_data:
+                            self._record_duplicate_window(
+                                delivery_id,
+                                update_data.get('driver_phone', old.get('driver_phone')),
+                                update_data.get('driver_id_card', old.get('driver_id_card')),
+                            )
+                        if locked and "contract_no" in update_data:
+                            refresh_contract_progress(
+                                cur, [locked.get("contract_no"), update_data.get("contract_no")], parts=(DELIVERIES,)
+                            )
+                        conn.commit()
+                        invalidate_manager_allocation()
+                    except Exception:
+                        conn.rollback()
+                        raise
 
                     # 删除旧图片文件
                     for p in old_images_to_delete:
-                        try:
-                            if os.path.exists(p):
-                                os.remove(p)
-                        except Exception as e:
-                            logger.warning(f"删除旧图片失败: {e}")
+                        release_image(p)
 
                     # 合同编号变更时重新同步品类单价表
                     if "contract_no" in data:
@@ -1648,11 +1667,7 @@ class DeliveryService:
         except Exception as e:
             # 清理临时新文件
             for f in temp_new_files:
-                try:
-                    if os.path.exists(f):
-                        os.remove(f)
-                except:
-                    pass
+                release_image(f)
             logger.error(f"更新报货订单失败: {e}")
             return {"success": False, "error": str(e)}
     # delivery_service.py - class DeliveryService
@@ -1705,7 +1720,7 @@ class DeliveryService:
         if result.get("success") and new_status == "审核未通过":
             self._delete_unuploaded_weighbills_for_delivery(delivery_id)
         return result
-    def add_voucher_images(self, delivery_id: int, image_bytes_list: List[bytes], vehicle_no: str = None) -> Dict[
+    def add_voucher_images(self, delivery_id: int, image_bytes_list: List[ImageSource], vehicle_no: str = None) -> Dict[
         str, Any]:
         """向指定订单追加凭证图片（最多6张）"""
         try:
@@ -1789,8 +1804,7 @@ class DeliveryService:
 
                     # 删除文件
                     path_to_delete = vouchers.pop(index)
-                    if path_to_delete and os.path.exists(path_to_delete):
-                        os.remove(path_to_delete)
+                    release_image(path_to_delete)
 
                     # 更新数据库
                     new_value = json.dumps(vouchers) if vouchers else None
@@ -1832,7 +1846,7 @@ class DeliveryService:
         参数:
             items: 上传项列表，每项包含：
                 - delivery_id: 报单ID
-                - image_bytes: 图片字节数据
+                - image_bytes: 图片字节数据或已落盘的文件句柄
                 - has_delivery_order: 联单状态（有/无）
             uploaded_by: 上传者身份（司机/公司）
 
@@ -1889,12 +1903,7 @@ class DeliveryService:
                                 continue
 
                             # 保存图片文件
-                            safe_name = re.sub(r'[^\w\-]', '_', str(old.get('vehicle_no', delivery_id)))
-                            filename = f"delivery_{safe_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
-                            file_path = UPLOAD_DIR / filename
-
-                            with open(file_path, "wb") as f:
-                                f.write(image_bytes)
+                            file_path = self._save_delivery_image(image_bytes, old.get('vehicle_no'))
 
                             # 计算联单费
                             service_fee = self._calculate_service_fee(has_order)
@@ -2078,10 +2087,21 @@ class DeliveryService:
             date_from: str = None,
             date_to: str = None,
             page: int = 1,
-            page_size: int = 20
+            page_size: int = 20,
+            cursor: str = None,
+            cursor_mode: bool = False,
+            count_mode: str = "exact"
     ) -> Dict[str, Any]:
-        """查询订单列表"""
+        """
+        查询订单列表
+
+        cursor_mode=True 或传入 cursor 时按 (created_at, id) 键集分页（忽略 page），
+        返回 next_cursor / has_more；count_mode 见 `app.utils.keyset_cursor`。
+        """
         try:
+            validate_count_mode(count_mode)
+            use_cursor = cursor_mode or bool(cursor)
+            after_key = decode_cursor(cursor) if cursor else None
             with get_conn() as conn:
                 with conn.cursor() as cur:
                     where_clauses = []
@@ -2143,15 +2163,22 @@ class DeliveryService:
                     if fuzzy_keywords:
                         tokens = [t for t in fuzzy_keywords.split() if t]
                         or_clauses = []
+                        like_params = []
                         for token in tokens:
                             like = f"%{token}%"
                             or_clauses.append(
                                 "(vehicle_no LIKE %s OR driver_name LIKE %s OR driver_phone LIKE %s "
                                 "OR target_factory_name LIKE %s OR product_name LIKE %s OR contract_no LIKE %s "
                                 "OR reporter_name LIKE %s OR shipper LIKE %s)")
-                            params.extend([like, like, like, like, like, like, like, like])
+                            like_params.extend([like, like, like, like, like, like, like, like])
                         if or_clauses:
-                            where_clauses.append("(" + " OR ".join(or_clauses) + ")")
+                            # 有 ngram 全文索引时先 MATCH 取候选行，再由 LIKE 精确过滤
+                            keyword_sql, keyword_params = keyword_filter(
+                                cur, "pd_deliveries", "", tokens,
+                                "(" + " OR ".join(or_clauses) + ")", like_params,
+                            )
+                            where_clauses.append(keyword_sql)
+                            params.extend(keyword_params)
 
                     if date_from:
                         where_clauses.append("report_date >= %s")
@@ -2163,18 +2190,41 @@ class DeliveryService:
 
                     where_sql = "WHERE " + " AND ".join(where_clauses) if where_clauses else ""
 
-                    cur.execute(f"SELECT COUNT(*) as total FROM pd_deliveries {where_sql}", tuple(params))
-                    total = cur.fetchone()["total"]
+                    total = count_total(
+                        cur,
+                        f"SELECT COUNT(*) as total FROM pd_deliveries {where_sql}",
+                        params,
+                        count_mode,
+                        estimate_sql=f"SELECT * FROM pd_deliveries {where_sql}",
+                    )
 
-                    offset = (page - 1) * page_size
-                    cur.execute(f"""
-                        SELECT * FROM pd_deliveries 
-                        {where_sql}
-                        ORDER BY created_at DESC
-                        LIMIT %s OFFSET %s
-                    """, tuple(params + [page_size, offset]))
+                    next_cursor = None
+                    if use_cursor:
+                        page_clauses = list(where_clauses)
+                        page_params = list(params)
+                        if after_key is not None:
+                            page_clauses.append(keyset_before_sql("created_at", "id"))
+                            page_params.extend(keyset_before_params(after_key))
+                        page_where = "WHERE " + " AND ".join(page_clauses) if page_clauses else ""
+                        cur.execute(f"""
+                            SELECT * FROM pd_deliveries
+                            {page_where}
+                            ORDER BY created_at DESC, id DESC
+                            LIMIT %s
+                        """, tuple(page_params + [page_size + 1]))
+                        rows, next_cursor = split_page(
+                            cur.fetchall(), page_size, lambda r: (r["created_at"], r["id"])
+                        )
+                    else:
+                        offset = (page - 1) * page_size
+                        cur.execute(f"""
+                            SELECT * FROM pd_deliveries 
+                            {where_sql}
+                            ORDER BY created_at DESC
+                            LIMIT %s OFFSET %s
+                        """, tuple(params + [page_size, offset]))
+                        rows = cur.fetchall()
 
-                    rows = cur.fetchall()
                     data = []
                     for row in rows:
                         item = dict(row)
@@ -2219,13 +2269,17 @@ class DeliveryService:
 
                     _attach_contract_product_prices_to_delivery_rows(data)
 
-                    return {
+                    result = {
                         "success": True,
                         "data": data,
                         "total": total,
-                        "page": page,
+                        "page": None if use_cursor else page,
                         "page_size": page_size
                     }
+                    if use_cursor:
+                        result["next_cursor"] = next_cursor
+                        result["has_more"] = next_cursor is not None
+                    return result
 
         except Exception as e:
             logger.error(f"查询列表失败: {e}")
@@ -2240,27 +2294,34 @@ class DeliveryService:
                     cur.execute("SELECT weighbill_image FROM pd_weighbills WHERE delivery_id = %s", (delivery_id,))
                     for row in cur.fetchall():
                         image_path = row.get('weighbill_image') if isinstance(row, dict) else row[0]
-                        if image_path and os.path.exists(image_path):
-                            try:
-                                os.remove(image_path)
-                            except:
-                                pass
+                        release_image(image_path)
 
                     # 获取联单图片路径
                     cur.execute("SELECT delivery_order_image FROM pd_deliveries WHERE id = %s", (delivery_id,))
                     row = cur.fetchone()
 
                     image_path = row.get('delivery_order_image') if isinstance(row, dict) else (row[0] if row else None)
-                    if image_path:
-                        cur.execute("DELETE FROM pd_deliveries WHERE id = %s", (delivery_id,))
-
-                        if os.path.exists(image_path):
-                            try:
-                                os.remove(image_path)
-                            except Exception as e:
-                                logger.warning(f"删除图片文件失败: {e}")
-                    else:
+                    conn.begin()
+                    try:
+                        cur.execute(
+                            "SELECT status, contract_no, planned_trucks, driver_phone, driver_id_card FROM pd_deliveries WHERE id = %s FOR UPDATE",
+                            (delivery_id,),
+                        )
+                        locked = cur.fetchone()
+                        apply_delivery_change(cur, locked, None)
                         cur.execute("DELETE FROM pd_deliveries WHERE id = %s", (delivery_id,))
+                        if locked:
+                            refresh_contract_progress(cur, [locked.get("contract_no")], parts=(DELIVERIES,))
+                        conn.commit()
+                        invalidate_manager_allocation()
+                        window = get_duplicate_window()
+                        if window is not None and locked:
+                            window.forget(delivery_id, locked.get("driver_phone"), locked.get("driver_id_card"))
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    if image_path:
+                        release_image(image_path)
 
                     return {"success": True, "message": "删除成功"}
 
@@ -2331,12 +2392,8 @@ class DeliveryService:
             # 解析API返回结果
             content = completion.choices[0].message.content
             
-            # 尝试从返回内容中提取JSON
-            import json
-            import re
-            
             # 查找JSON块
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
+            json_match = _JSON_BLOCK.search(content)
             if json_match:
                 result = json.loads(json_match.group())
             else:
@@ -2375,18 +2432,18 @@ class DeliveryService:
         # 车牌号：标准7位（省简称+字母+5位），也支持新能源8位
         if data.get('vehicle_no'):
             plate = str(data['vehicle_no']).strip().upper()
-            if re.match(r'[京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6}', plate):
+            if _PLATE.match(plate):
                 result['vehicle_no'] = plate
         
         # 司机姓名：支持2字、3字、4字或更多
         if data.get('driver_name'):
             name = str(data['driver_name']).strip()
-            if len(name) >= 1 and re.match(r'^[\u4e00-\u9fa5a-zA-Z·]+$', name):
+            if len(name) >= 1 and _DRIVER_NAME.match(name):
                 result['driver_name'] = name
         
         # 手机号
         if data.get('driver_phone'):
-            phone = re.sub(r'\D', '', str(data['driver_phone']))
+            phone = _NON_DIGITS.sub('', str(data['driver_phone']))
             if len(phone) == 11 and phone.startswith(('13', '14', '15', '16', '17', '18', '19')):
                 result['driver_phone'] = phone
         
@@ -2469,12 +2526,12 @@ class DeliveryService:
         
         if data.get('driver_id_card'):
             id_card = data['driver_id_card']
-            if len(id_card) != 18 or not re.match(r'^\d{17}[\dXx]$', id_card):
+            if len(id_card) != 18 or not _ID_CARD.match(id_card):
                 data['driver_id_card_error'] = '身份證號格式不正確（應為18位）'
         
         if data.get('vehicle_no'):
             plate = data['vehicle_no']
-            if not re.match(r'[京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6}', plate):
+            if not _PLATE.match(plate):
                 data['vehicle_no_error'] = '車牌號格式不正確（標準7位：省+字母+5位）'
         
         return {
@@ -2491,15 +2548,7 @@ class DeliveryService:
     ) -> Dict[str, Any]:
         """根据工厂名称和品种匹配合同"""
         if not factory_name or not product_name:
-            return {
-                'matched': False,
-                'contract_no': None,
-                'contract_id': None,
-                'unit_price': None,
-                'smelter_company': None,
-                'match_type': 'none',
-                'reason': '工厂名称或品种为空'
-            }
+            return _contract_unmatched('none', '工厂名称或品种为空')
         
         try:
             with get_conn() as conn:
@@ -2507,42 +2556,15 @@ class DeliveryService:
                     effective_date = report_date or datetime.today().date().isoformat()
                     
                     # 工厂别名映射
-                    factory_keywords = [factory_name]
-                    factory_aliases = {
-                        '金利': ['金利', '河南金利', '金利金铅'],
-                        '豫光': ['豫光', '河南豫光', '豫光金铅'],
-                        '万洋': ['万洋', '河南万洋'],
-                        '大华': ['大华', '河北大华'],
-                        '金凤': ['金凤', '河北金凤'],
-                        '南方': ['南方', '广东南方'],
-                        '中原': ['中原', '河南中原'],
-                        '华铂': ['华铂', '安徽华铂'],
-                    }
-                    
-                    for key, aliases in factory_aliases.items():
-                        if key in factory_name:
-                            factory_keywords.extend(aliases)
-                    
-                    factory_keywords = list(set(factory_keywords))
+                    keywords = factory_keywords(factory_name)
                     
                     # 构建工厂查询条件
-                    factory_conditions = []
-                    for keyword in factory_keywords:
-                        factory_conditions.append("c.smelter_company LIKE %s")
-                    
-                    factory_sql = " OR ".join(factory_conditions)
-                    factory_params = [f"%{k}%" for k in factory_keywords]
+                    factory_sql = " OR ".join(["c.smelter_company LIKE %s"] * len(keywords))
+                    factory_params = [f"%{k}%" for k in keywords]
                     
                     # 先精确匹配品种
                     sql = f"""
-                        SELECT 
-                            c.id,
-                            c.contract_no,
-                            c.smelter_company,
-                            p.unit_price,
-                            p.product_name as matched_product,
-                            c.contract_date,
-                            c.end_date
+                        SELECT {_CONTRACT_MATCH_COLUMNS}
                         FROM pd_contracts c
                         JOIN pd_contract_products p ON p.contract_id = c.id
                         WHERE ({factory_sql})
@@ -2561,31 +2583,14 @@ class DeliveryService:
                     row = cur.fetchone()
                     
                     if row:
-                        contract_id = row['id'] if isinstance(row, dict) else row[0]
-                        contract_no = row['contract_no'] if isinstance(row, dict) else row[1]
-                        unit_price_val = (row['unit_price'] if isinstance(row, dict) else row[3])
+                        match = _contract_match_from_row(row, 'exact')
                         contract_date = row.get('contract_date') if isinstance(row, dict) else row[5]
-                        logger.debug(f"匹配到合同(exact): id={contract_id}, no={contract_no}, date={contract_date}, unit_price={unit_price_val}")
-                        return {
-                            'matched': True,
-                            'contract_no': contract_no,
-                            'contract_id': contract_id,
-                            'unit_price': float(unit_price_val) if unit_price_val is not None else None,
-                            'smelter_company': row['smelter_company'] if isinstance(row, dict) else row[2],
-                            'match_type': 'exact',
-                            'matched_product': row['matched_product'] if isinstance(row, dict) else row[4],
-                        }
+                        logger.debug(f"匹配到合同(exact): id={match['contract_id']}, no={match['contract_no']}, date={contract_date}, unit_price={match['unit_price']}")
+                        return match
                     
                     # 模糊匹配品种
                     fuzzy_sql = f"""
-                        SELECT 
-                            c.id,
-                            c.contract_no,
-                            c.smelter_company,
-                            p.unit_price,
-                            p.product_name as matched_product,
-                            c.contract_date,
-                            c.end_date
+                        SELECT {_CONTRACT_MATCH_COLUMNS}
                         FROM pd_contracts c
                         JOIN pd_contract_products p ON p.contract_id = c.id
                         WHERE ({factory_sql})
@@ -2604,42 +2609,16 @@ class DeliveryService:
                     row = cur.fetchone()
                     
                     if row:
-                        contract_id = row['id'] if isinstance(row, dict) else row[0]
-                        contract_no = row['contract_no'] if isinstance(row, dict) else row[1]
-                        unit_price_val = (row['unit_price'] if isinstance(row, dict) else row[3])
+                        match = _contract_match_from_row(row, 'fuzzy')
                         contract_date = row.get('contract_date') if isinstance(row, dict) else row[5]
-                        logger.debug(f"匹配到合同(fuzzy): id={contract_id}, no={contract_no}, date={contract_date}, unit_price={unit_price_val}")
-                        return {
-                            'matched': True,
-                            'contract_no': contract_no,
-                            'contract_id': contract_id,
-                            'unit_price': float(unit_price_val) if unit_price_val is not None else None,
-                            'smelter_company': row['smelter_company'] if isinstance(row, dict) else row[2],
-                            'match_type': 'fuzzy',
-                            'matched_product': row['matched_product'] if isinstance(row, dict) else row[4],
-                        }
+                        logger.debug(f"匹配到合同(fuzzy): id={match['contract_id']}, no={match['contract_no']}, date={contract_date}, unit_price={match['unit_price']}")
+                        return match
                     
-                    return {
-                        'matched': False,
-                        'contract_no': None,
-                        'contract_id': None,
-                        'unit_price': None,
-                        'smelter_company': None,
-                        'match_type': 'none',
-                        'reason': f'未找到工厂[{factory_name}]品种[{product_name}]的生效合同'
-                    }
+                    return _contract_unmatched('none', f'未找到工厂[{factory_name}]品种[{product_name}]的生效合同')
                     
         except Exception as e:
             logger.error(f"合同匹配失败: {e}")
-            return {
-                'matched': False,
-                'contract_no': None,
-                'contract_id': None,
-                'unit_price': None,
-                'smelter_company': None,
-                'match_type': 'error',
-                'reason': f'匹配异常: {str(e)}'
-            }
+            return _contract_unmatched('error', f'匹配异常: {str(e)}')
 
     def extract_with_contract(
         self, 
@@ -2650,10 +2629,25 @@ class DeliveryService:
         # 1. 提取基础信息
         extracted = self.extract_from_text(text)
         
-        # 2. 验证数据
+        # 2. 验证数据、转换品种
+        validation = self._prepare_extracted(extracted)
+        
+        # 3. 匹配合同
+        factory_for_match = extracted.get('target_factory_name')
+        contract_match = self.match_contract_by_factory_and_product(
+            factory_name=factory_for_match,
+            product_name=extracted.get('product_name'),
+            report_date=report_date
+        )
+
+        logger.debug(f"合同匹配结果: factory={factory_for_match}, product={extracted.get('product_name')}, result={contract_match}")
+        
+        return self._assemble_extraction(extracted, validation, contract_match)
+
+    def _prepare_extracted(self, extracted: Dict[str, Any]) -> Dict[str, Any]:
+        """验证提取结果，并把品种就地转换为冶炼厂品种（支持多个品类）；返回验证结果"""
         validation = self.validate_extracted(extracted.copy())
 
-        # ---- 转换品种为冶炼厂品种（支持多个品类）----
         original_products = self._parse_products(extracted.get('products'), extracted.get('product_name'))
         mapped_products: List[str] = []
         for p in original_products:
@@ -2664,20 +2658,12 @@ class DeliveryService:
         if mapped_products:
             extracted['products'] = mapped_products
             extracted['product_name'] = mapped_products[0]
-        mill_product = extracted.get('product_name')
-        # ----------------------------------------------
-        
-        # 3. 匹配合同
-        factory_for_match = extracted.get('target_factory_name')
-        contract_match = self.match_contract_by_factory_and_product(
-            factory_name=factory_for_match,
-            product_name=mill_product,
-            report_date=report_date
-        )
+        return validation
 
-        logger.debug(f"合同匹配结果: factory={factory_for_match}, product={extracted.get('product_name')}, result={contract_match}")
-        
-        # 4. 组装结果
+    def _assemble_extraction(
+        self, extracted: Dict[str, Any], validation: Dict[str, Any], contract_match: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """组装解析结果；匹配到合同时把合同信息写回提取数据并给出建议报单数据"""
         result = {
             'success': True,
             'extracted': extracted,
@@ -2686,7 +2672,6 @@ class DeliveryService:
             'ready_to_create': validation['is_valid'] and contract_match['matched']
         }
         
-        # 5. 如果匹配成功，添加合同信息到提取数据
         if contract_match['matched']:
             extracted['contract_no'] = contract_match['contract_no']
             extracted['contract_id'] = contract_match['contract_id']
@@ -2702,7 +2687,123 @@ class DeliveryService:
         
         return result
 
-    def upload_delivery_pdf(self, delivery_id: int, pdf_bytes: bytes, uploaded_by: str = None) -> Dict[str, Any]:
+    def match_contracts_batch(
+            self,
+            pairs: Sequence[Tuple[Optional[str], Optional[str]]],
+            report_date: Optional[str] = None,
+    ) -> Dict[Tuple[Optional[str], Optional[str]], Dict[str, Any]]:
+        """
+        批量版 match_contract_by_factory_and_product：(工厂, 品种) 去重后一次查询取回全部候选合同品种行，
+        按原规则（品种精确相等优先，否则品种包含；同级按签订日期、创建时间、品种顺序）逐组挑选。
+        返回 {(工厂, 品种): 匹配结果}，结果结构与单条匹配相同。
+        """
+        results: Dict[Tuple[Optional[str], Optional[str]], Dict[str, Any]] = {}
+        wanted = []
+        for pair in dict.fromkeys(pairs):
+            if not pair[0] or not pair[1]:
+                results[pair] = _contract_unmatched('none', '工厂名称或品种为空')
+            else:
+                wanted.append(pair)
+        if not wanted:
+            return results
+
+        keywords = {pair: factory_keywords(pair[0]) for pair in wanted}
+        all_keywords = list(dict.fromkeys(k for ks in keywords.values() for k in ks))
+        products = list(dict.fromkeys(product for _, product in wanted))
+        effective_date = report_date or datetime.today().date().isoformat()
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT {_CONTRACT_MATCH_COLUMNS}
+                        FROM pd_contracts c
+                        JOIN pd_contract_products p ON p.contract_id = c.id
+                        WHERE ({" OR ".join(["c.smelter_company LIKE %s"] * len(all_keywords))})
+                        AND ({" OR ".join(["p.product_name LIKE %s"] * len(products))})
+                        AND p.unit_price > 0
+                        AND c.status = '生效中'
+                        AND c.contract_date <= %s
+                        AND (c.end_date IS NULL OR c.end_date >= %s)
+                        ORDER BY c.contract_date ASC, c.created_at ASC, p.sort_order ASC
+                    """, tuple(
+                        [f"%{k}%" for k in all_keywords] + [f"%{p}%" for p in products] + [effective_date, effective_date]
+                    ))
+                    columns = [d[0] for d in cur.description or ()]
+                    rows = [row if isinstance(row, dict) else dict(zip(columns, row)) for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"批量合同匹配失败: {e}")
+            for pair in wanted:
+                results[pair] = _contract_unmatched('error', f'匹配异常: {str(e)}')
+            return results
+
+        for pair in wanted:
+            factory_name, product_name = pair
+            lowered = [k.casefold() for k in keywords[pair]]
+            product_key = product_name.casefold()
+            candidates = [
+                r for r in rows
+                if any(k in str(r.get('smelter_company') or '').casefold() for k in lowered)
+            ]
+            exact = next((r for r in candidates if str(r.get('matched_product') or '').casefold() == product_key), None)
+            if exact is not None:
+                results[pair] = _contract_match_from_row(exact, 'exact')
+                continue
+            fuzzy = next((r for r in candidates if product_key in str(r.get('matched_product') or '').casefold()), None)
+            if fuzzy is not None:
+                results[pair] = _contract_match_from_row(fuzzy, 'fuzzy')
+            else:
+                results[pair] = _contract_unmatched('none', f'未找到工厂[{factory_name}]品种[{product_name}]的生效合同')
+        return results
+
+    def extract_with_contract_batch(
+            self,
+            texts: Sequence[str],
+            report_date: Optional[str] = None,
+            max_workers: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        批量解析报单文本（调度一次粘贴多条微信消息）：
+        - 相同文本只提取一次，不同文本并行调用大模型提取；
+        - 全部 (工厂, 品种) 去重后一次查询匹配合同；
+        - 全部司机手机号 / 身份证号一次 IN 查询做 24 小时重复校验，并标出本批中更早出现的同一司机。
+        每条结果与 extract_with_contract 相同，另附 index、duplicate_check，按输入顺序返回。
+        """
+        texts = list(texts)
+        unique = list(dict.fromkeys(texts))
+        workers = int(max_workers if max_workers is not None else settings.delivery_text_batch_max_workers)
+        workers = max(1, min(workers, len(unique) or 1))
+        if workers == 1:
+            extracted_by_text = {text: self.extract_from_text(text) for text in unique}
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="delivery-extract") as executor:
+                extracted_by_text = dict(zip(unique, executor.map(self.extract_from_text, unique)))
+
+        prepared = []
+        for text in texts:
+            extracted = copy.deepcopy(extracted_by_text[text])
+            prepared.append((extracted, self._prepare_extracted(extracted)))
+
+        pairs = [(e.get('target_factory_name'), e.get('product_name')) for e, _ in prepared]
+        matches = self.match_contracts_batch(pairs, report_date=report_date)
+        drivers = [(e.get('driver_phone'), e.get('driver_id_card')) for e, _ in prepared]
+        duplicates = self.check_duplicates_in_24h_batch(drivers)
+
+        earlier: Dict[str, List[int]] = {}
+        data = []
+        for index, ((extracted, validation), pair, driver, duplicate) in enumerate(
+                zip(prepared, pairs, drivers, duplicates)):
+            item = self._assemble_extraction(extracted, validation, dict(matches[pair]))
+            identifiers = [v for v in driver if v]
+            duplicate['batch_duplicates'] = sorted({i for v in identifiers for i in earlier.get(v, [])})
+            for v in dict.fromkeys(identifiers):
+                earlier.setdefault(v, []).append(index)
+            item['index'] = index
+            item['duplicate_check'] = duplicate
+            data.append(item)
+
+        return {"success": True, "total": len(data), "data": data}
+
+    def upload_delivery_pdf(self, delivery_id: int, pdf_bytes: ImageSource, uploaded_by: str = None) -> Dict[str, Any]:
         """上传联单 PDF 文件，保存路径到 delivery_order_pdf"""
         try:
             with get_conn() as conn:
@@ -2726,7 +2827,7 @@ class DeliveryService:
                     filename = f"delivery_{safe_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.pdf"
                     file_path = UPLOAD_DIR / filename
                     with open(file_path, "wb") as f:
-                        f.write(pdf_bytes)
+                        copy_image_source(pdf_bytes, f)
 
                     # 上传 PDF 也属于联单上传，需同步更新上传状态
                     cur.execute("""
@@ -2752,7 +2853,7 @@ class DeliveryService:
             logger.error(f"上传 PDF 失败: {e}")
             return {"success": False, "error": str(e)}
 
-    def update_delivery_pdf(self, delivery_id: int, pdf_bytes: bytes, uploaded_by: str = None) -> Dict[str, Any]:
+    def update_delivery_pdf(self, delivery_id: int, pdf_bytes: ImageSource, uploaded_by: str = None) -> Dict[str, Any]:
         """替换 PDF 文件（覆盖原有）"""
         try:
             with get_conn() as conn:
@@ -2771,7 +2872,7 @@ class DeliveryService:
                     filename = f"delivery_{safe_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.pdf"
                     file_path = UPLOAD_DIR / filename
                     with open(file_path, "wb") as f:
-                        f.write(pdf_bytes)
+                        copy_image_source(pdf_bytes, f)
 
                     # 替换 PDF 时也保持上传状态为已上传
                     cur.execute("UPDATE pd_deliveries SET delivery_order_pdf = %s, upload_status = '已上传', uploaded_at = NOW(), updated_at = NOW() WHERE id = %s",
@@ -0,0 +1,286 @@
+"""
+24 小时重复报单校验的司机号码滑动窗口。
+
+原校验对 pd_deliveries 执行 `created_at >= NOW() - 24h AND ((driver_phone = ? OR driver_id_card = ?) OR ...)`：
+身份证号分支用不上 `idx_driver_phone_created_at`，每次建单都退化为按时间范围扫描近 24 小时全部报单。现在：
+
+- 窗口以规范化（`normalize_identifier`：去首尾空白、转大写）后的号码为键（手机号、身份证号不区分列，与原校验
+  "任一号码命中任一列"的语义一致），记录近 24 小时用到该号码的报单 id 及其创建时间；
+  建单后 `record`、删单后 `forget`，启动时 `seed` 从库中载入近 24 小时报单；
+- 窗口只用来给出**候选** id，是库中真实命中集合的超集（时间边界多留 `SLACK_SECONDS`，改号、漏删都只会多出候选）；
+  候选为空时免查库，非空时调用方按主键回库复核，结果仍以库为准；
+- 窗口未就绪（尚未载入、Redis 不可用、写入失败后）时 `candidates` 返回 None，调用方改走索引查询：
+  `driver_phone IN (...)` 与 `driver_id_card IN (...)` 两条分别命中 `(列, created_at)` 索引的查询 UNION。
+
+后端由 `settings.driver_duplicate_window_backend` 选择：`redis`（多 worker 共享，键 `pd:dup24h:{号码}` 为按时间排序的
+有序集合）、`memory`（进程内，仅适用于单 worker 部署与测试）、`db`（默认，不建窗口，始终走索引查询）。
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = 24 * 3600
+# 应用与数据库时钟偏差、建单事务提交与写窗口之间的间隔：候选宁多勿少
+SLACK_SECONDS = 600
+
+REDIS_KEY_PREFIX = "pd:dup24h:"
+REDIS_READY_KEY = REDIS_KEY_PREFIX + "__ready__"
+
+# 近 24 小时报单（载入窗口用），created_at 按数据库时钟换算成 Unix 时间
+SEED_SQL = """
+    SELECT id, driver_phone, driver_id_card, UNIX_TIMESTAMP(created_at) AS created_ts
+    FROM pd_deliveries
+    WHERE created_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR)
+    AND (driver_phone IS NOT NULL OR driver_id_card IS NOT NULL)
+"""
+
+
+def normalize_identifier(value: Any) -> str:
+    """号码规范形式：去首尾空白、转大写（身份证号末位 x/X 同号；库里排序规则本就不区分大小写）。"""
+    return str(value).strip().upper() if value is not None else ""
+
+
+def driver_identifiers(*values: Optional[str]) -> List[str]:
+    """规范化、去空、去重保序后的号码列表；窗口键、查询参数与回库过滤都用这一形式。"""
+    return list(dict.fromkeys(key for key in map(normalize_identifier, values) if key))
+
+
+def indexed_recent_orders_sql(columns: str, identifier_count: int, exclude_id: Optional[int] = None) -> str:
+    """
+    号码命中任一列、近 24 小时的报单：两条各自走 `(列, created_at)` 索引的查询 UNION（去重同时命中两列的行）。
+    参数见 `indexed_recent_orders_params`。
+    """
+    placeholders = ",".join(["%s"] * identifier_count)
+    exclude = " AND id != %s" if exclude_id else ""
+    branches = [
+        f"""SELECT {columns} FROM pd_deliveries
+            WHERE {column} IN ({placeholders}) AND created_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR){exclude}"""
+        for column in ("driver_phone", "driver_id_card")
+    ]
+    return f"({branches[0]}) UNION ({branches[1]}) ORDER BY created_at DESC"
+
+
+def indexed_recent_orders_params(identifiers: Sequence[str], exclude_id: Optional[int] = None) -> Tuple[Any, ...]:
+    """号码… [exclude_id]，两条子查询各一份。"""
+    branch = tuple(identifiers) + ((exclude_id,) if exclude_id else ())
+    return branch * 2
+
+
+class MemoryWindowStore:
+    """进程内窗口：号码 → {报单 id: 创建时间}；读写时顺带清理过期项，整表清理至多每 `sweep_interval` 秒一次。"""
+
+    def __init__(self, sweep_interval: float = 300.0):
+        self._entries: Dict[str, Dict[int, float]] = {}
+        self._lock = threading.Lock()
+        self._ready = False
+        self._sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+
+    def is_ready(self) -> bool:
+        return self._ready
+
+    def mark_ready(self, ready: bool = True) -> None:
+        self._ready = ready
+
+    def add(self, delivery_id: int, identifiers: Iterable[str], ts: float) -> None:
+        with self._lock:
+            for key in identifiers:
+                self._entries.setdefault(key, {})[delivery_id] = ts
+            self._maybe_sweep(ts)
+
+    def remove(self, delivery_id: int, identifiers: Iterable[str]) -> None:
+        with self._lock:
+            for key in identifiers:
+                ids = self._entries.get(key)
+                if ids is not None:
+                    ids.pop(delivery_id, None)
+                    if not ids:
+                        del self._entries[key]
+
+    def lookup(self, identifiers: Iterable[str], since: float) -> List[int]:
+        found: Dict[int, None] = {}
+        with self._lock:
+            for key in identifiers:
+                ids = self._entries.get(key)
+                if not ids:
+                    continue
+                for delivery_id, ts in list(ids.items()):
+                    if ts >= since:
+                        found[delivery_id] = None
+                    else:
+                        del ids[delivery_id]
+                if not ids:
+                    del self._entries[key]
+        return list(found)
+
+    def key_count(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _maybe_sweep(self, now: float) -> None:
+        if now - self._last_sweep < self._sweep_interval:
+            return
+        self._last_sweep = now
+        cutoff = now - WINDOW_SECONDS - SLACK_SECONDS
+        for key in list(self._entries):
+            ids = self._entries[key]
+            for delivery_id in [d for d, ts in ids.items() if ts < cutoff]:
+                del ids[delivery_id]
+            if not ids:
+                del self._entries[key]
+
+
+class RedisWindowStore:
+    """多 worker 共享窗口：每个号码一个有序集合（成员 = 报单 id，分值 = 创建时间），键随窗口过期。"""
+
+    def __init__(self, client: Any):
+        self._client = client
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisWindowStore":
+        import redis
+
+        return cls(redis.Redis.from_url(url, decode_responses=True, socket_timeout=1.0))
+
+    def is_ready(self) -> bool:
+        return bool(self._client.exists(REDIS_READY_KEY))
+
+    def mark_ready(self, ready: bool = True) -> None:
+        if ready:
+            self._client.set(REDIS_READY_KEY, int(time.time()))
+        else:
+            self._client.delete(REDIS_READY_KEY)
+
+    def add(self, delivery_id: int, identifiers: Iterable[str], ts: float) -> None:
+        pipe = self._client.pipeline(transaction=False)
+        for key in identifiers:
+            rkey = REDIS_KEY_PREFIX + key
+            pipe.zadd(rkey, {str(delivery_id): ts})
+            pipe.zremrangebyscore(rkey, "-inf", ts - WINDOW_SECONDS - SLACK_SECONDS)
+            pipe.expire(rkey, WINDOW_SECONDS + SLACK_SECONDS)
+        pipe.execute()
+
+    def remove(self, delivery_id: int, identifiers: Iterable[str]) -> None:
+        pipe = self._client.pipeline(transaction=False)
+        for key in identifiers:
+            pipe.zrem(REDIS_KEY_PREFIX + key, str(delivery_id))
+        pipe.execute()
+
+    def lookup(self, identifiers: Iterable[str], since: float) -> List[int]:
+        pipe = self._client.pipeline(transaction=False)
+        for key in identifiers:
+            pipe.zrangebyscore(REDIS_KEY_PREFIX + key, since, "+inf")
+        found: Dict[int, None] = {}
+        for members in pipe.execute():
+            for member in members:
+                found[int(member)] = None
+        return list(found)
+
+
+class DuplicateDriverWindow:
+    """滑动窗口的读写入口；任何存储异常都不抛给调用方：写失败时撤下就绪标记，读失败时返回 None 让调用方查库。"""
+
+    def __init__(self, store: Any, clock=time.time):
+        self.store = store
+        self._clock = clock
+
+    def seed(self, rows: Iterable[Any]) -> int:
+        """载入近 24 小时报单（`SEED_SQL` 的结果行），完成后标记就绪；返回载入行数。"""
+        count = 0
+        try:
+            for row in rows:
+                if isinstance(row, dict):
+                    delivery_id, phone, id_card, ts = (
+                        row.get("id"), row.get("driver_phone"), row.get("driver_id_card"), row.get("created_ts")
+                    )
+                else:
+                    delivery_id, phone, id_card, ts = row[:4]
+                keys = driver_identifiers(phone, id_card)
+                if delivery_id is None or not keys or ts is None:
+                    continue
+                self.store.add(int(delivery_id), keys, float(ts))
+                count += 1
+            self.store.mark_ready(True)
+        except Exception as e:
+            logger.warning("重复报单窗口载入失败，改走数据库查询: %s", e)
+            self._invalidate()
+        return count
+
+    def record(self, delivery_id: int, driver_phone: Optional[str], driver_id_card: Optional[str],
+               created_ts: Optional[float] = None) -> None:
+        keys = driver_identifiers(driver_phone, driver_id_card)
+        if not delivery_id or not keys:
+            return
+        try:
+            self.store.add(int(delivery_id), keys, self._clock() if created_ts is None else created_ts)
+        except Exception as e:
+            logger.warning("重复报单窗口写入失败 delivery_id=%s，撤下窗口: %s", delivery_id, e)
+            self._invalidate()
+
+    def forget(self, delivery_id: int, driver_phone: Optional[str], driver_id_card: Optional[str]) -> None:
+        # 漏删只会多出候选（回库复核时过滤），失败不撤窗口
+        keys = driver_identifiers(driver_phone, driver_id_card)
+        if not delivery_id or not keys:
+            return
+        try:
+            self.store.remove(int(delivery_id), keys)
+        except Exception as e:
+            logger.warning("重复报单窗口删除失败 delivery_id=%s: %s", delivery_id, e)
+
+    def candidates(self, identifiers: Sequence[str]) -> Optional[List[int]]:
+        """近 24 小时用过这些号码的报单 id（超集）；窗口不可用时返回 None。"""
+        try:
+            if not self.store.is_ready():
+                return None
+            return self.store.lookup(identifiers, self._clock() - WINDOW_SECONDS - SLACK_SECONDS)
+        except Exception as e:
+            logger.warning("重复报单窗口查询失败，改走数据库查询: %s", e)
+            return None
+
+    def _invalidate(self) -> None:
+        try:
+            self.store.mark_ready(False)
+        except Exception:
+            logger.exception("重复报单窗口撤下就绪标记失败")
+
+
+_window: Optional[DuplicateDriverWindow] = None
+_window_lock = threading.Lock()
+
+
+def get_duplicate_window() -> Optional[DuplicateDriverWindow]:
+    """按配置创建的进程级窗口；backend 为 db（或无法创建）时返回 None。"""
+    global _window
+    backend = (settings.driver_duplicate_window_backend or "db").lower()
+    if backend not in ("redis", "memory"):
+        return None
+    if _window is None:
+        with _window_lock:
+            if _window is None:
+                store = (
+                    RedisWindowStore.from_url(settings.prediction_redis_url) if backend == "redis"
+                    else MemoryWindowStore()
+                )
+                _window = DuplicateDriverWindow(store)
+    return _window
+
+
+def seed_duplicate_window(connect=None) -> int:
+    """启动时载入窗口（未启用窗口时直接返回 0）。"""
+    window = get_duplicate_window()
+    if window is None:
+        return 0
+    if connect is None:
+        from core.database import get_conn as connect
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SEED_SQL)
+            rows = cur.fetchall() or []
+    count = window.seed(rows)
+    logger.info("duplicate driver window seeded backend=%s rows=%s", settings.driver_duplicate_window_backend, count)
+    return count
@@ -0,0 +1,393 @@
+"""
+内容寻址图片库：报单联单、凭证、磅单图片的统一存储。
+
+原实现按「前缀_车牌_时间戳_随机串.jpg」把上传字节原样写进 uploads/ 下的平铺目录，同一张照片重复上传就多一份文件，
+查看接口一律返回原图。现改为：
+
+- 按内容 SHA-256 寻址：`<类别>/<hash[0:2]>/<hash[2:4]>/<hash><扩展名>`，重复上传只存一份，目录按哈希前缀分片；
+- 写入时生成缩略图 `thumbs/<hash[0:2]>/<hash[2:4]>/<hash>.webp`（长边 ≤ IMAGE_THUMBNAIL_MAX_SIDE，
+  Pillow 不支持 WebP 时存 JPEG），列表/预览取缩略图，点开再取原图；
+- 存储后端抽象为 `ImageStorageBackend`：本地目录 `LocalImageBackend` 为默认实现，
+  对象存储（MinIO/S3 等）实现同一接口即可替换，引用写为 `store://<键>`。
+
+数据库中仍保存引用字符串：本地后端下即原图绝对路径，PDF 生成、OCR 等直接读路径的代码不受影响。
+内容寻址的文件可能被多条记录共用，删除/替换记录时不删库内文件（`release_image`），旧的平铺文件仍照常删除。
+"""
+import hashlib
+import io
+import logging
+import os
+import shutil
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Optional, Union
+
+from PIL import Image, ImageOps, features
+
+from app.core.config import settings
+from app.core.paths import UPLOADS_DIR
+
+logger = logging.getLogger(__name__)
+
+STORE_REF_PREFIX = "store://"
+THUMBNAIL_QUALITY = 80
+READ_CHUNK_BYTES = 64 * 1024
+
+_PIL_FORMAT_EXT = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "BMP": ".bmp", "GIF": ".gif", "TIFF": ".tif"}
+_EXT_MEDIA_TYPE = {
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".bmp": "image/bmp",
+    ".gif": "image/gif",
+    ".tif": "image/tiff",
+    ".pdf": "application/pdf",
+}
+IMAGE_EXTS = frozenset(ext for ext in _EXT_MEDIA_TYPE if ext != ".pdf")
+VARIANTS = ("original", "thumb")
+
+#: 上传图片：bytes 或已落盘的文件句柄（见 app.utils.upload_spool），服务层按需读取
+ImageSource = Union[bytes, BinaryIO]
+
+
+def copy_image_source(source: ImageSource, out: BinaryIO) -> None:
+    """写入目标文件；句柄按块拷贝。"""
+    if isinstance(source, (bytes, bytearray)):
+        out.write(source)
+        return
+    source.seek(0)
+    shutil.copyfileobj(source, out, READ_CHUNK_BYTES)
+
+
+@dataclass(frozen=True)
+class ObjectInfo:
+    size: int
+    mtime: float
+
+
+class ImageStorageBackend(ABC):
+    """
+    图片库后端：以 `/` 分隔的键读写不可变对象。
+    put 对已存在的键不覆盖（内容寻址，同键同内容）；read 的 end 为闭区间末字节下标。
+    """
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        ...
+
+    def put_file(self, key: str, fileobj: BinaryIO, content_type: str) -> None:
+        """从文件句柄写入（句柄位于开头）；后端可覆盖为流式上传。"""
+        self.put(key, fileobj.read(), content_type)
+
+    @abstractmethod
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        """对象不存在时返回 None。"""
+
+    @abstractmethod
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        ...
+
+    def iter_range(self, key: str, start: int, end: int, chunk_size: int = READ_CHUNK_BYTES) -> Iterator[bytes]:
+        """按块产出 [start, end] 字节，供流式响应使用。"""
+        pos = start
+        while pos <= end:
+            stop = min(pos + chunk_size - 1, end)
+            yield self.read(key, pos, stop)
+            pos = stop + 1
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """对象在本机文件系统上的路径（远端对象存储返回 None）。"""
+        return None
+
+    def ref_for(self, key: str) -> str:
+        """写入数据库的引用字符串。"""
+        return STORE_REF_PREFIX + key
+
+    def key_for(self, ref: str) -> Optional[str]:
+        """引用 → 键；不是本库管理的引用（如旧平铺文件路径）时返回 None。"""
+        if ref.startswith(STORE_REF_PREFIX):
+            return ref[len(STORE_REF_PREFIX):]
+        return None
+
+
+class LocalImageBackend(ImageStorageBackend):
+    """本地目录后端：引用即文件绝对路径；先写临时文件再原子改名，并发写同一键互不干扰。"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"非法的图片键: {key}")
+        return path
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        self.put_file(key, io.BytesIO(data), content_type)
+
+    def put_file(self, key: str, fileobj: BinaryIO, content_type: str) -> None:
+        path = self._path(key)
+        if path.is_file():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                shutil.copyfileobj(fileobj, f, READ_CHUNK_BYTES)
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            st = self._path(key).stat()
+        except (FileNotFoundError, ValueError):
+            return None
+        return ObjectInfo(size=st.st_size, mtime=st.st_mtime)
+
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            return f.read() if end is None else f.read(end - start + 1)
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return self._path(key)
+
+    def ref_for(self, key: str) -> str:
+        return str(self._path(key))
+
+    def key_for(self, ref: str) -> Optional[str]:
+        key = super().key_for(ref)
+        if key is not None:
+            return key
+        try:
+            return Path(ref).resolve().relative_to(self.root).as_posix()
+        except (ValueError, OSError):
+            return None
+
+
+@dataclass(frozen=True)
+class ResolvedImage:
+    """一次查看请求要返回的对象：库内对象有 key，旧平铺文件只有 path。"""
+
+    key: Optional[str]
+    path: Optional[Path]
+    info: ObjectInfo
+    etag: str
+    media_type: str
+
+
+def detect_extension(data: Union[bytes, BinaryIO]) -> str:
+    """按内容识别扩展名（不信任上传文件名）；无法识别时沿用旧实现的 .jpg。只读取文件头。"""
+    fileobj = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+    start = fileobj.tell()
+    try:
+        if fileobj.read(5) == b"%PDF-":
+            return ".pdf"
+        fileobj.seek(start)
+        with Image.open(fileobj) as img:
+            return _PIL_FORMAT_EXT.get(img.format or "", ".jpg")
+    except Exception:
+        return ".jpg"
+    finally:
+        fileobj.seek(start)
+
+
+def media_type_for(name: str) -> str:
+    return _EXT_MEDIA_TYPE.get(os.path.splitext(str(name))[1].lower(), "application/octet-stream")
+
+
+def _content_hash(key: str) -> Optional[str]:
+    stem = os.path.splitext(key.rsplit("/", 1)[-1])[0]
+    if len(stem) == 64 and all(c in "0123456789abcdef" for c in stem):
+        return stem
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _legacy_file_hash(path: str, mtime: float, size: int) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_BYTES), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ImageStore:
+    def __init__(self, backend: ImageStorageBackend, thumbnail_max_side: int = 480):
+        self.backend = backend
+        self.thumbnail_max_side = max(int(thumbnail_max_side), 16)
+        self.thumbnail_ext = ".webp" if features.check("webp") else ".jpg"
+
+    @staticmethod
+    def object_key(kind: str, digest: str, ext: str) -> str:
+        return f"{kind}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+    def thumbnail_key(self, digest: str) -> str:
+        return self.object_key("thumbs", digest, self.thumbnail_ext)
+
+    def save(self, data: ImageSource, kind: str) -> str:
+        """
+        写入原图（同内容已存在则复用）并生成缩略图，返回写入数据库的引用。
+        data 为文件句柄时边读边算哈希，不整体读入内存。缩略图失败只记日志，不影响原图保存。
+        """
+        if isinstance(data, (bytes, bytearray)):
+            if not data:
+                raise ValueError("图片内容为空")
+            data = bytes(data)
+            digest = hashlib.sha256(data).hexdigest()
+            ext = detect_extension(data)
+            key = self.object_key(kind, digest, ext)
+            self.backend.put(key, data, media_type_for(ext))
+            load: Callable[[], Union[bytes, BinaryIO]] = lambda: data
+        else:
+            data.seek(0)
+            h = hashlib.sha256()
+            size = 0
+            for chunk in iter(lambda: data.read(READ_CHUNK_BYTES), b""):
+                h.update(chunk)
+                size += len(chunk)
+            if size == 0:
+                raise ValueError("图片内容为空")
+            digest = h.hexdigest()
+            data.seek(0)
+            ext = detect_extension(data)
+            key = self.object_key(kind, digest, ext)
+            self.backend.put_file(key, data, media_type_for(ext))
+
+            def load() -> BinaryIO:
+                data.seek(0)
+                return data
+        if ext in IMAGE_EXTS:
+            self._ensure_thumbnail(digest, load)
+        return self.backend.ref_for(key)
+
+    def make_thumbnail(self, data: Union[bytes, BinaryIO]) -> bytes:
+        source = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+        with Image.open(source) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.thumbnail((self.thumbnail_max_side, self.thumbnail_max_side), Image.Resampling.LANCZOS)
+            buf = io.BytesIO()
+            if self.thumbnail_ext == ".webp":
+                img.save(buf, "WEBP", quality=THUMBNAIL_QUALITY, method=4)
+            else:
+                img.save(buf, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+            return buf.getvalue()
+
+    def _ensure_thumbnail(self, digest: str, load: Callable[[], Union[bytes, BinaryIO]]) -> Optional[str]:
+        """缩略图已存在直接返回键；否则 load() 取原图生成。失败返回 None。"""
+        key = self.thumbnail_key(digest)
+        if self.backend.stat(key) is not None:
+            return key
+        try:
+            self.backend.put(key, self.make_thumbnail(load()), media_type_for(self.thumbnail_ext))
+            return key
+        except Exception as e:
+            logger.warning("生成缩略图失败 %s: %s", digest, e)
+            return None
+
+    def _resolve_thumbnail(self, digest: str, load: Callable[[], bytes]) -> Optional[ResolvedImage]:
+        thumb_key = self._ensure_thumbnail(digest, load)
+        info = self.backend.stat(thumb_key) if thumb_key else None
+        if info is None:
+            return None
+        return ResolvedImage(
+            thumb_key, self.backend.local_path(thumb_key), info, f"{digest}-thumb", media_type_for(thumb_key)
+        )
+
+    def is_managed(self, ref: Optional[str]) -> bool:
+        return bool(ref) and self.backend.key_for(str(ref)) is not None
+
+    def resolve(self, ref: Optional[str], variant: str = "original") -> Optional[ResolvedImage]:
+        """
+        引用 → 可返回的对象；不存在时返回 None。
+        variant="thumb" 时取缩略图（旧平铺文件首次查看时补建）；非图片（如 PDF）或缩略图失败时退回原图。
+        """
+        if not ref:
+            return None
+        key = self.backend.key_for(str(ref))
+        if key is None:
+            return self._resolve_legacy(Path(str(ref)), variant)
+
+        info = self.backend.stat(key)
+        if info is None:
+            return None
+        digest = _content_hash(key)
+        if variant == "thumb" and digest and os.path.splitext(key)[1] in IMAGE_EXTS:
+            thumb = self._resolve_thumbnail(digest, lambda: self.backend.read(key))
+            if thumb is not None:
+                return thumb
+        etag = digest or f"{int(info.mtime)}-{info.size}"
+        return ResolvedImage(key, self.backend.local_path(key), info, etag, media_type_for(key))
+
+    def _resolve_legacy(self, path: Path, variant: str) -> Optional[ResolvedImage]:
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        if not path.is_file():
+            return None
+        digest = _legacy_file_hash(str(path), st.st_mtime, st.st_size)
+        suffix = ".jpg" if path.suffix.lower() == ".jpeg" else path.suffix.lower()
+        if variant == "thumb" and suffix in IMAGE_EXTS:
+            thumb = self._resolve_thumbnail(digest, path.read_bytes)
+            if thumb is not None:
+                return thumb
+        return ResolvedImage(None, path, ObjectInfo(st.st_size, st.st_mtime), digest, media_type_for("x" + suffix))
+
+    def iter_bytes(self, resolved: ResolvedImage, start: int, end: int) -> Iterator[bytes]:
+        if resolved.key is not None:
+            yield from self.backend.iter_range(resolved.key, start, end)
+            return
+        with open(resolved.path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(READ_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def release(self, ref: Optional[str]) -> None:
+        """
+        记录不再引用该文件时调用：库内对象可能被其它记录共用，保留不删（孤儿对象由离线清理处理）；
+        旧平铺文件路径照原逻辑删除。
+        """
+        if not ref or self.is_managed(ref):
+            return
+        try:
+            if os.path.exists(ref):
+                os.remove(ref)
+        except Exception as e:
+            logger.warning(f"删除图片文件失败: {e}")
+
+
+_store: Optional[ImageStore] = None
+_store_lock = threading.Lock()
+
+
+def get_image_store() -> ImageStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                root = Path(settings.image_store_dir) if settings.image_store_dir else UPLOADS_DIR / "store"
+                _store = ImageStore(LocalImageBackend(root), settings.image_thumbnail_max_side)
+    return _store
+
+
+def save_image(data: ImageSource, kind: str) -> str:
+    return get_image_store().save(data, kind)
+
+
+def release_image(ref: Optional[str]) -> None:
+    get_image_store().release(ref)
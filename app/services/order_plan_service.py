@@ -9,6 +9,7 @@ from typing import Any, Dict, Optional
 from pymysql.cursors import DictCursor
 from pymysql.err import DataError
 
+from app.services.allocation_cache import invalidate_manager_allocation
 from app.services.contract_service import get_conn
 from app.services.delivery_plan_service import (
     _mysql_duplicate_entry_value,
@@ -19,8 +20,6 @@ from app.services.delivery_plan_service import (
 
 logger = logging.getLogger(__name__)
 
-_ORDER_PLAN_REMARK_ENSURED = False
-
 AUDIT_STATUS_PENDING = "待审核"
 AUDIT_STATUS_APPROVED = "审核通过"
 AUDIT_STATUS_REJECTED = "审核未通过"
@@ -28,73 +27,6 @@ VALID_AUDIT_STATUSES = frozenset(
     {AUDIT_STATUS_PENDING, AUDIT_STATUS_APPROVED, AUDIT_STATUS_REJECTED}
 )
 
-_ORDER_PLAN_COLUMNS_ENSURED = False
-def _ensure_order_plan_new_columns() -> None:
-    """旧库补全订货计划签到时间和结算价格字段"""
-    global _ORDER_PLAN_COLUMNS_ENSURED
-    if getattr(OrderPlanService, '_columns_ensured', False):
-        return
-    try:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
-                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'pd_order_plans'
-                    """
-                )
-                existing = {row[0] for row in (cur.fetchall() or [])}
-
-                # 补全签到时间字段
-                if "sign_in_deadline" not in existing:
-                    cur.execute(
-                        """
-                        ALTER TABLE pd_order_plans
-                        ADD COLUMN sign_in_deadline VARCHAR(64) DEFAULT NULL COMMENT '签到截止时间，示例：4.9号下午五点前签到'
-                        """
-                    )
-                    logger.info("pd_order_plans 已添加 sign_in_deadline 列")
-
-                # 补全结算价格字段
-                if "settlement_price" not in existing:
-                    cur.execute(
-                        """
-                        ALTER TABLE pd_order_plans
-                        ADD COLUMN settlement_price DECIMAL(12, 2) DEFAULT NULL COMMENT '结算价格（仅用于统计核对，不参与计算），示例：9630'
-                        """
-                    )
-                    logger.info("pd_order_plans 已添加 settlement_price 列")
-            conn.commit()
-        OrderPlanService._columns_ensured = True
-    except Exception as e:
-        logger.warning("ensure_order_plan_new_columns skipped/failed: %s", e)
-def _ensure_order_plan_remark_column() -> None:
-    """旧库补全订货计划审核备注字段（仅执行一次）。"""
-    global _ORDER_PLAN_REMARK_ENSURED
-    if _ORDER_PLAN_REMARK_ENSURED:
-        return
-    try:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
-                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'pd_order_plans'
-                    """
-                )
-                existing = {row[0] for row in (cur.fetchall() or [])}
-                if "audit_remark" not in existing:
-                    cur.execute(
-                        """
-                        ALTER TABLE pd_order_plans
-                        ADD COLUMN audit_remark TEXT DEFAULT NULL COMMENT '审核备注/原因'
-                        """
-                    )
-            conn.commit()
-        _ORDER_PLAN_REMARK_ENSURED = True
-    except Exception as e:
-        logger.warning("ensure_order_plan_remark_column skipped/failed: %s", e)
-
 
 def _serialize_row(row: Dict[str, Any]) -> Dict[str, Any]:
     out = dict(row)
@@ -196,8 +128,6 @@ class OrderPlanService:
         operator_id: Optional[int] = None,
         operator_name: Optional[str] = None,
     ) -> Dict[str, Any]:
-        _ensure_order_plan_remark_column()
-        _ensure_order_plan_new_columns()
         plan_no = (plan_no or "").strip()
         if not plan_no:
             return {"success": False, "error": "报货计划编号不能为空"}
@@ -289,6 +219,7 @@ class OrderPlanService:
                     )
                     new_id = cur.lastrowid
                     conn.commit()
+                    invalidate_manager_allocation()
 
                     cur.execute(
                         f"SELECT {self._SELECT.strip()} FROM pd_order_plans WHERE id = %s",
@@ -305,7 +236,6 @@ class OrderPlanService:
             return {"success": False, "error": str(e)}
 
     def get(self, order_plan_id: int) -> Dict[str, Any]:
-        _ensure_order_plan_remark_column()
         try:
             with get_conn() as conn:
                 with conn.cursor(DictCursor) as cur:
@@ -336,7 +266,6 @@ class OrderPlanService:
         page: int = 1,
         page_size: int = 20,
     ) -> Dict[str, Any]:
-        _ensure_order_plan_remark_column()
         try:
             with get_conn() as conn:
                 with conn.cursor(DictCursor) as cur:
@@ -434,8 +363,6 @@ class OrderPlanService:
         if truck_count is not None and truck_count < 1:
             return {"success": False, "error": "车数须大于 0"}
 
-        _ensure_order_plan_remark_column()
-        _ensure_order_plan_new_columns()
 
         try:
             with get_conn() as conn:
@@ -614,6 +541,7 @@ class OrderPlanService:
                         out = cur.fetchone()
 
                     conn.commit()
+                    invalidate_manager_allocation()
                     return {
                         "success": True,
                         "message": "订货计划已更新",
@@ -666,7 +594,6 @@ class OrderPlanService:
         if truck_count < 1:
             return {"success": False, "error": "车数须大于 0"}
 
-        _ensure_order_plan_remark_column()
         try:
             with get_conn() as conn:
                 prev_ac = conn.get_autocommit()
@@ -820,6 +747,7 @@ class OrderPlanService:
                         )
                         out = cur.fetchone()
                     conn.commit()
+                    invalidate_manager_allocation()
                     msg = "车数已更新"
                     if (
                         current_status == AUDIT_STATUS_REJECTED
@@ -855,7 +783,6 @@ class OrderPlanService:
                 "error": f"audit_result 须为「{AUDIT_STATUS_APPROVED}」或「{AUDIT_STATUS_REJECTED}」",
             }
 
-        _ensure_order_plan_remark_column()
         rmk = (remark or "").strip()
         if audit_result == AUDIT_STATUS_REJECTED and not rmk:
             return {
@@ -926,6 +853,7 @@ class OrderPlanService:
                             ),
                         )
                     conn.commit()
+                    invalidate_manager_allocation()
                 except Exception:
                     conn.rollback()
                     raise
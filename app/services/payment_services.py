@@ -6,6 +6,16 @@ from enum import IntEnum
 from datetime import datetime, date
 from decimal import Decimal, ROUND_HALF_UP
 
+from app.core.schema_migrations import table_columns
+from app.services.contract_progress import PAYMENTS, contract_nos_for, refresh_contract_progress
+from app.utils.keyset_cursor import (
+    count_total,
+    decode_cursor,
+    keyset_before_params,
+    keyset_before_sql,
+    split_page,
+    validate_count_mode,
+)
 from core.database import get_conn
 from core.table_access import build_dynamic_select, _quote_identifier
 from core.logging import get_logger
@@ -493,6 +503,12 @@ class PaymentService:
                 if not cur.fetchone():
                     raise RuntimeError(f"{PaymentService.RECORD_TABLE} 表不存在，请先执行数据库初始化")
 
+    @staticmethod
+    def _refresh_contract_progress(cur, payment_ids=(), contract_nos=()) -> None:
+        """收款明细/回款记录写入后，在同一事务内重算所属合同的进度台账回款分组。"""
+        nos = list(contract_nos) + contract_nos_for(cur, PaymentService.TABLE_NAME, "id", payment_ids)
+        refresh_contract_progress(cur, nos, parts=(PAYMENTS,))
+
     @staticmethod
     def create_or_update_by_weighbill(
         weighbill_id: int,
@@ -516,6 +532,7 @@ class PaymentService:
         3. 预生成两条回款记录（首笔+尾款），金额为0待后续编辑
         """
         with get_conn() as conn:
+            conn.begin()
             with conn.cursor() as cur:
                 # 检查是否已存在该磅单对应的收款明细
                 cur.execute(
@@ -636,6 +653,7 @@ class PaymentService:
                                 VALUES (%s, %s, %s, %s, %s, %s)
                             """, (payment_id, 0, 2, date.today(), "预生成-尾款待回款", datetime.now()))
 
+                        PaymentService._refresh_contract_progress(cur, payment_ids=[payment_id])
                         conn.commit()
                         logger.info(f"根据磅单更新收款明细: ID={payment_id}, 磅单ID={weighbill_id}")
                 else:
@@ -665,8 +683,7 @@ class PaymentService:
                     }
 
                     # 动态获取表结构
-                    cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME}")
-                    columns = [r["Field"] for r in cur.fetchall()]
+                    columns = table_columns(cur, PaymentService.TABLE_NAME)
                     data = {k: v for k, v in data.items() if k in columns}
 
                     cols = list(data.keys())
@@ -695,6 +712,7 @@ class PaymentService:
                             VALUES (%s, %s, %s, %s, %s, %s, %s)
                         """, (payment_id, 0, 2, date.today(), "", "预生成-尾款待回款", datetime.now()))
 
+                    PaymentService._refresh_contract_progress(cur, payment_ids=[payment_id])
                     conn.commit()
                     logger.info(
                         f"根据磅单创建收款明细: ID={payment_id}, 磅单ID={weighbill_id}, 首笔={arrival_amount}, 尾款={final_amount}")
@@ -752,6 +770,7 @@ class PaymentService:
         total_amount = calculate_payment_amount(unit_price, net_weight)
 
         with get_conn() as conn:
+            conn.begin()
             with conn.cursor() as cur:
                 # 检查是否已存在该销售订单的收款明细
                 cur.execute(
@@ -762,8 +781,7 @@ class PaymentService:
                     raise ValueError("该销售订单已存在收款明细")
 
                 # 动态获取表结构
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME}")
-                columns = [r["Field"] for r in cur.fetchall()]
+                columns = table_columns(cur, PaymentService.TABLE_NAME)
 
                 # 准备插入数据
                 data = {
@@ -798,6 +816,7 @@ class PaymentService:
                 cur.execute(sql, tuple(vals))
 
                 payment_id = cur.lastrowid
+                PaymentService._refresh_contract_progress(cur, payment_ids=[payment_id])
                 conn.commit()
 
                 logger.info(f"创建收款明细成功: ID={payment_id}, 订单={sales_order_id}, 总额={total_amount}")
@@ -845,6 +864,7 @@ class PaymentService:
         payment_date = payment_date or date.today()
 
         with get_conn() as conn:
+            conn.begin()
             with conn.cursor() as cur:
                 # 获取收款明细
                 select_sql = build_dynamic_select(
@@ -884,8 +904,7 @@ class PaymentService:
                 }
 
                 # 动态获取记录表结构
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.RECORD_TABLE}")
-                record_columns = [r["Field"] for r in cur.fetchall()]
+                record_columns = table_columns(cur, PaymentService.RECORD_TABLE)
 
                 # 过滤存在的字段
                 record_data = {k: v for k, v in record_data.items() if k in record_columns}
@@ -916,6 +935,7 @@ class PaymentService:
                     payment_detail_id
                 ))
 
+                PaymentService._refresh_contract_progress(cur, payment_ids=[payment_detail_id])
                 conn.commit()
 
                 # 返回结果
@@ -1039,14 +1059,23 @@ class PaymentService:
             # 回款列表筛选参数
             collection_status: Optional[int] = None,  # 回款状态筛选：0-待回款, 1-已回首笔待回尾款, 2-已回款
             arrival_paid: Optional[int] = None,        # 是否已回首笔：0-否, 1-是
-            final_paid: Optional[int] = None           # 是否已回尾款：0-否, 1-是
+            final_paid: Optional[int] = None,          # 是否已回尾款：0-否, 1-是
+            cursor: Optional[str] = None,
+            cursor_mode: bool = False,
+            count_mode: str = "exact"
     ) -> Dict[str, Any]:
         """
         查询回款信息列表
         
         只返回已上传磅单的数据（有磅单信息才能回款）
         表头包含销售相关的回款字段
+
+        cursor_mode=True 或传入 cursor 时按 (pd.created_at, pd.id) 键集分页，返回 next_cursor / has_more；
+        cursor / count_mode 不合法时抛 ValueError。
         """
+        validate_count_mode(count_mode)
+        use_cursor = cursor_mode or bool(cursor)
+        after_key = decode_cursor(cursor) if cursor else None
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 构建WHERE条件
@@ -1094,11 +1123,30 @@ class PaymentService:
                     LEFT JOIN pd_deliveries d ON d.id = COALESCE(pd.delivery_id, wb.delivery_id)
                     WHERE {where_sql}
                 """
-                cur.execute(count_sql, tuple(params))
-                total = cur.fetchone()["total"]
+                total = count_total(
+                    cur,
+                    count_sql,
+                    params,
+                    count_mode,
+                    estimate_sql=f"SELECT pd.id FROM {PaymentService.TABLE_NAME} pd "
+                                 f"LEFT JOIN pd_weighbills wb ON wb.id = pd.weighbill_id "
+                                 f"LEFT JOIN pd_deliveries d ON d.id = COALESCE(pd.delivery_id, wb.delivery_id) "
+                                 f"WHERE {where_sql}",
+                )
 
                 # 分页查询 - 回款信息列表字段
-                offset = (page - 1) * size
+                if use_cursor:
+                    page_where = where_sql
+                    page_params = list(params)
+                    if after_key is not None:
+                        page_where += " AND " + keyset_before_sql("pd.created_at", "pd.id")
+                        page_params.extend(keyset_before_params(after_key))
+                    order_limit_sql = "ORDER BY pd.created_at DESC, pd.id DESC LIMIT %s"
+                    page_params.append(size + 1)
+                else:
+                    page_where = where_sql
+                    page_params = list(params) + [size, (page - 1) * size]
+                    order_limit_sql = "ORDER BY pd.created_at DESC LIMIT %s OFFSET %s"
                 query_sql = f"""
                     SELECT 
                         -- ========== 第一行：基础信息 ==========
@@ -1149,13 +1197,17 @@ class PaymentService:
                     FROM {PaymentService.TABLE_NAME} pd
                     LEFT JOIN pd_weighbills wb ON wb.id = pd.weighbill_id
                     LEFT JOIN pd_deliveries d ON d.id = COALESCE(pd.delivery_id, wb.delivery_id)
-                    WHERE {where_sql}
-                    ORDER BY pd.created_at DESC
-                    LIMIT %s OFFSET %s
+                    WHERE {page_where}
+                    {order_limit_sql}
                 """
 
-                cur.execute(query_sql, tuple(params + [size, offset]))
+                cur.execute(query_sql, tuple(page_params))
                 rows = cur.fetchall()
+                next_cursor = None
+                if use_cursor:
+                    rows, next_cursor = split_page(
+                        rows, size, lambda r: (r["created_at"], r["payment_detail_id"])
+                    )
 
                 # 处理数据
                 items = []
@@ -1177,9 +1229,9 @@ class PaymentService:
                     
                     items.append(item)
 
-                return {
+                result = {
                     "total": total,
-                    "page": page,
+                    "page": None if use_cursor else page,
                     "size": size,
                     "items": items,
                     "summary": {
@@ -1189,6 +1241,10 @@ class PaymentService:
                         "未生成回款笔数": sum(1 for i in items if i.get('回款状态') is None),
                     }
                 }
+                if use_cursor:
+                    result["next_cursor"] = next_cursor
+                    result["has_more"] = next_cursor is not None
+                return result
             
     @staticmethod
     def list_payment_out_details(
@@ -1213,17 +1269,14 @@ class PaymentService:
         """
         with get_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME}")
-                columns = [r["Field"] for r in cur.fetchall()]
+                columns = table_columns(cur, PaymentService.TABLE_NAME)
                 has_payee = "payee" in columns
                 has_payee_account = "payee_account" in columns
 
-                cur.execute("SHOW COLUMNS FROM pd_weighbills")
-                weighbill_columns = [r["Field"] for r in cur.fetchall()]
+                weighbill_columns = table_columns(cur, "pd_weighbills")
                 has_weighbill_warehouse_name = "warehouse_name" in weighbill_columns
 
-                cur.execute("SHOW COLUMNS FROM pd_balance_details")
-                balance_columns = [r["Field"] for r in cur.fetchall()]
+                balance_columns = table_columns(cur, "pd_balance_details")
                 has_balance_payee_bank_name = "payee_bank_name" in balance_columns
 
                 # 构建WHERE条件 - 必须已排期
@@ -1496,6 +1549,7 @@ class PaymentService:
         7. 更新 last_payment_date
         """
         with get_conn() as conn:
+            conn.begin()
             with conn.cursor() as cur:
                 # 获取当前收款明细
                 cur.execute(f"""
@@ -1517,10 +1571,8 @@ class PaymentService:
                 if not detail:
                     raise ValueError("收款明细不存在")
 
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME} LIKE 'updated_at'")
-                has_detail_updated_at = cur.fetchone() is not None
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.RECORD_TABLE} LIKE 'updated_at'")
-                has_record_updated_at = cur.fetchone() is not None
+                has_detail_updated_at = "updated_at" in table_columns(cur, PaymentService.TABLE_NAME)
+                has_record_updated_at = "updated_at" in table_columns(cur, PaymentService.RECORD_TABLE)
 
                 cur.execute(f"""
                     SELECT payment_stage, payment_date
@@ -1662,10 +1714,8 @@ class PaymentService:
                     params.append(datetime.now())
 
                 # 检查并更新日期字段
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME} LIKE 'arrival_payment_date'")
-                has_arrival_date_col = cur.fetchone() is not None
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME} LIKE 'final_payment_date'")
-                has_final_date_col = cur.fetchone() is not None
+                has_arrival_date_col = "arrival_payment_date" in table_columns(cur, PaymentService.TABLE_NAME)
+                has_final_date_col = "final_payment_date" in table_columns(cur, PaymentService.TABLE_NAME)
 
                 if has_arrival_date_col and arrival_date:
                     update_fields.append("arrival_payment_date = %s")
@@ -1788,6 +1838,7 @@ class PaymentService:
                             datetime.now()
                         ))
 
+                PaymentService._refresh_contract_progress(cur, payment_ids=[payment_id])
                 conn.commit()
 
                 return {
@@ -1970,6 +2021,7 @@ class PaymentService:
             ValueError: 收款明细不存在
         """
         with get_conn() as conn:
+            conn.begin()
             with conn.cursor() as cur:
                 # 检查收款明细是否存在
                 cur.execute(
@@ -2021,7 +2073,10 @@ class PaymentService:
                     WHERE id = %s
                 """
                 
+                # 改合同编号时原合同的台账也要重算
+                previous_nos = contract_nos_for(cur, PaymentService.TABLE_NAME, "id", [payment_id])
                 cur.execute(update_sql, tuple(params))
+                PaymentService._refresh_contract_progress(cur, payment_ids=[payment_id], contract_nos=previous_nos)
                 conn.commit()
                 
                 logger.info(f"更新收款明细成功: ID={payment_id}")
@@ -2042,6 +2097,7 @@ class PaymentService:
             ValueError: 收款明细不存在或已有回款记录无法删除
         """
         with get_conn() as conn:
+            conn.begin()
             with conn.cursor() as cur:
                 # 检查收款明细是否存在
                 cur.execute(
@@ -2068,8 +2124,10 @@ class PaymentService:
                     raise ValueError(f"存在{record_count}条回款记录，无法删除收款明细")
                 
                 # 执行删除
+                previous_nos = contract_nos_for(cur, PaymentService.TABLE_NAME, "id", [payment_id])
                 delete_sql = f"DELETE FROM {_quote_identifier(PaymentService.TABLE_NAME)} WHERE id = %s"
                 cur.execute(delete_sql, (payment_id,))
+                PaymentService._refresh_contract_progress(cur, contract_nos=previous_nos)
                 conn.commit()
                 
                 logger.info(f"删除收款明细成功: ID={payment_id}")
@@ -2084,7 +2142,7 @@ class PaymentService:
     ) -> Dict[str, Any]:
         """
         获取合同发运进度列表
-        统计每个合同的车数、吨数、已运/剩余情况
+        统计每个合同的车数、吨数、已运/剩余情况（已运数据读合同进度台账 pd_contract_progress）
         """
         with get_conn() as conn:
             with conn.cursor() as cur:
@@ -2119,25 +2177,13 @@ class PaymentService:
                         c.smelter_company as smelter_name,
                         c.total_quantity as planned_total_weight,   -- 直接从合同表获取总重量
                         c.truck_count as total_vehicles,            -- 直接从合同表获取总车数
-                        (
-                            SELECT COUNT(*)
-                            FROM pd_weighbills wb
-                            WHERE wb.contract_no = c.contract_no
-                              AND wb.ocr_status IN ('已上传磅单', '已确认')
-                        ) as shipped_vehicles,
-                        (
-                            SELECT COALESCE(SUM(wb.net_weight), 0)
-                            FROM pd_weighbills wb
-                            WHERE wb.contract_no = c.contract_no
-                              AND wb.ocr_status IN ('已上传磅单', '已确认')
-                        ) as shipped_weight,
-                        (
-                            SELECT MAX(wb.weigh_date)
-                            FROM pd_weighbills wb
-                            WHERE wb.contract_no = c.contract_no
-                              AND wb.ocr_status IN ('已上传磅单', '已确认')
-                        ) as last_ship_date
+                        COALESCE(p.shipped_trucks, 0) as shipped_vehicles,
+                        COALESCE(p.shipped_weight, 0) as shipped_weight,
+                        p.last_ship_date,
+                        COALESCE(p.balance_payable_amount, 0) as balance_payable_amount,
+                        COALESCE(p.balance_paid_amount, 0) as balance_paid_amount
                     FROM pd_contracts c
+                    LEFT JOIN pd_contract_progress p ON p.contract_no = c.contract_no
                     WHERE {where_sql}
                     ORDER BY c.created_at DESC
                     LIMIT %s OFFSET %s
@@ -2176,7 +2222,9 @@ class PaymentService:
                         "shipped_weight": round(shipped_weight, 2),
                         "remaining_weight": round(remaining_weight, 2),
                         "last_ship_date": str(item["last_ship_date"]) if item.get("last_ship_date") else None,
-                        "progress_rate": round(shipped_weight / planned_weight * 100, 2) if planned_weight > 0 else 0
+                        "progress_rate": round(shipped_weight / planned_weight * 100, 2) if planned_weight > 0 else 0,
+                        "balance_payable_amount": round(float(item.get("balance_payable_amount") or 0), 2),
+                        "balance_paid_amount": round(float(item.get("balance_paid_amount") or 0), 2),
                     })
 
                 return {
@@ -2186,6 +2234,65 @@ class PaymentService:
                     "items": items
                 }
 
+    @staticmethod
+    def _contract_payment_summary_rows(
+        cur,
+        contract_no: Optional[str],
+        smelter_name: Optional[str],
+        status: int,
+        size: int,
+        offset: int,
+    ):
+        """按明细状态筛选的合同回款汇总（台账只保存全部明细的合计，这里现场分组）。"""
+        where_clauses = ["pd.status = %s"]
+        params = [status]
+
+        if contract_no:
+            where_clauses.append("pd.contract_no LIKE %s")
+            params.append(f"%{contract_no}%")
+
+        if smelter_name:
+            where_clauses.append("pd.smelter_name LIKE %s")
+            params.append(f"%{smelter_name}%")
+
+        where_sql = " AND ".join(where_clauses)
+
+        count_sql = f"""
+            SELECT COUNT(DISTINCT pd.contract_no) as total 
+            FROM {PaymentService.TABLE_NAME} pd
+            WHERE {where_sql}
+        """
+        cur.execute(count_sql, tuple(params))
+        total = cur.fetchone()["total"]
+
+        # 回款记录先按明细取最后回款日再联表，避免按记录条数重复累计金额
+        query_sql = f"""
+            SELECT 
+                pd.contract_no,
+                pd.smelter_name,
+                SUM(pd.total_amount) as total_receivable,
+                SUM(pd.paid_amount) as total_received,
+                SUM(pd.unpaid_amount) as total_unreceived,
+                COUNT(DISTINCT pd.id) as order_count,
+                SUM(CASE WHEN pd.status = 0 THEN 1 ELSE 0 END) as unpaid_count,
+                SUM(CASE WHEN pd.status = 1 THEN 1 ELSE 0 END) as partial_count,
+                SUM(CASE WHEN pd.status = 2 THEN 1 ELSE 0 END) as paid_count,
+                SUM(CASE WHEN pd.status = 3 THEN 1 ELSE 0 END) as overpaid_count,
+                MAX(pr.last_payment_date) as last_payment_date
+            FROM {PaymentService.TABLE_NAME} pd
+            LEFT JOIN (
+                SELECT payment_detail_id, MAX(payment_date) as last_payment_date
+                FROM {PaymentService.RECORD_TABLE}
+                GROUP BY payment_detail_id
+            ) pr ON pd.id = pr.payment_detail_id
+            WHERE {where_sql}
+            GROUP BY pd.contract_no, pd.smelter_name
+            ORDER BY SUM(pd.total_amount) DESC
+            LIMIT %s OFFSET %s
+        """
+        cur.execute(query_sql, tuple(params + [size, offset]))
+        return cur.fetchall(), total
+
     @staticmethod
     def get_contract_payment_summary(
         contract_no: Optional[str] = None,
@@ -2196,58 +2303,53 @@ class PaymentService:
     ) -> Dict[str, Any]:
         """
         获取合同回款汇总列表（按合同编号分组）
+        不按明细状态筛选时读合同进度台账 pd_contract_progress；按状态筛选时只统计该状态的明细，仍现场分组
         """
         with get_conn() as conn:
             with conn.cursor() as cur:
-                where_clauses = ["1=1"]
-                params = []
-                
-                if contract_no:
-                    where_clauses.append("pd.contract_no LIKE %s")
-                    params.append(f"%{contract_no}%")
-                
-                if smelter_name:
-                    where_clauses.append("pd.smelter_name LIKE %s")
-                    params.append(f"%{smelter_name}%")
-                
-                if status is not None:
-                    where_clauses.append("pd.status = %s")
-                    params.append(status)
-                
-                where_sql = " AND ".join(where_clauses)
-                
-                count_sql = f"""
-                    SELECT COUNT(DISTINCT pd.contract_no) as total 
-                    FROM {PaymentService.TABLE_NAME} pd
-                    WHERE {where_sql}
-                """
-                cur.execute(count_sql, tuple(params))
-                total = cur.fetchone()["total"]
-                
                 offset = (page - 1) * size
-                query_sql = f"""
-                    SELECT 
-                        pd.contract_no,
-                        pd.smelter_name,
-                        SUM(pd.total_amount) as total_receivable,
-                        SUM(pd.paid_amount) as total_received,
-                        SUM(pd.unpaid_amount) as total_unreceived,
-                        COUNT(DISTINCT pd.id) as order_count,
-                        SUM(CASE WHEN pd.status = 0 THEN 1 ELSE 0 END) as unpaid_count,
-                        SUM(CASE WHEN pd.status = 1 THEN 1 ELSE 0 END) as partial_count,
-                        SUM(CASE WHEN pd.status = 2 THEN 1 ELSE 0 END) as paid_count,
-                        SUM(CASE WHEN pd.status = 3 THEN 1 ELSE 0 END) as overpaid_count,
-                        MAX(pr.payment_date) as last_payment_date
-                    FROM {PaymentService.TABLE_NAME} pd
-                    LEFT JOIN {PaymentService.RECORD_TABLE} pr ON pd.id = pr.payment_detail_id
-                    WHERE {where_sql}
-                    GROUP BY pd.contract_no, pd.smelter_name
-                    ORDER BY SUM(pd.total_amount) DESC
-                    LIMIT %s OFFSET %s
-                """
-                
-                cur.execute(query_sql, tuple(params + [size, offset]))
-                rows = cur.fetchall()
+                if status is None:
+                    where_clauses = ["p.payment_detail_count > 0"]
+                    params = []
+                    if contract_no:
+                        where_clauses.append("p.contract_no LIKE %s")
+                        params.append(f"%{contract_no}%")
+                    if smelter_name:
+                        where_clauses.append("p.smelter_name LIKE %s")
+                        params.append(f"%{smelter_name}%")
+                    where_sql = " AND ".join(where_clauses)
+
+                    cur.execute(
+                        f"SELECT COUNT(*) as total FROM pd_contract_progress p WHERE {where_sql}",
+                        tuple(params),
+                    )
+                    total = cur.fetchone()["total"]
+                    cur.execute(
+                        f"""
+                        SELECT
+                            p.contract_no,
+                            p.smelter_name,
+                            p.receivable_amount as total_receivable,
+                            p.received_amount as total_received,
+                            p.unreceived_amount as total_unreceived,
+                            p.payment_detail_count as order_count,
+                            p.unpaid_count,
+                            p.partial_count,
+                            p.paid_count,
+                            p.overpaid_count,
+                            p.last_payment_date
+                        FROM pd_contract_progress p
+                        WHERE {where_sql}
+                        ORDER BY p.receivable_amount DESC
+                        LIMIT %s OFFSET %s
+                        """,
+                        tuple(params + [size, offset]),
+                    )
+                    rows = cur.fetchall()
+                else:
+                    rows, total = PaymentService._contract_payment_summary_rows(
+                        cur, contract_no, smelter_name, status, size, offset
+                    )
                 
                 items = []
                 for row in rows:
@@ -2540,6 +2642,7 @@ class PaymentService:
             company_type: 公司类型 'yuguang' 或 'jinli'
         """
         with get_conn() as conn:
+            conn.begin()
             with conn.cursor() as cur:
                 # 检查是否已存在该磅单号的记录
                 cur.execute("""
@@ -2675,6 +2778,7 @@ class PaymentService:
                     payment_id = cur.lastrowid
                     action = 'created'
                 
+                PaymentService._refresh_contract_progress(cur, payment_ids=[payment_id])
                 conn.commit()
                 
                 return {
@@ -0,0 +1,328 @@
+"""
+支付回单批量对账：一批回单（OCR 结果或手工数据）与待支付结余明细的全局匹配。
+
+`BalanceService.match_pending_payments` 一次只对一张回单查一次库，财务一次上传几十张银行回单时，
+逐张识别、逐张查询，同一笔结余还可能被先处理的回单「抢走」。这里：
+
+- 所有回单涉及的收款人一次查询载入待支付结余（按 payee_key / driver_name / payee_name 三个索引列 IN）；
+- 对每个 (回单, 结余) 按容差规则打分：金额差在容差内才可匹配，收款人姓名、收款账号、交易日期与结余生成日期
+  的接近程度决定置信度；
+- 在可匹配的边上按连通分量求一对一的最大权匹配（匈牙利算法），而不是按回单顺序贪心；
+- 一对一没配上的回单，再在同一收款人剩余的结余里找至多三笔金额恰好凑齐的组合（合并打款）；
+- 返回每张回单的建议核销明细、置信度与状态（confident / review / unmatched），供前端确认后批量核销，本模块不写库。
+"""
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from app.services.balance_allocation import small_exact_subset
+
+#: 默认金额容差（元）；与单张匹配 `match_pending_payments` 一致
+DEFAULT_AMOUNT_TOLERANCE = Decimal("0.01")
+#: 置信度不低于该值且没有同分候选时标为 confident
+CONFIDENT_SCORE = 0.8
+
+# 置信度各部分权重（合计 1.0）
+_AMOUNT_WEIGHT = 0.6
+_NAME_WEIGHT = 0.25
+_ACCOUNT_WEIGHT = 0.1
+_DATE_WEIGHT = 0.05
+#: 组合匹配的金额得分折扣（多笔凑齐比一对一更可能是巧合）
+_COMBINATION_FACTOR = 0.8
+_TIE_EPSILON = 1e-6
+
+_CENT = Decimal("0.01")
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    raw = str(value).strip()
+    return raw or None
+
+
+def _decimal(value: Any) -> Optional[Decimal]:
+    if value is None or value == "":
+        return None
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def _as_date(value: Any) -> Optional[date]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+@dataclass
+class ReceiptInput:
+    """待对账的回单；index 为其在本批中的位置。"""
+    index: int
+    payee_name: Optional[str]
+    amount: Optional[Decimal]
+    payee_account: Optional[str] = None
+    payment_date: Optional[date] = None
+
+    @classmethod
+    def from_ocr(cls, index: int, data: Dict[str, Any]) -> "ReceiptInput":
+        # 转账金额（小写）是收款人实收；缺失时退回合计
+        amount = _decimal(data.get("amount"))
+        if amount is None or amount <= 0:
+            amount = _decimal(data.get("total_amount"))
+        return cls(
+            index=index,
+            payee_name=_text(data.get("payee_name")),
+            amount=amount,
+            payee_account=_text(data.get("payee_account")),
+            payment_date=_as_date(data.get("payment_date")),
+        )
+
+
+def balance_names(balance: Dict[str, Any]) -> Set[str]:
+    return {n for n in (_text(balance.get(k)) for k in ("payee_name", "driver_name", "payee_key")) if n}
+
+
+def load_pending_balances(cur, payee_names: Iterable[Optional[str]], date_range: int) -> List[Dict[str, Any]]:
+    """一次查询载入这些收款人近 date_range 天生成的待支付/部分支付结余。"""
+    names = sorted({n for n in (_text(v) for v in payee_names) if n})
+    if not names:
+        return []
+    placeholders = ",".join(["%s"] * len(names))
+    cur.execute(
+        f"""
+        SELECT id, contract_no, driver_name, driver_phone, vehicle_no, payee_name, payee_key, payee_account,
+               payable_amount, paid_amount, balance_amount, payment_status, created_at
+        FROM pd_balance_details
+        WHERE payment_status IN (0, 1)
+          AND created_at >= DATE_SUB(NOW(), INTERVAL %s DAY)
+          AND (payee_key IN ({placeholders}) OR driver_name IN ({placeholders}) OR payee_name IN ({placeholders}))
+        ORDER BY created_at ASC, id ASC
+        """,
+        tuple([date_range] + names * 3),
+    )
+    rows = cur.fetchall() or []
+    if rows and not isinstance(rows[0], dict):
+        columns = [d[0] for d in cur.description]
+        rows = [dict(zip(columns, row)) for row in rows]
+    return list(rows)
+
+
+def _name_score(receipt: ReceiptInput, balance: Dict[str, Any]) -> Optional[float]:
+    if not receipt.payee_name or receipt.payee_name not in balance_names(balance):
+        return None
+    return _NAME_WEIGHT if receipt.payee_name == _text(balance.get("payee_name")) else _NAME_WEIGHT * 0.6
+
+
+def _account_score(receipt: ReceiptInput, balance: Dict[str, Any]) -> float:
+    account = _text(balance.get("payee_account"))
+    if not receipt.payee_account or not account:
+        return 0.0
+    # 账号不一致多半是同名的另一个人，明显扣分但不直接排除（结余上的账号可能过期）
+    return _ACCOUNT_WEIGHT if receipt.payee_account == account else -2 * _ACCOUNT_WEIGHT
+
+
+def _date_score(receipt: ReceiptInput, balance: Dict[str, Any], date_range: int) -> float:
+    created = _as_date(balance.get("created_at"))
+    if receipt.payment_date is None or created is None:
+        return 0.0
+    days = (receipt.payment_date - created).days
+    if days < 0:
+        return 0.0
+    return _DATE_WEIGHT * max(0.0, 1 - days / max(date_range, 1))
+
+
+def score_pair(
+    receipt: ReceiptInput, balance: Dict[str, Any], tolerance: Decimal, date_range: int
+) -> Optional[float]:
+    """回单与单笔结余的匹配置信度；收款人不符或金额差超出容差时返回 None。"""
+    if receipt.amount is None:
+        return None
+    name = _name_score(receipt, balance)
+    if name is None:
+        return None
+    outstanding = _decimal(balance.get("balance_amount")) or Decimal("0")
+    diff = abs(receipt.amount - outstanding)
+    if outstanding <= 0 or diff > tolerance:
+        return None
+    amount = _AMOUNT_WEIGHT * (1 - 0.5 * float(diff / tolerance)) if tolerance > 0 else _AMOUNT_WEIGHT
+    return amount + name + _account_score(receipt, balance) + _date_score(receipt, balance, date_range)
+
+
+def max_weight_assignment(scores: Sequence[Sequence[Optional[float]]]) -> List[Tuple[int, int]]:
+    """
+    行列一对一、权重和最大的匹配（None 表示不可匹配）；返回 [(行, 列)]，不含不可匹配的边。
+    匈牙利算法（势能 + 增广路），O(行² × 列)；行数多于列数时转置求解。
+    """
+    n = len(scores)
+    m = len(scores[0]) if n else 0
+    if not n or not m:
+        return []
+    if n > m:
+        transposed = [[scores[i][j] for i in range(n)] for j in range(m)]
+        return sorted((i, j) for j, i in max_weight_assignment(transposed))
+
+    forbidden = 1.0 + sum(max((s for s in row if s is not None), default=0.0) for row in scores) * 2
+    cost = [[-s if s is not None else forbidden for s in row] for row in scores]
+    inf = float("inf")
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0, delta, j1 = p[j0], inf, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = cost[i0 - 1][j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j], way[j] = cur, j0
+                    if minv[j] < delta:
+                        delta, j1 = minv[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    return sorted((p[j] - 1, j - 1) for j in range(1, m + 1) if p[j] and scores[p[j] - 1][j - 1] is not None)
+
+
+def _components(edges: Dict[int, Dict[int, float]]) -> List[Tuple[List[int], List[int]]]:
+    """回单-结余可匹配边的连通分量：[(回单下标, 结余下标)]。"""
+    by_balance: Dict[int, List[int]] = {}
+    for r, cols in edges.items():
+        for c in cols:
+            by_balance.setdefault(c, []).append(r)
+    seen: Set[int] = set()
+    out = []
+    for start in edges:
+        if start in seen:
+            continue
+        rows, cols, stack = [], set(), [start]
+        seen.add(start)
+        while stack:
+            r = stack.pop()
+            rows.append(r)
+            for c in edges[r]:
+                if c in cols:
+                    continue
+                cols.add(c)
+                for other in by_balance[c]:
+                    if other not in seen:
+                        seen.add(other)
+                        stack.append(other)
+        out.append((sorted(rows), sorted(cols)))
+    return out
+
+
+def _item(balance: Dict[str, Any], amount: Decimal) -> Dict[str, Any]:
+    created = balance.get("created_at")
+    return {
+        "balance_id": balance.get("id"),
+        "amount": float(amount),
+        "balance_amount": float(_decimal(balance.get("balance_amount")) or 0),
+        "contract_no": balance.get("contract_no"),
+        "driver_name": balance.get("driver_name"),
+        "vehicle_no": balance.get("vehicle_no"),
+        "created_at": str(created) if created is not None else None,
+    }
+
+
+def reconcile(
+    receipts: Sequence[ReceiptInput],
+    balances: Sequence[Dict[str, Any]],
+    tolerance: Decimal = DEFAULT_AMOUNT_TOLERANCE,
+    date_range: int = 30,
+) -> List[Dict[str, Any]]:
+    """按回单顺序返回建议：{index, status, confidence, items, alternatives}。"""
+    by_name: Dict[str, List[int]] = {}
+    for c, balance in enumerate(balances):
+        for name in balance_names(balance):
+            by_name.setdefault(name, []).append(c)
+
+    edges: Dict[int, Dict[int, float]] = {}
+    for r, receipt in enumerate(receipts):
+        cols = {}
+        for c in by_name.get(receipt.payee_name or "", ()):
+            score = score_pair(receipt, balances[c], tolerance, date_range)
+            if score is not None:
+                cols[c] = score
+        if cols:
+            edges[r] = cols
+
+    assigned: Dict[int, int] = {}
+    for rows, cols in _components(edges):
+        matrix = [[edges[r].get(c) for c in cols] for r in rows]
+        for i, j in max_weight_assignment(matrix):
+            assigned[rows[i]] = cols[j]
+
+    used = set(assigned.values())
+    proposals: List[Dict[str, Any]] = []
+    for r, receipt in enumerate(receipts):
+        proposal: Dict[str, Any] = {
+            "index": receipt.index, "status": "unmatched", "confidence": 0.0, "items": [], "alternatives": [],
+        }
+        if r in assigned:
+            c = assigned[r]
+            score = edges[r][c]
+            ties = [o for o, s in edges[r].items() if o != c and abs(s - score) <= _TIE_EPSILON]
+            proposal["items"] = [_item(balances[c], min(receipt.amount, _decimal(balances[c]["balance_amount"])))]
+            proposal["confidence"] = round(max(score, 0.0), 3)
+            proposal["alternatives"] = [balances[o].get("id") for o in sorted(edges[r], key=lambda o: -edges[r][o])
+                                        if o != c][:3]
+            proposal["status"] = "confident" if score >= CONFIDENT_SCORE and not ties else "review"
+        elif receipt.amount is not None and receipt.payee_name:
+            combo = _combination(receipt, balances, used, date_range)
+            if combo:
+                cols, score = combo
+                used.update(cols)
+                proposal["items"] = [_item(balances[c], _decimal(balances[c]["balance_amount"])) for c in cols]
+                proposal["confidence"] = round(max(score, 0.0), 3)
+                proposal["status"] = "review"
+        proposals.append(proposal)
+    return proposals
+
+
+def _combination(
+    receipt: ReceiptInput, balances: Sequence[Dict[str, Any]], used: Set[int], date_range: int
+) -> Optional[Tuple[List[int], float]]:
+    """同一收款人未占用的结余里，至多三笔余额之和恰好等于回单金额的组合及其置信度。"""
+    pool = [
+        c for c, b in enumerate(balances)
+        if c not in used and receipt.payee_name in balance_names(b) and (_decimal(b.get("balance_amount")) or 0) > 0
+    ]
+    cents = [int((_decimal(balances[c]["balance_amount"]) / _CENT).to_integral_value()) for c in pool]
+    subset = small_exact_subset(cents, int((receipt.amount / _CENT).to_integral_value()))
+    if not subset or len(subset) < 2:
+        return None
+    cols = [pool[i] for i in subset]
+    parts = [balances[c] for c in cols]
+    score = (
+        _AMOUNT_WEIGHT * _COMBINATION_FACTOR
+        + min(_name_score(receipt, b) for b in parts)
+        + min(_account_score(receipt, b) for b in parts)
+        + min(_date_score(receipt, b, date_range) for b in parts)
+    )
+    return cols, score
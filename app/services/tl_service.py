@@ -3,7 +3,7 @@ TL比价模块服务层
 负责仓库、冶炼厂、品类、比价、运费、价格表、品类映射等数据库操作
 """
 import hashlib
-import io
+import itertools
 import json
 import logging
 import math
@@ -12,7 +12,9 @@ import uuid
 from datetime import date, datetime
 from decimal import Decimal
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
 
 from app.tl_runtime_config import UPLOAD_DIR
 from core.database import get_conn_tuple as get_conn
@@ -25,47 +27,33 @@ from app.quote_price_sources import (
     SOURCE_ORIGINAL,
 )
 from app.price_tax_utils import (
-    derive_net_and_vat_from_quote_row,
     derive_vat_prices_from_stated_price,
     fill_vat_from_exclusive_net,
-    inclusive_from_net,
     merge_factory_rates,
     net_from_inclusive,
     parse_price_basis_from_remark,
 )
+from app.quote_price_matrix import (
+    COL_INDEX,
+    SOURCE_LABELS,
+    TAX_INDEX,
+    QuotePriceMatrix,
+    round_like_python,
+    to_optional_list,
+)
 from app.services.vlm_extractor_service import QwenVLFullExtractor, VLMConfig
+from app.utils.keyset_cursor import count_total, decode_cursor, split_page, validate_count_mode
+from app.utils.streaming_export import EXPORT_FORMATS, iter_export_bytes, iter_keyset_pages
 
 logger = logging.getLogger(__name__)
 
 
-def _unit_for_optimal_price_basis(
-    basis: str,
-    breakdown: Optional[Tuple[float, float, float, float]],
-    qrow: Optional[Dict[str, Optional[float]]],
-) -> Optional[float]:
-    """
-    最优价用的单价（元/吨）：base/1pct/3pct/13pct 来自统一反推 breakdown；
-    普票、反向发票取表中对应列。
-    """
-    if basis == "base":
-        return breakdown[0] if breakdown else None
-    if basis == "1pct":
-        return breakdown[1] if breakdown else None
-    if basis == "3pct":
-        return breakdown[2] if breakdown else None
-    if basis == "13pct":
-        return breakdown[3] if breakdown else None
-    if basis == "normal_invoice":
-        if not qrow:
-            return None
-        v = qrow.get("price_normal_invoice")
-        return float(v) if v is not None else None
-    if basis == "reverse_invoice":
-        if not qrow:
-            return None
-        v = qrow.get("price_reverse_invoice")
-        return float(v) if v is not None else None
-    return None
+# 最优价口径 → 统一反推 breakdown (基准, 含1%, 含3%, 含13%) 的下标；普票、反向发票取表中对应列
+_OPTIMAL_BASIS_BREAKDOWN_INDEX: Dict[str, int] = {"base": 0, "1pct": 1, "3pct": 2, "13pct": 3}
+_OPTIMAL_BASIS_QUOTE_COLUMN: Dict[str, str] = {
+    "normal_invoice": "price_normal_invoice",
+    "reverse_invoice": "price_reverse_invoice",
+}
 
 
 class PurchaseSuggestionLLMError(Exception):
@@ -88,6 +76,23 @@ def _cell_json(v: Any) -> Any:
     return v
 
 
+# 报价明细列表/导出的排序；键集分页游标为末行的 (quote_date, factory_id, category_name, id)
+_QUOTE_DETAILS_ORDER_SQL = "ORDER BY qd.quote_date DESC, qd.factory_id, qd.category_name, qd.id DESC"
+
+
+def _quote_details_after_sql(after: Optional[tuple]) -> Tuple[str, Tuple[Any, ...]]:
+    """排在 after 之后的行的 AND 条件（与 `_QUOTE_DETAILS_ORDER_SQL` 一致）；after 为 None 时不加条件。"""
+    if after is None:
+        return "", ()
+    a_date, a_fid, a_cat, a_id = after
+    return (
+        " AND (qd.quote_date < %s OR (qd.quote_date = %s AND ("
+        "qd.factory_id > %s OR (qd.factory_id = %s AND ("
+        "qd.category_name > %s OR (qd.category_name = %s AND qd.id < %s))))))",
+        (a_date, a_date, a_fid, a_fid, a_cat, a_cat, a_id),
+    )
+
+
 def _json_cell_to_dict(val: Any) -> Optional[Dict[str, Any]]:
     """解析库表 JSON 列（或已解析的 dict）为字典。"""
     if val is None:
@@ -642,199 +647,153 @@ class TLService:
                     col_names = ["unit_price", "price_1pct_vat", "price_3pct_vat",
                                  "price_13pct_vat", "price_normal_invoice", "price_reverse_invoice"]
                     raw_price_map: Dict[tuple, Dict[str, Optional[float]]] = {}
-                    name_to_cat_id: Dict[str, int] = {}
                     for row in cur.fetchall():
                         fid_r, cat_name = row[0], row[1]
                         raw_price_map[(fid_r, cat_name)] = {
                             col: (float(v) if v is not None else None)
                             for col, v in zip(col_names, row[2:])
                         }
-                        # 建立品类名称到category_id的映射
-                        for cat_id, names in cat_id_to_names.items():
-                            if cat_name in names:
-                                name_to_cat_id[cat_name] = cat_id
-                                break
-
-            # 换算逻辑（纯 Python，连接已关闭）
-            # col → tax_type 的对应关系，用于反算不含税价
-            COL_TO_TAX: Dict[str, str] = {
-                "price_1pct_vat": "1pct",
-                "price_3pct_vat": "3pct",
-                "price_13pct_vat": "13pct",
-            }
 
-            def resolve_price(fid: int, cat_id: int) -> Tuple[Optional[float], str]:
-                """
-                返回 (price, source)
-                source: "direct" | "calc_from_base" | "calc_from_other_vat" | "unavailable"
-                """
-                # 找该 category_id 下的所有品类名称，取第一个有报价的
-                cat_names = cat_id_to_names.get(cat_id, [])
-                for cat_name in cat_names:
-                    prices = raw_price_map.get((fid, cat_name), {})
-                    if not prices:
-                        continue
+            # 列式换算（连接已关闭）：全部 (冶炼厂, 品类) 一次取价/反推，逐行只做组装
+            cells = [
+                (wid, fid, wname, fname, freight, cid)
+                for (wid, fid), (wname, fname, freight) in freight_map.items()
+                for cid in category_ids
+                if cat_map.get(cid) is not None
+            ]
+            if not cells:
+                return {
+                    "明细": [],
+                    "冶炼厂利润排行": [],
+                    "最优价排序口径": sort_basis,
+                }
 
-                    rates = tax_rate_map.get(fid, {})
-                    merged = merge_factory_rates(rates)
-
-                    # 1. 直接有目标列
-                    direct = prices.get(target_col)
-                    if direct is not None:
-                        return direct, "direct"
-
-                    # 2. 不含税 unit_price → 目标税率含税价
-                    if target_tax and prices.get("unit_price") is not None and target_tax in merged:
-                        up = float(prices["unit_price"])
-                        calc = inclusive_from_net(up, merged[target_tax])
-                        return calc, "calc_from_base"
-
-                    # 3. 目标为不含税基准，由已知含税价反算
-                    if target_col == "unit_price":
-                        for col, src_tax in COL_TO_TAX.items():
-                            known_price = prices.get(col)
-                            if known_price is not None and src_tax in merged:
-                                net = net_from_inclusive(float(known_price), merged[src_tax])
-                                return round(net, 2), f"calc_from_{src_tax}"
-
-                    # 4. 从某一档含税价反算不含税，再换算到目标税率
-                    if target_tax and target_tax in merged:
-                        for col, src_tax in COL_TO_TAX.items():
-                            known_price = prices.get(col)
-                            if known_price is not None and src_tax in merged:
-                                net = net_from_inclusive(float(known_price), merged[src_tax])
-                                calc = inclusive_from_net(net, merged[target_tax])
-                                return calc, f"calc_from_{src_tax}"
-
-                return None, "unavailable"
-
-            def pick_quote_row(fid: int, cat_id: int) -> Optional[Dict[str, Optional[float]]]:
-                for cn in cat_id_to_names.get(cat_id, []):
-                    row = raw_price_map.get((fid, cn), {})
-                    if row:
-                        return row
-                return None
+            matrix = QuotePriceMatrix.build(
+                [c[1] for c in cells],
+                [c[5] for c in cells],
+                cat_id_to_names,
+                raw_price_map,
+                tax_rate_map,
+            )
+            fi = np.array([matrix.factory_pos[c[1]] for c in cells])
+            ci = np.array([matrix.category_pos[c[5]] for c in cells])
 
-            # 组合结果；总运费恒为：车数×每车运费（元/车），车数由吨数与每车吨数推算
-            t = float(tons)
-            tp_truck = float(tons_per_truck) if tons_per_truck and tons_per_truck > 0 else 35.0
-            result: List[Dict[str, Any]] = []
-            for (wid, fid), (wname, fname, freight) in freight_map.items():
-                for cid in category_ids:
-                    cat_name = cat_map.get(cid)
-                    if cat_name is None:
-                        continue
-                    price, source = resolve_price(fid, cid)
-                    merged = merge_factory_rates(tax_rate_map.get(fid, {}))
-                    if price is not None and target_tax and target_tax in merged:
-                        p_net = round(
-                            net_from_inclusive(float(price), merged[target_tax]), 2
-                        )
-                    elif price is not None:
-                        p_net = float(price)
-                    else:
-                        p_net = None
+            price_fc, source_fc = matrix.resolve_target_prices(target_col, target_tax)
+            qrows_fc, has_row_fc = matrix.quote_rows()
+            breakdown_fc = matrix.breakdown(qrows_fc, has_row_fc)
 
-                    p = float(p_net) if p_net is not None else 0.0
-                    fr = float(freight) if freight is not None else 0.0
-                    n_trucks = max(1, math.ceil(t / tp_truck))
-                    freight_cost_total = round(fr * n_trucks, 2)
+            price = price_fc[fi, ci]
+            if target_tax:
+                p_net = round_like_python(
+                    price / (1 + matrix.rates[fi, TAX_INDEX[target_tax]]), 2
+                )
+            else:
+                p_net = price
 
-                    profit = round(p * t - freight_cost_total, 2)
+            # 总运费恒为：车数×每车运费（元/车），车数由吨数与每车吨数推算
+            t = float(tons)
+            tp_truck = float(tons_per_truck) if tons_per_truck and tons_per_truck > 0 else 35.0
+            n_trucks = max(1, math.ceil(t / tp_truck))
+            freight = np.array([float(c[4]) if c[4] is not None else 0.0 for c in cells])
+            freight_total = round_like_python(freight * n_trucks, 2)
+            profit = round_like_python(np.nan_to_num(p_net, nan=0.0) * t - freight_total, 2)
+
+            breakdown = breakdown_fc[fi, ci]
+            profit_base = round_like_python(breakdown[:, 0] * t - freight_total, 2)
+            profit_3 = round_like_python(breakdown[:, 2] * t - freight_total, 2)
+            qrows = qrows_fc[fi, ci]
+            optimal = {
+                b: round_like_python(
+                    (
+                        breakdown[:, _OPTIMAL_BASIS_BREAKDOWN_INDEX[b]]
+                        if b in _OPTIMAL_BASIS_BREAKDOWN_INDEX
+                        else qrows[:, COL_INDEX[_OPTIMAL_BASIS_QUOTE_COLUMN[b]]]
+                    ) * t - freight_total,
+                    2,
+                )
+                for b in bases
+            }
 
-                    qrow = pick_quote_row(fid, cid)
-                    breakdown = (
-                        derive_net_and_vat_from_quote_row(qrow, merged) if qrow else None
-                    )
-                    if breakdown:
-                        base_net, p1_vat, p3_vat, _p13 = breakdown
-                        profit_base = round(base_net * t - freight_cost_total, 2)
-                        profit_3 = round(p3_vat * t - freight_cost_total, 2)
-                    else:
-                        base_net = None
-                        p1_vat = None
-                        p3_vat = None
-                        profit_base = None
-                        profit_3 = None
-
-                    optimal_profits: Dict[str, Optional[float]] = {}
-                    for b in bases:
-                        u = _unit_for_optimal_price_basis(b, breakdown, qrow)
-                        optimal_profits[b] = (
-                            round(u * t - freight_cost_total, 2) if u is not None else None
-                        )
+            # 按排序口径利润降序（稳定排序，无值垫底）
+            sort_key = np.nan_to_num(optimal[sort_basis], nan=-np.inf)
+            order = np.argsort(-sort_key, kind="stable")
+
+            col_p_net = to_optional_list(p_net[order])
+            col_profit = profit[order].tolist()
+            col_base = to_optional_list(breakdown[order, 0])
+            col_p1 = to_optional_list(breakdown[order, 1])
+            col_p3 = to_optional_list(breakdown[order, 2])
+            col_profit_base = to_optional_list(profit_base[order])
+            col_profit_3 = to_optional_list(profit_3[order])
+            col_freight = freight[order].tolist()
+            col_freight_total = freight_total[order].tolist()
+            col_optimal = {b: to_optional_list(v[order]) for b, v in optimal.items()}
+            col_source = source_fc[fi, ci][order].tolist()
 
-                    rec: Dict[str, Any] = {
+            result: List[Dict[str, Any]] = []
+            for pos, i in enumerate(order.tolist()):
+                wid, fid, wname, fname, _freight, cid = cells[i]
+                source = SOURCE_LABELS[col_source[pos]]
+                result.append(
+                    {
                         "仓库id": wid,
                         "冶炼厂id": fid,
                         "品类id": cid,
                         "仓库": wname,
                         "冶炼厂": fname,
-                        "品类": cat_name,
+                        "品类": cat_map[cid],
                         "price_type": price_type_name,
                         "吨数": t,
                         "运费计价方式": "per_truck",
                         "车数": n_trucks,
                         "每车吨数": tp_truck,
-                        "运费": fr,
-                        "总运费": freight_cost_total,
-                        "报价": p_net if source != "unavailable" else None,
+                        "运费": col_freight[pos],
+                        "总运费": col_freight_total[pos],
+                        "报价": col_p_net[pos] if source != "unavailable" else None,
                         "报价来源": source,
-                        "基准价": base_net,
-                        "含1%税价": p1_vat,
-                        "含3%税价": p3_vat,
-                        "利润": profit,
-                        "利润_基准": profit_base,
-                        "利润_含3%": profit_3,
-                        "最优价各口径利润": optimal_profits,
+                        "基准价": col_base[pos],
+                        "含1%税价": col_p1[pos],
+                        "含3%税价": col_p3[pos],
+                        "利润": col_profit[pos],
+                        "利润_基准": col_profit_base[pos],
+                        "利润_含3%": col_profit_3[pos],
+                        "最优价各口径利润": {b: col_optimal[b][pos] for b in bases},
                     }
-                    result.append(rec)
+                )
 
-            result.sort(
-                key=lambda r: (
-                    r["最优价各口径利润"][sort_basis]
-                    if r["最优价各口径利润"].get(sort_basis) is not None
-                    else float("-inf")
-                ),
-                reverse=True,
-            )
+            # 按冶炼厂汇总（按明细顺序累加）；排行按「最优价排序口径」对应利润合计从高到低
+            sorted_fids = [int(cells[i][1]) for i in order.tolist()]
+            agg_fids = list(dict.fromkeys(sorted_fids))
+            agg_pos = {sfid: k for k, sfid in enumerate(agg_fids)}
+            group = np.array([agg_pos[sfid] for sfid in sorted_fids])
+
+            def group_total(values: np.ndarray) -> List[float]:
+                sums = np.bincount(
+                    group,
+                    weights=np.nan_to_num(values[order], nan=0.0),
+                    minlength=len(agg_fids),
+                )
+                return round_like_python(sums, 2).tolist()
 
-            # 按冶炼厂汇总；排行按「最优价排序口径」对应利润合计从高到低
-            agg: Dict[int, Dict[str, Any]] = {}
+            total_profit = group_total(profit)
+            total_profit_3 = group_total(profit_3)
+            total_profit_base = group_total(profit_base)
+            total_optimal = {b: group_total(v) for b, v in optimal.items()}
+            smelter_names: Dict[int, Any] = {}
             for row in result:
-                sfid = int(row["冶炼厂id"])
-                if sfid not in agg:
-                    agg[sfid] = {
-                        "冶炼厂id": sfid,
-                        "冶炼厂": row["冶炼厂"],
-                        "利润": 0.0,
-                        "利润_含3%合计": 0.0,
-                        "利润_基准合计": 0.0,
-                        "最优价口径合计": {b: 0.0 for b in bases},
-                    }
-                agg[sfid]["利润"] += float(row["利润"])
-                if row["利润_含3%"] is not None:
-                    agg[sfid]["利润_含3%合计"] += float(row["利润_含3%"])
-                if row["利润_基准"] is not None:
-                    agg[sfid]["利润_基准合计"] += float(row["利润_基准"])
-                op = row["最优价各口径利润"]
-                for b in bases:
-                    pv = op.get(b)
-                    if pv is not None:
-                        agg[sfid]["最优价口径合计"][b] += float(pv)
+                smelter_names.setdefault(int(row["冶炼厂id"]), row["冶炼厂"])
 
             ranking = sorted(
                 (
                     {
-                        **v,
-                        "利润": round(v["利润"], 2),
-                        "利润_含3%合计": round(v["利润_含3%合计"], 2),
-                        "利润_基准合计": round(v["利润_基准合计"], 2),
-                        "最优价口径合计": {
-                            b: round(v["最优价口径合计"][b], 2) for b in bases
-                        },
+                        "冶炼厂id": sfid,
+                        "冶炼厂": smelter_names[sfid],
+                        "利润": total_profit[k],
+                        "利润_含3%合计": total_profit_3[k],
+                        "利润_基准合计": total_profit_base[k],
+                        "最优价口径合计": {b: total_optimal[b][k] for b in bases},
                     }
-                    for v in agg.values()
+                    for k, sfid in enumerate(agg_fids)
                 ),
                 key=lambda x: x["最优价口径合计"][sort_basis],
                 reverse=True,
@@ -1618,11 +1577,21 @@ class TLService:
         page: int = 1,
         page_size: int = 50,
         response_format: str = "full",
+        cursor: Optional[str] = None,
+        cursor_mode: bool = False,
+        count_mode: str = "exact",
     ) -> Dict[str, Any]:
+        """
+        报价明细分页列表。cursor_mode=True 或传入 cursor 时按列表排序键做键集分页（忽略 page），
+        data 中附带 next_cursor / has_more；count_mode 见 `app.utils.keyset_cursor`。
+        """
         if response_format not in ("full", "table"):
             raise ValueError('response_format 仅支持 "full" 或 "table"')
         if page < 1:
             raise ValueError("page 必须 >= 1")
+        validate_count_mode(count_mode)
+        use_cursor = cursor_mode or bool(cursor)
+        after_key = tuple(decode_cursor(cursor, key_len=4)) if cursor else None
         page_size = min(max(page_size, 1), 500)
         where_sql, params = self._prepare_quote_details_filter(
             factory_id=factory_id,
@@ -1642,9 +1611,22 @@ class TLService:
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    cur.execute(f"SELECT COUNT(*) {base_from}", tuple(params))
-                    total = cur.fetchone()[0]
+                    total = count_total(
+                        cur,
+                        f"SELECT COUNT(*) {base_from}",
+                        params,
+                        count_mode,
+                        estimate_sql=f"SELECT qd.id {base_from}",
+                    )
 
+                    if use_cursor:
+                        keyset_sql, keyset_params = _quote_details_after_sql(after_key)
+                        limit_sql = "LIMIT %s"
+                        page_params = tuple(params) + keyset_params + (page_size + 1,)
+                    else:
+                        keyset_sql = ""
+                        limit_sql = "LIMIT %s OFFSET %s"
+                        page_params = tuple(params) + (page_size, offset)
                     cur.execute(
                         f"""
                         SELECT qd.id,
@@ -1662,15 +1644,22 @@ class TLService:
                                qd.price_field_sources AS `价格字段来源`,
                                qd.created_at AS `创建时间`,
                                qd.updated_at AS `更新时间`
-                        {base_from}
-                        ORDER BY qd.quote_date DESC, qd.factory_id, qd.category_name, qd.id DESC
-                        LIMIT %s OFFSET %s
+                        {base_from}{keyset_sql}
+                        {_QUOTE_DETAILS_ORDER_SQL}
+                        {limit_sql}
                         """,
-                        tuple(params) + (page_size, offset),
+                        page_params,
                     )
                     cols = [d[0] for d in cur.description]
+                    raw_rows = cur.fetchall()
+                    next_cursor = None
+                    if use_cursor:
+                        # 列序：id, 报价日期, 冶炼厂id, 冶炼厂, 品类名, ...
+                        raw_rows, next_cursor = split_page(
+                            raw_rows, page_size, lambda r: (r[1], r[2], r[4], r[0])
+                        )
                     rows = []
-                    for r in cur.fetchall():
+                    for r in raw_rows:
                         row: Dict[str, Any] = {}
                         for c, v in zip(cols, r):
                             if c == "价格字段来源":
@@ -1691,7 +1680,11 @@ class TLService:
                     }
                     for item in rows
                 ]
-            return {"code": 200, "data": {"total": total, "list": rows}}
+            data: Dict[str, Any] = {"total": total, "list": rows}
+            if use_cursor:
+                data["next_cursor"] = next_cursor
+                data["has_more"] = next_cursor is not None
+            return {"code": 200, "data": data}
         except ValueError:
             raise
         except Exception as e:
@@ -1709,8 +1702,16 @@ class TLService:
         category_name: Optional[str] = None,
         category_exact: bool = False,
         max_rows: int = 50000,
-    ) -> bytes:
-        """与列表接口相同筛选条件，导出与表格列一致的 xlsx（最多 max_rows 行）。"""
+        file_format: str = "xlsx",
+        page_size: int = 2000,
+    ) -> Iterator[bytes]:
+        """
+        与列表接口相同筛选条件，流式导出与表格列一致的 xlsx/csv（最多 max_rows 行）。
+        按排序键做键集分页读库（每页一次短连接），返回字节块迭代器供 StreamingResponse 使用；
+        筛选与格式校验在返回前完成（ValueError）。
+        """
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError(f"file_format 仅支持 {'/'.join(EXPORT_FORMATS)}")
         max_rows = min(max(max_rows, 1), 100000)
         where_sql, params = self._prepare_quote_details_filter(
             factory_id=factory_id,
@@ -1725,9 +1726,10 @@ class TLService:
             "JOIN dict_factories df ON qd.factory_id = df.id "
             f"WHERE {where_sql}"
         )
-        try:
-            from openpyxl import Workbook
 
+        def fetch_page(after: Optional[tuple], limit: int) -> List[tuple]:
+            # 与列表相同的排序：quote_date DESC, factory_id, category_name, id DESC
+            keyset_sql, keyset_params = _quote_details_after_sql(after)
             with get_conn() as conn:
                 with conn.cursor() as cur:
                     cur.execute(
@@ -1737,23 +1739,26 @@ class TLService:
                                qd.category_name,
                                qd.unit_price,
                                qd.price_3pct_vat,
-                               qd.price_13pct_vat
-                        {base_from}
-                        ORDER BY qd.quote_date DESC, qd.factory_id, qd.category_name, qd.id DESC
+                               qd.price_13pct_vat,
+                               qd.factory_id,
+                               qd.id
+                        {base_from}{keyset_sql}
+                        {_QUOTE_DETAILS_ORDER_SQL}
                         LIMIT %s
                         """,
-                        tuple(params) + (max_rows,),
+                        tuple(params) + keyset_params + (limit,),
                     )
-                    db_rows = cur.fetchall()
-
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "报价数据"
-            ws.append(["日期", "冶炼厂", "品种", "基准价", "3%含税价", "13%含税价"])
-            for row in db_rows:
-                qd_d, fname, cname, up, p3, p13 = row
-                ws.append(
-                    [
+                    return list(cur.fetchall())
+
+        def export_rows() -> Iterator[List[Any]]:
+            pages = iter_keyset_pages(
+                fetch_page,
+                key_of=lambda r: (r[0], r[6], r[2], r[7]),
+                page_size=min(page_size, max_rows),
+            )
+            try:
+                for qd_d, fname, cname, up, p3, p13, _fid, _id in itertools.islice(pages, max_rows):
+                    yield [
                         qd_d.isoformat() if isinstance(qd_d, date) else qd_d,
                         fname,
                         cname,
@@ -1761,15 +1766,16 @@ class TLService:
                         _cell_json(p3),
                         _cell_json(p13),
                     ]
-                )
-            buf = io.BytesIO()
-            wb.save(buf)
-            return buf.getvalue()
-        except ValueError:
-            raise
-        except Exception as e:
-            logger.error(f"导出报价 Excel 失败: {e}")
-            raise
+            except Exception as e:
+                logger.error(f"导出报价数据失败: {e}")
+                raise
+
+        return iter_export_bytes(
+            file_format,
+            ["日期", "冶炼厂", "品种", "基准价", "3%含税价", "13%含税价"],
+            export_rows(),
+            sheet_title="报价数据",
+        )
 
     # ==================== 接口7a：获取品类映射表 ====================
 
@@ -2060,51 +2066,16 @@ class TLService:
                         for col, v in zip(col_names, row[2:])
                     }
 
-        # 价格反算逻辑
-        COL_TO_TAX: Dict[str, str] = {
-            "price_1pct_vat": "1pct",
-            "price_3pct_vat": "3pct",
-            "price_13pct_vat": "13pct",
-        }
-
-        def resolve_price(fid: int, cat_id: int) -> Optional[float]:
-            cat_names = cat_id_to_names.get(cat_id, [])
-            for cat_name in cat_names:
-                prices = raw_price_map.get((fid, cat_name), {})
-                if not prices:
-                    continue
-
-                rates = tax_rate_map.get(fid, {})
-                merged = merge_factory_rates(rates)
-
-                direct = prices.get(target_col)
-                if direct is not None:
-                    return direct
-
-                if target_tax and prices.get("unit_price") is not None and target_tax in merged:
-                    return inclusive_from_net(float(prices["unit_price"]), merged[target_tax])
-
-                if target_col == "unit_price":
-                    for col, src_tax in COL_TO_TAX.items():
-                        known_price = prices.get(col)
-                        if known_price is not None and src_tax in merged:
-                            net = net_from_inclusive(float(known_price), merged[src_tax])
-                            return round(net, 2)
-
-                if target_tax and target_tax in merged:
-                    for col, src_tax in COL_TO_TAX.items():
-                        known_price = prices.get(col)
-                        if known_price is not None and src_tax in merged:
-                            net = net_from_inclusive(float(known_price), merged[src_tax])
-                            return inclusive_from_net(net, merged[target_tax])
-
-            return None
-
-        # 构建 price_map: {(factory_id, category_id): price}
+        # 构建 price_map: {(factory_id, category_id): price}，取价规则与比价表一致
+        matrix = QuotePriceMatrix.build(
+            smelter_ids, category_ids, cat_id_to_names, raw_price_map, tax_rate_map
+        )
+        price_fc, _source_fc = matrix.resolve_target_prices(target_col, target_tax)
         price_map: Dict[tuple, Optional[float]] = {}
         for fid in smelter_ids:
+            prices = to_optional_list(price_fc[matrix.factory_pos[fid]])
             for cid in category_ids:
-                price_map[(fid, cid)] = resolve_price(fid, cid)
+                price_map[(fid, cid)] = prices[matrix.category_pos[cid]]
 
         # 构造结构化数据：每条需求 × 全部冶炼厂，报价与各仓库运费对比
         demand_rows = []
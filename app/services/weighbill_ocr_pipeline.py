@@ -0,0 +1,249 @@
+"""
+磅单批量识别流水线（`WeighbillService.batch_upload_weighbills` 使用）。
+
+原实现逐张「写临时文件 → 预处理 → OCR → 匹配报单 → 入库」，一批 30 张照片只用一个核。现分三段：
+
+1. 预处理（解码、超分、增强、缩放、JPEG 编码）：纯 CPU 且持有 GIL，放进进程池（spawn 启动，
+   避免 fork 带着 onnxruntime 会话和数据库连接的服务进程）；
+2. OCR：onnxruntime 推理释放 GIL，用线程池 + 预加载的 RapidOCR 引擎池，每个线程独占一个引擎；
+3. 匹配报单与入库：回到调用线程按输入顺序依次执行（由服务层完成，同一批内的相同查询会复用结果）。
+
+并发度为 1 或只有一张图时不建任何池，行为与逐张处理一致。进程池不可用时自动退回当前进程内预处理。
+"""
+import io
+import logging
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Union
+
+import cv2
+import numpy as np
+from cv2 import dnn_superres
+from PIL import Image, ImageEnhance, ImageFilter
+
+logger = logging.getLogger(__name__)
+
+SUPER_RESOLUTION_MODEL = Path(__file__).parent / "models" / "ESPCN_x2.pb"
+MAX_IMAGE_SIDE = 2000
+JPEG_QUALITY = 95
+
+#: 上传图片：bytes 或已落盘的文件句柄（与 image_store.ImageSource 一致；此处不导入服务层，进程池子进程保持轻量）
+ImageSource = Union[bytes, BinaryIO]
+
+
+def _read_source(source: ImageSource) -> bytes:
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    source.seek(0)
+    return source.read()
+
+
+def apply_super_resolution(image: Image.Image) -> Image.Image:
+    """小图（< 800×600）做 2 倍超分；模型缺失或失败时原图返回。"""
+    if image.width < 800 or image.height < 600:
+        try:
+            if not SUPER_RESOLUTION_MODEL.exists():
+                logger.warning("超分辨率模型文件不存在，跳过")
+                return image
+
+            img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+            sr = dnn_superres.DnnSuperResImpl.create()
+            sr.readModel(str(SUPER_RESOLUTION_MODEL))
+            sr.setModel("fsrcnn", 2)
+            result = sr.upsample(img_cv)
+
+            result_rgb = cv2.cvtColor(result, cv2.COLOR_BGR2RGB)
+            return Image.fromarray(result_rgb)
+        except Exception as e:
+            logger.error(f"超分辨率处理失败: {e}")
+            return image
+    return image
+
+
+def enhance_for_ocr(img: Image.Image) -> Image.Image:
+    """转 RGB → 超分 → 对比度 1.5 → 锐化 → 长边缩到 2000 以内。"""
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img = apply_super_resolution(img)
+    img = ImageEnhance.Contrast(img).enhance(1.5)
+    img = img.filter(ImageFilter.SHARPEN)
+    if max(img.size) > MAX_IMAGE_SIDE:
+        ratio = MAX_IMAGE_SIDE / max(img.size)
+        new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+    return img
+
+
+def preprocess_image_bytes(image_bytes: bytes) -> bytes:
+    """
+    进程池任务：原图字节 → 预处理后的 JPEG 字节。
+    与 `WeighbillService.preprocess_image` 一致，预处理失败时返回原图（仍交给 OCR 尝试）。
+    """
+    try:
+        img = enhance_for_ocr(Image.open(io.BytesIO(image_bytes)))
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=JPEG_QUALITY)
+        return buf.getvalue()
+    except Exception as e:
+        logger.error(f"预处理失败: {e}")
+        return image_bytes
+
+
+class OcrEnginePool:
+    """
+    预加载的 OCR 引擎池：每个引擎同一时刻只借给一个线程（RapidOCR 实例不保证线程安全）。
+    引擎按需创建、创建后常驻，总数不超过 size。
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int, preloaded: Optional[List[Any]] = None):
+        self._factory = factory
+        self._size = max(int(size), 1)
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        for engine in (preloaded or [])[: self._size]:
+            self._idle.put(engine)
+            self._created += 1
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def resize(self, size: int) -> None:
+        """只增不减：已创建的引擎保留，后续按新上限补建。"""
+        with self._lock:
+            self._size = max(self._size, int(size))
+
+    def warm_up(self, count: int) -> None:
+        """提前创建引擎直到 count 个（不超过 size），避免首批请求承担模型加载耗时。"""
+        while True:
+            with self._lock:
+                if self._created >= min(count, self._size):
+                    return
+                self._created += 1
+            try:
+                self._idle.put(self._factory())
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+    @contextmanager
+    def acquire(self) -> Iterator[Any]:
+        engine = None
+        try:
+            engine = self._idle.get_nowait()
+        except queue.Empty:
+            create = False
+            with self._lock:
+                if self._created < self._size:
+                    self._created += 1
+                    create = True
+            if create:
+                try:
+                    engine = self._factory()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                engine = self._idle.get()
+        try:
+            yield engine
+        finally:
+            self._idle.put(engine)
+
+
+_preprocess_pool: Optional[ProcessPoolExecutor] = None
+_preprocess_pool_size = 0
+_preprocess_pool_lock = threading.Lock()
+
+
+def _get_preprocess_pool(workers: int) -> ProcessPoolExecutor:
+    global _preprocess_pool, _preprocess_pool_size
+    with _preprocess_pool_lock:
+        if _preprocess_pool is None or _preprocess_pool_size != workers:
+            if _preprocess_pool is not None:
+                _preprocess_pool.shutdown(wait=False, cancel_futures=True)
+            _preprocess_pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+            _preprocess_pool_size = workers
+        return _preprocess_pool
+
+
+def _discard_preprocess_pool() -> None:
+    global _preprocess_pool, _preprocess_pool_size
+    with _preprocess_pool_lock:
+        if _preprocess_pool is not None:
+            _preprocess_pool.shutdown(wait=False, cancel_futures=True)
+        _preprocess_pool = None
+        _preprocess_pool_size = 0
+
+
+def shutdown_pipeline_pools() -> None:
+    """进程退出时回收预处理进程池（lifespan 关闭阶段调用）。"""
+    _discard_preprocess_pool()
+
+
+def preprocess_batch(image_files: Sequence[ImageSource], max_workers: int) -> List[bytes]:
+    """
+    按输入顺序返回预处理结果；并发度 ≤ 1 或单张时在当前进程内执行。
+    输入为文件句柄时按需读取：进程内逐张读，进程池按 workers×2 的窗口读，同一时刻只有窗口内的原图在内存里。
+    """
+    workers = min(max(int(max_workers), 1), len(image_files))
+    if workers <= 1:
+        return [preprocess_image_bytes(_read_source(f)) for f in image_files]
+    window = workers * 2
+    results: List[bytes] = []
+    try:
+        pool = _get_preprocess_pool(workers)
+        for start in range(0, len(image_files), window):
+            chunk = [_read_source(f) for f in image_files[start:start + window]]
+            results.extend(pool.map(preprocess_image_bytes, chunk))
+        return results
+    except (BrokenProcessPool, OSError, RuntimeError) as e:
+        logger.warning("磅单预处理进程池不可用，改为进程内处理: %s", e)
+        _discard_preprocess_pool()
+        return results + [preprocess_image_bytes(_read_source(f)) for f in image_files[len(results):]]
+
+
+def recognize_batch(
+    images: List[bytes],
+    recognize: Callable[[bytes, Any], Dict[str, Any]],
+    engine_pool: OcrEnginePool,
+    max_workers: int,
+) -> List[Dict[str, Any]]:
+    """
+    每张图借一个引擎调用 recognize(image_bytes, engine)，按输入顺序返回结果。
+    单张图的异常转为 {"success": False, "error": ...}，不影响同批其它图片。
+    """
+
+    def run_one(image: bytes) -> Dict[str, Any]:
+        try:
+            with engine_pool.acquire() as engine:
+                return recognize(image, engine)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    workers = min(max(int(max_workers), 1), engine_pool.size, len(images))
+    if workers <= 1:
+        return [run_one(img) for img in images]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="weighbill-ocr") as executor:
+        return list(executor.map(run_one, images))
+
+
+def run_ocr_pipeline(
+    image_files: Sequence[ImageSource],
+    recognize: Callable[[bytes, Any], Dict[str, Any]],
+    engine_pool: OcrEnginePool,
+    max_workers: int,
+) -> List[Dict[str, Any]]:
+    """预处理（进程池）→ OCR（引擎池），结果与 image_files 一一对应。"""
+    if not image_files:
+        return []
+    processed = preprocess_batch(image_files, max_workers)
+    return recognize_batch(processed, recognize, engine_pool, max_workers)
@@ -2,19 +2,13 @@
 磅单服务 - 支持一报单多品种（最多4个）
 """
 import logging
-import os
 import re
 import tempfile
-import uuid
+import threading
 from decimal import Decimal, ROUND_HALF_UP
-import cv2  # 新增导入
-import numpy as np
-from cv2 import dnn_superres
-from pathlib import Path
-from typing import Dict, List, Optional, Any
-from datetime import datetime
+from typing import Dict, List, Optional, Any, Tuple, Union
 
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
 
 try:
     from rapidocr_onnxruntime import RapidOCR
@@ -25,8 +19,32 @@ except ImportError:
 from pymysql.cursors import DictCursor
 
 from app.core.logging import log_price_change
+from app.core.config import settings
 from app.core.paths import UPLOADS_DIR
+from app.core.schema_migrations import get_schema_capabilities
+from app.services.balance_party_summary import sync_balance_summaries
+from app.services.contract_capacity import apply_delivery_change
+from app.services.contract_progress import DELIVERIES, SHIPPING, refresh_contract_progress
 from app.services.contract_service import get_conn
+from app.services.image_store import ImageSource, release_image, save_image
+from app.services.weighbill_ocr_pipeline import (
+    JPEG_QUALITY,
+    OcrEnginePool,
+    apply_super_resolution,
+    enhance_for_ocr,
+    preprocess_image_bytes,
+    run_ocr_pipeline,
+)
+from app.utils.fulltext_search import keyword_filter
+from app.utils.keyset_cursor import (
+    count_total,
+    decode_cursor,
+    keyset_before_params,
+    keyset_before_sql,
+    split_page,
+    validate_count_mode,
+)
+from app.utils.ocr_fields import FieldExtractor
 from app.utils.product_mapping import convert_to_mill_product
 
 logger = logging.getLogger(__name__)
@@ -34,7 +52,100 @@ logger = logging.getLogger(__name__)
 UPLOAD_DIR = UPLOADS_DIR / "weighbills"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-_WEIGHBILL_AUDIT_COLS_ENSURED = False
+def delivery_weighbill_summary_sql(id_count: int) -> str:
+    """
+    报单 d.* + 磅单总数 / 已上传数。先对本页报单 ID 做一次 GROUP BY delivery_id 条件计数，
+    再 LEFT JOIN 回报单（替代每行两个相关子查询）；参数为两遍报单 ID 列表。
+    """
+    id_ph = ",".join(["%s"] * id_count)
+    return f"""
+        SELECT d.*,
+               COALESCE(agg.total_weighbills, 0) AS total_weighbills,
+               COALESCE(agg.uploaded_weighbills, 0) AS uploaded_weighbills
+        FROM pd_deliveries d
+        LEFT JOIN (
+            SELECT delivery_id,
+                   COUNT(*) AS total_weighbills,
+                   COUNT(CASE WHEN upload_status = '已上传' THEN 1 END) AS uploaded_weighbills
+            FROM pd_weighbills
+            WHERE delivery_id IN ({id_ph})
+            GROUP BY delivery_id
+        ) agg ON agg.delivery_id = d.id
+        WHERE d.id IN ({id_ph})
+        ORDER BY d.created_at DESC
+    """
+
+
+def delivery_match_query(
+    plate: str,
+    weigh_date: str,
+    driver_name: Optional[str] = None,
+    contract_no: Optional[str] = None,
+    plate_raw: Optional[str] = None,
+    use_plate_norm_column: bool = True,
+) -> Tuple[str, tuple]:
+    """
+    磅单匹配报单：规范化车牌 + 报货日期在磅单日期 ±1 天内，一次范围查询取最优的一条。
+    - 走 (vehicle_no_norm, report_date) 联合索引；旧库无该列时退回 REPLACE 表达式（全表扫描）；
+    - 带合同号时合同号一致的候选排在最前，没有则取同车同日期的其它报单（原先的二次查询）；
+    - 其余按与磅单日期的天数差、创建时间升序。
+    返回 (SQL, 参数)。
+    """
+    if use_plate_norm_column:
+        plate_sql, params = "vehicle_no_norm = %s", [plate]
+    else:
+        plate_sql = "(REPLACE(REPLACE(vehicle_no, ' ', ''), '　', '') = %s OR vehicle_no = %s)"
+        params = [plate, plate_raw or plate]
+    params += [weigh_date, weigh_date]
+    extra = ""
+    if driver_name:
+        extra = " AND driver_name = %s"
+        params.append(driver_name)
+    order_by = ""
+    if contract_no:
+        order_by = "(contract_no = %s) DESC, "
+        params.append(contract_no)
+    params.append(weigh_date)
+    sql = f"""
+        SELECT * FROM pd_deliveries
+        WHERE {plate_sql}
+        AND report_date BETWEEN DATE_SUB(DATE(%s), INTERVAL 1 DAY) AND DATE_ADD(DATE(%s), INTERVAL 1 DAY)
+        AND status IN ('待审核', '审核通过')
+        {extra}
+        ORDER BY {order_by}ABS(DATEDIFF(report_date, DATE(%s))), created_at ASC
+        LIMIT 1
+    """
+    return sql, tuple(params)
+
+
+# 车牌标准7位：省简称+字母+5位（如豫U12345），新能源8位支持{5,6}
+_PLATE = r"[京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6}"
+
+# 磅单字段 → 候选模式（按优先级）
+_WEIGHBILL_FIELDS = FieldExtractor({
+    "weigh_date": [
+        r"日期[：:]\s*(\d{4}年\d{1,2}月\d{1,2}日)",
+        r"(\d{4}年\d{1,2}月\d{1,2}日)",
+        r"(\d{4}-\d{2}-\d{2})",
+    ],
+    "ticket_no": [r"单据号[：:]\s*(\d+)", r"磅单号[：:]\s*(\d+)", r"单号[：:]\s*(\d+)"],
+    "contract_no": [r"合同编号[：:]\s*([A-Za-z0-9\-]+)", r"合同号[：:]\s*([A-Za-z0-9\-]+)"],
+    "vehicle_no": [rf"车号[：:]\s*({_PLATE})", rf"车牌[：:]\s*({_PLATE})", rf"({_PLATE})"],
+    "product_name": [r"货物名称[：:]\s*(.+?)(?:\n|$)", r"品名[：:]\s*(.+?)(?:\n|$)", r"货名[：:]\s*(.+?)(?:\n|$)"],
+    "gross_weight": [r"毛重[：:]\s*(\d+\.?\d*)"],
+    "tare_weight": [r"皮重[：:]\s*(\d+\.?\d*)"],
+    "net_weight": [r"净重[：:]\s*(\d+\.?\d*)"],
+    "delivery_unit": [r"送货单位[：:]\s*(.+?)(?:\n|$)"],
+    "receive_unit": [r"收货单位[：:]\s*(.+?)(?:\n|$)"],
+})
+
+
+def _stripped(value: Optional[str]) -> Optional[str]:
+    return value.strip() if value is not None else None
+
+
+def _float_or_none(value: Optional[str]) -> Optional[float]:
+    return float(value) if value is not None else None
 
 
 class WeighbillService:
@@ -42,8 +153,8 @@ class WeighbillService:
 
     def __init__(self):
         self.ocr = None
-        self._weighbill_has_warehouse_name = None
-        self._weighbill_has_audit_columns = None
+        self._ocr_pool: Optional[OcrEnginePool] = None
+        self._ocr_pool_lock = threading.Lock()
         if RAPIDOCR_AVAILABLE:
             try:
                 self.ocr = RapidOCR()
@@ -51,117 +162,40 @@ class WeighbillService:
             except Exception as e:
                 logger.error(f"磅单OCR初始化失败: {e}")
 
-    def _has_weighbill_warehouse_name_column(self) -> bool:
-        """兼容旧库：动态检查 pd_weighbills 是否已有 warehouse_name 字段。"""
-        if self._weighbill_has_warehouse_name is not None:
-            return self._weighbill_has_warehouse_name
-
-        try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SHOW COLUMNS FROM pd_weighbills LIKE 'warehouse_name'")
-                    self._weighbill_has_warehouse_name = cur.fetchone() is not None
-        except Exception as e:
-            logger.warning(f"检查 pd_weighbills.warehouse_name 字段失败: {e}")
-            self._weighbill_has_warehouse_name = False
+    def _get_ocr_engine_pool(self, size: int) -> OcrEnginePool:
+        """批量识别用的引擎池：首个引擎复用 self.ocr，其余按需创建后常驻。"""
+        with self._ocr_pool_lock:
+            if self._ocr_pool is None:
+                factory = RapidOCR if (RAPIDOCR_AVAILABLE and self.ocr is not None) else (lambda: None)
+                self._ocr_pool = OcrEnginePool(factory, size, preloaded=[self.ocr] if self.ocr else None)
+            else:
+                self._ocr_pool.resize(size)
+            return self._ocr_pool
 
-        return self._weighbill_has_warehouse_name
+    def _has_weighbill_warehouse_name_column(self) -> bool:
+        """兼容旧库：pd_weighbills 是否已有 warehouse_name 字段（读启动时的库结构能力表）。"""
+        return get_schema_capabilities().has_column("pd_weighbills", "warehouse_name")
 
-    def _ensure_weighbill_audit_columns(self) -> None:
-        """旧库补全 audit_status / audit_remark（仅执行一次成功的 ensure）。"""
-        global _WEIGHBILL_AUDIT_COLS_ENSURED
-        if _WEIGHBILL_AUDIT_COLS_ENSURED:
-            return
-        try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    parts: list[str] = []
-                    cur.execute("SHOW COLUMNS FROM pd_weighbills LIKE 'audit_status'")
-                    if not cur.fetchone():
-                        parts.append(
-                            "ADD COLUMN audit_status VARCHAR(32) DEFAULT '待审核' "
-                            "COMMENT '磅单审核状态：待审核/审核通过/审核未通过'"
-                        )
-                    cur.execute("SHOW COLUMNS FROM pd_weighbills LIKE 'audit_remark'")
-                    if not cur.fetchone():
-                        parts.append(
-                            "ADD COLUMN audit_remark TEXT DEFAULT NULL COMMENT '审核备注'"
-                        )
-                    if parts:
-                        cur.execute("ALTER TABLE pd_weighbills " + ", ".join(parts))
-                        try:
-                            cur.execute(
-                                "ALTER TABLE pd_weighbills ADD INDEX idx_audit_status (audit_status)"
-                            )
-                        except Exception:
-                            pass
-                    cur.execute("SHOW COLUMNS FROM pd_weighbills LIKE 'audit_status'")
-                    self._weighbill_has_audit_columns = cur.fetchone() is not None
-                conn.commit()
-            _WEIGHBILL_AUDIT_COLS_ENSURED = bool(self._weighbill_has_audit_columns)
-        except Exception as e:
-            logger.warning("补全磅单审核字段失败（可手工执行 database_setup.ensure_weighbill_audit_columns）: %s", e)
+    def _has_delivery_plate_norm_column(self) -> bool:
+        """兼容旧库：pd_deliveries 是否已有 vehicle_no_norm 生成列（database_setup 迁移补建）。"""
+        return get_schema_capabilities().has_column("pd_deliveries", "vehicle_no_norm")
 
     def _has_weighbill_audit_columns(self) -> bool:
-        """兼容旧库：检查 pd_weighbills 是否有 audit_status 字段"""
-        if self._weighbill_has_audit_columns is not None:
-            return self._weighbill_has_audit_columns
-        try:
-            with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SHOW COLUMNS FROM pd_weighbills LIKE 'audit_status'")
-                    self._weighbill_has_audit_columns = cur.fetchone() is not None
-        except Exception as e:
-            logger.warning("检查 pd_weighbills.audit_status 字段失败: %s", e)
-            self._weighbill_has_audit_columns = False
-        return self._weighbill_has_audit_columns
+        """兼容旧库：pd_weighbills 是否有 audit_status 字段（迁移 7 补建）"""
+        return get_schema_capabilities().has_column("pd_weighbills", "audit_status")
 
     # ========== 图片预处理 ==========
 
     def _apply_super_resolution(self, image: Image.Image) -> Image.Image:
-        """同 contract_service 中的实现"""
-        if image.width < 800 or image.height < 600:
-            try:
-                # 模型路径可根据项目结构调整，此处放在 app/models/ 下
-                model_path = Path(__file__).parent / "models" / "ESPCN_x2.pb"
-                if not model_path.exists():
-                    logger.warning("超分辨率模型文件不存在，跳过")
-                    return image
-
-                img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                sr = dnn_superres.DnnSuperResImpl.create()
-                sr.readModel(str(model_path))
-                sr.setModel("fsrcnn", 2)
-                result = sr.upsample(img_cv)
-
-                result_rgb = cv2.cvtColor(result, cv2.COLOR_BGR2RGB)
-                return Image.fromarray(result_rgb)
-            except Exception as e:
-                logger.error(f"超分辨率处理失败: {e}")
-                return image
-        return image
+        """同 contract_service 中的实现（模型放在 app/services/models/ 下）"""
+        return apply_super_resolution(image)
 
     def preprocess_image(self, image_path: str) -> str:
         try:
-            img = Image.open(image_path)
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-
-            # 新增超分辨率处理
-            img = self._apply_super_resolution(img)
-
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.5)
-            img = img.filter(ImageFilter.SHARPEN)
-
-            max_size = 2000
-            if max(img.size) > max_size:
-                ratio = max_size / max(img.size)
-                new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
+            img = enhance_for_ocr(Image.open(image_path))
 
             temp_path = tempfile.mktemp(suffix=".jpg")
-            img.save(temp_path, "JPEG", quality=95)
+            img.save(temp_path, "JPEG", quality=JPEG_QUALITY)
             return temp_path
 
         except Exception as e:
@@ -170,9 +204,10 @@ class WeighbillService:
 
     # ========== OCR识别 ==========
 
-    def recognize_weighbill(self, image_path: str) -> Dict[str, Any]:
-        """OCR识别磅单"""
-        if not self.ocr:
+    def recognize_weighbill(self, image_path: Union[str, bytes], ocr_engine: Any = None) -> Dict[str, Any]:
+        """OCR识别磅单（image_path 可为文件路径或图片字节；ocr_engine 缺省用实例自带引擎）"""
+        engine = ocr_engine or self.ocr
+        if not engine:
             return {
                 "success": True,
                 "data": self._empty_result("OCR未初始化"),
@@ -180,7 +215,7 @@ class WeighbillService:
             }
 
         try:
-            result, elapse = self.ocr(image_path)
+            result, elapse = engine(image_path)
             total_elapse = sum(elapse) if isinstance(elapse, list) else float(elapse or 0)
 
             if not result:
@@ -236,14 +271,19 @@ class WeighbillService:
         }
 
     def _parse_weighbill(self, text_lines: List[Dict], full_text: str) -> Dict:
-        """解析磅单信息"""
-        weigh_date = self._extract_date(full_text)
-        ticket_no = self._extract_ticket_no(full_text)
-        contract_no = self._extract_contract_no(full_text)
-        vehicle_no = self._extract_vehicle_no(full_text)
-        product_name = self._extract_product_name(full_text)
-        gross, tare, net = self._extract_weights(full_text)
-        delivery, receive = self._extract_units(full_text)
+        """解析磅单信息：字段表预编译，按需逐字段抽取"""
+        found = _WEIGHBILL_FIELDS.search(full_text)
+        weigh_date = found.group("weigh_date")
+        if weigh_date:
+            weigh_date = weigh_date.replace("年", "-").replace("月", "-").replace("日", "")
+        ticket_no = found.group("ticket_no")
+        contract_no = found.group("contract_no")
+        contract_no = contract_no.strip() if contract_no else None
+        vehicle_no = found.group("vehicle_no")
+        product_name = _stripped(found.group("product_name"))
+        gross, tare, net = (_float_or_none(found.group(f)) for f in ("gross_weight", "tare_weight", "net_weight"))
+        delivery = _stripped(found.group("delivery_unit"))
+        receive = _stripped(found.group("receive_unit"))
 
         missing = []
         if not weigh_date:
@@ -273,85 +313,6 @@ class WeighbillService:
             "ocr_message": message,
         }
 
-    def _extract_date(self, text: str) -> Optional[str]:
-        patterns = [
-            r"日期[：:]\s*(\d{4}年\d{1,2}月\d{1,2}日)",
-            r"(\d{4}年\d{1,2}月\d{1,2}日)",
-            r"(\d{4}-\d{2}-\d{2})",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return match.group(1).replace("年", "-").replace("月", "-").replace("日", "")
-        return None
-
-    def _extract_ticket_no(self, text: str) -> Optional[str]:
-        patterns = [r"单据号[：:]\s*(\d+)", r"磅单号[：:]\s*(\d+)", r"单号[：:]\s*(\d+)"]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return match.group(1)
-        return None
-
-    def _extract_contract_no(self, text: str) -> Optional[str]:
-        patterns = [
-            r"合同编号[：:]\s*([A-Za-z0-9\-]+)",
-            r"合同号[：:]\s*([A-Za-z0-9\-]+)",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return match.group(1).strip()
-        return None
-
-    def _extract_vehicle_no(self, text: str) -> Optional[str]:
-        # 車牌標準7位：省簡稱+字母+5位（如豫U12345），新能源8位支持{5,6}
-        patterns = [
-            r"车号[：:]\s*([京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6})",
-            r"车牌[：:]\s*([京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6})",
-            r"([京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6})",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return match.group(1)
-        return None
-
-    def _extract_product_name(self, text: str) -> Optional[str]:
-        patterns = [
-            r"货物名称[：:]\s*(.+?)(?:\n|$)",
-            r"品名[：:]\s*(.+?)(?:\n|$)",
-            r"货名[：:]\s*(.+?)(?:\n|$)",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return match.group(1).strip()
-        return None
-
-    def _extract_weights(self, text: str) -> tuple:
-        gross = tare = net = None
-        match = re.search(r"毛重[：:]\s*(\d+\.?\d*)", text)
-        if match:
-            gross = float(match.group(1))
-        match = re.search(r"皮重[：:]\s*(\d+\.?\d*)", text)
-        if match:
-            tare = float(match.group(1))
-        match = re.search(r"净重[：:]\s*(\d+\.?\d*)", text)
-        if match:
-            net = float(match.group(1))
-        return gross, tare, net
-
-    def _extract_units(self, text: str) -> tuple:
-        delivery = receive = None
-        match = re.search(r"送货单位[：:]\s*(.+?)(?:\n|$)", text)
-        if match:
-            delivery = match.group(1).strip()
-        match = re.search(r"收货单位[：:]\s*(.+?)(?:\n|$)", text)
-        if match:
-            receive = match.group(1).strip()
-        return delivery, receive
-
     # ========== 合同价格查询 ==========
 
     def get_contract_price_by_product(self, contract_no: str, product_name: str) -> Optional[float]:
@@ -435,71 +396,34 @@ class WeighbillService:
         """
         按磅单日期±1天 + 车牌匹配报单。
         参与匹配：待审核、审核通过（已明确驳回的不匹配）。
-        若带合同号首次未命中，会再尝试不按合同号匹配（避免 OCR 合同号与系统略有差异）。
+        带合同号时优先取合同号一致的报单，没有则退回不按合同号匹配（避免 OCR 合同号与系统略有差异），
+        两者在同一条查询中完成（见 delivery_match_query）。
         """
         plate_norm = self._normalize_vehicle_no_for_match(vehicle_no)
         plate_raw = str(vehicle_no).strip() if vehicle_no else None
         if not plate_norm and not plate_raw:
             return None
 
-        def _run_query(extra_conditions: str, params: list) -> Optional[Dict]:
-            try:
-                with get_conn() as conn:
-                    with conn.cursor() as cur:
-                        cur.execute(f"""
-                            SELECT * FROM pd_deliveries 
-                            WHERE (
-                                REPLACE(REPLACE(vehicle_no, ' ', ''), '　', '') = %s
-                                OR vehicle_no = %s
-                            )
-                            AND (
-                                report_date = DATE(%s)
-                                OR report_date = DATE_ADD(DATE(%s), INTERVAL 1 DAY)
-                                OR report_date = DATE_SUB(DATE(%s), INTERVAL 1 DAY)
-                            )
-                            AND status IN ('待审核', '审核通过')
-                            {extra_conditions}
-                            ORDER BY ABS(DATEDIFF(report_date, DATE(%s))), created_at ASC
-                            LIMIT 1
-                        """, tuple(params))
-                        row = cur.fetchone()
-                        if not row:
-                            return None
-                        columns = [desc[0] for desc in cur.description]
-                        return dict(zip(columns, row))
-            except Exception as e:
-                logger.error(f"匹配报货订单失败: {e}")
-                return None
-
-        base_params = [
+        sql, params = delivery_match_query(
             plate_norm or plate_raw,
-            plate_raw or plate_norm,
-            weigh_date, weigh_date, weigh_date, weigh_date,
-        ]
-        extra = ""
-        if driver_name:
-            extra += " AND driver_name = %s"
-            base_params.append(driver_name)
-        if contract_no:
-            extra += " AND contract_no = %s"
-            base_params.append(contract_no)
-
-        found = _run_query(extra, list(base_params))
-        if found:
-            return found
-        if contract_no:
-            # 合同号 OCR 与系统不一致时，用车牌+日期再试
-            retry_extra = ""
-            retry_params = [
-                plate_norm or plate_raw,
-                plate_raw or plate_norm,
-                weigh_date, weigh_date, weigh_date, weigh_date,
-            ]
-            if driver_name:
-                retry_extra += " AND driver_name = %s"
-                retry_params.append(driver_name)
-            return _run_query(retry_extra, retry_params)
-        return None
+            weigh_date,
+            driver_name=driver_name,
+            contract_no=contract_no,
+            plate_raw=plate_raw,
+            use_plate_norm_column=self._has_delivery_plate_norm_column(),
+        )
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    row = cur.fetchone()
+                    if not row:
+                        return None
+                    columns = [desc[0] for desc in cur.description]
+                    return dict(zip(columns, row))
+        except Exception as e:
+            logger.error(f"匹配报货订单失败: {e}")
+            return None
 
     def auto_fill_data(self, ocr_data: Dict) -> Dict:
         result = ocr_data.copy()
@@ -618,29 +542,10 @@ class WeighbillService:
             return None
 
     def _recognize_from_bytes(self, image_bytes: bytes) -> Dict[str, Any]:
-        """从字节流识别磅单"""
-        temp_path = None
+        """从字节流识别磅单（预处理在内存中完成，不落临时文件）"""
         try:
-            # 保存临时文件
-            temp_path = tempfile.mktemp(suffix=".jpg")
-            with open(temp_path, "wb") as f:
-                f.write(image_bytes)
-
-            # 预处理并识别
-            processed_path = self.preprocess_image(temp_path)
-            result = self.recognize_weighbill(processed_path)
-
-            # 清理临时文件
-            if processed_path != temp_path and os.path.exists(processed_path):
-                os.remove(processed_path)
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-
-            return result
-
+            return self.recognize_weighbill(preprocess_image_bytes(image_bytes))
         except Exception as e:
-            if temp_path and os.path.exists(temp_path):
-                os.remove(temp_path)
             return {"success": False, "error": str(e)}
 
     def _match_delivery_by_ocr(self, ocr_data: Dict) -> Optional[Dict]:
@@ -732,7 +637,7 @@ class WeighbillService:
             delivery_id: int,
             product_name: str,
             data: Dict[str, Any],
-            image_file: bytes = None,
+            image_file: ImageSource = None,
             current_user: dict = None,
             is_manual: bool = False
     ) -> Dict[str, Any]:
@@ -784,15 +689,8 @@ class WeighbillService:
                             existing = dict(zip(columns, existing_row))
 
                     if image_file:
-                        safe_product = re.sub(r"[^\w\-]", "_", normalized_product) or "product"
-                        filename = (
-                            f"weighbill_{delivery_id}_{safe_product}_"
-                            f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
-                        )
-                        file_path = UPLOAD_DIR / filename
-                        with open(file_path, "wb") as f:
-                            f.write(image_file)
-                        temp_file_path = str(file_path)
+                        # 内容寻址保存：同一张磅单照片重复上传复用同一文件
+                        temp_file_path = save_image(image_file, "weighbills")
                         old_image_path = existing.get("weighbill_image") if existing else None
 
                     final_weigh_date = payload.get("weigh_date") if payload.get("weigh_date") is not None else (existing.get("weigh_date") if existing else None)
@@ -857,6 +755,8 @@ class WeighbillService:
                     else:
                         final_ocr_status = '待上传磅单'
 
+                    # 磅单写入与合同进度台账同一事务；异常时连接关闭即回滚
+                    conn.begin()
                     if existing:
                         params = [
                             final_weigh_date,
@@ -981,6 +881,11 @@ class WeighbillService:
                                 operator_name=uploader_name,
                             )
 
+                    refresh_contract_progress(
+                        cur, [existing.get("contract_no") if existing else None, final_contract_no], parts=(SHIPPING,)
+                    )
+                    conn.commit()
+
             if any(key in payload for key in ("warehouse", "payee")):
                 self._sync_delivery_fields(delivery_id, payload)
 
@@ -993,11 +898,8 @@ class WeighbillService:
             if final_warehouse_name is None and existing:
                 final_warehouse_name = existing.get("warehouse_name")
 
-            if temp_file_path and old_image_path and old_image_path != temp_file_path and os.path.exists(old_image_path):
-                try:
-                    os.remove(old_image_path)
-                except Exception as e:
-                    logger.warning(f"删除旧磅单图片失败: {e}")
+            if temp_file_path and old_image_path and old_image_path != temp_file_path:
+                release_image(old_image_path)
 
             return {
                 "success": True,
@@ -1020,11 +922,8 @@ class WeighbillService:
             }
 
         except Exception as e:
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.remove(temp_file_path)
-                except Exception:
-                    pass
+            if temp_file_path:
+                release_image(temp_file_path)
             logger.error(
                 "上传/修改磅单失败 delivery_id=%s product_name=%s user_id=%s: %s",
                 delivery_id,
@@ -1111,8 +1010,9 @@ class WeighbillService:
             self,
             warehouse_name: str,
             payee_id: Optional[int],
-            image_files: List[bytes],
-            current_user: dict = None
+            image_files: List[ImageSource],
+            current_user: dict = None,
+            max_workers: Optional[int] = None
     ) -> Dict[str, Any]:
         """
         批量上传磅单（支持自动选择或指定收款人）
@@ -1121,6 +1021,9 @@ class WeighbillService:
             - 查询该库房收款人，1个则直接用，多个则返回选择列表
         如果 payee_id 不为 None：
             - 使用指定的收款人进行批量上传
+
+        max_workers：预处理进程数与并行 OCR 引擎数上限，缺省取 WEIGHBILL_BATCH_MAX_WORKERS；
+        为 1 时逐张处理。结果列表中的 index 与 image_files 下标一致。
         """
         
         # 阶段1：检查收款人（当 payee_id 为空时）
@@ -1195,11 +1098,22 @@ class WeighbillService:
             "failed_list": []
         }
 
-        # 逐张处理图片
-        for idx, image_bytes in enumerate(image_files):
+        workers = max_workers if max_workers is not None else settings.weighbill_batch_max_workers
+        workers = max(int(workers), 1)
+
+        # 阶段 1+2：预处理（进程池）与 OCR（引擎池）并行，结果与 image_files 顺序一致
+        ocr_results = run_ocr_pipeline(
+            image_files,
+            lambda image, engine: self.recognize_weighbill(image, ocr_engine=engine),
+            self._get_ocr_engine_pool(workers),
+            workers,
+        )
+
+        # 阶段 3：按输入顺序匹配报单并入库；同一批内相同 (日期, 车牌) / (合同, 品种) 只查一次
+        delivery_cache: Dict[tuple, Optional[Dict]] = {}
+        price_cache: Dict[tuple, Optional[float]] = {}
+        for idx, (image_bytes, ocr_result) in enumerate(zip(image_files, ocr_results)):
             try:
-                # OCR识别
-                ocr_result = self._recognize_from_bytes(image_bytes)
                 if not ocr_result.get("success"):
                     results["failed_list"].append({
                         "index": idx,
@@ -1212,7 +1126,10 @@ class WeighbillService:
                 ocr_data = ocr_result.get("data", {})
 
                 # 自动匹配报单
-                delivery_info = self._match_delivery_by_ocr(ocr_data)
+                match_key = (ocr_data.get("weigh_date"), ocr_data.get("vehicle_no"))
+                if match_key not in delivery_cache:
+                    delivery_cache[match_key] = self._match_delivery_by_ocr(ocr_data)
+                delivery_info = delivery_cache[match_key]
                 if not delivery_info:
                     results["failed_list"].append({
                         "index": idx,
@@ -1232,7 +1149,10 @@ class WeighbillService:
 
                 # 获取合同单价
                 contract_no = ocr_data.get("contract_no") or delivery_info.get("contract_no")
-                unit_price = self.get_contract_price_by_product(contract_no, product_name)
+                price_key = (contract_no, product_name)
+                if price_key not in price_cache:
+                    price_cache[price_key] = self.get_contract_price_by_product(contract_no, product_name)
+                unit_price = price_cache[price_key]
 
                 # 构建磅单数据
                 weighbill_data = {
@@ -1476,7 +1396,10 @@ class WeighbillService:
             exact_payout_status: int = None,  # 新增：打款状态 0=待打款,1=已打款
             exact_collection_status: int = None,  # 新增：回款状态 0=待回款,1=已回首笔,2=已回款
             page: int = 1,
-            page_size: int = 20
+            page_size: int = 20,
+            cursor: str = None,
+            cursor_mode: bool = False,
+            count_mode: str = "exact"
     ) -> Dict[str, Any]:
         """
         查询磅单列表（按报单ID分组）
@@ -1485,8 +1408,13 @@ class WeighbillService:
         司机姓名 / 身份证 / 车牌：与报单 pd_deliveries 关联。
         - driver_name、driver_id_card、vehicle_no 非空时按 LIKE %关键词% 模糊匹配；
         - 对应字段未传模糊参数时，可使用 exact_driver_name、exact_driver_id_card、exact_vehicle_no 精确匹配。
+
+        cursor_mode=True 或传入 cursor 时按报单 (created_at, id) 键集分页，返回 next_cursor / has_more。
         """
         try:
+            validate_count_mode(count_mode)
+            use_cursor = cursor_mode or bool(cursor)
+            after_key = decode_cursor(cursor) if cursor else None
             with get_conn() as conn:
                 with conn.cursor() as cur:
                     # 构建报单查询条件
@@ -1504,22 +1432,34 @@ class WeighbillService:
                         delivery_params.append(exact_report_date)
                     # 司机姓名：模糊优先
                     if driver_name and str(driver_name).strip():
-                        delivery_where.append("d.driver_name LIKE %s")
-                        delivery_params.append(f"%{str(driver_name).strip()}%")
+                        kw = str(driver_name).strip()
+                        kw_sql, kw_params = keyword_filter(
+                            cur, "pd_deliveries", "d", [kw], "d.driver_name LIKE %s", [f"%{kw}%"]
+                        )
+                        delivery_where.append(kw_sql)
+                        delivery_params.extend(kw_params)
                     elif exact_driver_name:
                         delivery_where.append("d.driver_name = %s")
                         delivery_params.append(exact_driver_name)
                     # 身份证：模糊优先
                     if driver_id_card and str(driver_id_card).strip():
-                        delivery_where.append("d.driver_id_card LIKE %s")
-                        delivery_params.append(f"%{str(driver_id_card).strip()}%")
+                        kw = str(driver_id_card).strip()
+                        kw_sql, kw_params = keyword_filter(
+                            cur, "pd_deliveries", "d", [kw], "d.driver_id_card LIKE %s", [f"%{kw}%"]
+                        )
+                        delivery_where.append(kw_sql)
+                        delivery_params.extend(kw_params)
                     elif exact_driver_id_card:
                         delivery_where.append("d.driver_id_card = %s")
                         delivery_params.append(exact_driver_id_card)
                     # 车牌号：模糊优先（报单车牌）
                     if vehicle_no and str(vehicle_no).strip():
-                        delivery_where.append("d.vehicle_no LIKE %s")
-                        delivery_params.append(f"%{str(vehicle_no).strip()}%")
+                        kw = str(vehicle_no).strip()
+                        kw_sql, kw_params = keyword_filter(
+                            cur, "pd_deliveries", "d", [kw], "d.vehicle_no LIKE %s", [f"%{kw}%"]
+                        )
+                        delivery_where.append(kw_sql)
+                        delivery_params.extend(kw_params)
                     elif exact_vehicle_no:
                         delivery_where.append("d.vehicle_no = %s")
                         delivery_params.append(exact_vehicle_no)
@@ -1530,37 +1470,59 @@ class WeighbillService:
                     delivery_sql = " AND ".join(delivery_where)
 
                     # 查询报单总数
-                    cur.execute(f"""
+                    total = count_total(
+                        cur,
+                        f"""
                         SELECT COUNT(DISTINCT d.id) 
                         FROM pd_deliveries d
                         WHERE {delivery_sql}
-                    """, tuple(delivery_params))
-                    total = cur.fetchone()[0]
+                    """,
+                        delivery_params,
+                        count_mode,
+                        estimate_sql=f"SELECT d.id FROM pd_deliveries d WHERE {delivery_sql}",
+                    )
 
                     # 分页查询报单ID
-                    offset = (page - 1) * page_size
-                    cur.execute(f"""
-                        SELECT DISTINCT d.id,d.created_at
-                        FROM pd_deliveries d
-                        WHERE {delivery_sql}
-                        ORDER BY d.created_at DESC
-                        LIMIT %s OFFSET %s
-                    """, tuple(delivery_params + [page_size, offset]))
-                    delivery_ids = [row[0] for row in cur.fetchall()]
+                    next_cursor = None
+                    if use_cursor:
+                        page_sql = delivery_sql
+                        page_params = list(delivery_params)
+                        if after_key is not None:
+                            page_sql += " AND " + keyset_before_sql("d.created_at", "d.id")
+                            page_params.extend(keyset_before_params(after_key))
+                        cur.execute(f"""
+                            SELECT d.id, d.created_at
+                            FROM pd_deliveries d
+                            WHERE {page_sql}
+                            ORDER BY d.created_at DESC, d.id DESC
+                            LIMIT %s
+                        """, tuple(page_params + [page_size + 1]))
+                        id_rows, next_cursor = split_page(cur.fetchall(), page_size, lambda r: (r[1], r[0]))
+                        delivery_ids = [row[0] for row in id_rows]
+                    else:
+                        offset = (page - 1) * page_size
+                        cur.execute(f"""
+                            SELECT DISTINCT d.id,d.created_at
+                            FROM pd_deliveries d
+                            WHERE {delivery_sql}
+                            ORDER BY d.created_at DESC
+                            LIMIT %s OFFSET %s
+                        """, tuple(delivery_params + [page_size, offset]))
+                        delivery_ids = [row[0] for row in cur.fetchall()]
 
                     if not delivery_ids:
-                        return {"success": True, "data": [], "total": 0, "page": page, "page_size": page_size}
+                        empty = {"success": True, "data": [], "total": 0 if total is not None else None,
+                                 "page": None if use_cursor else page, "page_size": page_size}
+                        if use_cursor:
+                            empty.update({"next_cursor": None, "has_more": False})
+                        return empty
 
-                    # 查询报单详细信息
+                    # 查询报单详细信息（本页报单的磅单计数：一次 GROUP BY delivery_id 条件聚合后关联）
                     format_ids = ','.join(['%s'] * len(delivery_ids))
-                    cur.execute(f"""
-                        SELECT d.*,
-                               (SELECT COUNT(*) FROM pd_weighbills WHERE delivery_id = d.id) as total_weighbills,
-                               (SELECT COUNT(*) FROM pd_weighbills WHERE delivery_id = d.id AND upload_status = '已上传') as uploaded_weighbills
-                        FROM pd_deliveries d
-                        WHERE d.id IN ({format_ids})
-                        ORDER BY d.created_at DESC
-                    """, tuple(delivery_ids))
+                    cur.execute(
+                        delivery_weighbill_summary_sql(len(delivery_ids)),
+                        tuple(delivery_ids) + tuple(delivery_ids),
+                    )
 
                     delivery_columns = [desc[0] for desc in cur.description]
                     delivery_rows = cur.fetchall()
@@ -1662,7 +1624,6 @@ class WeighbillService:
                             from app.services.delivery_service import DeliveryService
 
                             ds = DeliveryService()
-                            ds._ensure_weighbill_order_plan_last_column()
                             cup = dpre.get("contract_unit_price")
                             up_f = float(cup) if cup is not None else 0.0
                             uid = dpre.get("uploader_id")
@@ -1852,13 +1813,17 @@ class WeighbillService:
                             "weighbills": weighbills
                         })
 
-                    return {
+                    result = {
                         "success": True,
                         "data": result_data,
                         "total": total,
-                        "page": page,
+                        "page": None if use_cursor else page,
                         "page_size": page_size
                     }
+                    if use_cursor:
+                        result["next_cursor"] = next_cursor
+                        result["has_more"] = next_cursor is not None
+                    return result
 
         except Exception as e:
             logger.error(f"查询磅单列表失败: {e}")
@@ -1890,6 +1855,7 @@ class WeighbillService:
                         }
 
                     # 更新磅单排款日期
+                    conn.begin()
                     cur.execute("""
                         UPDATE pd_weighbills 
                         SET payment_schedule_date = %s, updated_at = NOW()
@@ -1902,6 +1868,9 @@ class WeighbillService:
                         SET schedule_date = %s, schedule_status = 1, updated_at = NOW()
                         WHERE weighbill_id = %s
                     """, (payment_schedule_date, weighbill_id))
+                    cur.execute("SELECT id FROM pd_balance_details WHERE weighbill_id = %s", (weighbill_id,))
+                    sync_balance_summaries(cur, [r[0] if not isinstance(r, dict) else r["id"] for r in cur.fetchall()])
+                    conn.commit()
 
             # 打款管理列表以 pd_payment_details 为主表；若从未走上传回款逻辑则无明细，补建一条
             try:
@@ -1985,11 +1954,10 @@ class WeighbillService:
             if not remark:
                 return {"success": False, "error": "审核未通过时必须填写审核备注"}
 
-        self._ensure_weighbill_audit_columns()
         if not self._has_weighbill_audit_columns():
             return {
                 "success": False,
-                "error": "磅单审核功能未启用：数据库缺少 audit_status 列且自动补全失败，请执行库迁移或联系管理员",
+                "error": "磅单审核功能未启用：数据库缺少 audit_status 列（启动迁移未成功），请执行库迁移或联系管理员",
             }
 
         try:
@@ -2062,7 +2030,16 @@ class WeighbillService:
 
                     conn.autocommit(False)
                     try:
-                        # 1. 更新报单的合同
+                        # 1. 更新报单的合同（审核通过的报单同步把车数从原合同台账转到新合同，不校验余量）
+                        cur.execute(
+                            "SELECT status, contract_no, planned_trucks FROM pd_deliveries WHERE id = %s FOR UPDATE",
+                            (delivery_id,),
+                        )
+                        delivery_before = cur.fetchone()
+                        if delivery_before:
+                            apply_delivery_change(
+                                cur, delivery_before, {**delivery_before, "contract_no": new_contract_no}, enforce=False
+                            )
                         cur.execute(
                             "UPDATE pd_deliveries SET contract_id = %s, contract_no = %s WHERE id = %s",
                             (contract_id, new_contract_no, delivery_id),
@@ -2146,6 +2123,11 @@ class WeighbillService:
                                     (contract_id, new_contract_no, wid),
                                 )
 
+                        refresh_contract_progress(
+                            cur,
+                            [wb.get("contract_no"), (delivery_before or {}).get("contract_no"), new_contract_no],
+                            parts=(SHIPPING, DELIVERIES),
+                        )
                         conn.commit()
                         return {
                             "success": True,
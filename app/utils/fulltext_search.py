@@ -0,0 +1,119 @@
+"""
+列表模糊搜索的 ngram 全文索引预筛选。
+
+原实现对每个关键词做 `col LIKE '%词%'` 多列 OR，前导通配符用不上 B-Tree 索引，每次都是全表扫描。
+库表上建有 `WITH PARSER ngram` 的 FULLTEXT 索引（见 database_setup.ensure_fulltext_search_indexes，
+建索引时关闭停用词）后，本模块把关键词改写为
+
+    MATCH(索引列) AGAINST('"词1" "词2"' IN BOOLEAN MODE) AND (原 LIKE 条件)
+
+- 关键词长度 ≥ ngram_token_size 时，子串出现必然意味着其全部 n-gram 在同一列中连续出现，
+  故 MATCH 短语检索是 LIKE 结果的超集：用全文索引取候选行，再由原 LIKE 条件精确过滤，结果与原语义一致；
+- 关键词过短或含字母、数字、汉字以外的字符（可能被 ngram 解析器当作分隔符，或是 LIKE 通配符）、索引不存在、
+  服务器不支持 ngram 时，原样退回 LIKE。
+"""
+import logging
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 表 → (索引名, 索引列)；MATCH 的列清单必须与索引定义完全一致
+FULLTEXT_INDEXES: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "pd_deliveries": (
+        "ft_delivery_search",
+        (
+            "vehicle_no", "driver_name", "driver_phone", "driver_id_card", "target_factory_name",
+            "product_name", "contract_no", "reporter_name", "shipper",
+        ),
+    ),
+    "pd_balance_details": (
+        "ft_balance_search",
+        ("contract_no", "driver_name", "driver_phone", "vehicle_no", "payee_name"),
+    ),
+}
+
+# 仅字母、数字、汉字（不含 `_`：它在 LIKE 中是通配符）
+_ELIGIBLE_TOKEN = re.compile(r"^[^\W_]+$")
+_NEGATIVE_TTL_SECONDS = 300
+
+_availability: Dict[str, Tuple[float, int]] = {}
+_availability_lock = threading.Lock()
+
+
+def _first_value(row) -> Optional[object]:
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return next(iter(row.values()))
+    return row[0]
+
+
+def ngram_token_size(cur, table: str) -> int:
+    """
+    table 上全文索引可用时返回服务器 ngram_token_size，否则返回 0。
+    探测结果进程内缓存：可用结果长期有效，不可用结果 5 分钟后重探（迁移补建索引后自动生效）。
+    """
+    now = time.monotonic()
+    with _availability_lock:
+        hit = _availability.get(table)
+    if hit is not None and (hit[1] > 0 or hit[0] > now):
+        return hit[1]
+
+    size = 0
+    index_name, _ = FULLTEXT_INDEXES[table]
+    try:
+        cur.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", (index_name,))
+        if cur.fetchall():
+            cur.execute("SELECT @@ngram_token_size")
+            size = int(_first_value(cur.fetchone()) or 0)
+    except Exception as e:
+        logger.warning("探测 %s 全文索引失败，模糊搜索退回 LIKE: %s", table, e)
+        size = 0
+    with _availability_lock:
+        _availability[table] = (now + _NEGATIVE_TTL_SECONDS, size)
+    return size
+
+
+def boolean_phrase_query(tokens: Sequence[str], min_len: int) -> Optional[str]:
+    """
+    关键词 → BOOLEAN MODE 查询串（各词为短语、任一命中即可）；
+    任一关键词不满足全文预筛选条件时返回 None（整组退回 LIKE，避免漏行）。
+    """
+    if not tokens or min_len <= 0:
+        return None
+    for token in tokens:
+        if len(token) < min_len or not _ELIGIBLE_TOKEN.match(token):
+            return None
+    return " ".join(f'"{t}"' for t in tokens)
+
+
+def keyword_filter(
+    cur,
+    table: str,
+    alias: str,
+    tokens: Sequence[str],
+    like_sql: str,
+    like_params: Sequence[object],
+) -> Tuple[str, List[object]]:
+    """
+    返回 (条件 SQL, 参数)。like_sql / like_params 为原 LIKE 条件；可用全文索引时在其前加 MATCH 预筛选。
+    alias 为 SQL 中该表的别名（无别名传空串）。
+    """
+    query = boolean_phrase_query(tokens, ngram_token_size(cur, table))
+    if query is None:
+        return like_sql, list(like_params)
+    prefix = f"{alias}." if alias else ""
+    _, columns = FULLTEXT_INDEXES[table]
+    match_cols = ", ".join(prefix + c for c in columns)
+    return (
+        f"(MATCH({match_cols}) AGAINST (%s IN BOOLEAN MODE) AND {like_sql})",
+        [query, *like_params],
+    )
+
+
+def reset_fulltext_probe_cache() -> None:
+    with _availability_lock:
+        _availability.clear()
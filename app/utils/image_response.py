@@ -0,0 +1,120 @@
+"""
+图片查看接口的条件请求与断点续传。
+
+- 响应带 `ETag`（内容哈希，缩略图加 `-thumb` 后缀）与 `Last-Modified`，`Cache-Control: private, no-cache`：
+  同一 URL 在联单被替换后内容会变，浏览器每次带 `If-None-Match` 校验，未变化时返回 304 不传正文；
+- `Range`：本机文件交给 Starlette `FileResponse`（支持多段与 `If-Range`）；
+  远端对象存储只支持单段范围，多段时返回完整内容（RFC 9110 允许忽略 Range）。
+"""
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Mapping, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
+
+from app.services.image_store import ImageStore, ResolvedImage
+
+_SINGLE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def is_not_modified(headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    """If-None-Match 优先；没有时比较 If-Modified-Since（秒级）。"""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= int(parsedate_to_datetime(if_modified_since).timestamp())
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_single_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    `bytes=a-b` / `bytes=a-` / `bytes=-n` → 闭区间 (start, end)；无 Range 或多段/格式不符返回 None（返回全文），
+    范围不可满足时抛 ValueError（调用方返回 416）。
+    """
+    if not header:
+        return None
+    m = _SINGLE_RANGE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):
+        length = int(m.group(2))
+        if length == 0 or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(size - length, 0), size - 1
+    start = int(m.group(1))
+    end = int(m.group(2)) if m.group(2) else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def _disposition(disposition_type: str, filename: str) -> str:
+    encoded = quote(filename)
+    if encoded != filename:
+        return f"{disposition_type}; filename*=utf-8''{encoded}"
+    return f'{disposition_type}; filename="{filename}"'
+
+
+def image_response(
+    request: Request,
+    store: ImageStore,
+    resolved: ResolvedImage,
+    filename: Optional[str] = None,
+    disposition_type: str = "attachment",
+) -> Response:
+    etag = f'"{resolved.etag}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(resolved.info.mtime, usegmt=True),
+        "Cache-Control": "private, no-cache",
+        "Accept-Ranges": "bytes",
+    }
+    if filename:
+        headers["Content-Disposition"] = _disposition(disposition_type, filename)
+
+    if request.method in ("GET", "HEAD") and is_not_modified(request.headers, etag, resolved.info.mtime):
+        return Response(status_code=304, headers=headers)
+
+    if resolved.path is not None:
+        return FileResponse(resolved.path, media_type=resolved.media_type, headers=headers)
+
+    size = resolved.info.size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range not in (etag, headers["Last-Modified"]):
+        range_header = None
+    try:
+        byte_range = parse_single_range(range_header, size)
+    except ValueError:
+        return PlainTextResponse(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        if size == 0:
+            return Response(status_code=200, media_type=resolved.media_type, headers=headers)
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    body = iter(()) if request.method == "HEAD" else store.iter_bytes(resolved, start, end)
+    return StreamingResponse(body, status_code=status_code, media_type=resolved.media_type, headers=headers)
@@ -0,0 +1,158 @@
+"""
+列表接口的键集（游标）分页与总数策略。
+
+游标模式下客户端不再传 page，而是把上一页返回的 `next_cursor` 原样带回：
+服务端按排序键做 `WHERE (created_at, id) < (上一页末行)` 的范围扫描，每页代价与页深无关。
+游标为不透明字符串（排序键值的 JSON 经 urlsafe base64 编码），客户端不应解析或拼装。
+
+总数（count_mode）：
+- exact：每页执行 COUNT（与原分页接口一致）；
+- cached：同一筛选条件的 COUNT 结果在进程内缓存 `COUNT_CACHE_TTL_SECONDS` 秒；
+- estimate：取 `EXPLAIN` 的估算行数（InnoDB 统计值，仅供滚动条/提示使用）；
+- none：不计算总数，返回 None。
+"""
+import base64
+import binascii
+import json
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+COUNT_MODES = ("exact", "cached", "estimate", "none")
+COUNT_CACHE_TTL_SECONDS = 60
+_COUNT_CACHE_MAX_ENTRIES = 512
+
+_count_cache: Dict[Tuple[str, tuple], Tuple[float, int]] = {}
+_count_cache_lock = threading.Lock()
+
+
+def _cursor_value(value: Any) -> Any:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return str(value)
+
+
+def encode_cursor(key: Sequence[Any]) -> str:
+    """排序键（如 (created_at, id)）→ 不透明游标；日期时间按 MySQL 可直接比较的字面量保存。"""
+    raw = json.dumps([_cursor_value(v) for v in key], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, key_len: int = 2) -> List[Any]:
+    """游标 → 排序键列表；格式不符或键个数不等于 key_len 时抛 ValueError。"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except (ValueError, UnicodeError, binascii.Error) as e:
+        raise ValueError("cursor 无效") from e
+    if not isinstance(key, list) or len(key) != key_len:
+        raise ValueError("cursor 无效")
+    if any(v is None or isinstance(v, (dict, list)) for v in key):
+        raise ValueError("cursor 无效")
+    return key
+
+
+def validate_count_mode(count_mode: str) -> str:
+    if count_mode not in COUNT_MODES:
+        raise ValueError(f"count_mode 仅支持 {'/'.join(COUNT_MODES)}")
+    return count_mode
+
+
+def keyset_before_sql(ts_col: str, id_col: str) -> str:
+    """(ts, id) 降序排列时「位于游标之后」的条件；参数用 `keyset_before_params`。"""
+    return f"({ts_col} < %s OR ({ts_col} = %s AND {id_col} < %s))"
+
+
+def keyset_before_params(key: Sequence[Any]) -> Tuple[Any, Any, Any]:
+    ts, row_id = key
+    return ts, ts, row_id
+
+
+def split_page(
+    rows: Sequence[T],
+    limit: int,
+    key_of: Callable[[T], Sequence[Any]],
+) -> Tuple[List[T], Optional[str]]:
+    """
+    查询时多取一条（LIMIT limit + 1）：超出即说明还有下一页，
+    返回 (本页 rows, 下一页游标)；没有下一页时游标为 None。
+    """
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(key_of(page[-1]))
+
+
+def _first_value(row: Any) -> Any:
+    if isinstance(row, dict):
+        return next(iter(row.values()))
+    return row[0]
+
+
+def _estimate_rows(cur, select_sql: str, params: tuple) -> int:
+    """EXPLAIN 首个访问表的 rows × filtered%（MySQL 5.7+ 列名）。"""
+    cur.execute(f"EXPLAIN {select_sql}", params)
+    plan = cur.fetchall()
+    if not plan:
+        return 0
+    first = plan[0]
+    if not isinstance(first, dict):
+        cols = [d[0] for d in cur.description]
+        first = dict(zip(cols, first))
+    rows = float(first.get("rows") or 0)
+    filtered = float(first.get("filtered") or 100)
+    return int(round(rows * filtered / 100))
+
+
+def count_total(
+    cur,
+    count_sql: str,
+    params: Sequence[Any],
+    count_mode: str = "exact",
+    *,
+    estimate_sql: Optional[str] = None,
+) -> Optional[int]:
+    """
+    按 count_mode 取总数。count_sql 为 `SELECT COUNT(...) ...`；
+    estimate 模式对 estimate_sql（缺省为 count_sql）做 EXPLAIN。
+    """
+    params = tuple(params)
+    if count_mode == "none":
+        return None
+    if count_mode == "estimate":
+        return _estimate_rows(cur, estimate_sql or count_sql, params)
+
+    cache_key = (count_sql, params)
+    now = time.monotonic()
+    if count_mode == "cached":
+        with _count_cache_lock:
+            hit = _count_cache.get(cache_key)
+        if hit and hit[0] > now:
+            return hit[1]
+
+    cur.execute(count_sql, params)
+    total = int(_first_value(cur.fetchone()) or 0)
+
+    if count_mode == "cached":
+        with _count_cache_lock:
+            if len(_count_cache) >= _COUNT_CACHE_MAX_ENTRIES:
+                for k in [k for k, (exp, _) in _count_cache.items() if exp <= now] or list(_count_cache)[:1]:
+                    _count_cache.pop(k, None)
+            _count_cache[cache_key] = (now + COUNT_CACHE_TTL_SECONDS, total)
+    return total
+
+
+def clear_count_cache() -> None:
+    with _count_cache_lock:
+        _count_cache.clear()
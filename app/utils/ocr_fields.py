@@ -0,0 +1,133 @@
+"""
+OCR 文本字段抽取的预编译引擎。
+
+磅单、合同、支付回单的解析原先对每个字段内联一串 `re.search(pattern, full_text)`：模式每次经 re 模块缓存查找，
+每个候选模式都把整段文本扫一遍。以关键词开头的模式（"毛重[：:]…"）在 C 层有字面量前缀快速查找，代价很小；
+真正慢的是以 `\\d` 等开头的兜底模式（"(\\d{4}年\\d{1,2}月\\d{1,2}日)""(\\d+)%.*到货款"），在每个位置都要试配。本模块：
+
+- 解析器在模块加载时把字段表编译一次（字段 → 按优先级排列的模式）；
+- 不以字面量开头的模式，从解析树中取出**任何匹配都必须包含**的字面量（也包括 `[*＊]` 这类小字符集）作为锚点，
+  文本缺任一锚点时直接跳过——不可能匹配，跳过不改变结果；
+- 字段按需求值并缓存，未用到的兜底字段不扫描。
+
+结果与逐条 `re.search` 完全一致：同一字段仍取"第一个能匹配的模式"的第一个匹配，而不是各模式中位置最靠前者。
+锚点用 `in` 逐个判断：实测把全部关键词合成一条前瞻交替式扫描一遍，在 CPython 上反而比逐个子串查找慢；
+以字面量开头的模式也不再额外判断锚点，re 自身的前缀查找已经同样快。
+"""
+import re
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    from re import _parser as _sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse as _sre_parse
+
+_LITERAL = _sre_parse.LITERAL
+_IN = _sre_parse.IN
+_SUBPATTERN = _sre_parse.SUBPATTERN
+_REPEATS = (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT)
+
+# 每个模式最多保留的锚点数、可作为锚点的字符集大小上限
+MAX_ANCHORS = 3
+MAX_CLASS_ANCHOR = 4
+
+# 锚点：文本须包含其中任一子串
+Anchor = Tuple[str, ...]
+
+
+def _walk(parsed, out: List[Anchor]) -> None:
+    run: List[str] = []
+
+    def flush() -> None:
+        if run:
+            out.append(("".join(run),))
+            run.clear()
+
+    for op, av in parsed:
+        if op is _LITERAL:
+            run.append(chr(av))
+            continue
+        flush()
+        if op is _SUBPATTERN:
+            if not av[1] & re.IGNORECASE:
+                _walk(av[-1], out)
+        elif op in _REPEATS and av[0] >= 1:
+            _walk(av[2], out)
+        elif op is _IN and 0 < len(av) <= MAX_CLASS_ANCHOR and all(o is _LITERAL for o, _ in av):
+            out.append(tuple(chr(c) for _, c in av))
+        # 分支、任意字符、类别、可选重复等：不产生锚点，也不向内展开（其中的字面量未必出现）
+    flush()
+
+
+def required_anchors(pattern: str) -> Tuple[Anchor, ...]:
+    """
+    模式任何匹配都必然包含的字面量（每项为若干可选子串之一），最长优先、至多 MAX_ANCHORS 项。
+    顶层或组内分支、可选部分里的字面量一律不计；忽略大小写的模式不取锚点。
+    """
+    parsed = _sre_parse.parse(pattern)
+    if parsed.state.flags & re.IGNORECASE:
+        return ()
+    out: List[Anchor] = []
+    _walk(parsed, out)
+    unique = list(dict.fromkeys(out))
+    unique.sort(key=lambda alts: -min(len(a) for a in alts))
+    return tuple(unique[:MAX_ANCHORS])
+
+
+def _literal_prefixed(pattern: str) -> bool:
+    parsed = _sre_parse.parse(pattern)
+    return bool(len(parsed)) and parsed[0][0] is _LITERAL and not parsed.state.flags & re.IGNORECASE
+
+
+def _anchors_present(text: str, anchors: Tuple[Anchor, ...]) -> bool:
+    for alternatives in anchors:
+        for a in alternatives:
+            if a in text:
+                break
+        else:
+            return False
+    return True
+
+
+class FieldMatches:
+    """某段文本上的字段抽取结果，按字段首次访问时求值。"""
+
+    __slots__ = ("_fields", "_text", "_cache")
+
+    def __init__(self, extractor: "FieldExtractor", text: str):
+        self._fields = extractor.fields
+        self._text = text
+        self._cache: Dict[str, Optional[re.Match]] = {}
+
+    def match(self, name: str) -> Optional[re.Match]:
+        if name in self._cache:
+            return self._cache[name]
+        text = self._text
+        found = None
+        for anchors, compiled in self._fields[name]:
+            if anchors and not _anchors_present(text, anchors):
+                continue
+            found = compiled.search(text)
+            if found:
+                break
+        self._cache[name] = found
+        return found
+
+    def group(self, name: str, index: int = 1) -> Optional[str]:
+        found = self.match(name)
+        return found.group(index) if found else None
+
+
+class FieldExtractor:
+    """字段 → 按优先级排列的模式表，构造时编译全部模式，并为不以字面量开头的模式取出锚点。"""
+
+    def __init__(self, fields: Mapping[str, Sequence[str]]):
+        self.fields: Dict[str, Tuple[Tuple[Tuple[Anchor, ...], re.Pattern], ...]] = {
+            name: tuple(
+                (() if _literal_prefixed(p) else required_anchors(p), re.compile(p)) for p in patterns
+            )
+            for name, patterns in fields.items()
+        }
+
+    def search(self, text: str) -> FieldMatches:
+        return FieldMatches(self, text or "")
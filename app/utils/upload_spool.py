@@ -0,0 +1,268 @@
+"""
+上传文件落盘与内存上限（图片、Excel 等上传接口共用）。
+
+原实现在路由里 `await file.read()` 把每个上传文件读成 bytes，再把 bytes 列表一路传给服务层；
+几个并发的 30 张批量上传就能把 worker 撑过内存上限。现改为：
+
+- `spool_uploads`：按块把 `UploadFile` 拷进 `SpooledTemporaryFile`（小于 UPLOAD_SPOOL_MEMORY_KB 留在内存，
+  超过即落盘），边拷边校验单文件上限；服务层拿到的是文件句柄（`SpooledUpload.file`），按需读取；
+- 单请求上限与全局在途字节都由 `UploadSizeLimitMiddleware` 在读取请求体之前处理：Content-Length 超过上限返回 413
+  （读取时另按实际到达字节计数，分块传输或 Content-Length 不实的请求超限同样 413）；
+  未超过的按 Content-Length 向 `InflightBytesBudget` 一次性预占（不会两个请求各占一半互等；没有 Content-Length 的
+  按单请求上限计），超出容量的请求排队，等待超过 UPLOAD_BUDGET_WAIT_SECONDS 返回 503。预占在请求处理结束时归还，
+  所以 Starlette 解析 multipart 时的缓冲、落盘与路由处理都在预占之内。
+
+预算为进程内计数（每个 worker 各自一份）。
+"""
+import asyncio
+import tempfile
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, BinaryIO, Deque, List, Optional, Sequence
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from app.core.config import settings
+from app.core.paths import TEMP_UPLOADS_DIR
+
+CHUNK_BYTES = 256 * 1024
+
+
+def _format_mb(nbytes: int) -> str:
+    return f"{nbytes / 1024 / 1024:.0f}MB"
+
+
+@dataclass
+class SpooledUpload:
+    filename: Optional[str]
+    content_type: Optional[str]
+    size: int
+    file: Optional[BinaryIO]
+    too_large: bool = False
+
+    def read_bytes(self) -> bytes:
+        """少数必须整体处理的场景（如解析 Excel）才调用。"""
+        if self.file is None:
+            return b""
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+
+
+def _set_result(fut: "asyncio.Future[None]") -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+class InflightBytesBudget:
+    """
+    在途上传字节的计数信号量。acquire 按 FIFO 授予，单次申请超过容量时按容量计（大文件独占而不是永远等待）。
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(int(capacity), 1)
+        self._used = 0
+        self._waiters: Deque[list] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def in_use(self) -> int:
+        return self._used
+
+    async def acquire(self, nbytes: int, timeout: Optional[float] = None) -> int:
+        """返回实际预占字节数（release 时原样传回）；超时抛 asyncio.TimeoutError。"""
+        n = min(max(int(nbytes), 0), self.capacity)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self._used + n <= self.capacity:
+                self._used += n
+                return n
+            waiter = [n, loop.create_future(), loop]
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            return n
+        except BaseException:
+            with self._lock:
+                granted = waiter not in self._waiters
+                if not granted:
+                    self._waiters.remove(waiter)
+                    self._grant_locked()
+            if granted:
+                self.release(n)
+            raise
+
+    def release(self, nbytes: int) -> None:
+        with self._lock:
+            self._used = max(self._used - int(nbytes), 0)
+            self._grant_locked()
+
+    def _grant_locked(self) -> None:
+        while self._waiters and self._used + self._waiters[0][0] <= self.capacity:
+            n, fut, loop = self._waiters.popleft()
+            self._used += n
+            loop.call_soon_threadsafe(_set_result, fut)
+
+
+_budget: Optional[InflightBytesBudget] = None
+_budget_lock = threading.Lock()
+
+
+def get_upload_budget() -> InflightBytesBudget:
+    global _budget
+    if _budget is None:
+        with _budget_lock:
+            if _budget is None:
+                _budget = InflightBytesBudget(settings.upload_inflight_max_bytes)
+    return _budget
+
+
+async def spool_upload(upload: UploadFile, max_bytes: Optional[int] = None, strict: bool = True) -> SpooledUpload:
+    """
+    UploadFile → SpooledUpload（句柄位于开头）。超过 max_bytes 时：strict 抛 413，否则返回 too_large=True 的空条目。
+    0 字节的文件（客户端留空的可选文件字段）按未上传处理：返回 file=None 的条目，与原先读出 b"" 后跳过一致。
+    拷贝完成后关闭原 UploadFile，释放 Starlette 解析 multipart 时的临时文件。
+    """
+    limit = max_bytes if max_bytes is not None else settings.upload_max_file_bytes
+    TEMP_UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+    buf = tempfile.SpooledTemporaryFile(max_size=settings.upload_spool_memory_bytes, dir=TEMP_UPLOADS_DIR)
+    size = 0
+    try:
+        await upload.seek(0)
+        while True:
+            chunk = await upload.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if limit and size > limit:
+                buf.close()
+                if strict:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"文件 {upload.filename} 超过 {_format_mb(limit)} 限制",
+                    )
+                return SpooledUpload(upload.filename, upload.content_type, size, None, too_large=True)
+            buf.write(chunk)
+        if size == 0:
+            buf.close()
+            return SpooledUpload(upload.filename, upload.content_type, 0, None)
+        buf.seek(0)
+    except BaseException:
+        buf.close()
+        raise
+    finally:
+        await upload.close()
+    return SpooledUpload(upload.filename, upload.content_type, size, buf)
+
+
+@asynccontextmanager
+async def spool_uploads(
+    uploads: Sequence[Optional[UploadFile]],
+    max_file_bytes: Optional[int] = None,
+    strict: bool = True,
+) -> AsyncIterator[List[SpooledUpload]]:
+    """
+    逐个落盘 → 交给调用方处理 → 关闭临时文件（在途字节已由 `UploadSizeLimitMiddleware` 在读请求体前预占）。
+    uploads 中的 None 会被跳过；返回列表与其余元素一一对应（0 字节的条目 file 为 None，见 `present_files`）。
+    """
+    items = [u for u in uploads if u is not None]
+    declared = sum(u.size or 0 for u in items)
+    if declared > settings.upload_max_request_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"上传文件总大小超过 {_format_mb(settings.upload_max_request_bytes)} 限制",
+        )
+
+    spooled: List[SpooledUpload] = []
+    try:
+        for upload in items:
+            spooled.append(await spool_upload(upload, max_file_bytes, strict))
+        yield spooled
+    finally:
+        for item in spooled:
+            item.close()
+
+
+def present_files(spooled: Sequence[SpooledUpload]) -> List[BinaryIO]:
+    """实际有内容的文件句柄（跳过 0 字节与超限条目），供按列表处理图片的服务层使用。"""
+    return [item.file for item in spooled if item.file is not None]
+
+
+class RequestBodyTooLarge(HTTPException):
+    """请求体实际字节数超过上限（没有 Content-Length 或与之不符时在读取过程中发现）。"""
+
+    def __init__(self, max_request_bytes: int):
+        super().__init__(status_code=413, detail=f"上传内容超过 {_format_mb(max_request_bytes)} 限制")
+
+
+class UploadSizeLimitMiddleware:
+    """
+    multipart 请求在读取请求体之前：Content-Length 超过 UPLOAD_MAX_REQUEST_MB 返回 413；
+    否则按 Content-Length 预占在途字节（排队超时返回 503），下游处理结束后归还。
+    读取请求体时另按实际到达的字节计数（分块传输、没有或谎报 Content-Length 的请求），超过上限即中止并返回 413。
+    """
+
+    def __init__(self, app, max_request_bytes: Optional[int] = None, budget: Optional[InflightBytesBudget] = None):
+        self.app = app
+        self.max_request_bytes = max_request_bytes or settings.upload_max_request_bytes
+        self.budget = budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/"):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = headers.get(b"content-length")
+        declared = int(content_length) if content_length and content_length.isdigit() else self.max_request_bytes
+        if declared > self.max_request_bytes:
+            await self._reject(scope, receive, send, 413, f"上传内容超过 {_format_mb(self.max_request_bytes)} 限制")
+            return
+        budget = self.budget or get_upload_budget()
+        try:
+            reserved = await budget.acquire(declared, settings.upload_budget_wait_seconds)
+        except asyncio.TimeoutError:
+            await self._reject(scope, receive, send, 503, "上传处理繁忙，请稍后重试")
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_request_bytes:
+                    # HTTPException：FastAPI 解析表单时原样抛出，由异常处理返回 413；未被处理时下面兜底
+                    raise RequestBodyTooLarge(self.max_request_bytes)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except RequestBodyTooLarge as e:
+            if response_started:
+                raise
+            await self._reject(scope, receive, send, e.status_code, e.detail)
+        finally:
+            budget.release(reserved)
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code: int, detail: str) -> None:
+        response = JSONResponse(status_code=status_code, content={"detail": detail})
+        await response(scope, receive, send)
@@ -0,0 +1,213 @@
+"""
+结余按收款人/报单人汇总基准：按计算表达式现场分组（旧） vs 读汇总表 `pd_balance_party_summary`（新）。
+
+模拟百万级结余明细下「按收款人汇总」「按报单人汇总」列表翻页（分组 COUNT + 分页查询）的耗时，
+另测一次核销后在事务内刷新分组键并重算该收款人/报单人汇总行（`sync_balance_summaries`）的耗时。
+
+用法（须指向独立的压测库，脚本会建表并写入大量数据）::
+
+    MYSQL_HOST=... MYSQL_PORT=3306 MYSQL_USER=... MYSQL_PASSWORD=... \\
+    python benchmarks/bench_balance_party_summary.py --database pd_bench --balances 1000000
+
+已有数据时加 `--skip-seed` 只跑查询。输出各用例 p50 / p95 / 平均耗时（毫秒）。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench_grouped_list_queries import _insert_many, _report, _timed  # noqa: E402
+
+OLD_PAYEE_EXPR = (
+    "COALESCE(NULLIF(TRIM(b.payee_name), ''), NULLIF(TRIM(b.driver_name), ''), CONCAT('未匹配收款人#', b.id))"
+)
+OLD_REPORTER_EXPR = (
+    "COALESCE(NULLIF(TRIM(d.reporter_name), ''), NULLIF(TRIM(d.shipper), ''), "
+    "CONCAT('未关联发货人#', b.delivery_id))"
+)
+OLD_WHERE = "b.payment_status IN (0, 1) AND b.balance_amount >= 0.01"
+
+OLD_PAYEE_COUNT_SQL = f"""
+    SELECT COUNT(*) FROM (
+        SELECT {OLD_PAYEE_EXPR} AS payee_name, b.driver_phone
+        FROM pd_balance_details b
+        LEFT JOIN pd_weighbills w ON w.id = b.weighbill_id
+        WHERE {OLD_WHERE}
+        GROUP BY {OLD_PAYEE_EXPR}, b.driver_phone
+    ) t
+"""
+
+OLD_PAYEE_PAGE_SQL = f"""
+    SELECT {OLD_PAYEE_EXPR} AS payee_name, b.driver_phone,
+           MAX(COALESCE(b.schedule_date, w.payment_schedule_date)) AS payment_schedule_date,
+           COUNT(*) AS bill_count, SUM(b.payable_amount) AS total_payable, SUM(b.paid_amount) AS total_paid,
+           SUM(b.balance_amount) AS total_balance,
+           GROUP_CONCAT(DISTINCT b.contract_no ORDER BY b.contract_no SEPARATOR ', ') AS related_contracts,
+           GROUP_CONCAT(DISTINCT b.vehicle_no ORDER BY b.vehicle_no SEPARATOR ', ') AS related_vehicles,
+           MIN(b.created_at) AS first_bill_date, MAX(b.created_at) AS last_bill_date,
+           SUM(CASE WHEN b.payment_status = 0 THEN 1 ELSE 0 END) AS pending_count,
+           SUM(CASE WHEN b.payment_status = 1 THEN 1 ELSE 0 END) AS partial_count
+    FROM pd_balance_details b
+    LEFT JOIN pd_weighbills w ON w.id = b.weighbill_id
+    WHERE {OLD_WHERE}
+    GROUP BY {OLD_PAYEE_EXPR}, b.driver_phone
+    ORDER BY total_balance DESC, last_bill_date DESC
+    LIMIT %s OFFSET %s
+"""
+
+OLD_REPORTER_COUNT_SQL = f"""
+    SELECT COUNT(*) FROM (
+        SELECT {OLD_REPORTER_EXPR} AS reporter_name
+        FROM pd_balance_details b
+        LEFT JOIN pd_deliveries d ON d.id = b.delivery_id
+        LEFT JOIN pd_weighbills w ON w.id = b.weighbill_id
+        WHERE {OLD_WHERE}
+        GROUP BY {OLD_REPORTER_EXPR}
+    ) t
+"""
+
+NEW_COUNT_SQL = "SELECT COUNT(*) FROM pd_balance_party_summary s WHERE s.party_type = %s"
+
+NEW_PAGE_SQL = """
+    SELECT s.party_key, s.driver_phone, s.payment_schedule_date, s.bill_count, s.total_payable, s.total_paid,
+           s.total_balance, s.related_contracts, s.related_vehicles, s.first_bill_date, s.last_bill_date,
+           s.pending_count, s.partial_count
+    FROM pd_balance_party_summary s
+    WHERE s.party_type = %s
+    ORDER BY s.total_balance DESC, s.last_bill_date DESC
+    LIMIT %s OFFSET %s
+"""
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", required=True, help="压测库名（会覆盖 MYSQL_DATABASE）")
+    parser.add_argument("--balances", type=int, default=1_000_000, help="结余明细行数")
+    parser.add_argument("--payees", type=int, default=20_000, help="收款人数")
+    parser.add_argument("--reporters", type=int, default=300, help="报单人数")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=50, help="随机翻页范围（前 N 页）")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--chunk", type=int, default=5000, help="批量插入每批行数")
+    parser.add_argument("--seed", type=int, default=20260101)
+    parser.add_argument("--skip-seed", action="store_true")
+    return parser.parse_args()
+
+
+def seed(conn, args: argparse.Namespace, rnd: random.Random) -> None:
+    n = args.balances
+    n_deliveries = (n + 1) // 2
+    with conn.cursor() as cur:
+        for table in ("pd_balance_party_summary", "pd_balance_details", "pd_weighbills", "pd_deliveries"):
+            cur.execute(f"DELETE FROM {table}")
+        conn.commit()
+
+        start = time.perf_counter()
+        for base in range(0, n_deliveries, args.chunk):
+            rows = []
+            for i in range(base, min(base + args.chunk, n_deliveries)):
+                reporter = f"报单人{rnd.randint(1, args.reporters)}"
+                # 少量报单只有发货人，覆盖分组键的回退分支
+                rows.append((i + 1, "2025-06-01", "压测冶炼厂", "电动车",
+                             None if i % 20 == 0 else reporter, reporter))
+            _insert_many(cur, "pd_deliveries",
+                         ("id", "report_date", "target_factory_name", "product_name", "reporter_name", "shipper"),
+                         rows)
+            conn.commit()
+
+        for base in range(0, n, args.chunk):
+            rows = []
+            for i in range(base, min(base + args.chunk, n)):
+                payee = rnd.randint(1, args.payees)
+                payable = round(rnd.uniform(5000, 15000), 2)
+                status = rnd.choice((0, 0, 1, 2, 2, 2))
+                paid = {0: 0, 1: round(payable / 2, 2), 2: payable}[status]
+                rows.append((
+                    i + 1, i // 2 + 1, f"HT-{rnd.randint(1, 800):04d}", f"司机{payee}",
+                    f"139{payee:08d}", f"粤B{rnd.randint(10000, 99999)}",
+                    f"收款人{payee}" if i % 10 else "  ", payable, paid, round(payable - paid, 2), status,
+                    f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:00:00",
+                ))
+            _insert_many(cur, "pd_balance_details",
+                         ("weighbill_id", "delivery_id", "contract_no", "driver_name", "driver_phone", "vehicle_no",
+                          "payee_name", "payable_amount", "paid_amount", "balance_amount", "payment_status",
+                          "created_at"), rows)
+            conn.commit()
+        print(f"seeded pd_balance_details={n} in {time.perf_counter() - start:.1f}s")
+        cur.execute("ANALYZE TABLE pd_deliveries, pd_balance_details")
+        cur.fetchall()
+
+
+def main() -> None:
+    args = _parse_args()
+    os.environ["MYSQL_DATABASE"] = args.database
+
+    from database_setup import create_tables
+    from app.core.schema_migrations import run_migrations
+    from app.services.balance_party_summary import rebuild_balance_summaries, sync_balance_summaries
+    from core.database import get_conn, get_conn_tuple
+
+    rnd = random.Random(args.seed)
+    if not args.skip_seed:
+        create_tables()
+        run_migrations()
+        with get_conn_tuple() as conn:
+            seed(conn, args, rnd)
+        start = time.perf_counter()
+        rebuild_balance_summaries()
+        print(f"rebuilt summaries in {time.perf_counter() - start:.1f}s")
+
+    def offset() -> int:
+        return rnd.randrange(args.pages) * args.page_size
+
+    with get_conn_tuple() as conn:
+
+        def query(sql: str, params_for: Callable[[], tuple]) -> Callable[[], None]:
+            def once() -> None:
+                with conn.cursor() as cur:
+                    cur.execute(sql, params_for())
+                    cur.fetchall()
+            return once
+
+        def both(*fns: Callable[[], None]) -> Callable[[], None]:
+            def once() -> None:
+                for fn in fns:
+                    fn()
+            return once
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM pd_balance_details WHERE payment_status IN (0, 1) LIMIT 1000")
+            open_ids: List[int] = [r[0] for r in cur.fetchall()]
+
+        cases = [
+            ("payee page (old)", both(query(OLD_PAYEE_COUNT_SQL, tuple),
+                                      query(OLD_PAYEE_PAGE_SQL, lambda: (args.page_size, offset())))),
+            ("payee page (new)", both(query(NEW_COUNT_SQL, lambda: ("payee",)),
+                                      query(NEW_PAGE_SQL, lambda: ("payee", args.page_size, offset())))),
+            ("reporter count (old)", query(OLD_REPORTER_COUNT_SQL, tuple)),
+            ("reporter page (new)", both(query(NEW_COUNT_SQL, lambda: ("reporter",)),
+                                         query(NEW_PAGE_SQL, lambda: ("reporter", args.page_size, offset())))),
+        ]
+        for name, fn in cases:
+            _timed(fn, min(3, args.iterations))
+            _report(name, _timed(fn, args.iterations))
+
+    with get_conn() as conn:
+
+        def sync_one() -> None:
+            conn.begin()
+            with conn.cursor() as cur:
+                sync_balance_summaries(cur, [rnd.choice(open_ids)])
+            conn.rollback()
+
+        _timed(sync_one, min(10, args.iterations))
+        _report("sync after verify (new)", _timed(sync_one, args.iterations * 4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+报单匹配合同基准：候选合同 + 逐个 SUM(planned_trucks)（旧） vs 联表读取合同车数台账（新）。
+
+模拟「同一冶炼厂/品种下有数百个生效中合同、报单表已有大量审核通过报单」时一次报单提交的合同匹配耗时；
+旧写法按匹配顺序逐个求和，合同越靠后（前面的合同车数用尽）查询次数越多。另测审核通过时锁台账并更新的耗时。
+
+用法（须指向独立的压测库，脚本会建表并写入大量数据）::
+
+    MYSQL_HOST=... MYSQL_PORT=3306 MYSQL_USER=... MYSQL_PASSWORD=... \\
+    python benchmarks/bench_contract_matching.py --database pd_bench --contracts 500 --deliveries 300000
+
+已有数据时加 `--skip-seed` 只跑查询。输出各用例 p50 / p95 / 平均耗时（毫秒）。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench_grouped_list_queries import _insert_many, _report, _timed  # noqa: E402
+
+SMELTER = "压测冶炼厂"
+PRODUCT = "电动车"
+
+CANDIDATES_SQL = """
+    SELECT c.id AS contract_id, c.contract_no, p.unit_price, FLOOR(c.total_quantity / 35) AS contract_trucks
+    FROM pd_contracts c
+    JOIN pd_contract_products p ON p.contract_id = c.id
+    WHERE c.smelter_company = %s AND p.product_name = %s AND p.unit_price > 0
+      AND c.status = '生效中' AND c.contract_date <= %s AND (c.end_date IS NULL OR c.end_date >= %s)
+    ORDER BY c.end_date ASC, c.contract_date ASC, p.sort_order ASC
+"""
+
+OLD_USED_SQL = """
+    SELECT COALESCE(SUM(planned_trucks), 0) FROM pd_deliveries
+    WHERE contract_no = %s AND status = '审核通过'
+"""
+
+NEW_MATCH_SQL = """
+    SELECT c.id AS contract_id, c.contract_no, p.unit_price, FLOOR(c.total_quantity / 35) AS contract_trucks,
+           COALESCE(cap.used_trucks, 0) AS used_trucks
+    FROM pd_contracts c
+    JOIN pd_contract_products p ON p.contract_id = c.id
+    LEFT JOIN pd_contract_capacity cap ON cap.contract_no = c.contract_no
+    WHERE c.smelter_company = %s AND p.product_name = %s AND p.unit_price > 0
+      AND c.status = '生效中' AND c.contract_date <= %s AND (c.end_date IS NULL OR c.end_date >= %s)
+    ORDER BY c.end_date ASC, c.contract_date ASC, p.sort_order ASC
+"""
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", required=True, help="压测库名（会覆盖 MYSQL_DATABASE）")
+    parser.add_argument("--contracts", type=int, default=500, help="生效中合同数")
+    parser.add_argument("--deliveries", type=int, default=300_000, help="报单总数")
+    parser.add_argument("--full-ratio", type=float, default=0.8, help="车数已用尽的合同占比（排在匹配顺序前面）")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--chunk", type=int, default=5000, help="批量插入每批行数")
+    parser.add_argument("--seed", type=int, default=20260101)
+    parser.add_argument("--skip-seed", action="store_true")
+    return parser.parse_args()
+
+
+def seed(conn, n_contracts: int, n_deliveries: int, full_ratio: float, chunk: int, rnd: random.Random) -> None:
+    with conn.cursor() as cur:
+        for table in ("pd_contract_capacity", "pd_weighbills", "pd_deliveries", "pd_contract_products", "pd_contracts"):
+            cur.execute(f"DELETE FROM {table}")
+        conn.commit()
+
+        start = time.perf_counter()
+        contracts, products = [], []
+        for i in range(1, n_contracts + 1):
+            # 每个合同 35 车；end_date 递增，前 full_ratio 的合同先被匹配到
+            contracts.append((i, f"BENCH-{i:05d}", "2025-01-01", f"2030-{1 + i // 28 % 12:02d}-{1 + i % 28:02d}",
+                              SMELTER, 35 * 35, "生效中"))
+            products.append((i, PRODUCT, 9000 + i % 100, 0))
+        contracts.sort(key=lambda r: r[3])
+        _insert_many(cur, "pd_contracts", ("id", "contract_no", "contract_date", "end_date", "smelter_company",
+                                           "total_quantity", "status"), contracts)
+        _insert_many(cur, "pd_contract_products", ("contract_id", "product_name", "unit_price", "sort_order"),
+                     products)
+        conn.commit()
+
+        full_nos = [c[1] for c in contracts[: int(len(contracts) * full_ratio)]]
+        all_nos = [c[1] for c in contracts]
+        for base in range(0, n_deliveries, chunk):
+            rows = []
+            for i in range(base, min(base + chunk, n_deliveries)):
+                # 排在前面的 full_ratio 合同各有 35 车审核通过报单（已用尽）；其余为待审/驳回报单，分散到全部合同
+                if i < len(full_nos) * 35:
+                    contract_no = full_nos[i // 35]
+                else:
+                    contract_no = rnd.choice(all_nos)
+                status = "审核通过" if i < len(full_nos) * 35 else rnd.choice(("待审核", "审核未通过"))
+                rows.append((f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}", SMELTER, PRODUCT,
+                             35, 1, contract_no, status))
+            _insert_many(cur, "pd_deliveries", ("report_date", "target_factory_name", "product_name", "quantity",
+                                                "planned_trucks", "contract_no", "status"), rows)
+            conn.commit()
+        print(f"seeded contracts={n_contracts} deliveries={n_deliveries} in {time.perf_counter() - start:.1f}s")
+        cur.execute("ANALYZE TABLE pd_contracts, pd_contract_products, pd_deliveries")
+        cur.fetchall()
+
+
+def main() -> None:
+    args = _parse_args()
+    os.environ["MYSQL_DATABASE"] = args.database
+
+    from database_setup import create_tables
+    from app.core.schema_migrations import run_migrations
+    from app.services.contract_capacity import apply_delivery_change, rebuild_contract_capacity
+    from core.database import get_conn
+
+    rnd = random.Random(args.seed)
+    if not args.skip_seed:
+        create_tables()
+        run_migrations()
+        with get_conn() as conn:
+            seed(conn, args.contracts, args.deliveries, args.full_ratio, args.chunk, rnd)
+        rebuild_contract_capacity()
+
+    today = "2026-01-15"
+    planned = 1
+    with get_conn() as conn:
+
+        def old_match() -> None:
+            with conn.cursor() as cur:
+                cur.execute(CANDIDATES_SQL, (SMELTER, PRODUCT, today, today))
+                for row in cur.fetchall():
+                    cur.execute(OLD_USED_SQL, (row["contract_no"],))
+                    used = int(list(cur.fetchone().values())[0] or 0)
+                    if planned < int(row["contract_trucks"] or 0) - used:
+                        return
+
+        def new_match() -> None:
+            with conn.cursor() as cur:
+                cur.execute(NEW_MATCH_SQL, (SMELTER, PRODUCT, today, today))
+                for row in cur.fetchall():
+                    if planned < int(row["contract_trucks"] or 0) - int(row["used_trucks"] or 0):
+                        return
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT contract_no FROM pd_contract_capacity ORDER BY used_trucks LIMIT 1")
+            target = cur.fetchone()["contract_no"]
+
+        def approve_and_revert() -> None:
+            conn.begin()
+            with conn.cursor() as cur:
+                pending = {"status": "待审核", "contract_no": target, "planned_trucks": 1}
+                apply_delivery_change(cur, pending, {**pending, "status": "审核通过"}, enforce=False)
+            conn.rollback()
+
+        cases: List[tuple[str, Callable[[], None]]] = [
+            ("match (old, per-contract SUM)", old_match),
+            ("match (new, capacity join)", new_match),
+            ("approve (lock + ledger update)", approve_and_revert),
+        ]
+        for name, fn in cases:
+            _timed(fn, min(10, args.iterations))
+            _report(name, _timed(fn, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+列表模糊搜索基准：前导通配 LIKE 全表扫描（旧） vs ngram 全文索引预筛选 + LIKE 精确过滤（新）。
+
+对比对象：
+- 报单列表 `DeliveryService.list_deliveries` 的 fuzzy_keywords（8 列 OR）；
+- 结余分组列表 `BalanceService.list_balance_details_grouped` 的 fuzzy_keywords（5 列 OR）。
+
+数据为随机生成的中文姓名、车牌（如 `粤BD12345`）、手机号、合同号。每个关键词的两种写法都会校验结果集一致。
+
+用法（须指向独立的压测库，脚本会建表、建全文索引并写入大量数据）::
+
+    MYSQL_HOST=... MYSQL_PORT=3306 MYSQL_USER=... MYSQL_PASSWORD=... \\
+    python benchmarks/bench_fuzzy_search.py --database pd_bench --rows 500000
+
+已有数据时加 `--skip-seed` 只跑查询。输出各查询 p50 / p95 / 平均耗时（毫秒）。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench_grouped_list_queries import _insert_many, _report, _timed  # noqa: E402
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰萍红建国文志海林波辉鹏宇浩俊峰斌龙飞云"
+PROVINCES = "粤湘赣桂闽琼川渝黔滇鄂豫皖苏浙"
+PLATE_LETTERS = "ABCDEFGHJKLMNPQRSTUVWXYZ"
+FACTORIES = ["豫光金铅", "株冶集团", "驰宏锌锗", "金利冶炼", "岳阳恒通", "安徽华鑫", "江西铜业", "河南万洋"]
+PRODUCTS = ["电动车", "黑皮", "新能源", "通信"]
+
+DELIVERY_COLUMNS = (
+    "vehicle_no", "driver_name", "driver_phone", "driver_id_card", "target_factory_name",
+    "product_name", "contract_no", "reporter_name", "shipper",
+)
+BALANCE_COLUMNS = ("contract_no", "driver_name", "driver_phone", "vehicle_no", "payee_name")
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", required=True, help="压测库名（会覆盖 MYSQL_DATABASE）")
+    parser.add_argument("--rows", type=int, default=500_000, help="报单与结余明细各写入行数")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=50, help="每个关键词重复次数")
+    parser.add_argument("--chunk", type=int, default=5000, help="批量插入每批行数")
+    parser.add_argument("--seed", type=int, default=20260101)
+    parser.add_argument("--skip-seed", action="store_true")
+    return parser.parse_args()
+
+
+def _name(rnd: random.Random) -> str:
+    return rnd.choice(SURNAMES) + "".join(rnd.choice(GIVEN) for _ in range(rnd.choice((1, 2))))
+
+
+def _plate(rnd: random.Random) -> str:
+    return (rnd.choice(PROVINCES) + rnd.choice(PLATE_LETTERS) + rnd.choice(PLATE_LETTERS)
+            + f"{rnd.randint(0, 99999):05d}")
+
+
+def _id_card(rnd: random.Random) -> str:
+    return f"{rnd.randint(110000, 659999)}19{rnd.randint(60, 99)}{rnd.randint(1, 12):02d}" \
+           f"{rnd.randint(1, 28):02d}{rnd.randint(0, 999):03d}{rnd.choice('0123456789X')}"
+
+
+def seed(conn, n_rows: int, chunk: int, rnd: random.Random) -> None:
+    with conn.cursor() as cur:
+        for table in ("pd_balance_details", "pd_deliveries"):
+            cur.execute(f"DELETE FROM {table}")
+        conn.commit()
+        start = time.perf_counter()
+        for base in range(0, n_rows, chunk):
+            d_rows, b_rows = [], []
+            for i in range(base, min(base + chunk, n_rows)):
+                driver, plate = _name(rnd), _plate(rnd)
+                phone = f"1{rnd.choice('3578')}{rnd.randint(0, 999_999_999):09d}"
+                contract = f"HT{rnd.randint(2023, 2026)}{rnd.randint(1, 9999):04d}"
+                reporter = _name(rnd)
+                d_rows.append((i + 1, plate, driver, phone, _id_card(rnd), rnd.choice(FACTORIES),
+                               rnd.choice(PRODUCTS), contract, reporter, reporter))
+                b_rows.append((i + 1, i + 1, contract, driver, phone, plate, _name(rnd),
+                               round(rnd.uniform(100_000, 400_000), 2), 0))
+            _insert_many(cur, "pd_deliveries", ("id",) + DELIVERY_COLUMNS, d_rows)
+            _insert_many(cur, "pd_balance_details",
+                         ("weighbill_id", "delivery_id") + BALANCE_COLUMNS + ("payable_amount", "payment_status"),
+                         b_rows)
+            conn.commit()
+        print(f"seeded pd_deliveries/pd_balance_details={n_rows} in {time.perf_counter() - start:.1f}s")
+        cur.execute("ANALYZE TABLE pd_deliveries, pd_balance_details")
+        cur.fetchall()
+
+
+def _like_sql(columns: Tuple[str, ...], alias: str, tokens: List[str]) -> Tuple[str, List[str]]:
+    prefix = f"{alias}." if alias else ""
+    clauses, params = [], []
+    for token in tokens:
+        clauses.append("(" + " OR ".join(f"{prefix}{c} LIKE %s" for c in columns) + ")")
+        params.extend([f"%{token}%"] * len(columns))
+    return "(" + " OR ".join(clauses) + ")", params
+
+
+def main() -> None:
+    args = _parse_args()
+    os.environ["MYSQL_DATABASE"] = args.database
+
+    from database_setup import create_tables
+    from core.database import get_conn_tuple
+    from app.utils.fulltext_search import keyword_filter, ngram_token_size
+
+    rnd = random.Random(args.seed)
+    if not args.skip_seed:
+        create_tables()
+        with get_conn_tuple() as conn:
+            seed(conn, args.rows, args.chunk, rnd)
+
+    with get_conn_tuple() as conn:
+        with conn.cursor() as cur:
+            if not ngram_token_size(cur, "pd_deliveries") or not ngram_token_size(cur, "pd_balance_details"):
+                raise SystemExit("全文索引不可用（需 MySQL 5.7.6+ ngram，并已执行 create_tables）")
+            cur.execute("SELECT driver_name, vehicle_no, contract_no FROM pd_deliveries ORDER BY RAND() LIMIT 5")
+            samples = cur.fetchall()
+
+        # 关键词：完整姓名、姓名片段、车牌后 4 位、车牌省份+字母、合同号片段、多词 OR
+        keywords = []
+        for driver, plate, contract in samples:
+            keywords += [driver, driver[-2:], plate[-4:], plate[:3], contract[2:8]]
+        keywords.append(f"{samples[0][0]} {samples[1][1][-5:]}")
+
+        cases = [
+            ("deliveries", "pd_deliveries", "", DELIVERY_COLUMNS,
+             "SELECT id FROM pd_deliveries WHERE {cond} ORDER BY created_at DESC, id DESC LIMIT %s"),
+            ("balance grouped", "pd_balance_details", "b", BALANCE_COLUMNS,
+             "SELECT b.delivery_id, MAX(b.created_at) AS m FROM pd_balance_details b WHERE {cond} "
+             "GROUP BY b.delivery_id ORDER BY m DESC, b.delivery_id DESC LIMIT %s"),
+        ]
+        for label, table, alias, columns, template in cases:
+            old_samples: List[float] = []
+            new_samples: List[float] = []
+            for kw in keywords:
+                tokens = kw.split()
+                like_sql, like_params = _like_sql(columns, alias, tokens)
+                with conn.cursor() as cur:
+                    new_cond, new_params = keyword_filter(cur, table, alias, tokens, like_sql, like_params)
+                old_q = (template.format(cond=like_sql), tuple(like_params) + (args.page_size,))
+                new_q = (template.format(cond=new_cond), tuple(new_params) + (args.page_size,))
+
+                def runner(q) -> Callable[[], list]:
+                    def once():
+                        with conn.cursor() as cur:
+                            cur.execute(*q)
+                            return cur.fetchall()
+                    return once
+
+                if sorted(runner(old_q)()) != sorted(runner(new_q)()):
+                    raise SystemExit(f"{label}: 关键词 {kw!r} 两种写法结果不一致")
+                old_samples += _timed(runner(old_q), args.iterations)
+                new_samples += _timed(runner(new_q), args.iterations)
+            _report(f"{label} LIKE (old)", old_samples)
+            _report(f"{label} ngram+LIKE (new)", new_samples)
+
+
+if __name__ == "__main__":
+    main()
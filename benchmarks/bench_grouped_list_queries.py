@@ -0,0 +1,202 @@
+"""
+分组列表汇总查询基准：相关子查询（旧） vs 派生表 GROUP BY delivery_id 条件聚合（新）。
+
+对比对象：
+- 结余按报单分组 `BalanceService.list_balance_details_grouped` 的报单汇总查询；
+- 磅单按报单分组 `WeighbillService.list_weighbills_grouped` 的报单计数查询。
+
+用法（须指向独立的压测库，脚本会建表并写入大量数据）::
+
+    MYSQL_HOST=... MYSQL_PORT=3306 MYSQL_USER=... MYSQL_PASSWORD=... \\
+    python benchmarks/bench_grouped_list_queries.py --database pd_bench --weighbills 500000
+
+已有数据时加 `--skip-seed` 只跑查询。输出各查询 p50 / p95 / 平均耗时（毫秒）。
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, Sequence, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+OLD_BALANCE_SUMMARY_SQL = """
+    SELECT d.*,
+           (SELECT COUNT(*) FROM pd_balance_details WHERE delivery_id = d.id) as total_items,
+           (SELECT COUNT(*) FROM pd_balance_details WHERE delivery_id = d.id AND payment_status = 0) as pending_items,
+           (SELECT COUNT(*) FROM pd_balance_details WHERE delivery_id = d.id AND payment_status = 1) as partial_items,
+           (SELECT COUNT(*) FROM pd_balance_details WHERE delivery_id = d.id AND payment_status = 2) as settled_items,
+           (SELECT COALESCE(SUM(payable_amount), 0) FROM pd_balance_details WHERE delivery_id = d.id) as total_payable,
+           (SELECT COALESCE(SUM(paid_amount), 0) FROM pd_balance_details WHERE delivery_id = d.id) as total_paid,
+           (SELECT COALESCE(SUM(balance_amount), 0) FROM pd_balance_details WHERE delivery_id = d.id) as total_balance
+    FROM pd_deliveries d
+    WHERE d.id IN ({ids})
+    ORDER BY d.created_at DESC
+"""
+
+OLD_WEIGHBILL_SUMMARY_SQL = """
+    SELECT d.*,
+           (SELECT COUNT(*) FROM pd_weighbills WHERE delivery_id = d.id) as total_weighbills,
+           (SELECT COUNT(*) FROM pd_weighbills WHERE delivery_id = d.id AND upload_status = '已上传') as uploaded_weighbills
+    FROM pd_deliveries d
+    WHERE d.id IN ({ids})
+    ORDER BY d.created_at DESC
+"""
+
+PRODUCTS = ["电动车", "黑皮", "新能源", "通信"]
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", required=True, help="压测库名（会覆盖 MYSQL_DATABASE）")
+    parser.add_argument("--weighbills", type=int, default=500_000, help="磅单/结余行数")
+    parser.add_argument("--per-delivery", type=int, default=2, help="每个报单的磅单数（≤4，对应品种）")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--chunk", type=int, default=5000, help="批量插入每批行数")
+    parser.add_argument("--seed", type=int, default=20260101)
+    parser.add_argument("--skip-seed", action="store_true")
+    return parser.parse_args()
+
+
+def _insert_many(cur, table: str, columns: Sequence[str], rows: List[tuple]) -> None:
+    row_ph = "(" + ",".join(["%s"] * len(columns)) + ")"
+    sql = f"INSERT INTO {table} ({','.join(columns)}) VALUES " + ",".join([row_ph] * len(rows))
+    cur.execute(sql, tuple(v for row in rows for v in row))
+
+
+def seed(conn, n_weighbills: int, per_delivery: int, chunk: int, rnd: random.Random) -> None:
+    per_delivery = max(1, min(per_delivery, len(PRODUCTS)))
+    n_deliveries = (n_weighbills + per_delivery - 1) // per_delivery
+    with conn.cursor() as cur:
+        for table in ("pd_balance_details", "pd_weighbills", "pd_deliveries"):
+            cur.execute(f"DELETE FROM {table}")
+        conn.commit()
+
+        start = time.perf_counter()
+        for base in range(0, n_deliveries, chunk):
+            rows = []
+            for i in range(base, min(base + chunk, n_deliveries)):
+                rows.append((
+                    i + 1,
+                    f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+                    f"测试库{rnd.randint(1, 30)}",
+                    f"冶炼厂{rnd.randint(1, 12)}",
+                    PRODUCTS[0],
+                    f"粤B{rnd.randint(10000, 99999)}",
+                    f"司机{rnd.randint(1, 5000)}",
+                    f"138{rnd.randint(10_000_000, 99_999_999)}",
+                    f"HT-{rnd.randint(1, 800):04d}",
+                    f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:00:00",
+                ))
+            _insert_many(
+                cur,
+                "pd_deliveries",
+                ("id", "report_date", "warehouse", "target_factory_name", "product_name",
+                 "vehicle_no", "driver_name", "driver_phone", "contract_no", "created_at"),
+                rows,
+            )
+            conn.commit()
+        print(f"seeded pd_deliveries={n_deliveries} in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        wb_id = 0
+        for base in range(0, n_deliveries, chunk):
+            wb_rows, bal_rows = [], []
+            for d in range(base + 1, min(base + chunk, n_deliveries) + 1):
+                for k in range(per_delivery):
+                    wb_id += 1
+                    if wb_id > n_weighbills:
+                        break
+                    net = round(rnd.uniform(20, 40), 3)
+                    payable = round(net * 9000 / 1.03, 2)
+                    status = rnd.choice((0, 0, 1, 2))
+                    paid = {0: 0, 1: round(payable / 2, 2), 2: payable}[status]
+                    wb_rows.append((wb_id, d, PRODUCTS[k], net, rnd.choice(("已上传", "待上传"))))
+                    bal_rows.append((wb_id, d, net, payable, paid, round(payable - paid, 2), status))
+            if wb_rows:
+                _insert_many(cur, "pd_weighbills",
+                             ("id", "delivery_id", "product_name", "net_weight", "upload_status"), wb_rows)
+                _insert_many(cur, "pd_balance_details",
+                             ("weighbill_id", "delivery_id", "purchase_unit_price", "payable_amount",
+                              "paid_amount", "balance_amount", "payment_status"), bal_rows)
+                conn.commit()
+        print(f"seeded pd_weighbills/pd_balance_details={min(wb_id, n_weighbills)} in "
+              f"{time.perf_counter() - start:.1f}s")
+        cur.execute("ANALYZE TABLE pd_deliveries, pd_weighbills, pd_balance_details")
+        cur.fetchall()
+
+
+def _timed(fn: Callable[[], None], iterations: int) -> List[float]:
+    out = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def _report(name: str, samples: List[float]) -> None:
+    ordered = sorted(samples)
+    p50 = ordered[len(ordered) // 2]
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name:<28} p50={p50:8.2f}ms  p95={p95:8.2f}ms  mean={statistics.mean(samples):8.2f}ms")
+
+
+def main() -> None:
+    args = _parse_args()
+    os.environ["MYSQL_DATABASE"] = args.database
+
+    from database_setup import create_tables
+    from core.database import get_conn_tuple
+    from app.services.balance_service import delivery_balance_summary_sql
+    from app.services.weighbill_service import delivery_weighbill_summary_sql
+
+    rnd = random.Random(args.seed)
+    if not args.skip_seed:
+        create_tables()
+        with get_conn_tuple() as conn:
+            seed(conn, args.weighbills, args.per_delivery, args.chunk, rnd)
+
+    with get_conn_tuple() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM pd_deliveries ORDER BY created_at DESC")
+            all_ids = [r[0] for r in cur.fetchall()]
+        if len(all_ids) < args.page_size:
+            raise SystemExit("压测库报单不足一页，请先写入数据")
+
+        pages: List[Tuple[int, ...]] = []
+        for _ in range(args.iterations):
+            start = rnd.randrange(0, len(all_ids) - args.page_size + 1)
+            pages.append(tuple(all_ids[start:start + args.page_size]))
+
+        def run(sql_for: Callable[[Tuple[int, ...]], Tuple[str, tuple]]) -> Callable[[], None]:
+            page_iter = iter(pages * 2)
+
+            def once() -> None:
+                sql, params = sql_for(next(page_iter))
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    cur.fetchall()
+            return once
+
+        def ph(ids: Tuple[int, ...]) -> str:
+            return ",".join(["%s"] * len(ids))
+
+        cases = [
+            ("balance summary (old)", lambda ids: (OLD_BALANCE_SUMMARY_SQL.format(ids=ph(ids)), ids)),
+            ("balance summary (new)", lambda ids: (delivery_balance_summary_sql(len(ids)), ids + ids)),
+            ("weighbill summary (old)", lambda ids: (OLD_WEIGHBILL_SUMMARY_SQL.format(ids=ph(ids)), ids)),
+            ("weighbill summary (new)", lambda ids: (delivery_weighbill_summary_sql(len(ids)), ids + ids)),
+        ]
+        for name, sql_for in cases:
+            # 预热一轮，避免首个用例吃冷缓存
+            _timed(run(sql_for), min(10, args.iterations))
+            _report(name, _timed(run(sql_for), args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+大区经理每日分配需求基准：逐计划查询（旧） vs 两次分组查询（新） vs 按日缓存命中。
+
+旧实现对每个订货计划各开一个连接查询其报货计划下合同的生效起止、再开一个连接统计已发车数，
+1k 条订货计划即 2k 次连接与查询；新实现 `compute_manager_daily_allocation` 在同一连接上
+用 `GROUP BY delivery_plan_id` / `GROUP BY order_plan_id` 两次查询取全部计划的数据，结果按日期缓存。
+
+用法（须指向独立的压测库，脚本会清空并写入报货计划/订货计划/合同/报单）::
+
+    MYSQL_HOST=... MYSQL_PORT=3306 MYSQL_USER=... MYSQL_PASSWORD=... \\
+    python benchmarks/bench_manager_daily_allocation.py --database pd_bench --order-plans 1000
+
+已有数据时加 `--skip-seed` 只跑计算。输出各用例 p50 / p95 / 平均耗时（毫秒）。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench_grouped_list_queries import _insert_many, _report, _timed  # noqa: E402
+
+OLD_WINDOW_SQL = """
+    SELECT contract_date, end_date
+    FROM pd_contracts
+    WHERE delivery_plan_id = %s AND status = '生效中'
+"""
+
+OLD_DELIVERED_SQL = """
+    SELECT COUNT(*) AS n
+    FROM pd_deliveries
+    WHERE order_plan_id = %s
+      AND status IN ('已发货', '已装车', '在途', '已签收')
+"""
+
+MANAGERS = [f"经理{i}" for i in range(1, 13)]
+STATUSES = ["已发货", "已装车", "在途", "已签收", "待审核"]
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", required=True, help="压测库名（会覆盖 MYSQL_DATABASE）")
+    parser.add_argument("--order-plans", type=int, default=1000, help="订货计划条数")
+    parser.add_argument("--per-delivery-plan", type=int, default=4, help="每个报货计划下的订货计划数")
+    parser.add_argument("--deliveries", type=int, default=20, help="每个订货计划的报单数上限")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=20260101)
+    parser.add_argument("--skip-seed", action="store_true")
+    return parser.parse_args()
+
+
+def seed(conn, args: argparse.Namespace, rnd: random.Random) -> None:
+    today = date.today()
+    n_plans = (args.order_plans + args.per_delivery_plan - 1) // args.per_delivery_plan
+    with conn.cursor() as cur:
+        for table in ("pd_balance_details", "pd_weighbills", "pd_deliveries", "pd_contract_products",
+                      "pd_contracts", "pd_order_plans", "pd_delivery_plan_products", "pd_delivery_plans"):
+            cur.execute(f"DELETE FROM {table}")
+        conn.commit()
+
+        start = time.perf_counter()
+        _insert_many(cur, "pd_delivery_plans", ("id", "plan_no", "plan_start_date", "plan_status"), [
+            (p, f"DP-{p:05d}", today + timedelta(days=rnd.randint(-5, 5)), "生效中") for p in range(1, n_plans + 1)
+        ])
+        contracts = []
+        for p in range(1, n_plans + 1):
+            for _ in range(rnd.randint(1, 3)):
+                signed = today + timedelta(days=rnd.randint(-20, 3))
+                end = signed + timedelta(days=rnd.randint(5, 40)) if rnd.random() < 0.8 else None
+                contracts.append((f"HT-{len(contracts) + 1:06d}", signed, end, "生效中", p))
+        _insert_many(cur, "pd_contracts", ("contract_no", "contract_date", "end_date", "status", "delivery_plan_id"),
+                     contracts)
+        _insert_many(cur, "pd_order_plans",
+                     ("id", "delivery_plan_id", "plan_no", "truck_count", "audit_status", "created_by_name"), [
+                         (o, (o - 1) // args.per_delivery_plan + 1, f"DP-{(o - 1) // args.per_delivery_plan + 1:05d}",
+                          rnd.randint(5, 60), rnd.choice(("待审核", "审核通过")), rnd.choice(MANAGERS))
+                         for o in range(1, args.order_plans + 1)
+                     ])
+        deliveries = [
+            (o, rnd.choice(STATUSES), f"粤B{rnd.randint(10000, 99999)}")
+            for o in range(1, args.order_plans + 1)
+            for _ in range(rnd.randint(0, args.deliveries))
+        ]
+        for base in range(0, len(deliveries), 5000):
+            _insert_many(cur, "pd_deliveries", ("order_plan_id", "status", "vehicle_no"), deliveries[base:base + 5000])
+        conn.commit()
+        cur.execute("ANALYZE TABLE pd_delivery_plans, pd_order_plans, pd_contracts, pd_deliveries")
+        cur.fetchall()
+    print(f"seeded delivery_plans={n_plans} order_plans={args.order_plans} contracts={len(contracts)} "
+          f"deliveries={len(deliveries)} in {time.perf_counter() - start:.1f}s")
+
+
+def _old_lookups(order_plan_rows) -> None:
+    """旧写法：每个订货计划一次生效期查询 + 一次已发车数查询，各自新建连接。"""
+    from app.services.contract_service import get_conn
+
+    for op_id, delivery_plan_id in order_plan_rows:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(OLD_WINDOW_SQL, (delivery_plan_id,))
+                cur.fetchall()
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(OLD_DELIVERED_SQL, (op_id,))
+                cur.fetchone()
+
+
+def main() -> None:
+    args = _parse_args()
+    os.environ["MYSQL_DATABASE"] = args.database
+
+    from database_setup import create_tables
+    from core.database import get_conn_tuple
+    from app.core.schema_migrations import run_migrations
+    from app.services.allocation_cache import invalidate_manager_allocation
+    from app.services.allocation_service import compute_manager_daily_allocation
+
+    rnd = random.Random(args.seed)
+    if not args.skip_seed:
+        create_tables()
+        run_migrations()
+        with get_conn_tuple() as conn:
+            seed(conn, args, rnd)
+
+    with get_conn_tuple() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT op.id, op.delivery_plan_id
+                FROM pd_order_plans op
+                INNER JOIN pd_delivery_plans dp ON dp.id = op.delivery_plan_id
+                WHERE op.audit_status IN ('待审核', '审核通过')
+                ORDER BY op.id
+            """)
+            order_plan_rows = cur.fetchall()
+    if not order_plan_rows:
+        raise SystemExit("压测库没有订货计划，请先写入数据")
+
+    def uncached() -> None:
+        compute_manager_daily_allocation(use_cache=False)
+
+    def cached() -> None:
+        compute_manager_daily_allocation()
+
+    invalidate_manager_allocation()
+    cases = [
+        (f"per-plan lookups x{len(order_plan_rows)} (old)", lambda: _old_lookups(order_plan_rows)),
+        ("grouped queries (new)", uncached),
+        ("cached (new)", cached),
+    ]
+    for name, fn in cases:
+        _timed(fn, 1)
+        _report(name, _timed(fn, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
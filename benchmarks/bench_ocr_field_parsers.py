@@ -0,0 +1,72 @@
+"""
+OCR 文本解析微基准：磅单 / 合同 / 支付回单 / 报单文本清洗四个解析器，各自在黄金样本（tests/golden/ocr）上的耗时，
+以及预编译字段表（一次关键词扫描 + 锚点不在则跳过）对比逐条内联 `re.search` 的字段抽取耗时。
+
+不连数据库、不跑 OCR，只测文本 → 字段这一段。--pad 在每份样本后追加若干行无关文本（印章、提示语等），
+模拟真实 OCR 输出里大量与字段无关的行。
+
+用法::
+
+    python benchmarks/bench_ocr_field_parsers.py --rounds 200 --pad 40
+"""
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench_grouped_list_queries import _report, _timed  # noqa: E402
+
+from tests.test_ocr_field_extraction import GOLDEN_DIR, PARSERS  # noqa: E402
+from app.services.balance_service import _RECEIPT_FIELDS  # noqa: E402
+from app.services.contract_service import _CONTRACT_FIELDS  # noqa: E402
+from app.services.weighbill_service import _WEIGHBILL_FIELDS  # noqa: E402
+
+PADDING = ["本回单仅供参考", "客户服务热线 95599", "打印次数：1", "盖章有效", "第1页 共1页", "经办人", "复核"]
+EXTRACTORS = {"weighbill": _WEIGHBILL_FIELDS, "contract": _CONTRACT_FIELDS, "receipt": _RECEIPT_FIELDS}
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200, help="每项重复次数（每次跑完整份样本）")
+    parser.add_argument("--pad", type=int, default=40, help="每份样本追加的无关文本行数")
+    return parser.parse_args()
+
+
+def _inline_search(extractor, text: str) -> None:
+    """旧写法：每个字段逐条 re.search 整段文本。"""
+    for compiled in extractor.fields.values():
+        for _, pattern in compiled:
+            if re.search(pattern.pattern, text):
+                break
+
+
+def _engine_search(extractor, text: str) -> None:
+    found = extractor.search(text)
+    for name in extractor.fields:
+        found.match(name)
+
+
+def main() -> None:
+    args = _parse_args()
+    cases = [json.loads(p.read_text(encoding="utf-8")) for p in sorted(GOLDEN_DIR.glob("*.json"))]
+    for case in cases:
+        if case["parser"] != "delivery":
+            case["input"] = case["input"] + [PADDING[i % len(PADDING)] for i in range(args.pad)]
+
+    for parser in PARSERS:
+        inputs = [c["input"] for c in cases if c["parser"] == parser]
+        _report(f"{parser} x{len(inputs)}", _timed(lambda: [PARSERS[parser](i) for i in inputs], args.rounds))
+
+    for parser, extractor in EXTRACTORS.items():
+        texts = ["\n".join(c["input"]) for c in cases if c["parser"] == parser]
+        inline = _timed(lambda: [_inline_search(extractor, t) for t in texts], args.rounds)
+        engine = _timed(lambda: [_engine_search(extractor, t) for t in texts], args.rounds)
+        _report(f"{parser} fields inline", inline)
+        _report(f"{parser} fields engine", engine)
+
+
+if __name__ == "__main__":
+    main()
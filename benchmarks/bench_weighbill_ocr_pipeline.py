@@ -0,0 +1,96 @@
+"""
+磅单批量识别吞吐基准：逐张「预处理 → OCR」（旧） vs 进程池预处理 + 引擎池并行 OCR（新）。
+
+图片为合成的磅单样式照片（白底黑字：日期、车号、毛重/皮重/净重等，叠加噪声并随机缩放），
+不连数据库，只测 `weighbill_ocr_pipeline.run_ocr_pipeline` 的识别阶段。需安装 rapidocr_onnxruntime。
+
+用法::
+
+    python benchmarks/bench_weighbill_ocr_pipeline.py --images 30 --workers 1 2 4
+
+输出每种并发度的总耗时与 张/秒；并发度 1 即旧的逐张处理路径。
+"""
+import argparse
+import io
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+PLATE_LETTERS = "ABCDEFGHJKLMNPQRSTUVWXYZ"
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=30, help="每批图片张数")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="待比较的并发度")
+    parser.add_argument("--rounds", type=int, default=2, help="每种并发度重复批次数（取最好一次）")
+    parser.add_argument("--seed", type=int, default=20260101)
+    return parser.parse_args()
+
+
+def synth_weighbill(rnd: random.Random) -> bytes:
+    width, height = rnd.choice([(1600, 1200), (1200, 900), (760, 560)])
+    img = Image.new("RGB", (width, height), (245, 245, 240))
+    draw = ImageDraw.Draw(img)
+    gross = rnd.uniform(40, 60)
+    tare = rnd.uniform(14, 20)
+    lines = [
+        f"Date: 2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+        f"Vehicle: GD{rnd.choice(PLATE_LETTERS)}{rnd.randint(10000, 99999)}",
+        f"Ticket: {rnd.randint(10_000_000, 99_999_999)}",
+        f"Gross: {gross:.2f} t",
+        f"Tare: {tare:.2f} t",
+        f"Net: {gross - tare:.2f} t",
+    ]
+    step = height // (len(lines) + 2)
+    for i, text in enumerate(lines, start=1):
+        draw.text((width // 10, i * step), text, fill=(20, 20, 20))
+    for _ in range(width * height // 400):
+        draw.point((rnd.randrange(width), rnd.randrange(height)), fill=(rnd.randint(150, 230),) * 3)
+    img = img.filter(ImageFilter.GaussianBlur(radius=0.6))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def main() -> None:
+    args = _parse_args()
+    from app.services.weighbill_ocr_pipeline import OcrEnginePool, run_ocr_pipeline, shutdown_pipeline_pools
+    from app.services.weighbill_service import RAPIDOCR_AVAILABLE, RapidOCR, WeighbillService
+
+    if not RAPIDOCR_AVAILABLE:
+        raise SystemExit("未安装 rapidocr_onnxruntime")
+
+    rnd = random.Random(args.seed)
+    images: List[bytes] = [synth_weighbill(rnd) for _ in range(args.images)]
+    service = WeighbillService()
+
+    def recognize(image: bytes, engine):
+        return service.recognize_weighbill(image, ocr_engine=engine)
+
+    try:
+        baseline = None
+        for workers in args.workers:
+            pool = OcrEnginePool(RapidOCR, workers, preloaded=[service.ocr])
+            pool.warm_up(workers)
+            best = float("inf")
+            for _ in range(max(args.rounds, 1)):
+                t0 = time.perf_counter()
+                results = run_ocr_pipeline(images, recognize, pool, workers)
+                best = min(best, time.perf_counter() - t0)
+            failed = sum(1 for r in results if not r.get("success"))
+            baseline = baseline or best
+            print(f"workers={workers:<3} {best:8.2f}s  {len(images) / best:6.2f} 张/秒  "
+                  f"x{baseline / best:4.2f}  failed={failed}")
+    finally:
+        shutdown_pipeline_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -43,3 +43,25 @@ def get_conn_tuple():
         yield connection
     finally:
         connection.close()
+
+
+@contextmanager
+def advisory_lock(connection, name: str, timeout: int):
+    """
+    MySQL 咨询锁（GET_LOCK），多个 worker 之间互斥执行同一段启动逻辑。
+    拿到锁时 yield True，等待超时 yield False；退出时释放（连接断开时 MySQL 也会自动释放）。
+    """
+    with connection.cursor() as cur:
+        cur.execute("SELECT GET_LOCK(%s, %s) AS acquired", (name, timeout))
+        row = cur.fetchone()
+    value = (row.get("acquired") if isinstance(row, dict) else row[0]) if row else None
+    acquired = value == 1
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                with connection.cursor() as cur:
+                    cur.execute("SELECT RELEASE_LOCK(%s)", (name,))
+            except Exception:
+                pass
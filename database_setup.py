@@ -1,8 +1,14 @@
+import hashlib
 import os
+import time
+from pathlib import Path
+from typing import Optional
 
 import pymysql
 from dotenv import load_dotenv
 
+from core.database import advisory_lock
+
 
 def get_mysql_config() -> dict:
 	load_dotenv()
@@ -162,6 +168,9 @@ TABLE_STATEMENTS = [
 		products VARCHAR(255) COMMENT '品种列表，逗号分隔，最多4个',
 		quantity DECIMAL(12, 3) COMMENT '数量（吨）',
 		vehicle_no VARCHAR(32) COMMENT '车牌号',
+		vehicle_no_norm VARCHAR(32) GENERATED ALWAYS AS (
+			UPPER(REPLACE(REPLACE(REPLACE(REPLACE(vehicle_no, ' ', ''), '　', ''), '·', ''), '.', ''))
+		) VIRTUAL COMMENT '规范化车牌（去空格/全角空格/分隔点并大写，磅单匹配报单用）',
 		driver_name VARCHAR(64) COMMENT '司机姓名',
 		driver_phone VARCHAR(32) COMMENT '司机电话',
 		driver_id_card VARCHAR(18) COMMENT '司机身份证号',
@@ -202,7 +211,10 @@ TABLE_STATEMENTS = [
 		INDEX idx_shipper (shipper),
 		INDEX idx_has_delivery_order (has_delivery_order),
 		INDEX idx_upload_status (upload_status),
-		INDEX idx_driver_phone_created_at (driver_phone, created_at)
+		INDEX idx_driver_phone_created_at (driver_phone, created_at),
+		INDEX idx_driver_id_card_created_at (driver_id_card, created_at),
+		INDEX idx_created_at (created_at),
+		INDEX idx_plate_norm_report_date (vehicle_no_norm, report_date)
 	) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='销售台账/报货订单';
 	""",
 	"""
@@ -500,7 +512,8 @@ TABLE_STATEMENTS = [
 		INDEX idx_payee_name (payee_name),
 		INDEX idx_schedule_date (schedule_date),
 		INDEX idx_schedule_status (schedule_status),
-		INDEX idx_payout_status (payout_status)
+		INDEX idx_payout_status (payout_status),
+		INDEX idx_delivery_id (delivery_id)
 	) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='磅单结余明细表';
 	""",
 	"""
@@ -1148,6 +1161,117 @@ def ensure_pd_allocation_predictions_regional_manager_column():
 		connection.close()
 
 
+def ensure_pd_balance_details_delivery_id_index():
+	"""旧库补全 pd_balance_details.delivery_id 索引（结余按报单分组汇总依赖）"""
+	config = get_mysql_config()
+	connection = pymysql.connect(**config)
+	try:
+		with connection.cursor() as cursor:
+			cursor.execute("SHOW TABLES LIKE 'pd_balance_details'")
+			if cursor.fetchone() is None:
+				return
+			cursor.execute("SHOW INDEX FROM pd_balance_details WHERE Key_name = 'idx_delivery_id'")
+			if cursor.fetchone() is None:
+				cursor.execute("ALTER TABLE pd_balance_details ADD INDEX idx_delivery_id (delivery_id)")
+				print("pd_balance_details 已添加 idx_delivery_id 索引")
+		connection.commit()
+	finally:
+		connection.close()
+
+
+def ensure_pd_deliveries_created_at_index():
+	"""旧库补全 pd_deliveries.created_at 索引（报单/磅单列表按 (created_at, id) 游标分页依赖）"""
+	config = get_mysql_config()
+	connection = pymysql.connect(**config)
+	try:
+		with connection.cursor() as cursor:
+			cursor.execute("SHOW TABLES LIKE 'pd_deliveries'")
+			if cursor.fetchone() is None:
+				return
+			cursor.execute("SHOW INDEX FROM pd_deliveries WHERE Key_name = 'idx_created_at'")
+			if cursor.fetchone() is None:
+				cursor.execute("ALTER TABLE pd_deliveries ADD INDEX idx_created_at (created_at)")
+				print("pd_deliveries 已添加 idx_created_at 索引")
+		connection.commit()
+	finally:
+		connection.close()
+
+
+# 与 pd_deliveries 建表语句中 vehicle_no_norm 的定义一致；
+# 规则与 WeighbillService._normalize_vehicle_no_for_match 相同（去空格、全角空格、分隔点并大写）
+PD_DELIVERIES_PLATE_NORM_EXPR = (
+	"UPPER(REPLACE(REPLACE(REPLACE(REPLACE(vehicle_no, ' ', ''), '　', ''), '·', ''), '.', ''))"
+)
+
+
+def ensure_pd_deliveries_plate_norm_index():
+	"""
+	旧库补全 pd_deliveries.vehicle_no_norm 虚拟生成列及 (vehicle_no_norm, report_date) 联合索引。
+	磅单匹配报单按「规范化车牌 + 日期±1 天」范围查询，由 MySQL 维护该列，报单各写入路径无需改动。
+	"""
+	config = get_mysql_config()
+	connection = pymysql.connect(**config)
+	try:
+		with connection.cursor() as cursor:
+			cursor.execute("SHOW TABLES LIKE 'pd_deliveries'")
+			if cursor.fetchone() is None:
+				return
+			cursor.execute("SHOW COLUMNS FROM pd_deliveries LIKE 'vehicle_no_norm'")
+			if cursor.fetchone() is None:
+				cursor.execute(
+					"ALTER TABLE pd_deliveries ADD COLUMN vehicle_no_norm VARCHAR(32) "
+					f"GENERATED ALWAYS AS ({PD_DELIVERIES_PLATE_NORM_EXPR}) VIRTUAL "
+					"COMMENT '规范化车牌（去空格/全角空格/分隔点并大写，磅单匹配报单用）' AFTER vehicle_no"
+				)
+				print("pd_deliveries 已添加 vehicle_no_norm 生成列")
+			cursor.execute("SHOW INDEX FROM pd_deliveries WHERE Key_name = 'idx_plate_norm_report_date'")
+			if cursor.fetchone() is None:
+				cursor.execute(
+					"ALTER TABLE pd_deliveries ADD INDEX idx_plate_norm_report_date (vehicle_no_norm, report_date)"
+				)
+				print("pd_deliveries 已添加 idx_plate_norm_report_date 索引")
+		connection.commit()
+	finally:
+		connection.close()
+
+
+def ensure_fulltext_search_indexes() -> bool:
+	"""
+	列表模糊搜索的 ngram 全文索引（列清单见 app.utils.fulltext_search.FULLTEXT_INDEXES）。
+	建索引时关闭停用词：ngram 解析器会丢弃含停用词（如单字母 a、i）的词元，导致车牌等英文片段漏检。
+	服务器不支持 ngram（如 MariaDB）时跳过，列表查询自动退回 LIKE。
+	返回是否全部索引都已存在或建成（有失败时不写建表指纹，下次启动重试）。
+	"""
+	from app.utils.fulltext_search import FULLTEXT_INDEXES
+
+	complete = True
+	config = get_mysql_config()
+	connection = pymysql.connect(**config)
+	try:
+		with connection.cursor() as cursor:
+			for table, (index_name, columns) in FULLTEXT_INDEXES.items():
+				cursor.execute("SHOW TABLES LIKE %s", (table,))
+				if cursor.fetchone() is None:
+					continue
+				cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", (index_name,))
+				if cursor.fetchone() is not None:
+					continue
+				try:
+					cursor.execute("SET SESSION innodb_ft_enable_stopword = OFF")
+					cursor.execute(
+						f"ALTER TABLE {table} ADD FULLTEXT INDEX {index_name} "
+						f"({', '.join(columns)}) WITH PARSER ngram"
+					)
+					print(f"{table} 已添加 {index_name} 全文索引")
+				except Exception as e:
+					complete = False
+					print(f"{table} 添加 {index_name} 全文索引失败（模糊搜索将使用 LIKE）: {e}")
+		connection.commit()
+	finally:
+		connection.close()
+	return complete
+
+
 def ensure_tl_quote_details_price_field_sources_column():
 	"""旧库升级：为 TL quote_details 增加 price_field_sources（新建库已由 CREATE TABLE 包含）。"""
 	config = get_mysql_config()
@@ -1275,7 +1399,9 @@ def ensure_pd_ip_delivery_records_smelter_column():
 		connection.close()
 
 
-def create_tables() -> None:
+def create_tables() -> bool:
+	"""建表并执行全部 ensure_* 补齐；返回是否每一步都成功（可容忍失败的步骤只打印，但会使返回值为 False）。"""
+	complete = True
 	# 第1步：先创建数据库（如果不存在）
 	create_database_if_not_exists()
 
@@ -1294,23 +1420,146 @@ def create_tables() -> None:
 		try:
 			ensure_pd_users_role_check()
 		except Exception as exc:
+			complete = False
 			print(f"检查/对齐 pd_users.role CHECK 失败: {exc}")
 		ensure_pd_delivery_plans_tonnage_column()
 		ensure_pd_warehouses_regional_manager_column()
 		ensure_pd_allocation_predictions_regional_manager_column()
 		ensure_pd_ip_delivery_records_smelter_column()
 		ensure_pd_ip_prediction_results_smelter_column()
+		ensure_pd_balance_details_delivery_id_index()
+		ensure_pd_deliveries_created_at_index()
+		try:
+			ensure_pd_deliveries_plate_norm_index()
+		except Exception as exc:
+			complete = False
+			print(f"检查/添加 pd_deliveries.vehicle_no_norm 失败: {exc}")
+		if not ensure_fulltext_search_indexes():
+			complete = False
 		migrate_delivery_status_to_audit()
 		try:
 			ensure_tl_quote_details_price_field_sources_column()
 		except Exception as exc:
+			complete = False
 			print(f"检查/添加 quote_details.price_field_sources 失败: {exc}")
 		try:
 			init_tl_default_dict_rows()
 		except Exception as exc:
+			complete = False
 			print(f"TL 默认字典数据初始化失败: {exc}")
 	finally:
 		connection.close()
+	return complete
+
+
+SCHEMA_META_TABLE = "pd_schema_meta"
+SCHEMA_FINGERPRINT_KEY = "schema_fingerprint"
+SCHEMA_SETUP_LOCK = "pd_schema_setup"
+
+
+def expected_schema_fingerprint() -> str:
+	"""
+	本文件（建表语句与全部 ensure_* 补齐逻辑）及其引用的外部定义（全文索引列清单）的内容哈希：
+	任一处有修改，下次启动都会完整执行一次建表。
+	"""
+	from app.utils.fulltext_search import FULLTEXT_INDEXES
+
+	try:
+		source = Path(__file__).read_bytes()
+	except OSError:
+		source = "\n".join(TABLE_STATEMENTS).encode("utf-8")
+	digest = hashlib.sha256(source)
+	digest.update(repr(sorted(FULLTEXT_INDEXES.items())).encode("utf-8"))
+	return digest.hexdigest()
+
+
+def read_schema_fingerprint(connection) -> Optional[str]:
+	"""库中记录的指纹；表不存在（新库或旧版本）时返回 None。"""
+	try:
+		with connection.cursor() as cursor:
+			cursor.execute(
+				f"SELECT value FROM {SCHEMA_META_TABLE} WHERE name = %s",
+				(SCHEMA_FINGERPRINT_KEY,)
+			)
+			row = cursor.fetchone()
+	except pymysql.MySQLError:
+		return None
+	return row[0] if row else None
+
+
+def write_schema_fingerprint(connection, fingerprint: str) -> None:
+	with connection.cursor() as cursor:
+		cursor.execute(f"""
+			CREATE TABLE IF NOT EXISTS {SCHEMA_META_TABLE} (
+				name VARCHAR(64) NOT NULL PRIMARY KEY COMMENT '键',
+				value VARCHAR(128) NOT NULL COMMENT '值',
+				updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+			) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='库结构元数据（建表指纹等）'
+		""")
+		cursor.execute(
+			f"""
+			INSERT INTO {SCHEMA_META_TABLE} (name, value) VALUES (%s, %s)
+			ON DUPLICATE KEY UPDATE value = VALUES(value)
+			""",
+			(SCHEMA_FINGERPRINT_KEY, fingerprint)
+		)
+	connection.commit()
+
+
+def ensure_schema(force: bool = False, lock_timeout: int = 300) -> dict:
+	"""
+	启动用的建表入口（create_tables 的快速路径）：
+	- 库中指纹与 expected_schema_fingerprint() 一致时跳过全部 DDL 与权限初始化，只花一次连接和一次查询；
+	- 否则持 MySQL 咨询锁执行 create_tables()：多个 worker 同时启动时只有一个执行，其余等锁后复查指纹即跳过；
+	- 每一步都成功后才写入指纹；有步骤失败时不写，下次启动重试。force=True（/init-db）时不看指纹，总是完整执行。
+	返回 {"skipped", "complete", "fingerprint", "phases": {阶段: 毫秒}, "total_ms"}，由调用方写日志。
+	"""
+	started = time.perf_counter()
+	phases = {}
+	expected = expected_schema_fingerprint()
+
+	def report(skipped: bool, complete: bool = True) -> dict:
+		return {
+			"skipped": skipped,
+			"complete": complete,
+			"fingerprint": expected[:12],
+			"phases": phases,
+			"total_ms": round((time.perf_counter() - started) * 1000, 1),
+		}
+
+	t0 = time.perf_counter()
+	try:
+		connection = pymysql.connect(**get_mysql_config())
+	except pymysql.err.OperationalError:
+		# 库不存在（1049）时先建库
+		create_database_if_not_exists()
+		connection = pymysql.connect(**get_mysql_config())
+	phases["connect"] = round((time.perf_counter() - t0) * 1000, 1)
+	try:
+		t0 = time.perf_counter()
+		up_to_date = not force and read_schema_fingerprint(connection) == expected
+		phases["fingerprint_check"] = round((time.perf_counter() - t0) * 1000, 1)
+		if up_to_date:
+			return report(True)
+
+		t0 = time.perf_counter()
+		with advisory_lock(connection, SCHEMA_SETUP_LOCK, lock_timeout) as acquired:
+			phases["lock_wait"] = round((time.perf_counter() - t0) * 1000, 1)
+			if not acquired:
+				raise RuntimeError(f"等待建表锁 {SCHEMA_SETUP_LOCK} 超时（{lock_timeout}s）")
+			if not force and read_schema_fingerprint(connection) == expected:
+				# 其他 worker 持锁期间已完成
+				return report(True)
+			t0 = time.perf_counter()
+			complete = create_tables()
+			phases["create_tables"] = round((time.perf_counter() - t0) * 1000, 1)
+			if complete:
+				write_schema_fingerprint(connection, expected)
+			else:
+				print("部分建表/补齐步骤失败，不记录建表指纹，下次启动重试")
+	finally:
+		connection.close()
+	return report(False, complete)
 
 
 if __name__ == "__main__":
@@ -32,12 +32,22 @@ import uvicorn
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from database_setup import create_tables
+from database_setup import ensure_schema
 from app.api.v1.api import api_router, public_api_router
 from app.core.config import settings
+from app.core.scheduled_jobs import get_job_runner
+from app.core.schema_migrations import run_migrations
+from app.core.startup import StartupOrchestrator
 from app.api.v1.user.routes import register_pd_auth_routes
 from core.auth import get_user_identity_from_authorization
+from app.services.balance_party_summary import rebuild_balance_summaries
+from app.services.contract_capacity import rebuild_contract_capacity
+from app.services.contract_progress import rebuild_contract_progress
+from app.services.coze_agent_service import close_coze_session
+from app.services.driver_duplicate_window import seed_duplicate_window
 from app.services.contract_service import expire_contracts_after_grace
+from app.services.weighbill_ocr_pipeline import shutdown_pipeline_pools
+from app.utils.upload_spool import UploadSizeLimitMiddleware
 from app.api.v1.routes.allocation import run_test_prediction
 from app.intelligent_prediction.services.scheduled_prediction import (
     run_scheduled_intelligent_prediction_sync,
@@ -51,55 +61,138 @@ async def lifespan(app: FastAPI):
         logger.warning(
             "JWT_SECRET 未配置或为默认值，生产环境请务必设置强随机密钥并妥善保管"
         )
-    print("正在检查数据库初始化...")
-    try:
-        create_tables()
-        print("数据库初始化完成")
-    except Exception as e:
-        print(f"数据库初始化失败: {e}")
-        logger.exception("database init failed")
-
-    expired_count = expire_contracts_after_grace()
-    logger.info("contract expire sync finished updated=%s", expired_count)
 
-    # 首次启动执行测试预测
-    try:
-        run_test_prediction(num_contracts=5, H=10)
-        logger.info("test prediction completed on startup")
-    except Exception as e:
-        logger.error("test prediction failed: %s", e)
+    def setup_schema() -> None:
+        print("正在检查数据库初始化...")
+        try:
+            schema_report = ensure_schema()
+        except Exception as e:
+            print(f"数据库初始化失败: {e}")
+            raise
+        print("数据库结构已是最新，跳过建表" if schema_report["skipped"] else "数据库初始化完成")
+        logger.info(
+            "schema setup skipped=%s complete=%s fingerprint=%s phases=%s total_ms=%s",
+            schema_report["skipped"],
+            schema_report["complete"],
+            schema_report["fingerprint"],
+            schema_report["phases"],
+            schema_report["total_ms"],
+        )
 
+    def sync_expired_contracts() -> None:
+        # 启动时全量核对一次（覆盖直接改库等回看窗口以外的情况），定时任务按水位线增量扫描
+        expired_count = expire_contracts_after_grace(full=True)
+        logger.info("contract expire sync finished updated=%s", expired_count)
+
+    def warm_up_ocr() -> None:
+        from app.services.weighbill_service import get_weighbill_service
+
+        get_weighbill_service()
+
+    async def connect_prediction_redis() -> None:
+        try:
+            from app.intelligent_prediction.services.cache_manager import get_cache_manager
+
+            await get_cache_manager().redis.connect()
+        except Exception as e:
+            logger.warning("intelligent_prediction Redis 连接跳过（不影响主服务）：%s", e)
+
+    # 就绪前必须完成：建表与迁移；其余在开始接请求后后台执行，一次性任务只在 leader worker 上执行
+    orchestrator = StartupOrchestrator()
+    app.state.startup = orchestrator
+    orchestrator.critical("schema_setup", setup_schema)
+    orchestrator.critical("schema_migrations", run_migrations)
+    orchestrator.deferred("expire_contracts", sync_expired_contracts, leader_only=True)
+    if settings.startup_test_prediction_enabled:
+        orchestrator.deferred(
+            "test_prediction", lambda: run_test_prediction(num_contracts=5, H=10), leader_only=True
+        )
+    orchestrator.deferred("prediction_redis", connect_prediction_redis)
+    if settings.driver_duplicate_window_backend in ("redis", "memory"):
+        # 进程内窗口每个 worker 各自载入；Redis 窗口多 worker 共享，由 leader 载入
+        orchestrator.deferred(
+            "duplicate_window",
+            seed_duplicate_window,
+            leader_only=settings.driver_duplicate_window_backend == "redis",
+        )
+    if settings.startup_ocr_warmup_enabled:
+        orchestrator.deferred("ocr_warmup", warm_up_ocr)
+    await orchestrator.run_critical()
+
+    # 每个 worker 都有调度器，到点后由 JobRunner 在 MySQL 中认领，每次触发只执行一次
+    runner = get_job_runner()
+    runner.register(
+        "expire_contracts", expire_contracts_after_grace, kwargs={"grace_days": 4}, description="合同过期同步"
+    )
+    runner.register(
+        "rebuild_contract_capacity", rebuild_contract_capacity, description="合同车数台账核对"
+    )
+    runner.register(
+        "rebuild_contract_progress", rebuild_contract_progress, lease_seconds=1800, description="合同发运/回款进度台账核对"
+    )
+    runner.register(
+        "rebuild_balance_summaries", rebuild_balance_summaries, lease_seconds=1800, description="结余收款人/报单人汇总核对"
+    )
+    runner.register(
+        "daily_prediction",
+        run_test_prediction,
+        kwargs={"num_contracts": 5, "H": 10},
+        lease_seconds=1800,
+        description="每日测试预测",
+    )
     scheduler = BackgroundScheduler(timezone="Asia/Shanghai")
     scheduler.add_job(
-        func=expire_contracts_after_grace,
+        func=runner.run_scheduled,
         trigger=CronTrigger(hour=0, minute=10),
-        kwargs={"grace_days": 4},
+        args=["expire_contracts"],
         id="expire_contracts",
         replace_existing=True,
     )
+    scheduler.add_job(
+        func=runner.run_scheduled,
+        trigger=CronTrigger(hour=0, minute=20),
+        args=["rebuild_contract_capacity"],
+        id="rebuild_contract_capacity",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        func=runner.run_scheduled,
+        trigger=CronTrigger(hour=0, minute=30),
+        args=["rebuild_contract_progress"],
+        id="rebuild_contract_progress",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        func=runner.run_scheduled,
+        trigger=CronTrigger(hour=0, minute=40),
+        args=["rebuild_balance_summaries"],
+        id="rebuild_balance_summaries",
+        replace_existing=True,
+    )
     # 正式分配预测（与 allocation 模块一致）：取消注释后启用
-    # scheduler.add_job(
-    #     func=run_daily_prediction,
-    #     trigger=CronTrigger(hour=1, minute=0),
-    #     kwargs={"H": 10},
-    #     id="daily_prediction",
-    #     replace_existing=True,
-    # )
+    # runner.register("daily_prediction", run_daily_prediction, kwargs={"H": 10}, lease_seconds=1800)
         # 添加每日测试预测任务（凌晨1点执行）
     scheduler.add_job(
-        func=run_test_prediction,
+        func=runner.run_scheduled,
         trigger=CronTrigger(hour=1, minute=0),
-        kwargs={"num_contracts": 5, "H": 10},
+        args=["daily_prediction"],
         id="daily_prediction",
         replace_existing=True,
     )
     if settings.intelligent_prediction_schedule_enabled:
+        runner.register(
+            "intelligent_prediction_schedule",
+            run_scheduled_intelligent_prediction_sync,
+            lease_seconds=1800,
+            description="智能预测定时任务",
+        )
         scheduler.add_job(
-            func=run_scheduled_intelligent_prediction_sync,
+            func=runner.run_scheduled,
             trigger=CronTrigger(
                 hour=settings.intelligent_prediction_schedule_cron_hour,
                 minute=settings.intelligent_prediction_schedule_cron_minute,
             ),
+            args=["intelligent_prediction_schedule"],
             id="intelligent_prediction_schedule",
             replace_existing=True,
         )
@@ -110,13 +203,10 @@ async def lifespan(app: FastAPI):
         )
     scheduler.start()
     logger.info("scheduler started")
-    try:
-        from app.intelligent_prediction.services.cache_manager import get_cache_manager
-
-        await get_cache_manager().redis.connect()
-    except Exception as e:
-        logger.warning("intelligent_prediction Redis 连接跳过（不影响主服务）：%s", e)
+    orchestrator.start_deferred()
     yield
+    await orchestrator.shutdown()
+    await close_coze_session()
     try:
         from app.intelligent_prediction.services.cache_manager import get_cache_manager
 
@@ -124,6 +214,7 @@ async def lifespan(app: FastAPI):
     except Exception:
         pass
     scheduler.shutdown(wait=False)
+    shutdown_pipeline_pools()
     print("应用关闭")
 
 
@@ -148,6 +239,8 @@ async def business_exception_handler(request: Request, exc: BusinessException) -
     )
 
 
+app.add_middleware(UploadSizeLimitMiddleware)
+
 cors_origins = [origin.strip() for origin in os.getenv("CORS_ALLOW_ORIGINS", "*").split(",") if origin.strip()]
 app.add_middleware(
     CORSMiddleware,
@@ -173,6 +266,9 @@ logger = get_logger("app")
 @app.middleware("http")
 async def request_logger(request: Request, call_next):
     start_time = time.perf_counter()
+    startup = getattr(request.app.state, "startup", None)
+    if startup is not None:
+        startup.mark_first_request()
     identity = get_user_identity_from_authorization(request.headers.get("Authorization"))
     user_token = set_log_user(identity)
     req_token = set_log_request_id(
@@ -215,14 +311,25 @@ def health_check() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/readyz")
+def readiness_check(request: Request) -> JSONResponse:
+    """就绪检查：关键启动任务（建表、迁移）全部成功后返回 200；后台预热进度见 warmup_finished / tasks，不影响就绪。"""
+    startup = getattr(request.app.state, "startup", None)
+    if startup is None:
+        return JSONResponse(status_code=503, content={"ready": False, "tasks": {}})
+    status = startup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
 @app.get("/init-db")
 def manual_init_db():
     """手动触发数据库初始化（默认关闭，需设置 ENABLE_MANUAL_DB_INIT=1）。"""
     if not settings.enable_manual_db_init:
         raise HTTPException(status_code=404, detail="Not Found")
     try:
-        create_tables()
-        return {"success": True, "message": "数据库初始化完成"}
+        schema_report = ensure_schema(force=True)
+        run_migrations()
+        return {"success": True, "message": "数据库初始化完成", "phases": schema_report["phases"]}
     except Exception as e:
         logger.exception("manual_init_db failed")
         raise HTTPException(
@@ -0,0 +1,163 @@
+"""回单分配：各策略金额守恒、单笔不超结余、至多一笔部分支付；能凑齐时整笔结清；整批写回两条语句；按收款人批量核销默认仍按时间先后。"""
+
+import random
+from decimal import Decimal
+
+import pytest
+
+from app.services.balance_allocation import (
+    ALLOCATION_POLICIES,
+    EXACT_FIRST,
+    MIN_PARTIALS,
+    OLDEST_FIRST,
+    OpenBalance,
+    allocate,
+    apply_allocation,
+    best_subset,
+)
+
+
+def _balances(rnd: random.Random, n: int):
+    out = []
+    for i in range(n):
+        payable = Decimal(rnd.randint(100, 2_000_000)) / 100
+        paid = Decimal(rnd.choice((0, 0, rnd.randint(0, int(payable * 100) - 1)))) / 100
+        out.append(OpenBalance(i + 1, payable, paid, payable - paid))
+    return out
+
+
+@pytest.mark.parametrize("policy", ALLOCATION_POLICIES)
+def test_allocation_invariants_hold_for_random_inputs(policy) -> None:
+    rnd = random.Random(f"alloc-{policy}")
+    for _ in range(120):
+        balances = _balances(rnd, rnd.randint(1, 40))
+        total = sum(b.balance for b in balances)
+        amount = Decimal(rnd.randint(1, int(total * 120))) / 100
+        result = allocate(balances, amount, policy)
+
+        by_id = {b.balance_id: b for b in balances}
+        assert len({i for i, _ in result.items}) == len(result.items)
+        assert all(Decimal("0") < settle <= by_id[i].balance for i, settle in result.items)
+        assert result.allocated + result.remaining == amount
+        assert result.allocated == min(amount, total)
+        partials = [i for i, settle in result.items if settle < by_id[i].balance]
+        assert len(partials) <= 1
+
+
+def test_exact_subset_is_settled_without_partials() -> None:
+    rnd = random.Random(7)
+    for _ in range(80):
+        balances = _balances(rnd, rnd.randint(2, 30))
+        picked = rnd.sample(balances, rnd.randint(1, len(balances) - 1))
+        amount = sum(b.balance for b in picked)
+        for policy in (EXACT_FIRST, MIN_PARTIALS):
+            result = allocate(balances, amount, policy)
+            if result.fell_back:
+                continue
+            assert result.remaining == 0
+            assert all(settle == next(b.balance for b in balances if b.balance_id == i) for i, settle in result.items)
+
+
+def test_policies_differ_where_lookahead_helps() -> None:
+    balances = [OpenBalance(i, Decimal(v), Decimal("0"), Decimal(v)) for i, v in ((1, "100"), (2, "250"), (3, "300"))]
+    assert allocate(balances, Decimal("300"), OLDEST_FIRST).items == [(1, Decimal("100")), (2, Decimal("200"))]
+    assert allocate(balances, Decimal("300"), EXACT_FIRST).items == [(3, Decimal("300"))]
+    # 凑不齐：尽量多整笔结清（100 + 300），剩余 20 落在最早的未结清明细上
+    assert allocate(balances, Decimal("420"), MIN_PARTIALS).items == [
+        (1, Decimal("100")), (2, Decimal("20")), (3, Decimal("300")),
+    ]
+    assert allocate(balances, Decimal("420"), EXACT_FIRST).items == allocate(balances, Decimal("420"), OLDEST_FIRST).items
+    with pytest.raises(ValueError):
+        allocate(balances, Decimal("1"), "largest_first")
+
+
+def test_subset_search_gives_up_past_state_limit() -> None:
+    assert best_subset([3, 5, 7, 11], 15) == [0, 1, 2]
+    assert best_subset([30, 5, 7], 14) == [1, 2]
+    assert best_subset(list(range(1, 200)), 10_000, max_states=50) is None
+
+
+class _Cursor:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append((" ".join(sql.split()), tuple(params)))
+
+
+def test_apply_writes_one_update_and_one_insert() -> None:
+    balances = [OpenBalance(1, Decimal("100"), Decimal("20"), Decimal("80")),
+                OpenBalance(2, Decimal("50"), Decimal("0"), Decimal("50"))]
+    allocation = allocate(balances, Decimal("100"), OLDEST_FIRST)
+    cur = _Cursor()
+    items = apply_allocation(cur, 9, balances, allocation)
+
+    assert items == [{"balance_id": 1, "settled_amount": 80.0, "status": 2},
+                     {"balance_id": 2, "settled_amount": 20.0, "status": 1}]
+    (update_sql, update_params), (insert_sql, insert_params) = cur.statements
+    assert update_sql.startswith("UPDATE pd_balance_details SET paid_amount = CASE id WHEN %s THEN %s WHEN %s THEN %s END")
+    assert update_params == (1, Decimal("100"), 2, Decimal("20"), 1, Decimal("0"), 2, Decimal("30"), 1, 2, 2, 1, 1, 2)
+    assert insert_sql.endswith("ON DUPLICATE KEY UPDATE settled_amount = VALUES(settled_amount)")
+    assert insert_params == (9, 1, Decimal("80"), 9, 2, Decimal("20"))
+    assert apply_allocation(_Cursor(), 9, balances, allocate(balances, Decimal("0"))) == []
+
+
+class _VerifyCursor(_Cursor):
+    """batch_verify_by_payee 用：回单 300 元待核销，收款人名下 100 / 250 / 300 三笔结余（按创建时间）。"""
+
+    def execute(self, sql, params=()):
+        super().execute(sql, params)
+        self._last = " ".join(sql.split())
+
+    def fetchone(self):
+        return (Decimal("300"), 1)
+
+    def fetchall(self):
+        return [(1, Decimal("100"), Decimal("0"), Decimal("100")),
+                (2, Decimal("250"), Decimal("0"), Decimal("250")),
+                (3, Decimal("300"), Decimal("0"), Decimal("300"))]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_batch_verify_defaults_to_oldest_first(monkeypatch) -> None:
+    import inspect
+    from contextlib import contextmanager
+
+    from app.api.v1.routes import balances as balance_routes
+    from app.services import balance_service
+    from app.services.balance_service import BalanceService
+
+    class _Conn:
+        def begin(self):
+            pass
+
+        def commit(self):
+            pass
+
+        def cursor(self):
+            return _VerifyCursor()
+
+    @contextmanager
+    def fake_get_conn():
+        yield _Conn()
+
+    monkeypatch.setattr(balance_service, "get_conn", fake_get_conn)
+    monkeypatch.setattr(balance_service, "refresh_contract_progress", lambda *a, **k: None)
+    monkeypatch.setattr(balance_service, "contract_nos_for", lambda *a, **k: [])
+    monkeypatch.setattr(balance_service, "sync_balance_summaries", lambda *a, **k: None)
+    service = BalanceService.__new__(BalanceService)
+
+    def settled(**kwargs):
+        result = service.batch_verify_by_payee(payee_name="张三", receipt_id=9, **kwargs)
+        assert result["success"], result
+        return result["data"]["policy"], [(i["balance_id"], i["settled_amount"]) for i in result["data"]["items"]]
+
+    # 现有调用方不传策略：仍按创建时间从早到晚扣减
+    assert settled() == (OLDEST_FIRST, [(1, 100.0), (2, 200.0)])
+    assert settled(policy=EXACT_FIRST) == (EXACT_FIRST, [(3, 300.0)])
+    assert inspect.signature(balance_routes.batch_verify_by_payee).parameters["policy"].default.default == OLDEST_FIRST
@@ -0,0 +1,147 @@
+"""结余批量回填：应付金额精确换算、预加载收款人映射、按磅单主键分批多行写入且可断点续跑。"""
+
+from contextlib import contextmanager
+from decimal import Decimal
+
+from app.services import balance_backfill
+from app.services.balance_backfill import (
+    backfill_balance_details,
+    load_warehouse_payees,
+    payable_amount,
+    resolve_payee_fields,
+)
+
+
+class _Caps:
+    def has_column(self, table, column):
+        return column == "payee_bank_name"
+
+
+class _Cursor:
+    def __init__(self, results):
+        self.results = results
+        self.statements = []
+        self.rows = []
+        self.rowcount = 0
+        self.description = []
+
+    def execute(self, sql, params=()):
+        text = " ".join(sql.split())
+        self.statements.append((text, tuple(params)))
+        self.rows = []
+        for prefix, queue in self.results.items():
+            if text.startswith(prefix):
+                self.rows = queue.pop(0) if queue and isinstance(queue[0], list) else list(queue)
+                break
+        self.rowcount = text.count("),(") + 1 if text.startswith("INSERT IGNORE INTO pd_balance_details") else 0
+
+    def executemany(self, sql, seq):
+        for params in seq:
+            self.execute(sql, params)
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Conn:
+    def __init__(self, cur):
+        self.cur = cur
+        self.commits = 0
+
+    def cursor(self):
+        return self.cur
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+def _weighbill(i, **extra):
+    row = {"weighbill_id": i, "contract_no": "HT-1", "delivery_id": i, "vehicle_no": "粤B1", "net_weight": "1",
+           "unit_price": "2.8034", "warehouse_name": "一号库", "driver_name": f"司机{i}", "driver_phone": "139",
+           "payee": None}
+    row.update(extra)
+    return row
+
+
+def test_payable_amount_rounds_half_up_on_exact_decimal() -> None:
+    # 2.8034 / 1.048 = 2.675：按浮点计算会落到 2.67
+    assert payable_amount("1", "2.8034") == Decimal("2.68")
+    assert payable_amount("31.45", 2580) == Decimal("77424.62")
+    assert payable_amount(None, 5) == Decimal("0.00")
+
+
+def test_payee_map_prefers_active_then_lowest_id() -> None:
+    cur = _Cursor({"SELECT id, warehouse_name": [
+        {"id": 3, "warehouse_name": "一号库", "payee_name": "Zhang", "payee_account": " 6222 ", "payee_bank_name": "工行",
+         "is_active": 1},
+        {"id": 1, "warehouse_name": "一号库", "payee_name": "zhang", "payee_account": "0000", "payee_bank_name": None,
+         "is_active": 0},
+    ]})
+    payees = load_warehouse_payees(cur)
+    assert len(payees) == 1
+
+    fields = resolve_payee_fields(payees, " 一号库 ", "ZHANG")
+    assert fields["payee_id"] == 3 and fields["payee_account"] == "6222" and fields["matched"]
+    missing = resolve_payee_fields(payees, "二号库", " 李四 ")
+    assert missing["payee_name"] == "李四" and missing["payee_id"] is None and not missing["matched"]
+
+
+def test_backfill_inserts_chunks_and_resumes_from_last_weighbill(monkeypatch) -> None:
+    monkeypatch.setattr(balance_backfill, "get_schema_capabilities", lambda: _Caps())
+    cur = _Cursor({
+        "SELECT id, warehouse_name": [{"id": 9, "warehouse_name": "一号库", "payee_name": "王五",
+                                       "payee_account": "6222", "payee_bank_name": "工行", "is_active": 1}],
+        "SELECT w.id AS weighbill_id": [[_weighbill(11, payee="王五"), _weighbill(15)], [_weighbill(20)]],
+        "SELECT id FROM pd_balance_details WHERE weighbill_id IN": [[{"id": 101}, {"id": 102}], [{"id": 103}]],
+    })
+    conn = _Conn(cur)
+
+    @contextmanager
+    def connect():
+        yield conn
+
+    seen = []
+    result = backfill_balance_details(after_weighbill_id=10, chunk_size=2, connect=connect,
+                                      on_chunk=lambda r: seen.append(r.last_weighbill_id))
+    assert result.as_dict() == {"after_weighbill_id": 10, "last_weighbill_id": 20, "scanned": 3, "generated": 3,
+                                "matched_payees": 1, "chunks": 2, "done": True}
+    assert seen == [15, 20] and conn.commits == 2
+
+    selects = [p for t, p in cur.statements if t.startswith("SELECT w.id AS weighbill_id")]
+    assert [p[0] for p in selects] == [10, 15] and selects[0][-1] == 2
+    inserts = [(t, p) for t, p in cur.statements if t.startswith("INSERT IGNORE INTO pd_balance_details")]
+    first_sql, first_params = inserts[0]
+    assert first_sql.count("),(") == 1 and "payee_bank_name, purchase_unit_price" in first_sql
+    # 第一行匹配到仓库收款人，应付/结余按精确换算
+    assert first_params[6:15] == (9, "王五", "6222", "工行", "2.8034", Decimal("2.68"), 0, Decimal("2.68"), 0)
+    assert first_params[15 + 7] == "司机15"
+    assert any(t.startswith("UPDATE pd_contract_progress p") for t, _ in cur.statements)
+    key_refreshes = [p for t, p in cur.statements if t.startswith("UPDATE pd_balance_details b")]
+    assert key_refreshes == [(101, 102), (103,)]
+
+
+def test_backfill_stops_after_max_chunks_without_finishing(monkeypatch) -> None:
+    monkeypatch.setattr(balance_backfill, "get_schema_capabilities", lambda: _Caps())
+    cur = _Cursor({"SELECT w.id AS weighbill_id": [[_weighbill(1), _weighbill(2)]]})
+
+    @contextmanager
+    def connect():
+        yield _Conn(cur)
+
+    result = backfill_balance_details(chunk_size=2, max_chunks=1, connect=connect)
+    assert result.last_weighbill_id == 2 and result.chunks == 1 and not result.done
@@ -0,0 +1,115 @@
+"""结余收款人/报单人汇总：改写前后分组键都重算、默认筛选读汇总表、其余筛选按存储的分组键现场分组。"""
+
+from contextlib import contextmanager
+
+from app.services import balance_service
+from app.services.balance_party_summary import sync_balance_summaries
+from app.services.balance_service import BalanceService
+
+
+class _Cursor:
+    """按 SQL 前缀返回预置结果的元组游标，记录执行过的语句。"""
+
+    def __init__(self, results=None):
+        self.results = results or {}
+        self.statements = []
+        self.rows = []
+        self.description = []
+
+    def execute(self, sql, params=()):
+        text = " ".join(sql.split())
+        self.statements.append((text, tuple(params)))
+        for prefix, (columns, rows) in self.results.items():
+            if text.startswith(prefix):
+                self.description = [(c,) for c in columns]
+                self.rows = list(rows.pop(0)) if rows and isinstance(rows[0], list) else list(rows)
+                return
+        self.description, self.rows = [], []
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_sync_rebuilds_groups_for_keys_before_and_after_the_write() -> None:
+    keys = ("payee_key", "reporter_key")
+    cur = _Cursor({
+        # 回写收款人前后：张三 -> 李四，报单人不变
+        "SELECT payee_key, reporter_key FROM pd_balance_details": (keys, [[("张三", "王五")], [("李四", "王五")]]),
+    })
+    touched = sync_balance_summaries(cur, [7, None, 7])
+    assert touched == {"payee": ["张三", "李四"], "reporter": ["王五"]}
+
+    texts = [t for t, _ in cur.statements]
+    refresh = next(t for t in texts if t.startswith("UPDATE pd_balance_details b"))
+    assert "SET b.payee_key = COALESCE(NULLIF(TRIM(b.payee_name), '')" in refresh and "WHERE b.id IN (%s)" in refresh
+
+    deletes = [(t, p) for t, p in cur.statements if t.startswith("DELETE FROM pd_balance_party_summary")]
+    assert deletes == [
+        ("DELETE FROM pd_balance_party_summary WHERE party_type = %s AND party_key IN (%s,%s)",
+         ("payee", "张三", "李四")),
+        ("DELETE FROM pd_balance_party_summary WHERE party_type = %s AND party_key IN (%s)", ("reporter", "王五")),
+    ]
+    inserts = [t for t in texts if t.startswith("INSERT INTO pd_balance_party_summary")]
+    assert "GROUP BY b.payee_key, b.driver_phone" in inserts[0] and "b.payee_key IN (%s,%s)" in inserts[0]
+    assert "GROUP BY b.reporter_key" in inserts[1] and "b.driver_phone," not in inserts[1].split("SELECT")[1][:80]
+    assert all("b.payment_status IN (0, 1) AND b.balance_amount >= 0.01" in t for t in inserts)
+
+    assert sync_balance_summaries(_Cursor(), []) == {"payee": [], "reporter": []}
+
+
+def _patch_conn(monkeypatch, cur) -> None:
+    class _Conn:
+        def cursor(self):
+            return cur
+
+    @contextmanager
+    def fake_conn():
+        yield _Conn()
+
+    monkeypatch.setattr(balance_service, "get_conn", fake_conn)
+
+
+def test_default_listing_reads_summary_table(monkeypatch) -> None:
+    columns = ("payee_name", "driver_phone", "payment_schedule_date", "bill_count", "total_payable", "total_paid",
+               "total_balance", "related_contracts", "related_vehicles", "first_bill_date", "last_bill_date",
+               "pending_count", "partial_count")
+    cur = _Cursor({
+        "SELECT COUNT(*) FROM pd_balance_party_summary": (("c",), [(1,)]),
+        "SELECT s.party_key as payee_name": (
+            columns, [("张三", "139", None, 2, 300, 100, 200, "HT-1", "粤B1", None, None, 1, 1)]
+        ),
+    })
+    _patch_conn(monkeypatch, cur)
+
+    result = BalanceService().list_balance_summary_by_payee(payee_name="张三", page=2, page_size=10)
+    assert result["total"] == 1 and result["summary"] == {"total_payees": 1, "total_balance": 200.0}
+    item = result["data"][0]
+    assert item["payable_amount"] == 300.0 and item["status_summary"] == "1笔待支付,1笔部分支付"
+    page_sql, page_params = cur.statements[1]
+    assert "ORDER BY s.total_balance DESC, s.last_bill_date DESC" in page_sql
+    assert page_params == ("payee", "张三", 10, 10)
+    assert not any("pd_balance_details" in t for t, _ in cur.statements)
+
+
+def test_filtered_listing_groups_on_stored_keys(monkeypatch) -> None:
+    cur = _Cursor({
+        "SELECT COUNT(*) FROM (": (("c",), [(0,)]),
+        "SELECT b.reporter_key as reporter_name": (("reporter_name",), []),
+    })
+    _patch_conn(monkeypatch, cur)
+
+    result = BalanceService().list_balance_summary_by_reporter(reporter_name="王五", payment_status=2)
+    assert result["success"] and result["data"] == [] and "total_payable_amount" in result["summary"]
+    texts = [t for t, _ in cur.statements]
+    assert all("pd_balance_party_summary" not in t for t in texts)
+    assert all("GROUP BY b.reporter_key" in t and "pd_deliveries" not in t for t in texts)
+    assert cur.statements[0][1] == ("王五", 2, 0.01)
@@ -0,0 +1,201 @@
+"""合同车数台账：报单变化的差额计算、审核通过时的余量复核、并发审核不超出合同车数、新建报单与台账同一事务。"""
+
+import threading
+from typing import Dict
+
+from app.services.contract_capacity import apply_delivery_change, capacity_deltas
+
+
+class _Ledger:
+    """内存台账：行锁用每个合同一把锁模拟，事务结束（commit/rollback）时释放。"""
+
+    def __init__(self, totals: Dict[str, int]):
+        self.totals = totals
+        self.used: Dict[str, int] = {}
+        self.row_locks = {no: threading.Lock() for no in totals}
+
+
+class _Cursor:
+    def __init__(self, ledger: _Ledger):
+        self.ledger = ledger
+        self.rows: list = []
+        self.held: list = []
+
+    def executemany(self, sql: str, seq):
+        for params in seq:
+            self.execute(sql, params)
+
+    def execute(self, sql: str, params=()):
+        text = " ".join(sql.split())
+        ledger = self.ledger
+        if text.startswith("INSERT IGNORE INTO pd_contract_capacity"):
+            ledger.used.setdefault(params[0], 0)
+        elif text.startswith("SELECT cap.contract_no"):
+            for no in params:
+                if no not in self.held:
+                    ledger.row_locks[no].acquire()
+                    self.held.append(no)
+            self.rows = [
+                {"contract_no": no, "used_trucks": ledger.used[no], "total_trucks": ledger.totals.get(no)}
+                for no in params
+            ]
+        elif text.startswith("UPDATE pd_contract_capacity"):
+            delta, no = params
+            ledger.used[no] += delta
+
+    def fetchall(self):
+        return self.rows
+
+    def end_transaction(self):
+        for no in self.held:
+            self.ledger.row_locks[no].release()
+        self.held = []
+
+
+def _delivery(status: str, contract_no: str = "HT-1", trucks: int = 2) -> dict:
+    return {"status": status, "contract_no": contract_no, "planned_trucks": trucks}
+
+
+def test_deltas_follow_approval_truck_and_contract_changes() -> None:
+    assert capacity_deltas(_delivery("待审核"), _delivery("审核通过")) == {"HT-1": 2}
+    assert capacity_deltas(_delivery("审核通过"), _delivery("审核未通过")) == {"HT-1": -2}
+    assert capacity_deltas(_delivery("审核通过"), _delivery("审核通过", trucks=3)) == {"HT-1": 1}
+    assert capacity_deltas(_delivery("审核通过"), _delivery("审核通过", contract_no="HT-2")) == {"HT-1": -2, "HT-2": 2}
+    assert capacity_deltas(_delivery("审核通过"), None) == {"HT-1": -2}
+    assert capacity_deltas(_delivery("待审核"), _delivery("待审核", trucks=5)) == {}
+
+
+def test_approval_is_rejected_when_contract_is_full() -> None:
+    ledger = _Ledger({"HT-1": 3})
+    cur = _Cursor(ledger)
+    assert apply_delivery_change(cur, _delivery("待审核"), _delivery("审核通过")) is None
+    cur.end_transaction()
+    error = apply_delivery_change(cur, _delivery("待审核"), _delivery("审核通过"))
+    cur.end_transaction()
+    assert error and "HT-1" in error
+    assert ledger.used["HT-1"] == 2
+
+    # 不校验时（如改绑合同）照常记账
+    assert apply_delivery_change(cur, _delivery("待审核"), _delivery("审核通过"), enforce=False) is None
+    cur.end_transaction()
+    assert ledger.used["HT-1"] == 4
+
+
+def test_concurrent_approvals_never_exceed_contract_trucks() -> None:
+    ledger = _Ledger({"HT-1": 10})
+    outcomes = []
+    barrier = threading.Barrier(8)
+
+    def approve() -> None:
+        cur = _Cursor(ledger)
+        barrier.wait()
+        outcomes.append(apply_delivery_change(cur, _delivery("待审核", trucks=3), _delivery("审核通过", trucks=3)))
+        cur.end_transaction()
+
+    threads = [threading.Thread(target=approve) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(1 for o in outcomes if o is None) == 3
+    assert ledger.used["HT-1"] == 9
+
+
+class _CreateConn:
+    """create_delivery 用的假连接：记录事务边界与 INSERT，lastrowid 固定为 101。"""
+
+    def __init__(self, events: list):
+        self.events = events
+
+    def cursor(self):
+        return _CreateCursor(self.events)
+
+    def begin(self):
+        self.events.append("begin")
+
+    def commit(self):
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+
+class _CreateCursor:
+    lastrowid = 101
+
+    def __init__(self, events: list):
+        self.events = events
+
+    def execute(self, sql, params=()):
+        if "INSERT INTO pd_deliveries" in sql:
+            self.events.append(("insert", dict(zip(sql.split("(")[1].split(")")[0].split(","), params))))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _create_service(monkeypatch, capacity_error=None):
+    from contextlib import contextmanager
+
+    from app.services import delivery_service
+    from app.services.delivery_service import DeliveryService
+
+    events, ledger_calls = [], []
+
+    @contextmanager
+    def fake_get_conn():
+        yield _CreateConn(events)
+
+    def fake_apply(cur, old, new, enforce=True):
+        ledger_calls.append((old, new, enforce))
+        return capacity_error
+
+    monkeypatch.setattr(delivery_service, "get_conn", fake_get_conn)
+    monkeypatch.setattr(delivery_service, "apply_delivery_change", fake_apply)
+    monkeypatch.setattr(delivery_service, "refresh_contract_progress", lambda *a, **k: None)
+    monkeypatch.setattr(delivery_service, "get_duplicate_window", lambda: None)
+    monkeypatch.setattr(delivery_service, "get_delivery_contract_price_service", lambda: type(
+        "_Prices", (), {"sync_from_contract": staticmethod(lambda delivery_id: {"success": True})})())
+
+    service = DeliveryService.__new__(DeliveryService)
+    service._convert_to_mill_product = lambda p: p
+    service._delivery_has_products_column = lambda: False
+    service._create_weighbills = lambda **kwargs: None
+    service._validate_manager_quota = lambda *args: None
+    service._match_order_plan_for_delivery = lambda *args: {"matched": True, "skipped": True}
+    service._match_contract_with_truck_check = lambda **kwargs: {
+        "matched": True, "contract_no": "HT-1", "contract_id": 1, "unit_price": 2000, "is_last_delivery": False,
+        "contract_total_trucks": 10, "contract_used_trucks": 0, "contract_remaining_trucks": 10,
+        "this_delivery_trucks": 2,
+    }
+    return service, events, ledger_calls
+
+
+_CREATE_DATA = {
+    "report_date": "2026-03-05", "target_factory_name": "冶炼厂", "product_name": "电动车", "quantity": 70,
+    "vehicle_no": "豫U12345", "driver_name": "张三", "has_delivery_order": "无", "status": "审核通过",
+}
+
+
+def test_create_delivery_goes_through_the_capacity_ledger(monkeypatch) -> None:
+    service, events, ledger_calls = _create_service(monkeypatch)
+    result = service.create_delivery(dict(_CREATE_DATA), confirm_flag=True)
+
+    assert result["success"], result
+    # 新建一律待审核：请求里的「审核通过」不直接落库，台账按实际写入的行计（待审核不占车数）
+    assert ledger_calls == [(None, {"status": "待审核", "contract_no": "HT-1", "planned_trucks": 2}, True)]
+    (_, inserted), = [e for e in events if isinstance(e, tuple)]
+    assert inserted["status"] == "待审核"
+    assert [e for e in events if isinstance(e, str)] == ["begin", "commit"]
+
+
+def test_create_delivery_rolls_back_when_capacity_is_exceeded(monkeypatch) -> None:
+    service, events, _ = _create_service(monkeypatch, capacity_error="合同 HT-1 车数不足")
+    result = service.create_delivery(dict(_CREATE_DATA), confirm_flag=True)
+
+    assert result == {"success": False, "error": "合同 HT-1 车数不足"}
+    assert [e for e in events if isinstance(e, str)] == ["begin", "rollback"]
@@ -0,0 +1,160 @@
+"""合同失效扫描：23:59:59 边界、分批提交、水位线增量与回看、新失效合同号通知。"""
+
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from app.services import contract_expiry
+from app.services.contract_expiry import (
+    add_expiry_listener,
+    expiry_cutoff,
+    remove_expiry_listener,
+    sweep_expired_contracts,
+)
+
+
+class _FakeDb:
+    """只实现扫描用到的 SQL 形态；记录事务次数与每批锁定行数。"""
+
+    def __init__(self, contracts: List[Dict]):
+        self.contracts = {c["id"]: dict(c, status=c.get("status", "生效中")) for c in contracts}
+        self.watermark: Optional[date] = None
+        self.transactions = 0
+        self.locked_batches: List[int] = []
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def begin(self):
+        self.transactions += 1
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class _FakeCursor:
+    def __init__(self, db: _FakeDb):
+        self.db = db
+        self.rows: list = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def _matches(self, c: Dict, text: str, params: tuple) -> bool:
+        if "end_date IS NULL" in text:
+            if c["end_date"] is not None or c["contract_date"] is None or c["contract_date"] > params[0]:
+                return False
+            return len(params) < 4 or c["contract_date"] > params[1]
+        if c["end_date"] is None or c["end_date"] > params[0]:
+            return False
+        return len(params) < 4 or c["end_date"] > params[1]
+
+    def execute(self, sql: str, params=()):
+        db = self.db
+        text = " ".join(sql.split())
+        self.rows = []
+        if text.startswith("SELECT watermark"):
+            self.rows = [{"watermark": db.watermark}] if db.watermark else []
+        elif text.startswith("INSERT INTO pd_sweep_watermarks"):
+            db.watermark = max(filter(None, [db.watermark, params[1]]))
+        elif text.startswith("SELECT id, contract_no FROM pd_contracts"):
+            after_id, limit = params[-2], params[-1]
+            hits = [
+                c for c in sorted(db.contracts.values(), key=lambda c: c["id"])
+                if c["status"] == "生效中" and c["id"] > after_id and self._matches(c, text, params)
+            ][:limit]
+            db.locked_batches.append(len(hits))
+            self.rows = [{"id": c["id"], "contract_no": c["contract_no"]} for c in hits]
+        elif text.startswith("UPDATE pd_contracts SET status = '已失效'"):
+            for cid in params:
+                if db.contracts[cid]["status"] == "生效中":
+                    db.contracts[cid]["status"] = "已失效"
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+def _connect(db: _FakeDb):
+    @contextmanager
+    def connect():
+        yield db
+
+    return connect
+
+
+def _contract(cid: int, end_date: Optional[date] = None, contract_date: Optional[date] = None) -> Dict:
+    return {"id": cid, "contract_no": f"HT{cid:03d}", "end_date": end_date, "contract_date": contract_date}
+
+
+def test_cutoff_matches_end_of_day_boundary() -> None:
+    assert expiry_cutoff(datetime(2026, 3, 10, 23, 59, 58)) == date(2026, 3, 9)
+    assert expiry_cutoff(datetime(2026, 3, 10, 23, 59, 59)) == date(2026, 3, 10)
+
+
+def test_sweep_expires_in_chunks_and_publishes_contract_nos() -> None:
+    db = _FakeDb(
+        [_contract(i, end_date=date(2026, 3, 1)) for i in range(1, 8)]
+        + [
+            _contract(8, end_date=date(2026, 3, 20)),
+            _contract(9, contract_date=date(2026, 3, 5)),  # 3.5 + 4 天 = 3.9 <= 3.9 已失效
+            _contract(10, contract_date=date(2026, 3, 6)),
+        ]
+    )
+    published = []
+    add_expiry_listener(published.append)
+    try:
+        result = sweep_expired_contracts(
+            grace_days=4, chunk_size=3, lookback_days=7, now=datetime(2026, 3, 10, 12), connect=_connect(db)
+        )
+    finally:
+        remove_expiry_listener(published.append)
+
+    assert result.expired_contract_nos == [f"HT{i:03d}" for i in range(1, 8)] + ["HT009"]
+    assert result.chunks == 4
+    assert max(db.locked_batches) <= 3
+    assert published == [result.expired_contract_nos]
+    assert {c["id"] for c in db.contracts.values() if c["status"] == "生效中"} == {8, 10}
+    assert db.watermark == date(2026, 3, 9)
+
+
+def test_incremental_sweep_uses_watermark_with_lookback() -> None:
+    db = _FakeDb([
+        _contract(1, end_date=date(2026, 1, 1)),   # 回看窗口以外：增量扫描不处理，全量扫描处理
+        _contract(2, end_date=date(2026, 3, 5)),   # 水位线之前但在回看窗口内（补录）
+        _contract(3, end_date=date(2026, 3, 10)),  # 新到期
+    ])
+    db.watermark = date(2026, 3, 9)
+
+    incremental = sweep_expired_contracts(
+        lookback_days=7, now=datetime(2026, 3, 11, 8), connect=_connect(db)
+    )
+    assert incremental.lower_bound == date(2026, 3, 2)
+    assert incremental.expired_contract_nos == ["HT002", "HT003"]
+    assert db.contracts[1]["status"] == "生效中"
+    assert db.watermark == date(2026, 3, 10)
+
+    full = sweep_expired_contracts(full=True, now=datetime(2026, 3, 11, 8), connect=_connect(db))
+    assert full.lower_bound is None and full.expired_contract_nos == ["HT001"]
+
+
+def test_listener_failure_does_not_break_sweep(monkeypatch) -> None:
+    monkeypatch.setattr(contract_expiry, "_listeners", [])
+    seen = []
+
+    def broken(nos):
+        raise RuntimeError("cache down")
+
+    add_expiry_listener(broken)
+    add_expiry_listener(seen.append)
+    db = _FakeDb([_contract(1, end_date=date(2026, 3, 1))])
+    sweep_expired_contracts(now=datetime(2026, 3, 10), connect=_connect(db))
+    assert seen == [["HT001"]]
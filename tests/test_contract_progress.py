@@ -0,0 +1,115 @@
+"""合同进度台账：按合同编号加锁重算各分组、全量重算不带过滤、回款汇总无状态筛选时读台账。"""
+
+from contextlib import contextmanager
+
+from app.services import payment_services
+from app.services.contract_progress import (
+    BALANCES,
+    PAYMENTS,
+    SHIPPING,
+    rebuild_progress_rows,
+    refresh_contract_progress,
+)
+from app.services.payment_services import PaymentService
+
+
+class _RecordingCursor:
+    def __init__(self, results=None):
+        self.statements = []
+        self.results = results or {}
+        self.rows = []
+        self.rowcount = 1
+
+    def executemany(self, sql, seq):
+        for params in seq:
+            self.execute(sql, params)
+
+    def execute(self, sql, params=()):
+        text = " ".join(sql.split())
+        self.statements.append((text, tuple(params)))
+        self.rows = next((rows for prefix, rows in self.results.items() if text.startswith(prefix)), [])
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_refresh_locks_sorted_rows_and_recomputes_requested_parts() -> None:
+    cur = _RecordingCursor()
+    nos = refresh_contract_progress(cur, ["HT-2", None, " HT-1 ", "", "HT-2"], parts=(SHIPPING, PAYMENTS))
+    assert nos == ["HT-1", "HT-2"]
+
+    inserts = [s for s in cur.statements if s[0].startswith("INSERT IGNORE INTO pd_contract_progress")]
+    assert [p for _, p in inserts] == [("HT-1",), ("HT-2",)]
+    lock_sql, lock_params = cur.statements[2]
+    assert lock_sql.endswith("ORDER BY contract_no FOR UPDATE") and lock_params == ("HT-1", "HT-2")
+
+    updates = [s for s in cur.statements if s[0].startswith("UPDATE pd_contract_progress p")]
+    # 发运 1 条，回款 2 条（明细合计与回款记录最后日期分开分组）
+    assert len(updates) == 3
+    shipping_sql, shipping_params = updates[0]
+    assert "FROM pd_weighbills" in shipping_sql and "p.shipped_trucks" in shipping_sql
+    assert shipping_params == ("已上传磅单", "已确认", "HT-1", "HT-2", "HT-1", "HT-2")
+    assert all("WHERE p.contract_no IN (%s,%s)" in sql for sql, _ in updates)
+    assert "JOIN pd_payment_details pd ON pd.id = pr.payment_detail_id" in updates[2][0]
+    assert not any("pd_balance_details" in sql for sql, _ in updates)
+
+    empty = _RecordingCursor()
+    assert refresh_contract_progress(empty, [None, ""], parts=(BALANCES,)) == []
+    assert empty.statements == []
+
+
+def test_rebuild_backfills_all_contracts_without_filters() -> None:
+    cur = _RecordingCursor()
+    rebuild_progress_rows(cur)
+    backfill_sql, _ = cur.statements[0]
+    for table in ("pd_contracts", "pd_weighbills", "pd_deliveries", "pd_payment_details", "pd_balance_details"):
+        assert f"FROM {table}" in backfill_sql
+    updates = cur.statements[1:]
+    assert len(updates) == 5
+    assert all(" IN (%s" not in sql.replace("ocr_status IN (%s,%s)", "") for sql, _ in updates)
+
+
+def test_payment_summary_reads_ledger_unless_filtering_by_status(monkeypatch) -> None:
+    ledger_row = {
+        "contract_no": "HT-1", "smelter_name": "冶炼厂", "total_receivable": 300, "total_received": 100,
+        "total_unreceived": 200, "order_count": 3, "unpaid_count": 1, "partial_count": 1, "paid_count": 1,
+        "overpaid_count": 0, "last_payment_date": "2026-01-05",
+    }
+    cur = _RecordingCursor({
+        "SELECT COUNT(*) as total FROM pd_contract_progress": [{"total": 1}],
+        "SELECT p.contract_no": [ledger_row],
+        "SELECT COUNT(DISTINCT pd.contract_no)": [{"total": 1}],
+        "SELECT pd.contract_no": [{**ledger_row, "order_count": 1, "unpaid_count": 1, "partial_count": 0,
+                                   "paid_count": 0}],
+    })
+
+    class _Conn:
+        def cursor(self):
+            return cur
+
+    @contextmanager
+    def fake_conn():
+        yield _Conn()
+
+    monkeypatch.setattr(payment_services, "get_conn", fake_conn)
+
+    result = PaymentService.get_contract_payment_summary(contract_no="HT")
+    assert result["total"] == 1
+    item = result["items"][0]
+    assert item["contract_status_name"] == "部分回款" and item["collection_rate"] == 33.33
+    assert all("pd_payment_details" not in sql for sql, _ in cur.statements)
+
+    cur.statements.clear()
+    filtered = PaymentService.get_contract_payment_summary(status=0)
+    assert filtered["items"][0]["contract_status_name"] == "未回款"
+    assert all("pd_contract_progress" not in sql for sql, _ in cur.statements)
+    assert any("GROUP BY payment_detail_id" in sql for sql, _ in cur.statements)
@@ -0,0 +1,204 @@
+"""Coze 异步客户端：SSE 逐段产出与聚合、错误映射、提前结束时关闭上游、会话按事件循环隔离并随 asyncio.run 关闭；/agent/chat/stream 事件格式与 502。"""
+
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.v1.routes import agent_chat
+from app.core.config import settings
+from app.services import coze_agent_service
+from app.services.coze_agent_service import (
+    CozeAgentError,
+    close_coze_session,
+    run_closing_coze_session,
+    run_coze_agent_chat,
+    stream_coze_agent,
+)
+
+
+@pytest.fixture
+def coze_settings(monkeypatch):
+    def configure(url: str) -> None:
+        monkeypatch.setattr(settings, "coze_stream_url", url)
+        monkeypatch.setattr(settings, "coze_bearer_token", "t")
+        monkeypatch.setattr(settings, "coze_project_id", "p")
+        monkeypatch.setattr(settings, "coze_session_id", "s")
+
+    return configure
+
+
+async def _serve(handler):
+    app = web.Application()
+    app.router.add_post("/stream_run", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/stream_run"
+
+
+async def _sse_response(request, events, delay=0.0):
+    resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await resp.prepare(request)
+    for event in events:
+        await resp.write(f"data: {event}\n\n".encode())
+        await asyncio.sleep(delay)
+    await resp.write_eof()
+    return resp
+
+
+def test_stream_yields_fragments_and_aggregates(coze_settings) -> None:
+    async def handler(request):
+        body = await request.json()
+        assert body["content"]["query"]["prompt"][0]["content"]["text"] == "鉴别"
+        return await _sse_response(request, [
+            json.dumps({"content": "合同"}, ensure_ascii=False),
+            json.dumps({"message": {"content": "公章"}}, ensure_ascii=False),
+            "纯文本",
+            "[DONE]",
+        ], delay=0.01)
+
+    async def scenario():
+        runner, url = await _serve(handler)
+        coze_settings(url)
+        try:
+            fragments = [f async for f in stream_coze_agent("鉴别")]
+            result = await run_coze_agent_chat("鉴别")
+            session = await coze_agent_service.get_coze_session()
+            assert session is await coze_agent_service.get_coze_session()
+        finally:
+            await close_coze_session()
+            await runner.cleanup()
+        return fragments, result
+
+    fragments, result = asyncio.run(scenario())
+    assert fragments == ["合同", "公章", "纯文本"]
+    assert result == {"success": True, "text": "合同公章纯文本"}
+
+
+def test_errors_are_mapped(coze_settings, monkeypatch) -> None:
+    async def http_error(request):
+        return web.Response(status=500, text="boom")
+
+    async def error_event(request):
+        return await _sse_response(request, [json.dumps({"error": "workflow failed"})])
+
+    async def scenario():
+        r1, url1 = await _serve(http_error)
+        r2, url2 = await _serve(error_event)
+        try:
+            coze_settings(url1)
+            first = await run_coze_agent_chat("x")
+            coze_settings(url2)
+            with pytest.raises(CozeAgentError, match="workflow failed"):
+                async for _ in stream_coze_agent("x"):
+                    pass
+            monkeypatch.setattr(settings, "coze_bearer_token", "")
+            missing = await run_coze_agent_chat("x")
+        finally:
+            await close_coze_session()
+            await r1.cleanup()
+            await r2.cleanup()
+        return first, missing
+
+    first, missing = asyncio.run(scenario())
+    assert not first["success"] and "HTTP 500" in first["error"] and "boom" in first["error"]
+    assert not missing["success"] and "YOUR_TOKEN" in missing["error"]
+
+
+def test_closing_stream_early_disconnects_upstream(coze_settings) -> None:
+    async def scenario():
+        closed = asyncio.Event()
+
+        async def slow(request):
+            resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await resp.prepare(request)
+            await resp.write(b'data: {"content": "first"}\n\n')
+            try:
+                for _ in range(250):
+                    await asyncio.sleep(0.02)
+                    await resp.write(b": keep-alive\n\n")
+            except (ConnectionResetError, ConnectionError, asyncio.CancelledError):
+                closed.set()
+                raise
+            return resp
+
+        runner, url = await _serve(slow)
+        coze_settings(url)
+        try:
+            fragments = stream_coze_agent("x")
+            assert await fragments.__anext__() == "first"
+            await fragments.aclose()
+            await asyncio.wait_for(closed.wait(), timeout=3)
+        finally:
+            await close_coze_session()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_sessions_are_per_loop_and_closed_when_asyncio_run_ends() -> None:
+    async def job():
+        return await coze_agent_service.get_coze_session()
+
+    first = asyncio.run(run_closing_coze_session(job()))
+    second = asyncio.run(run_closing_coze_session(job()))
+    assert first is not second and first.closed and second.closed
+    assert len(coze_agent_service._sessions) == 0
+
+    async def server_loop():
+        own = await coze_agent_service.get_coze_session()
+        # 另一线程里的 asyncio.run（如 APScheduler 定时任务）不替换、也不关闭本循环的会话
+        other = await asyncio.to_thread(asyncio.run, run_closing_coze_session(job()))
+        try:
+            assert other.closed and not own.closed
+            assert own is await coze_agent_service.get_coze_session()
+        finally:
+            await close_coze_session()
+        return own
+
+    assert asyncio.run(server_loop()).closed
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(agent_chat.router)
+    return app
+
+
+def test_stream_endpoint_forwards_sse_and_maps_early_errors(monkeypatch) -> None:
+    closed = []
+
+    async def fake_stream(text):
+        try:
+            yield "第一段"
+            yield "第二段"
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr(agent_chat, "stream_coze_agent", fake_stream)
+    with TestClient(_app()) as client:
+        with client.stream("POST", "/agent/chat/stream", json={"text": "x"}) as resp:
+            assert resp.status_code == 200
+            assert resp.headers["content-type"].startswith("text/event-stream")
+            body = "".join(resp.iter_text())
+    assert body == (
+        'data: {"text": "第一段"}\n\n'
+        'data: {"text": "第二段"}\n\n'
+        "event: done\ndata: {}\n\n"
+    )
+    assert closed == [True]
+
+    async def failing(text):
+        raise CozeAgentError("缺少 Coze 配置")
+        yield  # pragma: no cover
+
+    monkeypatch.setattr(agent_chat, "stream_coze_agent", failing)
+    with TestClient(_app()) as client:
+        resp = client.post("/agent/chat/stream", json={"text": "x"})
+    assert resp.status_code == 502 and resp.json()["detail"] == "缺少 Coze 配置"
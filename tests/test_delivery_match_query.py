@@ -0,0 +1,33 @@
+"""磅单匹配报单查询：规范化车牌走索引、参数与占位符顺序一致、合同号优先而非二次查询。"""
+
+from app.services.weighbill_service import WeighbillService, delivery_match_query
+
+
+def test_normalize_vehicle_no_matches_generated_column_rule() -> None:
+    assert WeighbillService._normalize_vehicle_no_for_match(" 粤b·12 345　") == "粤B12345"
+    assert WeighbillService._normalize_vehicle_no_for_match("  ") is None
+
+
+def test_match_query_uses_plate_norm_range() -> None:
+    sql, params = delivery_match_query("粤B12345", "2026-03-01")
+    assert "vehicle_no_norm = %s" in sql
+    assert "REPLACE(" not in sql
+    assert "report_date BETWEEN" in sql
+    assert sql.count("%s") == len(params)
+    assert params == ("粤B12345", "2026-03-01", "2026-03-01", "2026-03-01")
+
+
+def test_match_query_orders_contract_first_with_aligned_params() -> None:
+    sql, params = delivery_match_query("粤B12345", "2026-03-01", driver_name="张三", contract_no="HT001")
+    assert sql.count("%s") == len(params)
+    assert "AND contract_no" not in sql
+    assert "ORDER BY (contract_no = %s) DESC, ABS(DATEDIFF(report_date, DATE(%s)))" in sql
+    # 占位符依次为：车牌、日期下界、日期上界、司机、合同号、排序日期
+    assert params == ("粤B12345", "2026-03-01", "2026-03-01", "张三", "HT001", "2026-03-01")
+
+
+def test_match_query_legacy_fallback_without_column() -> None:
+    sql, params = delivery_match_query("粤B12345", "2026-03-01", plate_raw="粤B 12345", use_plate_norm_column=False)
+    assert "vehicle_no_norm" not in sql
+    assert sql.count("%s") == len(params)
+    assert params[:2] == ("粤B12345", "粤B 12345")
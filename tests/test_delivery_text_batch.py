@@ -0,0 +1,129 @@
+"""批量解析报单文本：相同文本只提取一次、合同匹配与 24 小时重复校验各一次查询、结果按输入顺序。"""
+
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from app.services import delivery_service
+from app.services.delivery_service import DeliveryService
+
+_CONTRACT_ROWS = [
+    {"id": 1, "contract_no": "JL-01", "smelter_company": "河南金利金铅集团", "unit_price": 9800,
+     "matched_product": "电动车电池", "contract_date": date(2026, 3, 1), "end_date": None},
+    {"id": 2, "contract_no": "JL-02", "smelter_company": "河南金利金铅集团", "unit_price": 9700,
+     "matched_product": "电动", "contract_date": date(2026, 3, 2), "end_date": None},
+    {"id": 3, "contract_no": "YG-01", "smelter_company": "豫光金铅", "unit_price": 9600,
+     "matched_product": "通信电池", "contract_date": date(2026, 3, 1), "end_date": None},
+]
+
+_RECENT_ROWS = [
+    {"id": 70, "contract_no": "JL-01", "report_date": date(2026, 3, 5), "vehicle_no": "豫U12345",
+     "driver_name": "张三", "driver_phone": "13800138000", "driver_id_card": None,
+     "created_at": datetime(2026, 3, 5, 8, 0)},
+]
+
+
+class _Cursor:
+    def __init__(self, statements):
+        self.statements = statements
+        self.description = None
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        sql = " ".join(sql.split())
+        self.statements.append((sql, tuple(params)))
+        self._rows = _CONTRACT_ROWS if "FROM pd_contracts" in sql else _RECENT_ROWS
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Conn:
+    def __init__(self, statements):
+        self.statements = statements
+
+    def cursor(self):
+        return _Cursor(self.statements)
+
+
+def _patch_conn(monkeypatch):
+    statements = []
+
+    @contextmanager
+    def fake_get_conn():
+        yield _Conn(statements)
+
+    monkeypatch.setattr(delivery_service, "get_conn", fake_get_conn)
+    return statements
+
+
+def _service():
+    service = DeliveryService.__new__(DeliveryService)
+    service._convert_to_mill_product = lambda p: p
+    return service
+
+
+def test_contract_matches_share_one_query(monkeypatch) -> None:
+    statements = _patch_conn(monkeypatch)
+    pairs = [("金利", "电动"), ("豫光", "通信"), ("金利", "电动"), ("大华", "黑皮"), (None, "电动")]
+    matches = _service().match_contracts_batch(pairs, report_date="2026-03-10")
+
+    (sql, params), = statements
+    # 工厂关键词（含别名）与品种各去重一次
+    assert sql.count("c.smelter_company LIKE %s") == 8
+    assert sql.count("p.product_name LIKE %s") == 3
+    assert params[-2:] == ("2026-03-10", "2026-03-10")
+    # 精确相等优先于更早签订的包含匹配
+    assert matches[("金利", "电动")]["contract_no"] == "JL-02"
+    assert matches[("金利", "电动")]["match_type"] == "exact"
+    assert matches[("豫光", "通信")]["match_type"] == "fuzzy"
+    assert matches[("豫光", "通信")]["contract_no"] == "YG-01"
+    assert matches[("大华", "黑皮")]["match_type"] == "none"
+    assert matches[(None, "电动")]["reason"] == "工厂名称或品种为空"
+
+
+def test_duplicate_check_uses_one_in_query(monkeypatch) -> None:
+    statements = _patch_conn(monkeypatch)
+    results = _service().check_duplicates_in_24h_batch(
+        [("13800138000", None), (None, "410881199001011234"), (None, None)])
+
+    (sql, params), = statements
+    assert "WHERE driver_phone IN (%s,%s) AND created_at" in sql and "UNION" in sql
+    assert "WHERE driver_id_card IN (%s,%s) AND created_at" in sql
+    assert params == ("13800138000", "410881199001011234") * 2
+    assert results[0]["is_duplicate"] and results[0]["existing_orders"][0]["created_at"] == "2026-03-05 08:00:00"
+    assert [r["duplicate_count"] for r in results] == [1, 0, 0]
+
+
+def test_batch_extraction_dedupes_texts_and_keeps_order(monkeypatch) -> None:
+    statements = _patch_conn(monkeypatch)
+    service = _service()
+    extracted = {
+        "A": {"vehicle_no": "豫U12345", "driver_name": "张三", "driver_phone": "13800138000",
+              "products": ["电动"], "product_name": "电动", "target_factory_name": "金利"},
+        "B": {"vehicle_no": "豫A54321", "driver_name": "李四", "driver_phone": "13900139000",
+              "products": ["通信"], "product_name": "通信", "target_factory_name": "豫光"},
+    }
+    calls = []
+
+    def fake_extract(text):
+        calls.append(text)
+        return dict(extracted[text], products=list(extracted[text]["products"]))
+
+    monkeypatch.setattr(service, "extract_from_text", fake_extract)
+    result = service.extract_with_contract_batch(["A", "B", "A"], report_date="2026-03-10", max_workers=2)
+
+    assert sorted(calls) == ["A", "B"]
+    assert len(statements) == 2
+    assert [item["index"] for item in result["data"]] == [0, 1, 2]
+    first, second, third = result["data"]
+    assert first["ready_to_create"] and first["extracted"]["contract_no"] == "JL-02"
+    assert second["contract_match"]["contract_no"] == "YG-01"
+    assert first["duplicate_check"]["is_duplicate"] and not second["duplicate_check"]["is_duplicate"]
+    assert third["duplicate_check"]["batch_duplicates"] == [0]
+    assert first["extracted"] is not third["extracted"]
@@ -0,0 +1,249 @@
+"""24 小时重复报单校验：号码窗口只给候选（超集）、按主键回库复核，窗口不可用时走两条索引查询的 UNION；号码去空白、转大写后比较。"""
+
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from app.services import delivery_service
+from app.services.delivery_service import DeliveryService
+from app.services.driver_duplicate_window import (
+    REDIS_KEY_PREFIX,
+    REDIS_READY_KEY,
+    SLACK_SECONDS,
+    WINDOW_SECONDS,
+    DuplicateDriverWindow,
+    MemoryWindowStore,
+    RedisWindowStore,
+    driver_identifiers,
+)
+
+NOW = 1_770_000_000.0
+
+
+class _Clock:
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_window_candidates_expire_and_survive_store_failures() -> None:
+    clock = _Clock()
+    window = DuplicateDriverWindow(MemoryWindowStore(), clock=clock)
+    assert window.candidates(["13800138000"]) is None
+
+    window.seed([
+        {"id": 1, "driver_phone": "13800138000", "driver_id_card": None, "created_ts": NOW - 3600},
+        (2, None, "410881199001011234", NOW - WINDOW_SECONDS - SLACK_SECONDS - 1),
+        (3, None, None, NOW),
+    ])
+    window.record(4, "13900139000", "410881199001011234")
+    assert window.candidates(["13800138000"]) == [1]
+    # 2 号已出窗口，身份证号只剩 4 号
+    assert window.candidates(["410881199001011234"]) == [4]
+    assert window.candidates(["13800138000", "13900139000"]) == [1, 4]
+
+    window.forget(4, "13900139000", "410881199001011234")
+    assert window.candidates(["13900139000", "410881199001011234"]) == []
+    clock.now += WINDOW_SECONDS + SLACK_SECONDS
+    assert window.candidates(["13800138000"]) == []
+
+    def broken_add(*args):
+        raise ConnectionError("redis down")
+
+    window.store.add = broken_add
+    window.record(5, "13700137000", None)
+    # 写失败后窗口不再是超集，撤下改走数据库
+    assert window.candidates(["13700137000"]) is None
+
+
+_ROWS = [
+    {"id": 7, "contract_no": "HT-1", "report_date": date(2026, 3, 5), "vehicle_no": "豫U12345",
+     "driver_name": "张三", "driver_phone": "13800138000", "driver_id_card": None,
+     "created_at": datetime(2026, 3, 5, 8, 0)},
+    # 窗口里的旧号码已被改掉：回库复核时过滤
+    {"id": 8, "contract_no": "HT-1", "report_date": date(2026, 3, 5), "vehicle_no": "豫A54321",
+     "driver_name": "李四", "driver_phone": "13900139000", "driver_id_card": None,
+     "created_at": datetime(2026, 3, 5, 7, 0)},
+]
+
+
+class _Cursor:
+    def __init__(self, statements):
+        self.statements = statements
+
+    def execute(self, sql, params=()):
+        self.statements.append((" ".join(sql.split()), tuple(params)))
+
+    def fetchall(self):
+        return list(_ROWS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Conn:
+    def __init__(self, statements):
+        self.statements = statements
+
+    def cursor(self):
+        return _Cursor(self.statements)
+
+
+def _patch(monkeypatch, window):
+    statements = []
+
+    @contextmanager
+    def fake_get_conn():
+        yield _Conn(statements)
+
+    monkeypatch.setattr(delivery_service, "get_conn", fake_get_conn)
+    monkeypatch.setattr(delivery_service, "get_duplicate_window", lambda: window)
+    return statements
+
+
+def test_duplicate_check_uses_window_candidates(monkeypatch) -> None:
+    window = DuplicateDriverWindow(MemoryWindowStore(), clock=_Clock())
+    window.seed([])
+    statements = _patch(monkeypatch, window)
+    service = DeliveryService.__new__(DeliveryService)
+
+    # 窗口里没有这个司机：不查库
+    result = service.check_duplicate_in_24h("13800138000", None)
+    assert result == {"is_duplicate": False, "existing_orders": [], "duplicate_count": 0}
+    assert statements == []
+
+    window.record(7, "13800138000", None)
+    window.record(8, "13800138000", None)
+    window.record(9, "13800138000", None)
+    result = service.check_duplicate_in_24h("13800138000", "410881199001011234", exclude_id=9)
+    (sql, params), = statements
+    assert "WHERE id IN (%s,%s) AND created_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR)" in sql
+    assert params == (7, 8)
+    assert [o["id"] for o in result["existing_orders"]] == [7]
+    assert result["existing_orders"][0]["created_at"] == "2026-03-05 08:00:00"
+
+
+def test_duplicate_check_falls_back_to_indexed_union(monkeypatch) -> None:
+    statements = _patch(monkeypatch, None)
+    result = DeliveryService.__new__(DeliveryService).check_duplicate_in_24h(
+        "13800138000", "410881199001011234", exclude_id=3)
+
+    (sql, params), = statements
+    phone_branch, id_card_branch = sql.split(" UNION ")
+    assert "WHERE driver_phone IN (%s,%s) AND created_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR) AND id != %s" in phone_branch
+    assert "WHERE driver_id_card IN (%s,%s) AND created_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR) AND id != %s" in id_card_branch
+    assert " OR " not in sql
+    assert params == ("13800138000", "410881199001011234", 3) * 2
+    assert result["duplicate_count"] == 2
+
+
+def test_identifiers_are_normalized_in_window_and_post_filter(monkeypatch) -> None:
+    window = DuplicateDriverWindow(MemoryWindowStore(), clock=_Clock())
+    window.seed([])
+    # 建单时带空格、小写 x，校验时去空格、大写 X：仍是同一个号码
+    window.record(7, " 13800138000 ", "41088119900101123x")
+    assert window.candidates(driver_identifiers("13800138000")) == [7]
+    assert window.candidates(driver_identifiers(" 41088119900101123X")) == [7]
+
+    monkeypatch.setitem(globals(), "_ROWS", [
+        {**_ROWS[0], "driver_phone": " 13800138000", "driver_id_card": "41088119900101123x"},
+    ])
+    statements = _patch(monkeypatch, window)
+    service = DeliveryService.__new__(DeliveryService)
+    assert service.check_duplicate_in_24h("13800138000 ", None)["duplicate_count"] == 1
+
+    # 回退到 UNION 查询时，库按不区分大小写的排序规则返回的行也要能分拣给对应司机
+    monkeypatch.setattr(delivery_service, "get_duplicate_window", lambda: None)
+    results = service.check_duplicates_in_24h_batch([(None, "41088119900101123X"), ("13900139000", None)])
+    assert [r["duplicate_count"] for r in results] == [1, 0]
+    assert statements[-1][1] == ("41088119900101123X", "13900139000") * 2
+
+
+class _FakeRedis:
+    """RedisWindowStore 用到的命令子集：有序集合、键过期（只记录 TTL）、非事务管道。"""
+
+    def __init__(self):
+        self.zsets = {}
+        self.strings = {}
+        self.ttls = {}
+
+    def exists(self, key):
+        return int(key in self.strings or key in self.zsets)
+
+    def set(self, key, value):
+        self.strings[key] = str(value)
+
+    def delete(self, key):
+        self.strings.pop(key, None)
+        self.zsets.pop(key, None)
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update({m: float(s) for m, s in mapping.items()})
+
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    def zremrangebyscore(self, key, low, high):
+        low, high = float(low), float(high)
+        zset = self.zsets.get(key, {})
+        for member in [m for m, s in zset.items() if low <= s <= high]:
+            del zset[member]
+
+    def zrangebyscore(self, key, low, high):
+        low, high = float(low), float(high)
+        return [m for m, s in sorted(self.zsets.get(key, {}).items(), key=lambda kv: kv[1]) if low <= s <= high]
+
+    def expire(self, key, seconds):
+        self.ttls[key] = seconds
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args):
+            self.calls.append((name, args))
+        return queue
+
+    def execute(self):
+        return [getattr(self.client, name)(*args) for name, args in self.calls]
+
+
+def test_redis_store_window_operations() -> None:
+    client = _FakeRedis()
+    clock = _Clock()
+    window = DuplicateDriverWindow(RedisWindowStore(client), clock=clock)
+
+    # 就绪键不存在：窗口不可用，调用方查库
+    window.record(1, "13800138000", None, created_ts=NOW - 3600)
+    assert window.candidates(["13800138000"]) is None
+
+    window.seed([(2, "13800138000", "41088119900101123x", NOW - 60)])
+    assert client.exists(REDIS_READY_KEY)
+    assert window.candidates(["13800138000"]) == [1, 2]
+    assert window.candidates(["41088119900101123X"]) == [2]
+    assert client.ttls[REDIS_KEY_PREFIX + "13800138000"] == WINDOW_SECONDS + SLACK_SECONDS
+
+    # 写入新成员时裁掉出窗口的旧成员
+    window.record(3, "13800138000", None, created_ts=NOW + WINDOW_SECONDS + SLACK_SECONDS - 1800)
+    assert set(client.zsets[REDIS_KEY_PREFIX + "13800138000"]) == {"2", "3"}
+    # 查询只取窗口内的成员
+    clock.now = NOW + WINDOW_SECONDS + SLACK_SECONDS - 30
+    assert window.candidates(["13800138000"]) == [3]
+
+    window.forget(3, "13800138000", None)
+    assert window.candidates(["13800138000"]) == []
+
+    # 撤下就绪键后不再给候选
+    window.store.mark_ready(False)
+    assert not client.exists(REDIS_READY_KEY)
+    assert window.candidates(["13800138000"]) is None
@@ -0,0 +1,54 @@
+"""模糊搜索的 ngram 全文预筛选：仅在不会漏行时改写，否则保持原 LIKE 条件。"""
+
+from app.utils import fulltext_search
+from app.utils.fulltext_search import boolean_phrase_query, keyword_filter, reset_fulltext_probe_cache
+
+
+class _FakeCursor:
+    def __init__(self, has_index=True, token_size=2):
+        self.has_index = has_index
+        self.token_size = token_size
+        self.executed: list[str] = []
+        self._last = ""
+
+    def execute(self, sql, params=()):
+        self.executed.append(sql)
+        self._last = sql
+
+    def fetchall(self):
+        return [("idx",)] if self.has_index else []
+
+    def fetchone(self):
+        return (self.token_size,)
+
+
+def test_boolean_phrase_query_requires_every_token_eligible() -> None:
+    assert boolean_phrase_query(["张三", "粤B12345"], 2) == '"张三" "粤B12345"'
+    assert boolean_phrase_query(["张三", "王"], 2) is None
+    assert boolean_phrase_query(["HT-0001"], 2) is None
+    assert boolean_phrase_query(["a_b"], 2) is None
+    assert boolean_phrase_query(["张三"], 0) is None
+
+
+def test_keyword_filter_prefixes_match_and_keeps_like() -> None:
+    reset_fulltext_probe_cache()
+    cur = _FakeCursor()
+    sql, params = keyword_filter(cur, "pd_balance_details", "b", ["李四"], "(b.driver_name LIKE %s)", ["%李四%"])
+    assert sql == (
+        "(MATCH(b.contract_no, b.driver_name, b.driver_phone, b.vehicle_no, b.payee_name) "
+        "AGAINST (%s IN BOOLEAN MODE) AND (b.driver_name LIKE %s))"
+    )
+    assert params == ['"李四"', "%李四%"]
+    # 探测结果已缓存
+    keyword_filter(cur, "pd_balance_details", "b", ["李四"], "(b.driver_name LIKE %s)", ["%李四%"])
+    assert len(cur.executed) == 2
+
+
+def test_keyword_filter_falls_back_without_index() -> None:
+    reset_fulltext_probe_cache()
+    cur = _FakeCursor(has_index=False)
+    assert keyword_filter(cur, "pd_deliveries", "", ["粤B"], "(vehicle_no LIKE %s)", ["%粤B%"]) == (
+        "(vehicle_no LIKE %s)", ["%粤B%"]
+    )
+    assert fulltext_search.ngram_token_size(cur, "pd_deliveries") == 0
+    reset_fulltext_probe_cache()
@@ -0,0 +1,135 @@
+"""内容寻址图片库：去重与分片、缩略图、引用释放语义、ETag/Range 响应（本地后端与对象存储替身）。"""
+
+import io
+from pathlib import Path
+from typing import Dict, Optional
+
+import pytest
+from fastapi import FastAPI, Query, Request
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.services.image_store import (
+    ImageStorageBackend,
+    ImageStore,
+    LocalImageBackend,
+    ObjectInfo,
+)
+from app.utils.image_response import image_response, parse_single_range
+
+
+def _jpeg(width: int = 1200, height: int = 900, color=(30, 120, 200)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+class _MemoryBackend(ImageStorageBackend):
+    """对象存储（MinIO）替身：引用为 store://键，无本地路径。"""
+
+    def __init__(self):
+        self.objects: Dict[str, bytes] = {}
+        self.puts = 0
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        self.puts += 1
+        self.objects.setdefault(key, data)
+
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        data = self.objects.get(key)
+        return None if data is None else ObjectInfo(size=len(data), mtime=1_700_000_000.0)
+
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        data = self.objects[key]
+        return data[start:] if end is None else data[start:end + 1]
+
+
+def _client(store: ImageStore) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/img")
+    def view(request: Request, ref: str, variant: str = Query("original")):
+        resolved = store.resolve(ref, variant)
+        return image_response(request, store, resolved, filename="x.jpg")
+
+    return TestClient(app)
+
+
+def test_local_store_dedupes_and_shards(tmp_path: Path) -> None:
+    store = ImageStore(LocalImageBackend(tmp_path / "store"), thumbnail_max_side=200)
+    data = _jpeg()
+    ref1 = store.save(data, "weighbills")
+    ref2 = store.save(data, "weighbills")
+    assert ref1 == ref2
+    rel = Path(ref1).relative_to((tmp_path / "store").resolve()).as_posix()
+    kind, a, b, name = rel.split("/")
+    assert kind == "weighbills" and name.startswith(a + b) and name.endswith(".jpg")
+    assert Path(ref1).read_bytes() == data
+
+    thumb = store.resolve(ref1, "thumb")
+    assert thumb is not None and thumb.etag.endswith("-thumb")
+    with Image.open(thumb.path) as img:
+        assert max(img.size) == 200
+        assert img.format in ("WEBP", "JPEG")
+
+
+def test_release_keeps_shared_objects_but_removes_legacy_files(tmp_path: Path) -> None:
+    store = ImageStore(LocalImageBackend(tmp_path / "store"))
+    ref = store.save(_jpeg(), "delivery_orders")
+    store.release(ref)
+    assert Path(ref).exists()
+
+    legacy = tmp_path / "delivery_old.jpg"
+    legacy.write_bytes(_jpeg(color=(0, 0, 0)))
+    assert not store.is_managed(str(legacy))
+    assert store.resolve(str(legacy), "thumb").key.startswith("thumbs/")
+    store.release(str(legacy))
+    assert not legacy.exists()
+    assert store.resolve(str(legacy)) is None
+
+
+def test_pdf_has_no_thumbnail_and_falls_back_to_original(tmp_path: Path) -> None:
+    store = ImageStore(LocalImageBackend(tmp_path / "store"))
+    ref = store.save(b"%PDF-1.4 fake", "delivery_orders")
+    assert ref.endswith(".pdf")
+    resolved = store.resolve(ref, "thumb")
+    assert resolved.media_type == "application/pdf"
+
+
+@pytest.mark.parametrize("remote", [False, True])
+def test_conditional_and_range_responses(tmp_path: Path, remote: bool) -> None:
+    backend = _MemoryBackend() if remote else LocalImageBackend(tmp_path / "store")
+    store = ImageStore(backend)
+    data = _jpeg()
+    ref = store.save(data, "vouchers")
+    if remote:
+        assert ref.startswith("store://")
+    client = _client(store)
+
+    full = client.get("/img", params={"ref": ref})
+    assert full.status_code == 200
+    assert full.content == data
+    etag = full.headers["etag"]
+
+    assert client.get("/img", params={"ref": ref}, headers={"If-None-Match": etag}).status_code == 304
+
+    part = client.get("/img", params={"ref": ref}, headers={"Range": "bytes=10-19"})
+    assert part.status_code == 206
+    assert part.content == data[10:20]
+    assert part.headers["content-range"] == f"bytes 10-19/{len(data)}"
+
+    assert client.get("/img", params={"ref": ref}, headers={"Range": f"bytes={len(data)}-"}).status_code == 416
+
+    thumb = client.get("/img", params={"ref": ref, "variant": "thumb"})
+    assert thumb.status_code == 200
+    assert thumb.headers["etag"] != etag
+    assert len(thumb.content) < len(data)
+
+
+def test_parse_single_range() -> None:
+    assert parse_single_range(None, 100) is None
+    assert parse_single_range("bytes=0-9,20-29", 100) is None
+    assert parse_single_range("bytes=-10", 100) == (90, 99)
+    assert parse_single_range("bytes=95-200", 100) == (95, 99)
+    with pytest.raises(ValueError):
+        parse_single_range("bytes=100-", 100)
@@ -0,0 +1,79 @@
+"""列表游标分页：游标编解码、多取一条判定下一页、总数策略。"""
+
+from datetime import date, datetime
+
+import pytest
+
+from app.utils.keyset_cursor import (
+    clear_count_cache,
+    count_total,
+    decode_cursor,
+    encode_cursor,
+    keyset_before_params,
+    keyset_before_sql,
+    split_page,
+)
+
+
+class _FakeCursor:
+    def __init__(self, count=0, plan=None):
+        self.count = count
+        self.plan = plan or []
+        self.executed: list[tuple] = []
+        self.description = None
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, params))
+
+    def fetchone(self):
+        return (self.count,)
+
+    def fetchall(self):
+        return self.plan
+
+
+def test_cursor_round_trip_keeps_mysql_comparable_literals() -> None:
+    token = encode_cursor((datetime(2026, 3, 1, 8, 30, 5), 42))
+    assert "=" not in token
+    assert decode_cursor(token) == ["2026-03-01 08:30:05", 42]
+    assert decode_cursor(encode_cursor((date(2026, 1, 5), 3, "黑皮", 9)), key_len=4) == [
+        "2026-01-05", 3, "黑皮", 9
+    ]
+
+
+@pytest.mark.parametrize("bad", ["", "not-base64!", encode_cursor((1,)), encode_cursor((None, 1))])
+def test_decode_cursor_rejects_malformed(bad: str) -> None:
+    with pytest.raises(ValueError):
+        decode_cursor(bad)
+
+
+def test_split_page_uses_extra_row_as_has_more() -> None:
+    rows = [(datetime(2026, 1, 1, 0, 0, 10 - i), 100 - i) for i in range(4)]
+    page, nxt = split_page(rows, 3, lambda r: r)
+    assert page == rows[:3]
+    assert decode_cursor(nxt) == ["2026-01-01 00:00:08", 98]
+    assert split_page(rows[:3], 3, lambda r: r) == (rows[:3], None)
+
+
+def test_keyset_before_condition() -> None:
+    assert keyset_before_sql("d.created_at", "d.id") == (
+        "(d.created_at < %s OR (d.created_at = %s AND d.id < %s))"
+    )
+    assert keyset_before_params(["2026-01-01", 5]) == ("2026-01-01", "2026-01-01", 5)
+
+
+def test_count_total_modes() -> None:
+    clear_count_cache()
+    cur = _FakeCursor(count=7)
+    assert count_total(cur, "SELECT COUNT(*) FROM t WHERE a = %s", [1], "cached") == 7
+    cur.count = 99
+    assert count_total(cur, "SELECT COUNT(*) FROM t WHERE a = %s", [1], "cached") == 7
+    assert count_total(cur, "SELECT COUNT(*) FROM t WHERE a = %s", [2], "cached") == 99
+    assert count_total(cur, "SELECT COUNT(*) FROM t WHERE a = %s", [1], "exact") == 99
+    assert len(cur.executed) == 3
+
+    assert count_total(cur, "SELECT COUNT(*) FROM t", [], "none") is None
+
+    est = _FakeCursor(plan=[{"rows": 1000, "filtered": 12.5}])
+    assert count_total(est, "SELECT COUNT(*) FROM t", [], "estimate", estimate_sql="SELECT id FROM t") == 125
+    assert est.executed == [("EXPLAIN SELECT id FROM t", ())]
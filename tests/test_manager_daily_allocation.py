@@ -0,0 +1,125 @@
+"""大区经理每日分配需求：生效期与已发车数各一次分组查询、结果按日期缓存，写入后失效。"""
+
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from app.services import contract_service
+from app.services.allocation_cache import DailyResultCache, invalidate_manager_allocation, manager_allocation_cache
+from app.services.allocation_service import compute_manager_daily_allocation
+
+TODAY = date(2026, 3, 10)
+
+_ORDER_PLANS = [
+    # 计划 1：两份合同，窗口 3/8 ~ 3/12（无截止日的按签订日 + 4 天），只算今天起 3 天
+    {"order_plan_id": 11, "delivery_plan_id": 1, "truck_count": 7, "created_by_name": "张经理",
+     "plan_no": "OP-11", "plan_start_date": None, "plan_status": "生效中"},
+    # 已发 2 车，剩 3 车；计划开始日 3/11 晚于今天
+    {"order_plan_id": 12, "delivery_plan_id": 1, "truck_count": 5, "created_by_name": " ",
+     "plan_no": "OP-12", "plan_start_date": datetime(2026, 3, 11), "plan_status": "生效中"},
+    # 已发满
+    {"order_plan_id": 13, "delivery_plan_id": 1, "truck_count": 1, "created_by_name": "张经理",
+     "plan_no": "OP-13", "plan_start_date": None, "plan_status": "生效中"},
+    # 报货计划下没有生效中合同
+    {"order_plan_id": 14, "delivery_plan_id": 2, "truck_count": 9, "created_by_name": "李经理",
+     "plan_no": "OP-14", "plan_start_date": None, "plan_status": None},
+]
+_WINDOWS = [{"delivery_plan_id": 1, "start_date": date(2026, 3, 8), "end_date": date(2026, 3, 12)}]
+_DELIVERED = [{"order_plan_id": 12, "n": 2}, {"order_plan_id": 13, "n": 1}]
+
+
+class _Cursor:
+    def __init__(self, statements):
+        self.statements = statements
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        sql = " ".join(sql.split())
+        self.statements.append((sql, tuple(params)))
+        if "FROM pd_order_plans" in sql:
+            self._rows = _ORDER_PLANS
+        elif "FROM pd_contracts" in sql:
+            self._rows = _WINDOWS
+        else:
+            self._rows = _DELIVERED
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Conn:
+    def __init__(self, statements):
+        self.statements = statements
+
+    def cursor(self, *args):
+        return _Cursor(self.statements)
+
+
+def _patch_conn(monkeypatch):
+    statements = []
+
+    @contextmanager
+    def fake_get_conn():
+        yield _Conn(statements)
+
+    monkeypatch.setattr(contract_service, "get_conn", fake_get_conn)
+    invalidate_manager_allocation()
+    return statements
+
+
+def test_allocation_uses_grouped_queries(monkeypatch) -> None:
+    statements = _patch_conn(monkeypatch)
+    result = compute_manager_daily_allocation(today=TODAY, use_cache=False)
+
+    assert len(statements) == 3
+    _, (windows_sql, windows_params), (delivered_sql, delivered_params) = statements
+    assert "WHERE delivery_plan_id IN (%s,%s)" in windows_sql and "GROUP BY delivery_plan_id" in windows_sql
+    assert windows_params == (1, 2)
+    assert "WHERE order_plan_id IN (%s,%s,%s)" in delivered_sql and "GROUP BY order_plan_id" in delivered_sql
+    assert delivered_params[:3] == (11, 12, 13)
+
+    assert result["success"] and result["meta"] == {"today": "2026-03-10", "date_count": 3}
+    assert [
+        (d["date"], [(m["manager_name"], m["truck_count"], m["order_plan_ids"]) for m in d["by_manager"]])
+        for d in result["days"]
+    ] == [
+        ("2026-03-10", [("张经理", 3, [11])]),
+        ("2026-03-11", [("张经理", 2, [11]), ("未指定", 2, [12])]),
+        ("2026-03-12", [("张经理", 2, [11]), ("未指定", 1, [12])]),
+    ]
+    assert result["days"][1]["total_tonnage"] == 140
+
+
+def test_allocation_is_cached_per_day_until_invalidated(monkeypatch) -> None:
+    monkeypatch.setattr(manager_allocation_cache, "_ttl_seconds", 60)
+    statements = _patch_conn(monkeypatch)
+
+    first = compute_manager_daily_allocation(today=TODAY)
+    assert compute_manager_daily_allocation(today=TODAY) is first
+    assert len(statements) == 3
+    compute_manager_daily_allocation(today=date(2026, 3, 11))
+    assert len(statements) == 6
+
+    invalidate_manager_allocation()
+    assert compute_manager_daily_allocation(today=TODAY) is not first
+    assert len(statements) == 9
+
+
+def test_daily_cache_drops_results_computed_across_an_invalidation() -> None:
+    now = [0.0]
+    cache = DailyResultCache(ttl_seconds=30, clock=lambda: now[0])
+    generation = cache.generation
+    cache.invalidate()
+    assert not cache.put(TODAY, {"days": []}, generation)
+    assert cache.get(TODAY) is None
+
+    assert cache.put(TODAY, {"days": []}, cache.generation)
+    assert cache.get(TODAY) == {"days": []}
+    now[0] = 30
+    assert cache.get(TODAY) is None
+    assert not DailyResultCache(ttl_seconds=0).put(TODAY, {}, 0)
@@ -0,0 +1,84 @@
+"""OCR 字段抽取：预编译引擎与逐条 re.search 结果一致；各解析器对黄金样本（tests/golden/ocr）的输出不变。"""
+
+import json
+import random
+import re
+from pathlib import Path
+
+import pytest
+
+from app.services.balance_service import _RECEIPT_FIELDS, BalanceService
+from app.services.contract_service import _CONTRACT_FIELDS, ContractService
+from app.services.delivery_service import DeliveryService
+from app.services.weighbill_service import _WEIGHBILL_FIELDS, WeighbillService
+from app.utils.ocr_fields import FieldExtractor, required_anchors
+
+GOLDEN_DIR = Path(__file__).parent / "golden" / "ocr"
+
+
+def _weighbill(lines):
+    return WeighbillService.__new__(WeighbillService)._parse_weighbill(
+        [{"text": t} for t in lines], "\n".join(lines))
+
+
+def _contract(lines):
+    service = ContractService.__new__(ContractService)
+    return service._parse_contract([{"text": t} for t in lines], service._fix_common_ocr_errors("\n".join(lines)))
+
+
+def _receipt(lines):
+    return BalanceService.__new__(BalanceService)._parse_receipt_text("\n".join(lines), [{"text": t} for t in lines])
+
+
+def _delivery(data):
+    return DeliveryService.__new__(DeliveryService)._clean_extracted_data(dict(data))
+
+
+PARSERS = {"weighbill": _weighbill, "contract": _contract, "receipt": _receipt, "delivery": _delivery}
+
+
+def _jsonable(value):
+    return json.loads(json.dumps(value, ensure_ascii=False, default=str))
+
+
+@pytest.mark.parametrize("path", sorted(GOLDEN_DIR.glob("*.json")), ids=lambda p: p.stem)
+def test_parsers_match_golden_corpus(path) -> None:
+    case = json.loads(path.read_text(encoding="utf-8"))
+    assert _jsonable(PARSERS[case["parser"]](case["input"])) == case["expected"]
+
+
+def test_required_anchors_only_take_mandatory_literals() -> None:
+    assert required_anchors(r"毛重[：:]\s*(\d+)") == (("毛重",), ("：", ":"))
+    assert required_anchors(r"(\d{4}年\d{1,2}月\d{1,2}日)") == (("年",), ("月",), ("日",))
+    assert required_anchors(r"(\d+)%.*到货款") == (("到货款",), ("%",))
+    assert required_anchors(r"(\d{4,6}[*＊]{2,6}\d{3,4})") == (("*", "＊"),)
+    assert required_anchors(r"网银流水号[：:]?\s*(\d+)") == (("网银流水号",),)
+    assert required_anchors(r"ab?c") == (("a",), ("c",))
+    assert required_anchors(r"单号|流水号") == ()
+    assert required_anchors(r"(?:单号|流水号)：(\d+)") == (("：",),)
+    assert required_anchors(r"(?i)qty\d") == ()
+    assert required_anchors(r"[^*]+") == ()
+
+
+def test_extractor_keeps_pattern_priority_over_position() -> None:
+    extractor = FieldExtractor({"no": [r"合同编号[：:]\s*(\w+)", r"编号[：:]\s*(\w+)"]})
+    found = extractor.search("编号：B1\n合同编号：A1")
+    assert found.group("no") == "A1"
+    assert extractor.search("无关文本").match("no") is None
+
+
+@pytest.mark.parametrize("extractor", [_WEIGHBILL_FIELDS, _CONTRACT_FIELDS, _RECEIPT_FIELDS])
+def test_extractor_agrees_with_inline_search(extractor) -> None:
+    """随机打乱、截断、拼接黄金样本的文本行，逐字段与逐条 re.search 的结果比对。"""
+    cases = [json.loads(path.read_text(encoding="utf-8")) for path in GOLDEN_DIR.glob("*.json")]
+    pool = [line for case in cases if case["parser"] != "delivery" for line in case["input"]]
+    rnd = random.Random(47)
+    for _ in range(300):
+        lines = rnd.sample(pool, rnd.randint(0, 12))
+        lines = [line[:rnd.randint(0, len(line))] if rnd.random() < 0.2 else line for line in lines]
+        text = "\n".join(lines)
+        found = extractor.search(text)
+        for name, compiled in extractor.fields.items():
+            expected = next((m for m in (re.search(p.pattern, text) for _, p in compiled) if m), None)
+            got = found.match(name)
+            assert (got and (got.span(), got.groups())) == (expected and (expected.span(), expected.groups()))
@@ -0,0 +1,124 @@
+"""比价列式取价内核：与逐格标量换算（price_tax_utils）结果一致。"""
+
+import random
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pytest
+
+from app.price_tax_utils import (
+    derive_net_and_vat_from_quote_row,
+    inclusive_from_net,
+    merge_factory_rates,
+    net_from_inclusive,
+)
+from app.quote_price_matrix import (
+    PRICE_COLUMNS,
+    SOURCE_LABELS,
+    QuotePriceMatrix,
+    round_like_python,
+    to_optional_list,
+)
+
+_COL_TO_TAX = {"price_1pct_vat": "1pct", "price_3pct_vat": "3pct", "price_13pct_vat": "13pct"}
+
+
+def _scalar_resolve(
+    rows: List[Dict[str, Optional[float]]],
+    rates: Dict[str, float],
+    target_col: str,
+    target_tax: Optional[str],
+) -> Tuple[Optional[float], str]:
+    """比价表原逐格取价逻辑（参照实现）。"""
+    merged = merge_factory_rates(rates)
+    for prices in rows:
+        if not prices:
+            continue
+        if prices.get(target_col) is not None:
+            return prices[target_col], "direct"
+        if target_tax and prices.get("unit_price") is not None:
+            return inclusive_from_net(prices["unit_price"], merged[target_tax]), "calc_from_base"
+        if target_col == "unit_price":
+            for col, src in _COL_TO_TAX.items():
+                if prices.get(col) is not None:
+                    return round(net_from_inclusive(prices[col], merged[src]), 2), f"calc_from_{src}"
+        if target_tax:
+            for col, src in _COL_TO_TAX.items():
+                if prices.get(col) is not None:
+                    net = net_from_inclusive(prices[col], merged[src])
+                    return inclusive_from_net(net, merged[target_tax]), f"calc_from_{src}"
+    return None, "unavailable"
+
+
+def _random_case(seed: int):
+    rnd = random.Random(seed)
+    fids = list(range(1, rnd.randint(2, 6)))
+    cids = list(range(10, 10 + rnd.randint(1, 6)))
+    names = {c: [f"品类{c}-{k}" for k in range(rnd.randint(1, 3))] for c in cids}
+    raw: Dict[tuple, Dict[str, Optional[float]]] = {}
+    for f in fids:
+        for c in cids:
+            for n in names[c]:
+                if rnd.random() < 0.7:
+                    raw[(f, n)] = {
+                        col: rnd.choice([None, round(rnd.uniform(100, 30000), rnd.randint(0, 3))])
+                        for col in PRICE_COLUMNS
+                    }
+    taxes = {
+        f: {t: rnd.choice([0.01, 0.03, 0.06, 0.13]) for t in ("1pct", "3pct", "13pct") if rnd.random() < 0.3}
+        for f in fids
+    }
+    return fids, cids, names, raw, taxes
+
+
+@pytest.mark.parametrize(
+    "target_col,target_tax",
+    [
+        ("unit_price", None),
+        ("price_1pct_vat", "1pct"),
+        ("price_3pct_vat", "3pct"),
+        ("price_13pct_vat", "13pct"),
+        ("price_normal_invoice", None),
+        ("price_reverse_invoice", None),
+    ],
+)
+def test_resolve_matches_scalar_reference(target_col: str, target_tax: Optional[str]) -> None:
+    for seed in range(200):
+        fids, cids, names, raw, taxes = _random_case(seed)
+        matrix = QuotePriceMatrix.build(fids, cids, names, raw, taxes)
+        price, code = matrix.resolve_target_prices(target_col, target_tax)
+        for f in fids:
+            got_prices = to_optional_list(price[matrix.factory_pos[f]])
+            for c in cids:
+                rows = [raw.get((f, n), {}) for n in names[c]]
+                expected = _scalar_resolve(rows, taxes[f], target_col, target_tax)
+                j = matrix.category_pos[c]
+                got = (got_prices[j], SOURCE_LABELS[code[matrix.factory_pos[f], j]])
+                assert got == expected, (seed, f, c)
+
+
+def test_breakdown_matches_derive_net_and_vat() -> None:
+    for seed in range(200):
+        fids, cids, names, raw, taxes = _random_case(seed)
+        matrix = QuotePriceMatrix.build(fids, cids, names, raw, taxes)
+        rows, has_row = matrix.quote_rows()
+        breakdown = matrix.breakdown(rows, has_row)
+        for f in fids:
+            for c in cids:
+                qrow = next((raw[(f, n)] for n in names[c] if raw.get((f, n))), None)
+                expected = (
+                    derive_net_and_vat_from_quote_row(qrow, merge_factory_rates(taxes[f]))
+                    if qrow
+                    else None
+                )
+                got = to_optional_list(breakdown[matrix.factory_pos[f], matrix.category_pos[c]])
+                assert got == (list(expected) if expected else [None] * 4), (seed, f, c)
+
+
+def test_round_like_python_on_ties_and_nan() -> None:
+    values = [2.675, 1.005, 0.125, 0.375, -2.675, 1234.565, 8.325, 100.0, 0.0]
+    rnd = random.Random(7)
+    values += [round(rnd.uniform(-1e5, 1e5), 3) for _ in range(2000)]
+    got = round_like_python(np.array(values + [np.nan]), 2)
+    assert got[:-1].tolist() == [round(v, 2) for v in values]
+    assert np.isnan(got[-1])
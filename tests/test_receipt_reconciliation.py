@@ -0,0 +1,104 @@
+"""批量回单对账：一次查询载入结余、全局最大权匹配而非贪心、同分候选转人工、未配上的回单找多笔组合。"""
+
+import itertools
+import random
+from datetime import datetime
+from decimal import Decimal
+
+from app.services.receipt_reconciliation import (
+    ReceiptInput,
+    load_pending_balances,
+    max_weight_assignment,
+    reconcile,
+)
+
+
+def _brute_force(scores):
+    n, m = len(scores), len(scores[0])
+    best = (0, 0.0)
+    for perm in itertools.permutations(range(max(n, m)), max(n, m)):
+        pairs = [(i, perm[i]) for i in range(n) if perm[i] < m and scores[i][perm[i]] is not None] if n <= m else \
+            [(perm[j], j) for j in range(m) if perm[j] < n and scores[perm[j]][j] is not None]
+        key = (len(pairs), round(sum(scores[i][j] for i, j in pairs), 9))
+        best = max(best, key)
+    return best
+
+
+def test_assignment_is_global_not_greedy() -> None:
+    # 贪心会把第 0 行配给第 0 列（0.9），第 1 行就没得配
+    assert max_weight_assignment([[0.9, 0.85], [0.8, None]]) == [(0, 1), (1, 0)]
+    assert max_weight_assignment([[0.5], [0.7], [None]]) == [(1, 0)]
+    assert max_weight_assignment([]) == []
+
+    rnd = random.Random(46)
+    for _ in range(150):
+        n, m = rnd.randint(1, 5), rnd.randint(1, 5)
+        scores = [[round(rnd.uniform(0.2, 1), 3) if rnd.random() < 0.6 else None for _ in range(m)] for _ in range(n)]
+        pairs = max_weight_assignment(scores)
+        assert len({i for i, _ in pairs}) == len(pairs) == len({j for _, j in pairs})
+        got = (len(pairs), round(sum(scores[i][j] for i, j in pairs), 9))
+        assert got == _brute_force(scores)
+
+
+def _balance(balance_id, amount, payee="张三", driver="张三", account=None, created="2026-03-01"):
+    return {"id": balance_id, "payee_name": payee, "driver_name": driver, "payee_key": payee or driver,
+            "payee_account": account, "balance_amount": Decimal(amount), "contract_no": "HT-1", "vehicle_no": "粤B1",
+            "created_at": datetime.strptime(created, "%Y-%m-%d")}
+
+
+def _receipt(index, amount, payee="张三", account=None, date="2026-03-05"):
+    return ReceiptInput.from_ocr(index, {"payee_name": payee, "amount": amount, "payee_account": account,
+                                         "payment_date": date})
+
+
+def test_reconcile_proposes_confident_review_and_combination_matches() -> None:
+    balances = [
+        _balance(1, "1000.00", account="6222"),
+        _balance(2, "999.99"),
+        _balance(3, "500.00", payee="李四", driver="李四"),
+        _balance(4, "500.00", payee="李四", driver="李四"),
+        _balance(5, "300.00", payee="王五", driver="王五"),
+        _balance(6, "200.00", payee="王五", driver="王五"),
+    ]
+    receipts = [
+        _receipt(0, 1000, account="6222"),
+        _receipt(1, 1000),
+        _receipt(2, "500", payee="李四"),
+        # 转账金额没识别出来时按合计
+        ReceiptInput.from_ocr(3, {"payee_name": "王五", "amount": 0, "total_amount": "500.00"}),
+        _receipt(4, 42, payee="赵六"),
+    ]
+    proposals = reconcile(receipts, balances)
+
+    assert [p["index"] for p in proposals] == [0, 1, 2, 3, 4]
+    # 0 号回单账号吻合拿走 1 号结余；1 号回单只能配 999.99（容差内）
+    assert proposals[0]["status"] == "confident" and proposals[0]["items"][0]["balance_id"] == 1
+    assert proposals[1]["items"][0]["balance_id"] == 2 and proposals[1]["items"][0]["amount"] == 999.99
+    # 两笔同为 500 的结余同分，需人工确认
+    assert proposals[2]["status"] == "review" and proposals[2]["alternatives"]
+    # 没有单笔 500：300 + 200 组合
+    assert proposals[3]["status"] == "review"
+    assert sorted(i["balance_id"] for i in proposals[3]["items"]) == [5, 6]
+    assert proposals[4] == {"index": 4, "status": "unmatched", "confidence": 0.0, "items": [], "alternatives": []}
+
+
+class _Cursor:
+    def __init__(self):
+        self.statements = []
+        self.description = [("id",), ("driver_name",)]
+
+    def execute(self, sql, params=()):
+        self.statements.append((" ".join(sql.split()), tuple(params)))
+
+    def fetchall(self):
+        return [(1, "张三")]
+
+
+def test_pending_balances_load_in_one_query() -> None:
+    cur = _Cursor()
+    rows = load_pending_balances(cur, ["张三", " 李四 ", None, "张三"], 30)
+    assert rows == [{"id": 1, "driver_name": "张三"}]
+    (sql, params), = cur.statements
+    assert "payee_key IN (%s,%s) OR driver_name IN (%s,%s) OR payee_name IN (%s,%s)" in sql
+    assert params == (30, "张三", "李四", "张三", "李四", "张三", "李四")
+    assert load_pending_balances(_Cursor(), [None, " "], 30) == []
@@ -0,0 +1,210 @@
+"""定时任务执行层：多 worker 同一触发只执行一次、租约互斥与过期接管、执行历史、手动触发。"""
+
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from app.core.scheduled_jobs import (
+    FAILED,
+    SKIPPED,
+    SUCCESS,
+    JobRunner,
+    cron_fire_key,
+)
+
+
+class _FakeDb:
+    """只实现执行层用到的 SQL 形态；每条语句在全局锁内执行，模拟 MySQL 的行级原子性。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs: List[Dict] = []
+        self.leases: Dict[str, Dict] = {}
+        self.now = datetime(2026, 1, 1, 0, 10)
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def commit(self):
+        pass
+
+
+class _FakeCursor:
+    def __init__(self, db: _FakeDb):
+        self.db = db
+        self.rows: list = []
+        self.rowcount = 0
+        self.lastrowid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql: str, params=()):
+        db = self.db
+        text = " ".join(sql.split())
+        with db.lock:
+            self.rows, self.rowcount = [], 0
+            if text.startswith("INSERT IGNORE INTO pd_job_runs"):
+                job_id, fire_key, trigger, by, holder, status = params
+                if any(r["job_id"] == job_id and r["fire_key"] == fire_key for r in db.runs):
+                    return
+                db.runs.append({
+                    "id": len(db.runs) + 1, "job_id": job_id, "fire_key": fire_key, "trigger": trigger,
+                    "triggered_by": by, "holder": holder, "status": status,
+                })
+                self.rowcount, self.lastrowid = 1, len(db.runs)
+            elif text.startswith("INSERT INTO pd_job_leases"):
+                job_id, holder, seconds = params
+                until = db.now + timedelta(seconds=seconds)
+                lease = db.leases.get(job_id)
+                if lease is None or lease["lease_until"] < db.now or lease["holder"] == holder:
+                    db.leases[job_id] = {"holder": holder, "lease_until": until}
+            elif text.startswith("SELECT holder FROM pd_job_leases"):
+                lease = db.leases.get(params[0])
+                self.rows = [{"holder": lease["holder"]}] if lease else []
+            elif text.startswith("UPDATE pd_job_leases SET lease_until = NOW() +"):
+                seconds, job_id, holder = params
+                lease = db.leases.get(job_id)
+                if lease and lease["holder"] == holder:
+                    lease["lease_until"] = db.now + timedelta(seconds=seconds)
+                    self.rowcount = 1
+            elif text.startswith("UPDATE pd_job_leases SET lease_until = NOW() -"):
+                job_id, holder = params
+                lease = db.leases.get(job_id)
+                if lease and lease["holder"] == holder:
+                    lease["lease_until"] = db.now - timedelta(seconds=1)
+            elif text.startswith("UPDATE pd_job_runs"):
+                status, duration_ms, result, error, run_id = params
+                db.runs[run_id - 1].update(status=status, duration_ms=duration_ms, result=result, error=error)
+            elif text.startswith("SELECT id, job_id"):
+                runs = [r for r in db.runs if not params[:-1] or r["job_id"] == params[0]]
+                self.rows = sorted(runs, key=lambda r: -r["id"])[: params[-1]]
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+def _connect(db: _FakeDb):
+    @contextmanager
+    def connect():
+        yield db
+
+    return connect
+
+
+def test_cron_fire_key_tolerates_clock_skew() -> None:
+    fire = datetime(2026, 1, 1, 16, 10, tzinfo=timezone.utc)
+    assert cron_fire_key(fire - timedelta(seconds=20)) == cron_fire_key(fire + timedelta(seconds=25))
+    assert cron_fire_key(fire) != cron_fire_key(fire + timedelta(minutes=1))
+
+
+def test_each_fire_runs_once_across_workers() -> None:
+    db = _FakeDb()
+    calls = []
+
+    def expire(grace_days):
+        time.sleep(0.02)
+        calls.append(grace_days)
+        return 3
+
+    workers = [JobRunner(connect=_connect(db), holder=f"host:{i}") for i in range(4)]
+    for w in workers:
+        w.register("expire_contracts", expire, kwargs={"grace_days": 4})
+    barrier = threading.Barrier(len(workers))
+
+    def fire(w: JobRunner):
+        barrier.wait()
+        w.run("expire_contracts", fire_key="cron:2026-01-01T16:10")
+
+    threads = [threading.Thread(target=fire, args=(w,)) for w in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == [4]
+    assert len(db.runs) == 1
+    run = db.runs[0]
+    assert run["status"] == SUCCESS and run["result"] == "3" and run["duration_ms"] >= 0
+
+    # 下一次触发（不同分钟）照常执行
+    workers[1].run("expire_contracts", fire_key="cron:2026-01-02T16:10")
+    assert calls == [4, 4]
+
+
+def test_lease_blocks_overlap_until_expired_and_failures_are_recorded() -> None:
+    db = _FakeDb()
+    a = JobRunner(connect=_connect(db), holder="host:a")
+    b = JobRunner(connect=_connect(db), holder="host:b")
+    for w in (a, b):
+        w.register("daily_prediction", lambda: 1 / 0, lease_seconds=60)
+
+    # a 崩溃前持有租约：b 的执行记为 skipped
+    assert a.acquire_lease("daily_prediction", 60)
+    assert b.run("daily_prediction", fire_key="cron:1") == SKIPPED
+    assert db.runs[-1]["status"] == SKIPPED
+
+    # 租约过期后 b 接管；任务异常记为 failed 并释放租约
+    db.now += timedelta(seconds=61)
+    assert b.run("daily_prediction", fire_key="cron:2") == FAILED
+    assert "ZeroDivisionError" in db.runs[-1]["error"]
+    assert a.acquire_lease("daily_prediction", 60)
+
+
+def test_manual_trigger_runs_in_background_and_lists_history() -> None:
+    db = _FakeDb()
+    done = threading.Event()
+    runner = JobRunner(connect=_connect(db), holder="host:a")
+    runner.register("expire_contracts", done.set)
+
+    run_id = runner.trigger_manual("expire_contracts", triggered_by="admin")
+    assert done.wait(5)
+    for _ in range(100):
+        if db.runs[run_id - 1]["status"] != "running":
+            break
+        time.sleep(0.01)
+
+    runs = runner.list_runs("expire_contracts")
+    assert [r["id"] for r in runs] == [run_id]
+    assert runs[0]["trigger"] == "manual" and runs[0]["triggered_by"] == "admin"
+    assert runs[0]["status"] == SUCCESS
+
+
+def test_concurrent_runs_in_one_process_do_not_overlap() -> None:
+    db = _FakeDb()
+    runner = JobRunner(connect=_connect(db), holder="host:a")
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        assert release.wait(5)
+
+    runner.register("rebuild_contract_progress", slow, lease_seconds=60)
+    first = runner.claim("rebuild_contract_progress", "manual", "manual:1")
+    second = runner.claim("rebuild_contract_progress", "cron", "cron:1")
+    results = {}
+    t = threading.Thread(
+        target=lambda: results.update(first=runner.execute(first, runner.jobs["rebuild_contract_progress"]))
+    )
+    t.start()
+    assert started.wait(5)
+
+    # 同进程的第二次执行（定时触发）拿不到第一次执行持有的租约
+    assert runner.execute(second, runner.jobs["rebuild_contract_progress"]) == SKIPPED
+    assert db.leases["rebuild_contract_progress"]["holder"] == f"host:a:{first}"
+    assert db.leases["rebuild_contract_progress"]["lease_until"] > db.now
+
+    release.set()
+    t.join()
+    assert results["first"] == SUCCESS and calls == [1]
+    assert db.leases["rebuild_contract_progress"]["lease_until"] < db.now
@@ -0,0 +1,159 @@
+"""版本化迁移：旧库补齐、版本记录与幂等（无待执行迁移时不取锁）、单个失败不阻断、能力表只读且读取不发查询。"""
+
+import re
+from contextlib import contextmanager
+from typing import Dict, List, Set
+
+import pytest
+
+from app.core import schema_migrations
+from app.core.schema_migrations import (
+    Migration,
+    apply_pending_migrations,
+    get_schema_capabilities,
+    registered_migrations,
+    run_migrations,
+)
+
+
+class _FakeDb:
+    """只实现迁移用到的 SQL 形态；列与索引保存在内存里。"""
+
+    def __init__(self, tables: Dict[str, Dict[str, str]]):
+        self.tables = tables
+        self.indexes: Dict[str, Set[str]] = {t: set() for t in tables}
+        self.versions: Dict[int, str] = {}
+        self.statements: List[str] = []
+        self.commits = 0
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+class _FakeCursor:
+    def __init__(self, db: _FakeDb):
+        self.db = db
+        self.rows: list = []
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql: str, params=()):
+        db = self.db
+        text = " ".join(sql.split())
+        db.statements.append(text)
+        self.rows = []
+        if text.startswith("SELECT GET_LOCK"):
+            self.rows = [{"acquired": 1}]
+        elif text.startswith("SELECT version FROM"):
+            self.rows = [{"version": v} for v in db.versions]
+        elif "INFORMATION_SCHEMA.COLUMNS" in text and "TABLE_NAME = %s" in text:
+            cols = db.tables.get(params[0], {})
+            self.rows = [{"column_name": c, "column_type": t} for c, t in cols.items()]
+        elif "INFORMATION_SCHEMA.COLUMNS" in text:
+            self.rows = [{"table_name": t, "column_name": c} for t, cols in db.tables.items() for c in cols]
+        elif "INFORMATION_SCHEMA.STATISTICS" in text and "INDEX_NAME = %s" in text:
+            self.rows = [{"1": 1}] if params[1] in db.indexes.get(params[0], ()) else []
+        elif "INFORMATION_SCHEMA.STATISTICS" in text:
+            self.rows = [{"table_name": t, "index_name": i} for t, idx in db.indexes.items() for i in idx]
+        elif text.startswith("ALTER TABLE"):
+            table = text.split()[2]
+            for name in re.findall(r"ADD COLUMN (\w+) (\w+)", text):
+                db.tables[table][name[0]] = name[1].lower()
+        elif text.startswith("CREATE INDEX"):
+            m = re.match(r"CREATE INDEX (\w+) ON (\w+)", text)
+            db.indexes.setdefault(m.group(2), set()).add(m.group(1))
+        elif text.startswith("INSERT IGNORE INTO pd_schema_migrations"):
+            db.versions.setdefault(params[0], params[1])
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+def _legacy_db() -> _FakeDb:
+    return _FakeDb({
+        "pd_delivery_plans": {"id": "bigint", "planned_trucks": "int", "planned_tonnage": "decimal(12,3)"},
+        "pd_order_plans": {"id": "bigint"},
+        "pd_deliveries": {"id": "bigint", "products": "varchar(255)"},
+        "pd_weighbills": {"id": "bigint"},
+        "pd_contracts": {"id": "bigint"},
+        "pd_balance_details": {"id": "bigint", "payee_name": "varchar(64)"},
+    })
+
+
+def _connect(db: _FakeDb):
+    @contextmanager
+    def connect():
+        yield db
+
+    return connect
+
+
+def test_registry_versions_are_unique_and_ascending() -> None:
+    versions = [m.version for m in registered_migrations()]
+    assert versions == sorted(set(versions))
+
+
+def test_migrations_backfill_legacy_schema_once(monkeypatch) -> None:
+    monkeypatch.setattr(schema_migrations, "_capabilities", None)
+    db = _legacy_db()
+    caps = run_migrations(connect=_connect(db))
+
+    assert set(db.versions) == {m.version for m in registered_migrations()}
+    assert caps.versions == frozenset(db.versions)
+    assert caps.has_column("pd_delivery_plans", "created_by_name")
+    assert caps.has_column("pd_order_plans", "settlement_price")
+    assert caps.has_column("pd_weighbills", "audit_status")
+    assert caps.has_index("pd_deliveries", "idx_order_plan_id")
+    assert caps.has_index("pd_deliveries", "idx_driver_id_card_created_at")
+    assert caps.has_column("pd_balance_details", "payee_key")
+    assert caps.has_index("pd_balance_details", "idx_payee_key")
+    assert not caps.has_column("pd_deliveries", "vehicle_no_norm")
+
+    db.statements.clear()
+    run_migrations(connect=_connect(db))
+    assert not any(s.startswith(("ALTER", "CREATE INDEX", "UPDATE", "SELECT GET_LOCK")) for s in db.statements)
+
+
+def test_failed_migration_is_retried_and_does_not_block_others() -> None:
+    db = _legacy_db()
+
+    def boom(cur):
+        raise RuntimeError("lock wait timeout")
+
+    applied = apply_pending_migrations(db, [
+        Migration(1, "fails", boom),
+        Migration(2, "ok", lambda cur: cur.execute("ALTER TABLE pd_contracts ADD COLUMN x INT")),
+    ])
+    assert applied == {2}
+    assert set(db.versions) == {2}
+    assert "x" in db.tables["pd_contracts"]
+
+
+def test_capabilities_are_immutable_and_served_without_queries(monkeypatch) -> None:
+    monkeypatch.setattr(schema_migrations, "_capabilities", None)
+    db = _legacy_db()
+    caps = run_migrations(connect=_connect(db))
+    db.statements.clear()
+
+    assert get_schema_capabilities() is caps
+    assert get_schema_capabilities().has_column("pd_deliveries", "products")
+    assert db.statements == []
+
+    with pytest.raises(TypeError):
+        caps.columns["pd_new"] = frozenset()
+    with pytest.raises(AttributeError):
+        caps.columns["pd_deliveries"].add("y")
@@ -0,0 +1,117 @@
+"""启动建表快速路径：指纹一致时跳过 DDL、指纹变化时持锁建表并写回（有步骤失败则不写）、等锁期间他人已完成则跳过。"""
+
+from typing import List, Optional
+
+import pytest
+
+import database_setup
+from app.utils import fulltext_search
+
+
+class _FakeConnection:
+    def __init__(self, stored: Optional[str], lock_result: int = 1):
+        self.stored = stored
+        self.lock_result = lock_result
+        self.statements: List[str] = []
+        self.on_lock = None
+        self.closed = False
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeCursor:
+    def __init__(self, conn: _FakeConnection):
+        self.conn = conn
+        self.row = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        text = " ".join(sql.split())
+        self.conn.statements.append(text)
+        self.row = None
+        if text.startswith("SELECT GET_LOCK"):
+            self.row = (self.conn.lock_result,)
+            if self.conn.on_lock:
+                self.conn.on_lock()
+        elif text.startswith("SELECT value FROM"):
+            self.row = (self.conn.stored,) if self.conn.stored else None
+        elif text.startswith("INSERT INTO pd_schema_meta"):
+            self.conn.stored = params[1]
+
+    def fetchone(self):
+        return self.row
+
+
+@pytest.fixture
+def setup_env(monkeypatch):
+    calls = []
+    monkeypatch.setattr(database_setup, "get_mysql_config", lambda: {})
+    monkeypatch.setattr(database_setup, "create_tables", lambda: calls.append("create_tables") or True)
+
+    def use(conn):
+        monkeypatch.setattr(database_setup.pymysql, "connect", lambda **kw: conn)
+        return calls
+
+    return use
+
+
+def test_matching_fingerprint_skips_all_ddl(setup_env) -> None:
+    conn = _FakeConnection(stored=database_setup.expected_schema_fingerprint())
+    calls = setup_env(conn)
+    report = database_setup.ensure_schema()
+    assert report["skipped"] and calls == []
+    assert not any(s.startswith("SELECT GET_LOCK") for s in conn.statements)
+    assert set(report["phases"]) == {"connect", "fingerprint_check"}
+    assert conn.closed
+
+
+def test_changed_fingerprint_runs_setup_under_lock_and_records_it(setup_env) -> None:
+    conn = _FakeConnection(stored="old")
+    calls = setup_env(conn)
+    report = database_setup.ensure_schema()
+    assert not report["skipped"] and calls == ["create_tables"]
+    assert conn.stored == database_setup.expected_schema_fingerprint()
+    assert {"lock_wait", "create_tables"} <= set(report["phases"])
+    assert any(s.startswith("SELECT RELEASE_LOCK") for s in conn.statements)
+
+
+def test_worker_waiting_on_lock_skips_when_another_finished(setup_env) -> None:
+    conn = _FakeConnection(stored=None)
+    conn.on_lock = lambda: setattr(conn, "stored", database_setup.expected_schema_fingerprint())
+    calls = setup_env(conn)
+    assert database_setup.ensure_schema()["skipped"]
+    assert calls == []
+
+
+def test_lock_timeout_raises(setup_env) -> None:
+    setup_env(_FakeConnection(stored=None, lock_result=0))
+    with pytest.raises(RuntimeError):
+        database_setup.ensure_schema(lock_timeout=1)
+
+
+def test_failed_setup_step_does_not_record_fingerprint(setup_env, monkeypatch) -> None:
+    conn = _FakeConnection(stored="old")
+    setup_env(conn)
+    monkeypatch.setattr(database_setup, "create_tables", lambda: False)
+    report = database_setup.ensure_schema()
+    assert not report["skipped"] and not report["complete"]
+    assert conn.stored == "old"
+
+
+def test_fingerprint_covers_fulltext_index_definitions(monkeypatch) -> None:
+    before = database_setup.expected_schema_fingerprint()
+    changed = dict(fulltext_search.FULLTEXT_INDEXES, pd_extra=("ft_extra", ("name",)))
+    monkeypatch.setattr(fulltext_search, "FULLTEXT_INDEXES", changed)
+    assert database_setup.expected_schema_fingerprint() != before
@@ -0,0 +1,210 @@
+"""启动编排：关键任务顺序与失败隔离、预热后台执行、leader_only、/readyz 状态、leader 选举与锁丢失后的复核。"""
+
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from app.core.startup import DONE, FAILED, SKIPPED, LeaderElection, StartupOrchestrator
+
+
+class _StaticLeader(LeaderElection):
+    def __init__(self, is_leader: bool):
+        super().__init__()
+        self._fixed = is_leader
+
+    def try_acquire(self) -> bool:
+        self.is_leader = self._fixed
+        return self.is_leader
+
+    def confirm(self) -> bool:
+        return self.is_leader
+
+    def release(self) -> None:
+        self.is_leader = False
+
+
+def test_critical_tasks_run_in_order_and_failures_do_not_block() -> None:
+    calls = []
+    orch = StartupOrchestrator(leader=_StaticLeader(True))
+
+    def boom():
+        calls.append("schema")
+        raise RuntimeError("db down")
+
+    orch.critical("schema", boom)
+    orch.critical("migrations", lambda: calls.append("migrations"))
+    orch.deferred("warmup", lambda: calls.append("warmup"))
+
+    async def scenario():
+        await orch.run_critical()
+        assert calls == ["schema", "migrations"]
+        assert not orch.ready
+        orch.start_deferred()
+        await orch._background
+        await orch.shutdown()
+
+    asyncio.run(scenario())
+    status = orch.status()
+    assert calls == ["schema", "migrations", "warmup"]
+    assert status["tasks"]["schema"]["state"] == FAILED and "db down" in status["tasks"]["schema"]["error"]
+    assert status["tasks"]["warmup"]["state"] == DONE
+    # 关键任务失败：进程不就绪
+    assert not status["ready"] and status["warmup_finished"] and status["startup_ms"] is not None
+
+    healthy = StartupOrchestrator(leader=_StaticLeader(True))
+    healthy.critical("schema", lambda: None)
+    asyncio.run(healthy.run_critical())
+    assert healthy.ready
+
+
+def test_leader_only_tasks_are_skipped_on_followers() -> None:
+    ran = []
+    orch = StartupOrchestrator(leader=_StaticLeader(False))
+    orch.deferred("test_prediction", lambda: ran.append(1), leader_only=True)
+
+    async def scenario():
+        await orch.run_critical()
+        orch.start_deferred()
+        await orch._background
+
+    asyncio.run(scenario())
+    assert ran == []
+    assert orch.status()["tasks"]["test_prediction"]["state"] == SKIPPED
+
+
+def test_readyz_does_not_wait_for_warmup_but_reports_it() -> None:
+    release = threading.Event()
+    orch = StartupOrchestrator(leader=_StaticLeader(True))
+    orch.critical("schema", lambda: None)
+    orch.deferred("ocr_warmup", lambda: release.wait(5))
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        app.state.startup = orch
+        await orch.run_critical()
+        orch.start_deferred()
+        yield
+        release.set()
+        await orch.shutdown()
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.get("/readyz")
+    def readyz(request: Request):
+        startup = request.app.state.startup
+        startup.mark_first_request()
+        status = startup.status()
+        return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+    with TestClient(app) as client:
+        first = client.get("/readyz")
+        assert first.status_code == 200
+        assert not first.json()["warmup_finished"]
+        assert first.json()["tasks"]["ocr_warmup"]["state"] in ("pending", "running")
+        assert first.json()["time_to_first_request_ms"] is not None
+        release.set()
+        for _ in range(100):
+            resp = client.get("/readyz")
+            if resp.json()["warmup_finished"]:
+                break
+            threading.Event().wait(0.02)
+        assert resp.status_code == 200
+        assert resp.json()["tasks"]["ocr_warmup"]["state"] == DONE
+
+
+class _LockConn:
+    def __init__(self, granted: int, held: int = 1):
+        self.granted = granted
+        self.held = held
+        self.closed = False
+        self.released = False
+
+    def cursor(self):
+        conn = self
+
+        class _Cur:
+            row = None
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql, params=()):
+                if sql.startswith("SELECT GET_LOCK"):
+                    self.row = {"acquired": conn.granted}
+                elif sql.startswith("SELECT RELEASE_LOCK"):
+                    conn.released = True
+                elif sql.startswith("SELECT IS_USED_LOCK"):
+                    if conn.held is None:
+                        raise ConnectionError("MySQL server has gone away")
+                    self.row = {"held": conn.held}
+
+            def fetchone(self):
+                return self.row
+
+        return _Cur()
+
+
+def _connect(conn: _LockConn):
+    @contextmanager
+    def connect():
+        try:
+            yield conn
+        finally:
+            conn.closed = True
+
+    return connect
+
+
+def test_leader_election_holds_connection_until_release() -> None:
+    conn = _LockConn(granted=1)
+    leader = LeaderElection(connect=_connect(conn))
+    assert leader.try_acquire()
+    assert not conn.closed
+    leader.release()
+    assert conn.released and conn.closed and not leader.is_leader
+
+    follower_conn = _LockConn(granted=0)
+    follower = LeaderElection(connect=_connect(follower_conn))
+    assert not follower.try_acquire()
+    assert follower_conn.closed
+
+
+def test_leader_drops_leadership_when_its_lock_connection_is_lost() -> None:
+    # 第一条连接被服务端断开（锁已释放），重新竞选时锁已被其他 worker 拿走
+    lost, taken = _LockConn(granted=1), _LockConn(granted=0)
+    conns = iter([lost, taken])
+
+    @contextmanager
+    def connect():
+        conn = next(conns)
+        try:
+            yield conn
+        finally:
+            conn.closed = True
+
+    leader = LeaderElection(connect=connect)
+    assert leader.try_acquire() and leader.confirm()
+    lost.held = None
+
+    # leader-only 任务执行前复核，发现锁已丢失即跳过
+    ran = []
+    orch = StartupOrchestrator(leader=leader)
+    orch.deferred("expire_contracts", lambda: ran.append(1), leader_only=True)
+    asyncio.run(orch._run(orch.tasks[0]))
+    assert ran == [] and orch.tasks[0].state == SKIPPED
+    assert not leader.is_leader and lost.closed and taken.closed
+    assert not leader.confirm()
+
+    # 锁仍在但已不归本连接（连接重连后 CONNECTION_ID 变了）：同样放弃，锁空出时重新当选
+    first, second = _LockConn(granted=1, held=0), _LockConn(granted=1)
+    conns = iter([first, second])
+    leader = LeaderElection(connect=connect)
+    assert leader.try_acquire()
+    assert leader.confirm() and leader._conn is second and first.closed
@@ -0,0 +1,130 @@
+"""流式导出工具：键集分页与 xlsx/csv 分块输出；合同导出中途失败时中断响应流、首页失败返回错误说明。"""
+
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+from io import BytesIO
+
+import pytest
+from openpyxl import load_workbook
+
+from app.services import contract_service
+from app.services.contract_service import ContractService
+from app.utils.streaming_export import (
+    content_disposition,
+    iter_csv_bytes,
+    iter_keyset_pages,
+    iter_xlsx_bytes,
+)
+
+
+def test_iter_keyset_pages_walks_all_rows_by_key() -> None:
+    data = list(range(1, 2502))
+    calls: list[tuple] = []
+
+    def fetch_page(after, limit):
+        calls.append((after, limit))
+        start = 0 if after is None else data.index(after) + 1
+        return data[start : start + limit]
+
+    out = list(iter_keyset_pages(fetch_page, key_of=lambda x: x, page_size=1000))
+    assert out == data
+    assert calls == [(None, 1000), (1000, 1000), (2000, 1000)]
+
+
+def test_iter_keyset_pages_stops_after_exact_multiple() -> None:
+    pages = [[1, 2], [3, 4], []]
+    out = list(iter_keyset_pages(lambda after, limit: pages.pop(0), key_of=lambda x: x, page_size=2))
+    assert out == [1, 2, 3, 4]
+    assert pages == []
+
+
+def test_iter_csv_bytes_has_bom_and_batches() -> None:
+    rows = ([i, f"名{i}", None] for i in range(1200))
+    chunks = list(iter_csv_bytes(["id", "名称", "空"], rows, batch_rows=500))
+    assert chunks[0] == "\ufeff".encode("utf-8")
+    assert len(chunks) == 1 + 3
+    text = b"".join(chunks).decode("utf-8-sig").splitlines()
+    assert text[0] == "id,名称,空"
+    assert text[1] == "0,名0,"
+    assert len(text) == 1201
+
+
+def test_iter_xlsx_bytes_round_trips_values() -> None:
+    rows = [[date(2026, 1, 5), "冶炼厂A", Decimal("12.50"), None, {"k": "v"}]]
+    raw = b"".join(iter_xlsx_bytes(["日期", "冶炼厂", "价格", "空", "来源"], rows, sheet_title="报价数据"))
+    ws = load_workbook(BytesIO(raw), read_only=True)["报价数据"]
+    got = list(ws.iter_rows(values_only=True))
+    assert got[0] == ("日期", "冶炼厂", "价格", "空", "来源")
+    assert got[1][1:] == ("冶炼厂A", 12.5, None, '{"k": "v"}')
+
+
+def test_content_disposition_keeps_ascii_fallback() -> None:
+    header = content_disposition("报价数据导出.xlsx")
+    assert header.startswith('attachment; filename="______.xlsx"')
+    assert "filename*=UTF-8''%E6%8A%A5" in header
+
+
+def test_contract_export_failure_aborts_the_stream(monkeypatch) -> None:
+    class _Cursor:
+        description = [("id",), ("seq_no",), ("contract_no",)]
+
+        def __init__(self):
+            self.rows = []
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def execute(self, sql, params=()):
+            if "FROM pd_contracts" in sql:
+                if len(params) > 1:
+                    raise ConnectionError("lost connection during export")
+                self.rows = [(1, 1, "HT-1"), (2, 2, "HT-2")]
+            else:
+                self.rows = [(1, "电动车", Decimal("9800"))]
+
+        def fetchall(self):
+            return self.rows
+
+    class _Conn:
+        def cursor(self):
+            return _Cursor()
+
+    @contextmanager
+    def fake_get_conn():
+        yield _Conn()
+
+    monkeypatch.setattr(contract_service, "get_conn", fake_get_conn)
+    rows = ContractService.__new__(ContractService).iter_export_contracts(page_size=2)
+    assert next(rows)["product_name"] == "电动车"
+    assert next(rows)["product_name"] is None
+    # 第二页读取失败：异常须抛给响应流，而不是悄悄结束产出截断的文件
+    with pytest.raises(ConnectionError):
+        next(rows)
+
+
+def test_contract_export_query_failure_maps_to_http_error(monkeypatch) -> None:
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.api.v1.routes import contracts as contract_routes
+
+    @contextmanager
+    def broken_get_conn():
+        raise ConnectionError("database unavailable")
+        yield  # pragma: no cover
+
+    monkeypatch.setattr(contract_service, "get_conn", broken_get_conn)
+    service = ContractService.__new__(ContractService)
+    # 一次性列表接口保持原约定：失败记日志、返回空列表
+    assert service.export_contracts() == []
+
+    app = FastAPI()
+    app.include_router(contract_routes.router)
+    app.dependency_overrides[contract_routes.get_contract_service] = lambda: service
+    resp = TestClient(app).post("/contracts/export", json=None)
+    assert resp.status_code == 500
+    assert resp.json()["detail"] == "导出合同失败: database unavailable"
@@ -0,0 +1,173 @@
+"""上传落盘：在途字节预算（排队/超时/超容量）、单文件上限、中间件在读请求体前限长与预占、图片库按句柄保存。"""
+
+import asyncio
+import io
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.core.config import settings
+from app.services.image_store import ImageStore, LocalImageBackend
+from app.utils.upload_spool import (
+    InflightBytesBudget,
+    UploadSizeLimitMiddleware,
+    present_files,
+    spool_upload,
+    spool_uploads,
+)
+
+
+def _upload(data: bytes, name: str = "a.jpg") -> UploadFile:
+    return UploadFile(io.BytesIO(data), size=len(data), filename=name)
+
+
+def test_budget_queues_until_release_and_times_out() -> None:
+    async def scenario():
+        budget = InflightBytesBudget(100)
+        assert await budget.acquire(80) == 80
+        waiter = asyncio.ensure_future(budget.acquire(50, timeout=5))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        budget.release(80)
+        assert await waiter == 50
+        assert budget.in_use == 50
+
+        with pytest.raises(asyncio.TimeoutError):
+            await budget.acquire(60, timeout=0.05)
+        assert budget.in_use == 50
+        budget.release(50)
+
+        # 超过容量的申请按容量计，独占而不是永远等待
+        assert await budget.acquire(1000) == 100
+        budget.release(100)
+        assert budget.in_use == 0
+
+    asyncio.run(scenario())
+
+
+def test_spool_upload_enforces_file_limit() -> None:
+    async def scenario():
+        ok = await spool_upload(_upload(b"x" * 1000), max_bytes=1000)
+        assert ok.size == 1000 and ok.read_bytes() == b"x" * 1000
+        ok.close()
+
+        skipped = await spool_upload(_upload(b"x" * 1001), max_bytes=1000, strict=False)
+        assert skipped.too_large and skipped.file is None
+
+        with pytest.raises(HTTPException) as exc:
+            await spool_upload(_upload(b"x" * 1001), max_bytes=1000)
+        assert exc.value.status_code == 413
+
+    asyncio.run(scenario())
+
+
+def test_spool_uploads_closes_handles_and_skips_none() -> None:
+    async def scenario():
+        async with spool_uploads([_upload(b"a" * 300), None, _upload(b"b" * 200)]) as spooled:
+            assert [s.size for s in spooled] == [300, 200]
+            handles = [s.file for s in spooled]
+        assert all(h.closed for h in handles)
+
+    asyncio.run(scenario())
+
+
+def test_empty_parts_are_treated_as_not_uploaded() -> None:
+    async def scenario():
+        # 客户端把可选文件字段留空时会发 0 字节的 part：与原先读出 b"" 后跳过一致，不交给服务层保存
+        async with spool_uploads([_upload(b""), _upload(b"v" * 10), _upload(b"")]) as spooled:
+            assert [s.size for s in spooled] == [0, 10, 0]
+            assert spooled[0].file is None and spooled[0].read_bytes() == b""
+            files = present_files(spooled)
+            assert len(files) == 1 and files[0].read() == b"v" * 10
+
+    asyncio.run(scenario())
+
+
+def test_middleware_rejects_oversized_multipart() -> None:
+    app = FastAPI()
+
+    @app.post("/up")
+    async def up(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    client = TestClient(UploadSizeLimitMiddleware(app, max_request_bytes=1024, budget=InflightBytesBudget(10_000)))
+    assert client.post("/up", files={"file": ("a.bin", b"x" * 100)}).json() == {"size": 100}
+    resp = client.post("/up", files={"file": ("a.bin", b"x" * 4096)})
+    assert resp.status_code == 413
+
+
+def test_middleware_counts_body_bytes_without_content_length() -> None:
+    app = FastAPI()
+
+    @app.post("/up")
+    async def up(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    boundary = "b0undary"
+
+    def chunked(payload: bytes):
+        # 生成器请求体：httpx 以分块传输发送，不带 Content-Length
+        yield f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="a.bin"\r\n\r\n'.encode()
+        for i in range(0, len(payload), 256):
+            yield payload[i:i + 256]
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+    client = TestClient(UploadSizeLimitMiddleware(app, max_request_bytes=1024, budget=InflightBytesBudget(10_000)))
+    headers = {"content-type": f"multipart/form-data; boundary={boundary}"}
+    ok = client.post("/up", content=chunked(b"x" * 100), headers=headers)
+    assert ok.json() == {"size": 100}
+    resp = client.post("/up", content=chunked(b"x" * 4096), headers=headers)
+    assert resp.status_code == 413 and "限制" in resp.json()["detail"]
+
+    # 没有 FastAPI 异常处理的下游应用：由中间件兜底返回 413
+    async def raw_app(scope, receive, send):
+        while (await receive()).get("more_body"):
+            pass
+        await JSONResponse({"ok": True})(scope, receive, send)
+
+    raw = TestClient(UploadSizeLimitMiddleware(raw_app, max_request_bytes=1024, budget=InflightBytesBudget(10_000)))
+    assert raw.post("/", content=chunked(b"x" * 4096), headers=headers).status_code == 413
+
+
+def test_middleware_reserves_budget_before_the_body_is_parsed(monkeypatch) -> None:
+    budget = InflightBytesBudget(10_000)
+    seen = []
+    app = FastAPI()
+
+    @app.post("/up")
+    async def up(request: Request, file: UploadFile = File(...)):
+        # 到这里 multipart 已解析完：预占须早于解析、覆盖整个请求体
+        seen.append((budget.in_use, int(request.headers["content-length"])))
+        return {"size": len(await file.read())}
+
+    client = TestClient(UploadSizeLimitMiddleware(app, max_request_bytes=8192, budget=budget))
+    assert client.post("/up", files={"file": ("a.bin", b"x" * 500)}).json() == {"size": 500}
+    (in_use, content_length), = seen
+    assert in_use == content_length > 500
+    assert budget.in_use == 0
+
+    # 预算占满时排队超时返回 503，路由（及请求体解析）不会执行
+    monkeypatch.setattr(settings, "upload_budget_wait_seconds", 0.05)
+    asyncio.run(budget.acquire(10_000))
+    resp = client.post("/up", files={"file": ("a.bin", b"x" * 500)})
+    assert resp.status_code == 503 and len(seen) == 1
+    budget.release(10_000)
+    # 非 multipart 请求不占预算
+    assert client.post("/up", json={}).status_code == 422 and budget.in_use == 0
+
+
+def test_image_store_saves_from_handle_like_bytes(tmp_path: Path) -> None:
+    buf = io.BytesIO()
+    Image.new("RGB", (640, 480), (10, 20, 30)).save(buf, "PNG")
+    data = buf.getvalue()
+    store = ImageStore(LocalImageBackend(tmp_path / "store"), thumbnail_max_side=100)
+
+    ref_from_handle = store.save(io.BytesIO(data), "weighbills")
+    assert ref_from_handle == store.save(data, "weighbills")
+    assert ref_from_handle.endswith(".png")
+    assert Path(ref_from_handle).read_bytes() == data
+    assert store.resolve(ref_from_handle, "thumb").key.startswith("thumbs/")
@@ -0,0 +1,101 @@
+"""磅单批量识别流水线：结果顺序、引擎独占、单张失败隔离、串行退化。"""
+
+import io
+import threading
+import time
+
+from PIL import Image
+
+from app.services.weighbill_ocr_pipeline import (
+    OcrEnginePool,
+    preprocess_batch,
+    preprocess_image_bytes,
+    recognize_batch,
+    run_ocr_pipeline,
+)
+
+
+def _png(width: int, height: int) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 200, 200)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+class _Engine:
+    def __init__(self):
+        self.busy = False
+        self.calls = 0
+
+
+def test_preprocess_image_bytes_outputs_bounded_jpeg_and_keeps_bad_input() -> None:
+    out = preprocess_image_bytes(_png(3000, 1000))
+    img = Image.open(io.BytesIO(out))
+    assert img.format == "JPEG"
+    assert max(img.size) == 2000
+    assert preprocess_image_bytes(b"not an image") == b"not an image"
+
+
+def test_engine_pool_never_lends_one_engine_to_two_threads() -> None:
+    created = []
+
+    def factory():
+        created.append(_Engine())
+        return created[-1]
+
+    pool = OcrEnginePool(factory, size=3)
+    overlaps = []
+
+    def recognize(image: bytes, engine: _Engine):
+        if engine.busy:
+            overlaps.append(image)
+        engine.busy = True
+        engine.calls += 1
+        time.sleep(0.005)
+        engine.busy = False
+        return {"success": True, "data": {"image": image}}
+
+    images = [str(i).encode() for i in range(40)]
+    results = recognize_batch(images, recognize, pool, max_workers=3)
+    assert [r["data"]["image"] for r in results] == images
+    assert overlaps == []
+    assert 1 <= len(created) <= 3
+    assert sum(e.calls for e in created) == 40
+
+
+def test_engine_pool_uses_preloaded_engine_and_warm_up_respects_size() -> None:
+    preloaded = _Engine()
+    pool = OcrEnginePool(_Engine, size=2, preloaded=[preloaded])
+    with pool.acquire() as engine:
+        assert engine is preloaded
+    pool.warm_up(5)
+    pool.resize(1)
+    assert pool.size == 2
+
+
+def test_recognize_batch_isolates_per_image_failures() -> None:
+    def recognize(image: bytes, engine):
+        if image == b"bad":
+            raise RuntimeError("识别异常")
+        return {"success": True, "data": image}
+
+    results = recognize_batch([b"a", b"bad", b"c"], recognize, OcrEnginePool(object, 2), max_workers=2)
+    assert results[0] == {"success": True, "data": b"a"}
+    assert results[1] == {"success": False, "error": "识别异常"}
+    assert results[2] == {"success": True, "data": b"c"}
+
+
+def test_single_worker_runs_inline_in_caller_thread() -> None:
+    caller = threading.get_ident()
+    seen = []
+
+    def recognize(image: bytes, engine):
+        seen.append(threading.get_ident())
+        return {"success": True}
+
+    images = [_png(900, 700), _png(900, 700)]
+    assert preprocess_batch(images, max_workers=1) == [preprocess_image_bytes(b) for b in images]
+    assert run_ocr_pipeline(images, recognize, OcrEnginePool(object, 4), max_workers=1) == [
+        {"success": True}, {"success": True}
+    ]
+    assert seen == [caller, caller]
+    assert run_ocr_pipeline([], recognize, OcrEnginePool(object, 1), max_workers=4) == []